@@ -4,6 +4,7 @@ from PIL.Image import Image
 
 from colpali_engine.models.idefics_2 import ColIdefics2Processor
 from colpali_engine.models.paligemma import ColPaliProcessor
+from colpali_engine.models.qwen2.colqwen2 import ColQwen2Processor
 from colpali_engine.utils.processing_utils import BaseVisualRetrieverProcessor
 
 
@@ -16,10 +17,14 @@ class VisualRetrieverCollator:
         self,
         processor: BaseVisualRetrieverProcessor,
         max_length: int = 2048,
+        pad_pixel_values: bool = False,
     ):
         self.processor = processor
         self.image_token_id = None
         self.max_length = max_length
+        # Pad the ColQwen2 pixel values per image, only needed when the batch is scattered across GPUs
+        # (see `ColQwen2Processor.process_images`)
+        self.pad_pixel_values = pad_pixel_values
 
         if isinstance(self.processor, ColPaliProcessor) or isinstance(self.processor, ColIdefics2Processor):
             self.image_token_id = self.processor.tokenizer.additional_special_tokens_ids[
@@ -59,8 +64,13 @@ class VisualRetrieverCollator:
                 neg_images.append(cast(Image, example["neg_image"]))
 
         # Process the documents
+        process_images_kwargs = {}
+        if isinstance(self.processor, ColQwen2Processor):
+            process_images_kwargs["pad_pixel_values"] = self.pad_pixel_values
+
         batch_doc = self.processor.process_images(
             images=images,
+            **process_images_kwargs,
         )
 
         # Process the negative documents (if available)
@@ -68,6 +78,7 @@ class VisualRetrieverCollator:
         if len(neg_images) > 0:
             batch_neg_doc = self.processor.process_images(
                 images=neg_images,
+                **process_images_kwargs,
             )
 
         # Process the queries
@@ -2,6 +2,8 @@ import torch
 import torch.nn.functional as F  # noqa: N812
 from torch.nn import CrossEntropyLoss
 
+from colpali_engine.utils.scoring_utils import max_sim_scores
+
 
 class ColbertLoss(torch.nn.Module):
     def __init__(self):
@@ -14,7 +16,7 @@ class ColbertLoss(torch.nn.Module):
         doc_embeddings: (batch_size, num_doc_tokens, dim)
         """
 
-        scores = torch.einsum("bnd,csd->bcns", query_embeddings, doc_embeddings).max(dim=3)[0].sum(dim=2)
+        scores = max_sim_scores(query_embeddings, doc_embeddings)  # (batch_size, batch_size)
 
         # scores = torch.zeros((query_embeddings.shape[0], doc_embeddings.shape[0]), device=query_embeddings.device)
         # for i in range(query_embeddings.shape[0]):
@@ -51,9 +53,7 @@ class ColbertPairwiseCELoss(torch.nn.Module):
         """
 
         # Compute the ColBERT scores
-        scores = (
-            torch.einsum("bnd,csd->bcns", query_embeddings, doc_embeddings).max(dim=3)[0].sum(dim=2)
-        )  # (batch_size, batch_size)
+        scores = max_sim_scores(query_embeddings, doc_embeddings)  # (batch_size, batch_size)
 
         # Positive scores are the diagonal of the scores matrix.
         pos_scores = scores.diagonal()  # (batch_size,)
@@ -95,9 +95,7 @@ class ColbertPairwiseNegativeCELoss(torch.nn.Module):
         loss = F.softplus(neg_scores - pos_scores).mean()
 
         if self.in_batch_term:
-            scores = (
-                torch.einsum("bnd,csd->bcns", query_embeddings, doc_embeddings).max(dim=3)[0].sum(dim=2)
-            )  # (batch_size, batch_size)
+            scores = max_sim_scores(query_embeddings, doc_embeddings)  # (batch_size, batch_size)
 
             # Positive scores are the diagonal of the scores matrix.
             pos_scores = scores.diagonal()  # (batch_size,)
@@ -91,6 +91,8 @@ class ColIdefics3Processor(BaseVisualRetrieverProcessor, Idefics3Processor):
         """
         Compute the MaxSim score (ColBERT-like) for the given multi-vector query and passage embeddings.
         """
+        kwargs.setdefault("quantization", self.quantization)
+        kwargs.setdefault("rerank_top_k", self.rerank_top_k)
         return self.score_multi_vector(qs, ps, device=device, **kwargs)
 
     def get_n_patches(
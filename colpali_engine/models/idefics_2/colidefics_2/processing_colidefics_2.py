@@ -92,6 +92,8 @@ class ColIdefics2Processor(BaseVisualRetrieverProcessor, Idefics2Processor):
         """
         Compute the MaxSim score (ColBERT-like) for the given multi-vector query and passage embeddings.
         """
+        kwargs.setdefault("quantization", self.quantization)
+        kwargs.setdefault("rerank_top_k", self.rerank_top_k)
         return self.score_multi_vector(qs, ps, device=device, **kwargs)
 
     def get_n_patches(
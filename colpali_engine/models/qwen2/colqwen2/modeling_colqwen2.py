@@ -4,6 +4,8 @@ import torch
 from torch import nn
 from transformers.models.qwen2_vl import Qwen2VLConfig, Qwen2VLForConditionalGeneration
 
+from colpali_engine.models.qwen2.colqwen2.processing_colqwen2 import unpad_pixel_values_per_image
+
 
 class ColQwen2(Qwen2VLForConditionalGeneration):
     """
@@ -77,14 +79,10 @@ class ColQwen2(Qwen2VLForConditionalGeneration):
         kwargs.pop("output_hidden_states", None)
 
 
-        # The following code is a hack to make sure the scatter in DDP is done correctly when training on multiple GPUs
-        if "pixel_values" in kwargs:
-            # compute pixel_values offsets
-            offsets = kwargs["image_grid_thw"][:, 1] * kwargs["image_grid_thw"][:, 2]
-            kwargs["pixel_values"] = torch.cat(
-                [pv[:o] for pv, o in zip(kwargs["pixel_values"], offsets)],
-                dim=0,
-            )
+        # The pixel values are packed, unless they were padded per image to be scattered across GPUs along the
+        # batch dimension (see `ColQwen2Processor.process_images`)
+        if "pixel_values" in kwargs and kwargs["pixel_values"].dim() == 3:
+            kwargs["pixel_values"] = unpad_pixel_values_per_image(kwargs["pixel_values"], kwargs["image_grid_thw"])
 
         position_ids, rope_deltas = self.get_rope_index(
             input_ids=kwargs["input_ids"],
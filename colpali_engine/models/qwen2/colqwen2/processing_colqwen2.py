@@ -24,6 +24,33 @@ def floor_by_factor(number: float, factor: int) -> int:
     return math.floor(number / factor) * factor
 
 
+def get_pixel_values_offsets(image_grid_thw: torch.Tensor) -> torch.Tensor:
+    """
+    Returns the start of the patches of each image in the packed `pixel_values`, plus the end of the last one.
+    """
+    n_patches = image_grid_thw.prod(dim=-1)
+    return torch.cat([n_patches.new_zeros(1), n_patches.cumsum(dim=0)])
+
+
+def pad_pixel_values_per_image(pixel_values: torch.Tensor, image_grid_thw: torch.Tensor) -> torch.Tensor:
+    """
+    Pad the packed `(n_patches, patch_dim)` pixel values into a `(batch_size, max_n_patches, patch_dim)` tensor.
+    """
+    n_patches = image_grid_thw.prod(dim=-1).to(pixel_values.device)
+    padded = pixel_values.new_zeros((len(n_patches), int(n_patches.max()), pixel_values.shape[-1]))
+    padded[torch.arange(padded.shape[1], device=pixel_values.device) < n_patches[:, None]] = pixel_values
+    return padded
+
+
+def unpad_pixel_values_per_image(pixel_values: torch.Tensor, image_grid_thw: torch.Tensor) -> torch.Tensor:
+    """
+    Pack the `(batch_size, max_n_patches, patch_dim)` pixel values padded per image into a `(n_patches, patch_dim)`
+    tensor.
+    """
+    n_patches = image_grid_thw.prod(dim=-1).to(pixel_values.device)
+    return pixel_values[torch.arange(pixel_values.shape[1], device=pixel_values.device) < n_patches[:, None]]
+
+
 class ColQwen2Processor(BaseVisualRetrieverProcessor, Qwen2VLProcessor):
     """
     Processor for ColQwen2.
@@ -87,6 +114,22 @@ class ColQwen2Processor(BaseVisualRetrieverProcessor, Qwen2VLProcessor):
 
         return h_bar, w_bar
 
+    def get_image_grid_size(self, image_size: Tuple[int, int]) -> Tuple[int, int]:
+        """
+        Returns the (height, width) grid of visual tokens of an image of size `image_size` (width, height) once
+        resized by `smart_resize`: one token per `factor` x `factor` patch (i.e. 2x2 merged 14x14 patches).
+        The number of visual tokens of the image is the product of the two.
+        """
+        resized_height, resized_width = self.smart_resize_helper(
+            width=image_size[0],
+            height=image_size[1],
+            factor=self.factor,
+            max_ratio=self.max_ratio,
+            min_pixels=self.min_pixels,
+            max_pixels=self.max_pixels,
+        )
+        return resized_height // self.factor, resized_width // self.factor
+
     def smart_resize(self, image: Image.Image) -> Image.Image:
         """
         Resize and convert the image to the required format.
@@ -105,9 +148,16 @@ class ColQwen2Processor(BaseVisualRetrieverProcessor, Qwen2VLProcessor):
     def process_images(
         self,
         images: List[Image.Image],
+        pad_pixel_values: bool = False,
     ) -> BatchFeature:
         """
         Process images for ColQwen2.
+
+        The `pixel_values` of the images are packed: the patches of all the images, concatenated into a single
+        `(n_patches, patch_dim)` tensor, the patches of each image being delimited by the offsets of
+        `get_pixel_values_offsets`. With `pad_pixel_values`, they are padded per image into a
+        `(batch_size, max_n_patches, patch_dim)` tensor instead, only needed when the batch is scattered across
+        GPUs along its first dimension (i.e. `nn.DataParallel`).
         """
         texts_doc = [self.visual_prompt_prefix] * len(images)
 
@@ -120,30 +170,22 @@ class ColQwen2Processor(BaseVisualRetrieverProcessor, Qwen2VLProcessor):
             return_tensors="pt",
         )
 
-        # NOTE: The following code is a hack to make sure the scatter in DDP is done correctly when training
-        # on multiple GPUs.
-        offsets = batch_doc["image_grid_thw"][:, 1] * batch_doc["image_grid_thw"][:, 2]
-
-        # separate pixel_values for each image
-        pixel_values = torch.split(batch_doc["pixel_values"], offsets.tolist())
-
-        # pad pixel_values to the same length to be able to make it into a tensor
-        max_length = max([len(pv) for pv in pixel_values])
-
-        pixel_values = [
-            torch.cat([pv, torch.zeros((max_length - len(pv), pv.shape[1]), dtype=pv.dtype, device=pv.device)])
-            for pv in pixel_values
-        ]
-        batch_doc["pixel_values"] = torch.stack(pixel_values)
+        if pad_pixel_values:
+            batch_doc["pixel_values"] = pad_pixel_values_per_image(
+                batch_doc["pixel_values"], batch_doc["image_grid_thw"]
+            )
 
         return batch_doc
 
     def process_images_texts(
         self,
         passages,
+        pad_pixel_values: bool = False,
     ) -> BatchFeature:
         """
         Process images for ColQwen2.
+
+        The `pixel_values` are packed, or padded per image with `pad_pixel_values` (see `process_images`).
         """
         # print(passages)
         images: List[Image.Image] = [i[0] for i in passages]
@@ -164,21 +206,10 @@ class ColQwen2Processor(BaseVisualRetrieverProcessor, Qwen2VLProcessor):
             return_tensors="pt",
         )
 
-        # NOTE: The following code is a hack to make sure the scatter in DDP is done correctly when training
-        # on multiple GPUs.
-        offsets = batch_doc["image_grid_thw"][:, 1] * batch_doc["image_grid_thw"][:, 2]
-
-        # separate pixel_values for each image
-        pixel_values = torch.split(batch_doc["pixel_values"], offsets.tolist())
-
-        # pad pixel_values to the same length to be able to make it into a tensor
-        max_length = max([len(pv) for pv in pixel_values])
-
-        pixel_values = [
-            torch.cat([pv, torch.zeros((max_length - len(pv), pv.shape[1]), dtype=pv.dtype, device=pv.device)])
-            for pv in pixel_values
-        ]
-        batch_doc["pixel_values"] = torch.stack(pixel_values)
+        if pad_pixel_values:
+            batch_doc["pixel_values"] = pad_pixel_values_per_image(
+                batch_doc["pixel_values"], batch_doc["image_grid_thw"]
+            )
 
         return batch_doc
 
@@ -231,6 +262,8 @@ class ColQwen2Processor(BaseVisualRetrieverProcessor, Qwen2VLProcessor):
         """
         Compute the MaxSim score (ColBERT-like) for the given multi-vector query and passage embeddings.
         """
+        kwargs.setdefault("quantization", self.quantization)
+        kwargs.setdefault("rerank_top_k", self.rerank_top_k)
         return self.score_multi_vector(qs, ps, device=device, **kwargs)
 
     def matching_score(
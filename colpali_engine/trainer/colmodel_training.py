@@ -129,6 +129,9 @@ class ColModelTraining:
         )
 
         trainer.args.remove_unused_columns = False
+        # `nn.DataParallel` (several GPUs in a single process) scatters the batches along their first dimension, the
+        # pixel values must then be padded per image
+        self.collator.pad_pixel_values = trainer.args.n_gpu > 1
 
         result = trainer.train(resume_from_checkpoint=self.config.tr_args.resume_from_checkpoint)
         print_summary(result)
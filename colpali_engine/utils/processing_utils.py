@@ -5,14 +5,32 @@ import torch
 from PIL import Image
 from transformers import BatchEncoding, BatchFeature
 
+from colpali_engine.utils.scoring_utils import (
+    DEFAULT_TILE_SIZE,
+    PassageBlocks,
+    fused_max_sim,
+    get_lexical_mask,
+    get_passage_blocks,
+    get_token_ids,
+    max_sim_scores,
+    score_multi_vector_bucketed,
+    score_multi_vector_top_k,
+    segment_max_sim,
+)
 from colpali_engine.utils.torch_utils import get_torch_device
 
 
 class BaseVisualRetrieverProcessor(ABC):
     """
     Base class for visual retriever processors.
+
+    The `quantization` ("int8" or "binary") and `rerank_top_k` attributes are the default quantized scoring mode
+    of the multi-vector `score` methods (see `score_multi_vector`). They are disabled by default.
     """
 
+    quantization: Optional[str] = None
+    rerank_top_k: Optional[int] = None
+
     @abstractmethod
     def process_images(
         self,
@@ -143,7 +161,7 @@ class BaseVisualRetrieverProcessor(ABC):
     @staticmethod
     def score_multi_vector_text_nonlexical(
         qs: Union[torch.Tensor, List[torch.Tensor]],
-        ps: Union[torch.Tensor, List[torch.Tensor]],
+        ps: Union[torch.Tensor, List[torch.Tensor], PassageBlocks],
         semantic_matching_indices: Optional[Dict[str, Dict[int, List[str]]]] = None,
         batch_size: int = 128,
         device: Optional[Union[str, torch.device]] = None,
@@ -165,11 +183,21 @@ class BaseVisualRetrieverProcessor(ABC):
         if len(ps) == 0:
             raise ValueError("No passages provided")
         
+        if semantic_matching_indices is not None:
+            # Map the token strings to vocabulary ids once, so that the masks can be computed with tensor ops
+            vocabulary: Dict[str, int] = {}
+            query_token_ids = get_token_ids(
+                [semantic_matching_indices["query"].get(idx, []) for idx in range(len(qs))], vocabulary
+            )
+            passage_token_ids = get_token_ids(
+                [semantic_matching_indices["passage"].get(idx, []) for idx in range(len(ps))], vocabulary
+            )
+
+        ps_blocks = get_passage_blocks(ps, batch_size, bucketed=False)
         scores_list: List[torch.Tensor] = []
         
         # Process queries in batches.
         for i in range(0, len(qs), batch_size):
-            scores_batch = []
             qs_batch = torch.nn.utils.rnn.pad_sequence(
                 qs[i : i + batch_size],
                 batch_first=True,
@@ -177,50 +205,30 @@ class BaseVisualRetrieverProcessor(ABC):
             ).to(device)
             qs_batch_special = qs_batch[:, 2:-10, :]
         
-            for j in range(0, len(ps), batch_size):
-                try:
-                    ps_batch = torch.nn.utils.rnn.pad_sequence(
-                        ps[j : j + batch_size],
-                        batch_first=True,
-                        padding_value=0
-                    ).to(device)
-                except TypeError:
-                    embedding_dim = qs_batch_special.size(-1)
-                    default_shape = (batch_size, 1, embedding_dim)
-                    ps_batch = torch.zeros(default_shape, dtype=qs_batch_special.dtype, device=device)
-        
-                # Compute the similarity matrix between query and passage tokens.
-                # Shape: [B (queries), C (passages), n (query tokens), s (passage tokens)]
-                similarity_matrix = torch.einsum("bnd,csd->bcns", qs_batch_special, ps_batch)
+            # The passage blocks are padded once and reused across the query batches. Blocks that could
+            # not be padded are scored as all-zero passage embeddings, i.e. get a score of zero.
+            scores_batch = torch.zeros((qs_batch.shape[0], len(ps_blocks)), dtype=torch.float32)
+            for indices, ps_batch, _ in ps_blocks:
+                if ps_batch is None:
+                    continue
                 # For each query token, take the maximum similarity over the passage tokens.
-                max_similarity, _ = similarity_matrix.max(dim=3)
-        
+                # Shape: [B (queries), C (passages), n (query tokens)]
+                max_similarity = fused_max_sim(qs_batch_special, ps_batch.to(device, non_blocking=True))
+
                 if semantic_matching_indices is not None:
-                    semantic_mask = torch.zeros_like(max_similarity, dtype=torch.float32)
-                    B, C, n = max_similarity.shape
-                    for b in range(B):
-                        abs_query_index = i + b
-                        # Get the token list for this query.
-                        query_tokens = semantic_matching_indices["query"].get(abs_query_index, [])
-                        # Normalize tokens (if desired)
-                        # query_tokens = [tok.lower() for tok in query_tokens]
-                        for c in range(C):
-                            abs_passage_index = j + c
-                            passage_tokens = semantic_matching_indices["passage"].get(abs_passage_index, [])
-
-                            for t in range(n):
-                                # Be sure that the token index t exists in your token list.
-                                if t < len(query_tokens):
-                                    if query_tokens[t] not in passage_tokens:
-                                        semantic_mask[b, c, t] = 1.0
-                    # Apply the mask: only tokens that appear in the passage contribute.
-                    max_similarity = max_similarity * semantic_mask
-        
+                    # Only the query tokens that do not appear in the passage contribute.
+                    semantic_mask = get_lexical_mask(
+                        query_token_ids[i : i + batch_size],
+                        passage_token_ids[indices],
+                        vocab_size=len(vocabulary),
+                        n_query_tokens=max_similarity.shape[2],
+                        lexical=False,
+                    )
+                    max_similarity = max_similarity * semantic_mask.to(max_similarity.device, torch.float32)
+
                 # Sum over query tokens to get one score per query–passage pair.
                 query_wise_score = max_similarity.sum(dim=2)
-                scores_batch.append(query_wise_score)
-        
-            scores_batch = torch.cat(scores_batch, dim=1).cpu()
+                scores_batch[:, indices] = query_wise_score.to(dtype=torch.float32, device="cpu")
             scores_list.append(scores_batch)
         
         scores = torch.cat(scores_list, dim=0)
@@ -230,7 +238,7 @@ class BaseVisualRetrieverProcessor(ABC):
     @staticmethod
     def score_multi_vector_text_lexical(
         qs: Union[torch.Tensor, List[torch.Tensor]],
-        ps: Union[torch.Tensor, List[torch.Tensor]],
+        ps: Union[torch.Tensor, List[torch.Tensor], PassageBlocks],
         semantic_matching_indices: Optional[Dict[str, Dict[int, List[str]]]] = None,
         batch_size: int = 128,
         device: Optional[Union[str, torch.device]] = None,
@@ -252,11 +260,21 @@ class BaseVisualRetrieverProcessor(ABC):
         if len(ps) == 0:
             raise ValueError("No passages provided")
         
+        if semantic_matching_indices is not None:
+            # Map the token strings to vocabulary ids once, so that the masks can be computed with tensor ops
+            vocabulary: Dict[str, int] = {}
+            query_token_ids = get_token_ids(
+                [semantic_matching_indices["query"].get(idx, []) for idx in range(len(qs))], vocabulary
+            )
+            passage_token_ids = get_token_ids(
+                [semantic_matching_indices["passage"].get(idx, []) for idx in range(len(ps))], vocabulary
+            )
+
+        ps_blocks = get_passage_blocks(ps, batch_size, bucketed=False)
         scores_list: List[torch.Tensor] = []
         
         # Process queries in batches.
         for i in range(0, len(qs), batch_size):
-            scores_batch = []
             qs_batch = torch.nn.utils.rnn.pad_sequence(
                 qs[i : i + batch_size],
                 batch_first=True,
@@ -266,55 +284,30 @@ class BaseVisualRetrieverProcessor(ABC):
             # (Make sure that you have built your token lists accordingly.)
             qs_batch_special = qs_batch[:, 2:-10, :]
         
-            for j in range(0, len(ps), batch_size):
-                try:
-                    ps_batch = torch.nn.utils.rnn.pad_sequence(
-                        ps[j : j + batch_size],
-                        batch_first=True,
-                        padding_value=0
-                    ).to(device)
-                except TypeError:
-                    embedding_dim = qs_batch_special.size(-1)
-                    default_shape = (batch_size, 1, embedding_dim)
-                    ps_batch = torch.zeros(default_shape, dtype=qs_batch_special.dtype, device=device)
-        
-                # Compute the similarity matrix between query and passage tokens.
-                # Shape: [B (queries), C (passages), n (query tokens), s (passage tokens)]
-                similarity_matrix = torch.einsum("bnd,csd->bcns", qs_batch_special, ps_batch)
+            # The passage blocks are padded once and reused across the query batches. Blocks that could
+            # not be padded are scored as all-zero passage embeddings, i.e. get a score of zero.
+            scores_batch = torch.zeros((qs_batch.shape[0], len(ps_blocks)), dtype=torch.float32)
+            for indices, ps_batch, _ in ps_blocks:
+                if ps_batch is None:
+                    continue
                 # For each query token, take the maximum similarity over the passage tokens.
-                # We end up with max_similarity of shape [B, C, n].
-                max_similarity, _ = similarity_matrix.max(dim=3)
-        
+                # Shape: [B (queries), C (passages), n (query tokens)]
+                max_similarity = fused_max_sim(qs_batch_special, ps_batch.to(device, non_blocking=True))
+
                 if semantic_matching_indices is not None:
-                    # Instead of using the best-matching token index, we simply build a binary mask.
-                    # For each query token (by absolute index) we check if that token appears in the passage.
-                    semantic_mask = torch.zeros_like(max_similarity, dtype=torch.float32)
-                    B, C, n = max_similarity.shape
-                    for b in range(B):
-                        abs_query_index = i + b
-                        # Get the token list for this query.
-                        query_tokens = semantic_matching_indices["query"].get(abs_query_index, [])
-                        # Normalize tokens (if desired)
-                        # query_tokens = [tok.lower() for tok in query_tokens]
-                        for c in range(C):
-                            abs_passage_index = j + c
-                            passage_tokens = semantic_matching_indices["passage"].get(abs_passage_index, [])
-                            # passage_tokens = [tok.lower() for tok in passage_tokens]
-                            # For each token position in the (sliced) query embeddings,
-                            # check if the corresponding query token is in the passage token list.
-                            for t in range(n):
-                                # Be sure that the token index t exists in your token list.
-                                if t < len(query_tokens):
-                                    if query_tokens[t] in passage_tokens:
-                                        semantic_mask[b, c, t] = 1.0
-                    # Apply the mask: only tokens that appear in the passage contribute.
-                    max_similarity = max_similarity * semantic_mask
-        
+                    # Only the query tokens that appear in the passage contribute.
+                    semantic_mask = get_lexical_mask(
+                        query_token_ids[i : i + batch_size],
+                        passage_token_ids[indices],
+                        vocab_size=len(vocabulary),
+                        n_query_tokens=max_similarity.shape[2],
+                        lexical=True,
+                    )
+                    max_similarity = max_similarity * semantic_mask.to(max_similarity.device, torch.float32)
+
                 # Sum over query tokens to get one score per query–passage pair.
                 query_wise_score = max_similarity.sum(dim=2)
-                scores_batch.append(query_wise_score)
-        
-            scores_batch = torch.cat(scores_batch, dim=1).cpu()
+                scores_batch[:, indices] = query_wise_score.to(dtype=torch.float32, device="cpu")
             scores_list.append(scores_batch)
         
         scores = torch.cat(scores_list, dim=0)
@@ -324,7 +317,7 @@ class BaseVisualRetrieverProcessor(ABC):
     @staticmethod
     def score_multi_vector_text_special(
         qs: Union[torch.Tensor, List[torch.Tensor]],
-        ps: Union[torch.Tensor, List[torch.Tensor]],
+        ps: Union[torch.Tensor, List[torch.Tensor], PassageBlocks],
         batch_size: int = 128,
         device: Optional[Union[str, torch.device]] = None,
     ) -> torch.Tensor:
@@ -341,10 +334,10 @@ class BaseVisualRetrieverProcessor(ABC):
         if len(ps) == 0:
             raise ValueError("No passages provided")
 
+        ps_blocks = get_passage_blocks(ps, batch_size, bucketed=False)
         scores_list: List[torch.Tensor] = []
 
         for i in range(0, len(qs), batch_size):
-            scores_batch = []
             qs_batch = torch.nn.utils.rnn.pad_sequence(qs[i : i + batch_size], batch_first=True, padding_value=0).to(
                 device
             )
@@ -355,20 +348,14 @@ class BaseVisualRetrieverProcessor(ABC):
             else:
                 qs_batch_special = torch.cat([qs_batch[:, :2, :], qs_batch[:, -10:, :]], dim=1)
 
-            for j in range(0, len(ps), batch_size):
-                try:
-                    ps_batch = torch.nn.utils.rnn.pad_sequence(
-                    ps[j : j + batch_size], batch_first=True, padding_value=0).to(device)
-                except TypeError as e:
-                    embedding_dim = 128  # Example embedding dimension
-                    default_shape = (batch_size, 1, embedding_dim)  # Modify based on expected tensor sizes
-                    ps_batch = torch.zeros(default_shape, dtype=torch.bfloat16, device=device)
-
-                query_wise_max_score_special = (torch.einsum("bnd,csd->bcns", qs_batch_special, ps_batch).max(dim=3)[0].sum(dim=2))
-
-                scores_batch.append(query_wise_max_score_special)
-            
-            scores_batch = torch.cat(scores_batch, dim=1).cpu()
+            # The passage blocks are padded once and reused across the query batches. Blocks that could
+            # not be padded are scored as all-zero passage embeddings, i.e. get a score of zero.
+            scores_batch = torch.zeros((qs_batch.shape[0], len(ps_blocks)), dtype=torch.float32)
+            for indices, ps_batch, _ in ps_blocks:
+                if ps_batch is None:
+                    continue
+                query_wise_max_score_special = max_sim_scores(qs_batch_special, ps_batch.to(device, non_blocking=True))
+                scores_batch[:, indices] = query_wise_max_score_special.to(dtype=torch.float32, device="cpu")
             scores_list.append(scores_batch)
 
         scores = torch.cat(scores_list, dim=0)
@@ -386,64 +373,37 @@ class BaseVisualRetrieverProcessor(ABC):
         batch_size: int = 128,
         device: Optional[Union[str, torch.device]] = None,
     ) -> torch.Tensor:
-        
-        def to_bfloat16_tensor(item, device):
-            if isinstance(item, torch.Tensor):
-                return item.to(dtype=torch.bfloat16, device=device)
-            else:
-                return torch.tensor(item, dtype=torch.bfloat16, device=device)
+        """
+        Index-restricted late-interaction score: for every query-passage pair, only the precomputed
+        `semantic_matching_indices[query_idx][passage_idx] = (q_indices, p_indices)` tokens are used
+        in the MaxSim. Pairs without selected tokens get a score of zero.
+
+        Each (query batch, passage batch) block is scored at once with `segment_max_sim`.
 
+        Returns:
+            `torch.Tensor`: A tensor of shape `(n_queries, n_passages)` containing the scores. The score
+            tensor is saved on the "cpu" device.
+        """
         device = device or get_torch_device("auto")
 
-        # We will accumulate scores in blocks.
+        if semantic_matching_indices is None:
+            raise ValueError("`semantic_matching_indices` must be provided")
+
         scores_list: List[torch.Tensor] = []
 
-        # Process queries in batches.
         for i in range(0, len(qs), batch_size):
-            # Determine the query indices for this batch.
-            batch_q_indices = list(range(i, min(i + batch_size, len(qs))))
-            current_batch_size_q = len(batch_q_indices)
-            # Prepare a list to accumulate score rows for this query batch.
-            batch_scores_rows = []
-
-            # Process passages in batches.
-            for j in range(0, len(qs), batch_size):
-                batch_p_indices = list(range(j, min(j + batch_size, len(ps))))
-                current_batch_size_p = len(batch_p_indices)
-
-                # Prepare a tensor to hold the scores for this block
-                block_scores = torch.empty((current_batch_size_q, current_batch_size_p), device=device, dtype=torch.float32)
-
-                # Now, for each query in the current query batch...
-                for qi, global_q_idx in enumerate(batch_q_indices):
-                    q_emb = qs[global_q_idx].to(device)  # shape: [n_q_tokens, D]
-                    # For each passage in the current passage batch...
-                    for pi, global_p_idx in enumerate(batch_p_indices):
-                        p_emb = ps[global_p_idx].to(device)  # shape: [n_p_tokens, D]
-                        # Retrieve the matching indices computed earlier.
-                        # semantic_matching_indices is assumed to be a nested list such that:
-                        # semantic_matching_indices[global_q_idx][global_p_idx] = (q_indices, p_indices)
-                        q_indices, p_indices = semantic_matching_indices[global_q_idx][global_p_idx]
-                        if len(q_indices) == 0 or len(p_indices) == 0:
-                            # If there are no overlapping token indices, assign a score of zero.
-                            block_scores[qi, pi] = 0.0
-                        else:
-                            # Select only the embeddings corresponding to the matching indices.
-                            q_emb_lex = q_emb[q_indices, :]  # shape: [n_q_selected, D]
-                            p_emb_lex = p_emb[p_indices, :]  # shape: [n_p_selected, D]
-                            # Compute dot products: result shape [n_q_selected, n_p_selected]
-                            dot = torch.matmul(q_emb_lex, p_emb_lex.t())
-                            # For each query token (row), take the maximum over the passage tokens.
-                            max_per_q = dot.max(dim=1)[0]  # shape: [n_q_selected]
-                            # Sum these maximum values to obtain a single score.
-                            block_scores[qi, pi] = max_per_q.sum()
-                # Append this block's scores along the passage dimension.
-                batch_scores_rows.append(block_scores)
-            # Concatenate all passage-blocks (columns) for this query batch.
-            batch_scores = torch.cat(batch_scores_rows, dim=1)
-            scores_list.append(batch_scores)
-
-        # Concatenate all query batches (rows).
+            batch_scores = []
+            for j in range(0, len(ps), batch_size):
+                batch_scores.append(
+                    segment_max_sim(
+                        qs[i : i + batch_size],
+                        ps[j : j + batch_size],
+                        [row[j : j + batch_size] for row in semantic_matching_indices[i : i + batch_size]],
+                        device=device,
+                    )
+                )
+            scores_list.append(torch.cat(batch_scores, dim=1))
+
         scores = torch.cat(scores_list, dim=0)
         if scores.shape[0] != len(qs):
             raise ValueError(f"Expected {len(qs)} scores, got {scores.shape[0]}")
@@ -453,7 +413,7 @@ class BaseVisualRetrieverProcessor(ABC):
     @staticmethod
     def score_multi_vector_image_qtm(
         qs: Union[torch.Tensor, List[torch.Tensor]],
-        ps: Union[torch.Tensor, List[torch.Tensor]],
+        ps: Union[torch.Tensor, List[torch.Tensor], PassageBlocks],
         batch_size: int = 128,
         device: Optional[Union[str, torch.device]] = None,
     ) -> torch.Tensor:
@@ -492,10 +452,10 @@ class BaseVisualRetrieverProcessor(ABC):
         if len(ps) == 0:
             raise ValueError("No passages provided")
 
+        ps_blocks = get_passage_blocks(ps, batch_size, bucketed=False)
         scores_list: List[torch.Tensor] = []
 
         for i in range(0, len(qs), batch_size):
-            scores_batch = []
             qs_batch = torch.nn.utils.rnn.pad_sequence(qs[i : i + batch_size], batch_first=True, padding_value=0).to(
                 device
             )
@@ -503,20 +463,14 @@ class BaseVisualRetrieverProcessor(ABC):
             # Use first 2 and last 10 tokens if available; otherwise, use all tokens.
             qs_batch_special = qs_batch[:, 2:-10, :]
 
-            for j in range(0, len(ps), batch_size):
-                try:
-                    ps_batch = torch.nn.utils.rnn.pad_sequence(
-                    ps[j : j + batch_size], batch_first=True, padding_value=0).to(device)
-                except TypeError as e:
-                    embedding_dim = 128  # Example embedding dimension
-                    default_shape = (batch_size, 1, embedding_dim)  # Modify based on expected tensor sizes
-                    ps_batch = torch.zeros(default_shape, dtype=torch.bfloat16, device=device)
-
-                query_wise_max_score_special = (torch.einsum("bnd,csd->bcns", qs_batch_special, ps_batch).max(dim=3)[0].sum(dim=2))
-
-                scores_batch.append(query_wise_max_score_special)
-            
-            scores_batch = torch.cat(scores_batch, dim=1).cpu()
+            # The passage blocks are padded once and reused across the query batches. Blocks that could
+            # not be padded are scored as all-zero passage embeddings, i.e. get a score of zero.
+            scores_batch = torch.zeros((qs_batch.shape[0], len(ps_blocks)), dtype=torch.float32)
+            for indices, ps_batch, _ in ps_blocks:
+                if ps_batch is None:
+                    continue
+                query_wise_max_score_special = max_sim_scores(qs_batch_special, ps_batch.to(device, non_blocking=True))
+                scores_batch[:, indices] = query_wise_max_score_special.to(dtype=torch.float32, device="cpu")
             scores_list.append(scores_batch)
 
         scores = torch.cat(scores_list, dim=0)
@@ -528,7 +482,7 @@ class BaseVisualRetrieverProcessor(ABC):
     @staticmethod
     def score_multi_vector_text_qtm(
         qs: Union[torch.Tensor, List[torch.Tensor]],
-        ps: Union[torch.Tensor, List[torch.Tensor]],
+        ps: Union[torch.Tensor, List[torch.Tensor], PassageBlocks],
         batch_size: int = 128,
         device: Optional[Union[str, torch.device]] = None,
     ) -> torch.Tensor:
@@ -567,10 +521,10 @@ class BaseVisualRetrieverProcessor(ABC):
         if len(ps) == 0:
             raise ValueError("No passages provided")
 
+        ps_blocks = get_passage_blocks(ps, batch_size, bucketed=False)
         scores_list: List[torch.Tensor] = []
 
         for i in range(0, len(qs), batch_size):
-            scores_batch = []
             qs_batch = torch.nn.utils.rnn.pad_sequence(qs[i : i + batch_size], batch_first=True, padding_value=0).to(
                 device
             )
@@ -578,20 +532,14 @@ class BaseVisualRetrieverProcessor(ABC):
             # Use first 2 and last 10 tokens if available; otherwise, use all tokens.
             qs_batch_special = qs_batch[:, 2:-10, :]
 
-            for j in range(0, len(ps), batch_size):
-                try:
-                    ps_batch = torch.nn.utils.rnn.pad_sequence(
-                    ps[j : j + batch_size], batch_first=True, padding_value=0).to(device)
-                except TypeError as e:
-                    embedding_dim = 128  # Example embedding dimension
-                    default_shape = (batch_size, 1, embedding_dim)  # Modify based on expected tensor sizes
-                    ps_batch = torch.zeros(default_shape, dtype=torch.bfloat16, device=device)
-
-                query_wise_max_score_special = (torch.einsum("bnd,csd->bcns", qs_batch_special, ps_batch).max(dim=3)[0].sum(dim=2))
-
-                scores_batch.append(query_wise_max_score_special)
-            
-            scores_batch = torch.cat(scores_batch, dim=1).cpu()
+            # The passage blocks are padded once and reused across the query batches. Blocks that could
+            # not be padded are scored as all-zero passage embeddings, i.e. get a score of zero.
+            scores_batch = torch.zeros((qs_batch.shape[0], len(ps_blocks)), dtype=torch.float32)
+            for indices, ps_batch, _ in ps_blocks:
+                if ps_batch is None:
+                    continue
+                query_wise_max_score_special = max_sim_scores(qs_batch_special, ps_batch.to(device, non_blocking=True))
+                scores_batch[:, indices] = query_wise_max_score_special.to(dtype=torch.float32, device="cpu")
             scores_list.append(scores_batch)
 
         scores = torch.cat(scores_list, dim=0)
@@ -604,7 +552,7 @@ class BaseVisualRetrieverProcessor(ABC):
     @staticmethod
     def score_multi_vector_image_special(
         qs: Union[torch.Tensor, List[torch.Tensor]],
-        ps: Union[torch.Tensor, List[torch.Tensor]],
+        ps: Union[torch.Tensor, List[torch.Tensor], PassageBlocks],
         batch_size: int = 128,
         device: Optional[Union[str, torch.device]] = None,
     ) -> torch.Tensor:
@@ -643,30 +591,24 @@ class BaseVisualRetrieverProcessor(ABC):
         if len(ps) == 0:
             raise ValueError("No passages provided")
 
+        ps_blocks = get_passage_blocks(ps, batch_size, bucketed=False)
         scores_list: List[torch.Tensor] = []
 
         for i in range(0, len(qs), batch_size):
-            scores_batch = []
             qs_batch = torch.nn.utils.rnn.pad_sequence(qs[i : i + batch_size], batch_first=True, padding_value=0).to(
                 device
             )
 
             qs_batch_special = torch.cat([qs_batch[:, :2, :], qs_batch[:, -10:, :]], dim=1)
 
-            for j in range(0, len(ps), batch_size):
-                try:
-                    ps_batch = torch.nn.utils.rnn.pad_sequence(
-                    ps[j : j + batch_size], batch_first=True, padding_value=0).to(device)
-                except TypeError as e:
-                    embedding_dim = 128  # Example embedding dimension
-                    default_shape = (batch_size, 1, embedding_dim)  # Modify based on expected tensor sizes
-                    ps_batch = torch.zeros(default_shape, dtype=torch.bfloat16, device=device)
-
-                query_wise_max_score_special = (torch.einsum("bnd,csd->bcns", qs_batch_special, ps_batch).max(dim=3)[0].sum(dim=2))
-
-                scores_batch.append(query_wise_max_score_special)
-            
-            scores_batch = torch.cat(scores_batch, dim=1).cpu()
+            # The passage blocks are padded once and reused across the query batches. Blocks that could
+            # not be padded are scored as all-zero passage embeddings, i.e. get a score of zero.
+            scores_batch = torch.zeros((qs_batch.shape[0], len(ps_blocks)), dtype=torch.float32)
+            for indices, ps_batch, _ in ps_blocks:
+                if ps_batch is None:
+                    continue
+                query_wise_max_score_special = max_sim_scores(qs_batch_special, ps_batch.to(device, non_blocking=True))
+                scores_batch[:, indices] = query_wise_max_score_special.to(dtype=torch.float32, device="cpu")
             scores_list.append(scores_batch)
 
         scores = torch.cat(scores_list, dim=0)
@@ -678,9 +620,15 @@ class BaseVisualRetrieverProcessor(ABC):
     @staticmethod
     def score_multi_vector(
         qs: Union[torch.Tensor, List[torch.Tensor]],
-        ps: Union[torch.Tensor, List[torch.Tensor]],
+        ps: Union[torch.Tensor, List[torch.Tensor], PassageBlocks],
         batch_size: int = 128,
         device: Optional[Union[str, torch.device]] = None,
+        tile_size: int = DEFAULT_TILE_SIZE,
+        num_workers: int = 1,
+        backend: str = "thread",
+        num_threads_per_worker: Optional[int] = None,
+        quantization: Optional[str] = None,
+        rerank_top_k: Optional[int] = None,
     ) -> torch.Tensor:
         """
         Compute the late-interaction/MaxSim score (ColBERT-like) for the given multi-vector
@@ -693,23 +641,39 @@ class BaseVisualRetrieverProcessor(ABC):
         (2) a single tensor of shape (n_passages, max_sequence_length, embedding_dim) -> usually
             obtained by padding the list of tensors.
 
+        The all-zero padding rows are stripped and ignored by the MaxSim. The passages are sorted into
+        length buckets of `batch_size` passages that are each padded to their own longest passage, so
+        that a single long passage (e.g. a tall ColQwen2 page) does not inflate the whole block.
+
+        The padded passage blocks are built once and reused across all the query batches. To also reuse
+        them across calls (e.g. repeated evaluations over the same index), pass a prebuilt
+        `PassageBlocks.from_embeddings(ps, batch_size)` instance (optionally pinned or device-resident)
+        instead of `ps`.
+
         Args:
             qs (`Union[torch.Tensor, List[torch.Tensor]`): Query embeddings.
-            ps (`Union[torch.Tensor, List[torch.Tensor]`): Passage embeddings.
+            ps (`Union[torch.Tensor, List[torch.Tensor], PassageBlocks]`): Passage embeddings or prebuilt
+                passage blocks.
             batch_size (`int`, *optional*, defaults to 128): Batch size for computing scores.
             device (`Union[str, torch.device]`, *optional*): Device to use for computation. If not
                 provided, uses `get_torch_device("auto")`.
+            tile_size (`int`, *optional*, defaults to 64): Number of passage tokens processed at once by the
+                fused MaxSim kernel. The peak memory of a block scales with `batch_size² · n · tile_size`.
+            num_workers (`int`, *optional*, defaults to 1): Number of CPU workers scoring the passage buckets
+                in parallel. Only supported on the "cpu" device.
+            backend (`str`, *optional*, defaults to "thread"): Worker pool used when `num_workers > 1`, either
+                "thread" (the threads share the intra-op thread pool of the process) or "process".
+            num_threads_per_worker (`int`, *optional*): Number of intra-op (BLAS) threads each worker process is
+                pinned to, with the "process" backend. Defaults to `torch.get_num_threads() // num_workers`.
+            quantization (`str`, *optional*): Score with "int8" (per-token int8 codes and scales) or "binary"
+                (1-bit sign codes) quantized embeddings instead of the full-precision ones.
+            rerank_top_k (`int`, *optional*): With `quantization`, rescore the `rerank_top_k` best passages of each
+                query exactly with the full-precision embeddings. Requires `ps` to be the passage embeddings.
 
         Returns:
             `torch.Tensor`: A tensor of shape `(n_queries, n_passages)` containing the scores. The score
             tensor is saved on the "cpu" device.
         """
-        def to_bfloat16_tensor(item, device):
-            if isinstance(item, torch.Tensor):
-                return item.to(dtype=torch.bfloat16, device=device)
-            else:
-                return torch.tensor(item, dtype=torch.bfloat16, device=device)
-
         device = device or get_torch_device("auto")
 
         if len(qs) == 0:
@@ -717,48 +681,90 @@ class BaseVisualRetrieverProcessor(ABC):
         if len(ps) == 0:
             raise ValueError("No passages provided")
 
-        scores_list: List[torch.Tensor] = []
-
-        for i in range(0, len(qs), batch_size):
-            scores_batch = []
-            qs_batch = torch.nn.utils.rnn.pad_sequence(qs[i : i + batch_size], batch_first=True, padding_value=0).to(
-                device
-            )
-            for j in range(0, len(ps), batch_size):
-                try:
-                    ps_batch = torch.nn.utils.rnn.pad_sequence(
-                    ps[j : j + batch_size], batch_first=True, padding_value=0).to(device)
-                except TypeError as e:
-                    embedding_dim = 128  # Example embedding dimension
-                    default_shape = (batch_size, 1, embedding_dim)  # Modify based on expected tensor sizes
-                    ps_batch = torch.zeros(default_shape, dtype=torch.bfloat16, device=device)
-                                
-                
-                query_wise_max_score = torch.einsum("bnd,csd->bcns", qs_batch, ps_batch).max(dim=3)[0].sum(dim=2)
-                # print("qs_batch ", qs_batch.shape)
-                # print("ps_batch ", ps_batch.shape)
-                # print("query_wise_max_score ", query_wise_max_score.shape)
-
-                # query_wise_sum_score = tmp_score.sum(dim=3).sum(dim=2)
-                # print("query_wise_sum_score ", query_wise_sum_score.shape, "\n")
-                
-                # attention_weights = torch.softmax(tmp_score, dim=3)
-                # weighted_query_wise_sum_score = (tmp_score * attention_weights).sum(dim=3).sum(dim=2)
-
-                # attention_weights = torch.softmax(tmp_score, dim=3)
-                # weighted_query_wise_sum_score = (tmp_score * attention_weights).max(dim=3)[0].sum(dim=2)
-                # max_over_query = tmp_score.max(dim=2)[0].sum(dim=2)
-                scores_batch.append(query_wise_max_score)
-            
-            scores_batch = torch.cat(scores_batch, dim=1).cpu()
-            scores_list.append(scores_batch)
-
-        scores = torch.cat(scores_list, dim=0)
+        scores = score_multi_vector_bucketed(
+            qs,
+            ps,
+            batch_size=batch_size,
+            device=device,
+            tile_size=tile_size,
+            num_workers=num_workers,
+            backend=backend,
+            num_threads_per_worker=num_threads_per_worker,
+            quantization=quantization,
+            rerank_top_k=rerank_top_k,
+        )
         assert scores.shape[0] == len(qs), f"Expected {len(qs)} scores, got {scores.shape[0]}"
 
-        scores = scores.to(torch.float32)
         return scores
 
+    @staticmethod
+    def score_multi_vector_top_k(
+        qs: Union[torch.Tensor, List[torch.Tensor]],
+        ps: Union[torch.Tensor, List[torch.Tensor], PassageBlocks],
+        k: int = 100,
+        batch_size: int = 128,
+        device: Optional[Union[str, torch.device]] = None,
+        tile_size: int = DEFAULT_TILE_SIZE,
+        num_workers: int = 1,
+        backend: str = "thread",
+        num_threads_per_worker: Optional[int] = None,
+        quantization: Optional[str] = None,
+        rerank_top_k: Optional[int] = None,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Streaming version of `score_multi_vector` that only returns the top-k passages of each query.
+
+        The scores of every passage block are merged into a running top-k per query instead of being written
+        to a dense `(n_queries, n_passages)` matrix, so that the memory footprint is O(n_queries · k) no matter
+        how large the corpus is.
+
+        Args:
+            qs (`Union[torch.Tensor, List[torch.Tensor]`): Query embeddings.
+            ps (`Union[torch.Tensor, List[torch.Tensor], PassageBlocks]`): Passage embeddings or prebuilt
+                passage blocks.
+            k (`int`, *optional*, defaults to 100): Number of passages to retrieve per query.
+            batch_size (`int`, *optional*, defaults to 128): Batch size for computing scores.
+            device (`Union[str, torch.device]`, *optional*): Device to use for computation. If not
+                provided, uses `get_torch_device("auto")`.
+            tile_size (`int`, *optional*, defaults to 64): Number of passage tokens processed at once by the
+                fused MaxSim kernel.
+            num_workers (`int`, *optional*, defaults to 1): Number of CPU workers scoring the passage buckets
+                in parallel. Only supported on the "cpu" device.
+            backend (`str`, *optional*, defaults to "thread"): Worker pool used when `num_workers > 1`, either
+                "thread" (the threads share the intra-op thread pool of the process) or "process".
+            num_threads_per_worker (`int`, *optional*): Number of intra-op (BLAS) threads each worker process is
+                pinned to, with the "process" backend. Defaults to `torch.get_num_threads() // num_workers`.
+            quantization (`str`, *optional*): Score with "int8" (per-token int8 codes and scales) or "binary"
+                (1-bit sign codes) quantized embeddings instead of the full-precision ones.
+            rerank_top_k (`int`, *optional*): With `quantization`, rescore the `rerank_top_k` best passages of each
+                query exactly with the full-precision embeddings. Requires `ps` to be the passage embeddings.
+
+        Returns:
+            `Tuple[torch.Tensor, torch.Tensor]`: The passage indices and the scores of the top-k passages of
+            each query, both of shape `(n_queries, min(k, n_passages))` and sorted by decreasing score. The
+            tensors are saved on the "cpu" device.
+        """
+        device = device or get_torch_device("auto")
+
+        if len(qs) == 0:
+            raise ValueError("No queries provided")
+        if len(ps) == 0:
+            raise ValueError("No passages provided")
+
+        return score_multi_vector_top_k(
+            qs,
+            ps,
+            k=k,
+            batch_size=batch_size,
+            device=device,
+            tile_size=tile_size,
+            num_workers=num_workers,
+            backend=backend,
+            num_threads_per_worker=num_threads_per_worker,
+            quantization=quantization,
+            rerank_top_k=rerank_top_k,
+        )
+
     @abstractmethod
     def get_n_patches(
         self,
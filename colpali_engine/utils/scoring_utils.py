@@ -0,0 +1,1003 @@
+import math
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import torch
+
+DEFAULT_TILE_SIZE = 64
+DEFAULT_SEGMENT_CHUNK_SIZE = 1 << 16
+QUANTIZATIONS = ("int8", "binary")
+
+_BIT_SHIFTS = torch.arange(7, -1, -1, dtype=torch.uint8)
+# ±1 signs of the 8 bits of every byte value, most significant bit first
+_BYTE_SIGNS = 2 * ((torch.arange(256, dtype=torch.uint8)[:, None] >> _BIT_SHIFTS) & 1).float() - 1
+
+
+def strip_padding(embeddings: torch.Tensor) -> torch.Tensor:
+    """
+    Remove the padding rows of a multi-vector embedding of shape (sequence_length, embedding_dim).
+
+    Padding rows are exactly zero: they are either added by `pad_sequence` or by the models, which
+    multiply their L2-normalized outputs by the attention mask. A real token can never be all-zero.
+    """
+    return embeddings[embeddings.ne(0).any(dim=-1)]
+
+
+def get_length_buckets(lengths: Sequence[int], bucket_size: int) -> List[torch.Tensor]:
+    """
+    Sort the items by length and split them into buckets of at most `bucket_size` items.
+
+    Returns the list of the (original) item indices of each bucket. Items of similar length end up
+    in the same bucket, so that padding each bucket to its own longest item wastes little compute.
+    """
+    if bucket_size < 1:
+        raise ValueError("`bucket_size` must be at least one")
+
+    order = torch.argsort(torch.tensor(lengths, dtype=torch.long), stable=True)
+    return list(torch.split(order, bucket_size))
+
+
+def pad_with_mask(embeddings: List[torch.Tensor]) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Right-pad a list of multi-vector embeddings to the longest one.
+
+    Returns:
+        `Tuple[torch.Tensor, torch.Tensor]`: The padded embeddings of shape (batch_size, max_length, embedding_dim)
+        and the boolean token mask of shape (batch_size, max_length), which is `True` for real tokens.
+    """
+    padded = torch.nn.utils.rnn.pad_sequence(embeddings, batch_first=True, padding_value=0)
+    lengths = torch.tensor([len(emb) for emb in embeddings], device=padded.device)
+    mask = torch.arange(padded.shape[1], device=padded.device)[None, :] < lengths[:, None]
+    return padded, mask
+
+
+class _FusedMaxSim(torch.autograd.Function):
+    """
+    Tiled MaxSim with a tiled backward pass.
+
+    Only the passage token index of every max (the argmax, of shape (B, n, C)) is saved for the backward pass,
+    instead of the similarity tile of every matmul: the gradients are recomputed tile by tile from the argmax
+    indices, with one matmul per tile for the queries and one for the passages. The peak memory of the backward
+    pass thus also scales with B·C·n·tile_size.
+    """
+
+    @staticmethod
+    def forward(
+        ctx,
+        qs_batch: torch.Tensor,
+        ps_batch: torch.Tensor,
+        ps_mask: Optional[torch.Tensor],
+        tile_size: int,
+    ) -> torch.Tensor:
+        n_queries, n_query_tokens, dim = qs_batch.shape
+        n_passages, n_passage_tokens, _ = ps_batch.shape
+        needs_argmax = ctx.needs_input_grad[0] or ctx.needs_input_grad[1]
+
+        qs_flat = qs_batch.reshape(n_queries * n_query_tokens, dim)
+        max_similarity = torch.full(
+            (n_queries, n_query_tokens, n_passages),
+            float("-inf"),
+            dtype=torch.result_type(qs_batch, ps_batch),
+            device=qs_batch.device,
+        )
+        argmax = None
+        if needs_argmax:
+            argmax = torch.full(max_similarity.shape, -1, dtype=torch.long, device=qs_batch.device)
+
+        for start in range(0, n_passage_tokens, tile_size):
+            ps_tile = ps_batch[:, start : start + tile_size]
+            tile_length = ps_tile.shape[1]
+
+            similarity = qs_flat @ ps_tile.reshape(n_passages * tile_length, dim).T
+            similarity = similarity.view(n_queries, n_query_tokens, n_passages, tile_length)
+            if ps_mask is not None:
+                tile_mask = ps_mask[:, start : start + tile_length]
+                similarity = similarity.masked_fill(~tile_mask[None, None, :, :], float("-inf"))
+
+            if argmax is None:
+                max_similarity = torch.maximum(max_similarity, similarity.amax(dim=3))
+                continue
+
+            tile_max, tile_argmax = similarity.max(dim=3)
+            update = tile_max > max_similarity
+            max_similarity = torch.where(update, tile_max, max_similarity)
+            argmax = torch.where(update, tile_argmax + start, argmax)
+
+        if argmax is not None:
+            # Query tokens with no (unmasked) passage token keep the -1 argmax and get no gradient
+            ctx.save_for_backward(qs_batch, ps_batch, argmax)
+        ctx.tile_size = tile_size
+
+        return max_similarity
+
+    @staticmethod
+    @torch.autograd.function.once_differentiable
+    def backward(ctx, grad_output: torch.Tensor):
+        qs_batch, ps_batch, argmax = ctx.saved_tensors
+        n_passage_tokens = ps_batch.shape[1]
+        grad_output = grad_output.to(qs_batch.dtype)
+
+        grad_qs = torch.zeros_like(qs_batch) if ctx.needs_input_grad[0] else None
+        grad_ps = torch.zeros_like(ps_batch) if ctx.needs_input_grad[1] else None
+
+        for start in range(0, n_passage_tokens, ctx.tile_size):
+            ps_tile = ps_batch[:, start : start + ctx.tile_size]
+            positions = torch.arange(start, start + ps_tile.shape[1], device=argmax.device)
+
+            # Gradient of the max w.r.t. the similarities of the tile: non-zero at the argmax only
+            tile_grad = (argmax[..., None] == positions).to(grad_output.dtype) * grad_output[..., None]
+
+            if grad_qs is not None:
+                grad_qs += torch.einsum("bnct,ctd->bnd", tile_grad, ps_tile)
+            if grad_ps is not None:
+                grad_ps[:, start : start + ps_tile.shape[1]] += torch.einsum("bnct,bnd->ctd", tile_grad, qs_batch)
+
+        return grad_qs, grad_ps, None, None
+
+
+def fused_max_sim(
+    qs_batch: torch.Tensor,
+    ps_batch: torch.Tensor,
+    ps_mask: Optional[torch.Tensor] = None,
+    tile_size: int = DEFAULT_TILE_SIZE,
+) -> torch.Tensor:
+    """
+    Compute, for every query token, the maximum similarity over the tokens of every passage.
+
+    This is equivalent to `torch.einsum("bnd,csd->bcns", qs_batch, ps_batch).max(dim=3)[0]`, but the
+    4-D similarity tensor is never materialized: the passage tokens are processed in tiles of `tile_size`
+    tokens with a single matmul per tile, and only a running max is kept. The peak memory thus scales
+    with B·C·n·tile_size instead of B·C·n·s.
+
+    The function is differentiable and can be used in the losses: only the argmax indices are kept for the
+    backward pass, which recomputes the gradients tile by tile (see `_FusedMaxSim`), so that training does not
+    keep the similarity tiles alive either.
+
+    Args:
+        qs_batch (`torch.Tensor`): Query embeddings of shape (B, n, d).
+        ps_batch (`torch.Tensor`): Passage embeddings of shape (C, s, d).
+        ps_mask (`torch.Tensor`, *optional*): Passage token mask of shape (C, s), `True` for real tokens.
+            Masked tokens are excluded from the max.
+        tile_size (`int`, *optional*, defaults to 64): Number of passage tokens processed at once.
+
+    Returns:
+        `torch.Tensor`: The max similarities of shape (B, C, n). Query tokens with no (unmasked) passage
+        token to compare with get `-inf`.
+    """
+    if tile_size < 1:
+        raise ValueError("`tile_size` must be at least one")
+
+    return _FusedMaxSim.apply(qs_batch, ps_batch, ps_mask, tile_size).permute(0, 2, 1)
+
+
+def max_sim_scores(
+    qs_batch: torch.Tensor,
+    ps_batch: torch.Tensor,
+    tile_size: int = DEFAULT_TILE_SIZE,
+) -> torch.Tensor:
+    """
+    Fused equivalent of `torch.einsum("bnd,csd->bcns", qs_batch, ps_batch).max(dim=3)[0].sum(dim=2)`.
+
+    Returns:
+        `torch.Tensor`: The MaxSim scores of shape (B, C).
+    """
+    return fused_max_sim(qs_batch, ps_batch, tile_size=tile_size).sum(dim=2)
+
+
+def masked_max_sim(
+    qs_batch: torch.Tensor,
+    qs_mask: torch.Tensor,
+    ps_batch: torch.Tensor,
+    ps_mask: torch.Tensor,
+    tile_size: int = DEFAULT_TILE_SIZE,
+) -> torch.Tensor:
+    """
+    Compute the MaxSim scores between a block of padded queries and a block of padded passages.
+
+    Padded passage tokens are excluded from the max, so that they can never be picked over real tokens
+    with negative similarities. Padded query tokens contribute zero to the sum, as do the query tokens
+    of empty passages.
+
+    Args:
+        qs_batch (`torch.Tensor`): Padded query embeddings of shape (B, n, d).
+        qs_mask (`torch.Tensor`): Query token mask of shape (B, n).
+        ps_batch (`torch.Tensor`): Padded passage embeddings of shape (C, s, d).
+        ps_mask (`torch.Tensor`): Passage token mask of shape (C, s).
+        tile_size (`int`, *optional*, defaults to 64): Number of passage tokens processed at once.
+
+    Returns:
+        `torch.Tensor`: The scores of shape (B, C).
+    """
+    max_similarity = fused_max_sim(qs_batch, ps_batch, ps_mask=ps_mask, tile_size=tile_size)  # (B, C, n)
+
+    valid = qs_mask[:, None, :] & ps_mask.any(dim=1)[None, :, None]
+    max_similarity = max_similarity.masked_fill(~valid, 0)
+
+    return max_similarity.sum(dim=2)
+
+
+def get_token_ids(token_lists: Sequence[Sequence[str]], vocabulary: Dict[str, int]) -> torch.Tensor:
+    """
+    Map lists of token strings to a right-padded tensor of vocabulary ids.
+
+    The unseen tokens are added to `vocabulary` in place, so that calling this function on the queries and then on
+    the passages with the same `vocabulary` yields consistent ids.
+
+    Returns:
+        `torch.Tensor`: An int64 tensor of shape (n_items, max_n_tokens), padded with -1.
+    """
+    ids = [torch.tensor([vocabulary.setdefault(token, len(vocabulary)) for token in tokens]) for tokens in token_lists]
+    max_length = max((len(item_ids) for item_ids in ids), default=0)
+
+    token_ids = torch.full((len(ids), max_length), -1, dtype=torch.long)
+    for idx, item_ids in enumerate(ids):
+        token_ids[idx, : len(item_ids)] = item_ids
+    return token_ids
+
+
+def get_lexical_mask(
+    query_token_ids: torch.Tensor,
+    passage_token_ids: torch.Tensor,
+    vocab_size: int,
+    n_query_tokens: int,
+    lexical: bool = True,
+) -> torch.Tensor:
+    """
+    Compute, for every query token, whether it appears in every passage.
+
+    Each passage is represented as a (C, vocab_size) bitmap of its token ids, and the bitmap is gathered at the
+    query token ids, so that the whole mask is computed with two tensor ops.
+
+    Args:
+        query_token_ids (`torch.Tensor`): Padded query token ids of shape (B, L_q), see `get_token_ids`.
+        passage_token_ids (`torch.Tensor`): Padded passage token ids of shape (C, L_p), see `get_token_ids`.
+        vocab_size (`int`): Number of distinct token ids.
+        n_query_tokens (`int`): Number of query token positions n of the mask. The query token lists are truncated
+            or padded to n.
+        lexical (`bool`, *optional*, defaults to `True`): If `True`, the mask selects the query tokens that appear in
+            the passage. Otherwise, it selects the query tokens that do not.
+
+    Returns:
+        `torch.Tensor`: A boolean mask of shape (B, C, n). Query token positions beyond the length of the query token
+        list are always `False`.
+    """
+    # Padding ids (-1) are mapped to an extra bitmap column that is always `False`
+    bitmap = torch.zeros((len(passage_token_ids), vocab_size + 1), dtype=torch.bool)
+    bitmap.scatter_(1, passage_token_ids.masked_fill(passage_token_ids < 0, vocab_size), True)
+    bitmap[:, vocab_size] = False
+
+    query_token_ids = query_token_ids[:, :n_query_tokens]
+    query_token_ids = torch.nn.functional.pad(query_token_ids, (0, n_query_tokens - query_token_ids.shape[1]), value=-1)
+    query_valid = query_token_ids >= 0
+
+    mask = bitmap[:, query_token_ids.masked_fill(~query_valid, vocab_size)].permute(1, 0, 2)  # (B, C, n)
+    if not lexical:
+        mask = ~mask & query_valid[:, None, :]
+
+    return mask
+
+
+def _pad_segment_indices(
+    selected: List[int],
+    lengths: torch.Tensor,
+    offsets: torch.Tensor,
+    max_length: int,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Turn the ragged token index lists of the pairs (concatenated in `selected`, of `lengths` tokens each) into a
+    right-padded (n_pairs, max_length) tensor of indices into the concatenated embeddings (shifted by the `offsets`
+    of the pairs) and its boolean mask.
+    """
+    pair = torch.repeat_interleave(torch.arange(len(lengths)), lengths)
+    position = torch.arange(len(pair)) - (lengths.cumsum(0) - lengths)[pair]
+
+    indices = torch.zeros((len(lengths), max_length), dtype=torch.long)
+    mask = torch.zeros((len(lengths), max_length), dtype=torch.bool)
+    indices[pair, position] = offsets[pair] + torch.tensor(selected, dtype=torch.long)
+    mask[pair, position] = True
+    return indices, mask
+
+
+def segment_max_sim(
+    qs: List[torch.Tensor],
+    ps: List[torch.Tensor],
+    matching_indices: Sequence[Sequence[Tuple[Sequence[int], Sequence[int]]]],
+    device: Union[str, torch.device] = "cpu",
+    chunk_size: int = DEFAULT_SEGMENT_CHUNK_SIZE,
+) -> torch.Tensor:
+    """
+    Index-restricted MaxSim between a block of queries and a block of passages.
+
+    For the query-passage pair (b, c) with `matching_indices[b][c] = (q_indices, p_indices)`, the score is the sum,
+    over the selected query tokens, of the max similarity with the selected passage tokens. Pairs with no selected
+    query or passage token get a score of zero.
+
+    Rather than looping over the pairs, the selected tokens of every pair are gathered into padded (pair, token)
+    tensors with their masks, and the pairs are scored with one batched matmul (`bmm`) per chunk, followed by a
+    masked max over the passage tokens and a masked sum over the query tokens. The chunks hold at most
+    `chunk_size` similarities to bound the memory, and the pairs are sorted by size so that each chunk is only
+    padded to its own longest pair.
+
+    Args:
+        qs (`List[torch.Tensor]`): Query embeddings of the block, each of shape (n_i, d).
+        ps (`List[torch.Tensor]`): Passage embeddings of the block, each of shape (s_j, d).
+        matching_indices (`Sequence[Sequence[Tuple[Sequence[int], Sequence[int]]]]`): The selected token indices
+            of every query-passage pair, indexed as `[query][passage]`.
+        device (`Union[str, torch.device]`, *optional*, defaults to "cpu"): Device to use for computation.
+        chunk_size (`int`, *optional*): Number of token similarities computed at once.
+
+    Returns:
+        `torch.Tensor`: A float32 tensor of shape (B, C) saved on the "cpu" device.
+    """
+    n_queries, n_passages = len(qs), len(ps)
+    n_pairs = n_queries * n_passages
+
+    qs_flat = torch.cat(list(qs)).to(device)
+    ps_flat = torch.cat(list(ps)).to(device)
+    q_offsets = torch.tensor([0] + [len(q) for q in qs[:-1]]).cumsum(0)
+    p_offsets = torch.tensor([0] + [len(p) for p in ps[:-1]]).cumsum(0)
+
+    # Concatenate the ragged index lists of the B·C pairs (pair k = b·C + c)
+    q_selected: List[int] = []
+    p_selected: List[int] = []
+    q_lengths: List[int] = []
+    p_lengths: List[int] = []
+    for b in range(n_queries):
+        for c in range(n_passages):
+            q_indices, p_indices = matching_indices[b][c]
+            q_selected.extend(q_indices)
+            p_selected.extend(p_indices)
+            q_lengths.append(len(q_indices))
+            p_lengths.append(len(p_indices))
+
+    q_lengths = torch.tensor(q_lengths, dtype=torch.long)
+    p_lengths = torch.tensor(p_lengths, dtype=torch.long)
+    max_q, max_p = max(1, int(q_lengths.max())), max(1, int(p_lengths.max()))
+    q_indices, q_mask = _pad_segment_indices(q_selected, q_lengths, q_offsets.repeat_interleave(n_passages), max_q)
+    p_indices, p_mask = _pad_segment_indices(p_selected, p_lengths, p_offsets.repeat(n_queries), max_p)
+
+    # Pairs of similar sizes end up in the same chunk, which is only padded to its own longest pair
+    order = torch.argsort(q_lengths * p_lengths, stable=True)
+    pairs_per_chunk = max(1, chunk_size // (max_q * max_p))
+
+    scores = torch.zeros(n_pairs, device=device)
+    for pairs in torch.split(order, pairs_per_chunk):
+        chunk_q = max(1, int(q_lengths[pairs].max()))
+        chunk_p = max(1, int(p_lengths[pairs].max()))
+        chunk_q_mask = q_mask[pairs, :chunk_q].to(device)
+        chunk_p_mask = p_mask[pairs, :chunk_p].to(device)
+
+        qs_selected = qs_flat[q_indices[pairs, :chunk_q].to(device)].float()  # (k, n, d)
+        ps_selected = ps_flat[p_indices[pairs, :chunk_p].to(device)].float()  # (k, s, d)
+
+        similarity = torch.bmm(qs_selected, ps_selected.transpose(1, 2))  # (k, n, s)
+        similarity = similarity.masked_fill(~chunk_p_mask[:, None, :], float("-inf"))
+        max_similarity = similarity.amax(dim=2)
+
+        # Padded query tokens and pairs with no selected passage token contribute zero
+        valid = chunk_q_mask & chunk_p_mask.any(dim=1, keepdim=True)
+        scores[pairs.to(device)] = max_similarity.masked_fill(~valid, 0).sum(dim=1)
+
+    return scores.view(n_queries, n_passages).cpu()
+
+
+def merge_top_k(
+    top_k_scores: torch.Tensor,
+    top_k_indices: torch.Tensor,
+    block_scores: torch.Tensor,
+    block_indices: torch.Tensor,
+    k: int,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Merge the scores of a new block of passages into the running top-k of a batch of queries.
+
+    Args:
+        top_k_scores (`torch.Tensor`): Running top-k scores of shape (B, k'), with k' <= k.
+        top_k_indices (`torch.Tensor`): Passage indices of the running top-k, of shape (B, k').
+        block_scores (`torch.Tensor`): Scores of the new block of passages, of shape (B, C).
+        block_indices (`torch.Tensor`): Passage indices of the new block, of shape (C,) or (B, C).
+        k (`int`): Number of passages to keep per query.
+
+    Returns:
+        `Tuple[torch.Tensor, torch.Tensor]`: The new top-k scores and passage indices, sorted by decreasing score.
+    """
+    scores = torch.cat([top_k_scores, block_scores], dim=1)
+    if block_indices.dim() == 1:
+        block_indices = block_indices[None, :].expand(block_scores.shape[0], -1)
+    indices = torch.cat([top_k_indices, block_indices], dim=1)
+
+    top_k_scores, positions = scores.topk(min(k, scores.shape[1]), dim=1)
+    return top_k_scores, indices.gather(1, positions)
+
+
+def quantize_embeddings(
+    embeddings: torch.Tensor,
+    quantization: str,
+) -> Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]]:
+    """
+    Quantize (padded) multi-vector embeddings of shape (..., embedding_dim).
+
+    Args:
+        embeddings (`torch.Tensor`): The embeddings to quantize.
+        quantization (`str`): The quantized representation:
+            - "int8": symmetric per-token int8 codes with a float scale per token (2x smaller than bf16).
+            - "binary": 1-bit sign codes packed into uint8 bytes (16x smaller than bf16). The embedding dimension
+                must be a multiple of 8.
+
+    Returns:
+        `Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]]`: The `(codes, scales)` pair for "int8", the packed
+        codes of shape (..., embedding_dim // 8) for "binary".
+    """
+    if quantization == "int8":
+        scales = embeddings.abs().amax(dim=-1, keepdim=True).float() / 127
+        codes = torch.round(embeddings.float() / scales.clamp_min(torch.finfo(torch.float32).tiny))
+        return codes.to(torch.int8), scales
+    elif quantization == "binary":
+        if embeddings.shape[-1] % 8 != 0:
+            raise ValueError("The embedding dimension must be a multiple of 8 for binary quantization")
+        bits = (embeddings > 0).view(*embeddings.shape[:-1], -1, 8).to(torch.uint8)
+        return (bits << _BIT_SHIFTS.to(bits.device)).sum(dim=-1, dtype=torch.uint8)
+    raise ValueError(f"Unknown quantization `{quantization}`. Available quantizations: {QUANTIZATIONS}")
+
+
+def dequantize_embeddings(
+    codes: Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]],
+    quantization: str,
+    dtype: torch.dtype = torch.float32,
+) -> torch.Tensor:
+    """
+    Decode the output of `quantize_embeddings` into `dtype` embeddings.
+
+    The binary codes are decoded to ±1/sqrt(embedding_dim) vectors, so that the dot product of two decoded vectors
+    is `1 - 2 · hamming_distance / embedding_dim`, i.e. it lives on the same [-1, 1] scale as the cosine similarity.
+    """
+    if quantization == "int8":
+        codes, scales = codes
+        return codes.to(dtype) * scales.to(dtype)
+    elif quantization == "binary":
+        signs = _unpack_signs(codes, dtype)
+        return signs / math.sqrt(signs.shape[-1])
+    raise ValueError(f"Unknown quantization `{quantization}`. Available quantizations: {QUANTIZATIONS}")
+
+
+def _unpack_signs(codes: torch.Tensor, dtype: torch.dtype) -> torch.Tensor:
+    """
+    Unpack the binary codes of shape (..., embedding_dim // 8) into ±1 vectors of shape (..., embedding_dim), with
+    one lookup of the 8 signs of each byte.
+    """
+    signs = torch.nn.functional.embedding(codes.long(), _BYTE_SIGNS.to(device=codes.device, dtype=dtype))
+    return signs.flatten(start_dim=-2)
+
+
+def binary_max_sim(
+    qs_codes: torch.Tensor,
+    qs_mask: torch.Tensor,
+    ps_codes: torch.Tensor,
+    ps_mask: torch.Tensor,
+    tile_size: int = DEFAULT_TILE_SIZE,
+) -> torch.Tensor:
+    """
+    Compute the MaxSim scores between a block of padded queries and a block of padded passages, both given as
+    packed binary codes (see `quantize_embeddings`).
+
+    The similarity of two tokens is `1 - 2 · hamming_distance / embedding_dim`, i.e. the dot product of their ±1
+    sign vectors divided by `embedding_dim`. As torch has no popcount, the codes are unpacked to bf16 ±1 vectors
+    and scored with the matrix products of `fused_max_sim`: the token dot products are integers, exact in bf16 up
+    to an embedding dim of 256, and they are summed in float32. As in `masked_max_sim`, the padded passage tokens
+    are excluded from the max, and the padded query tokens and the query tokens of empty passages contribute zero
+    to the sum.
+
+    Args:
+        qs_codes (`torch.Tensor`): Padded query codes of shape (B, n, d // 8).
+        qs_mask (`torch.Tensor`): Query token mask of shape (B, n).
+        ps_codes (`torch.Tensor`): Padded passage codes of shape (C, s, d // 8).
+        ps_mask (`torch.Tensor`): Passage token mask of shape (C, s).
+        tile_size (`int`, *optional*, defaults to 64): Number of passage tokens processed at once.
+
+    Returns:
+        `torch.Tensor`: The float32 scores of shape (B, C).
+    """
+    qs_signs = _unpack_signs(qs_codes, torch.bfloat16)
+    ps_signs = _unpack_signs(ps_codes, torch.bfloat16)
+    return _sign_max_sim(qs_signs, qs_mask, ps_signs, ps_mask, tile_size=tile_size)
+
+
+def _sign_max_sim(
+    qs_signs: torch.Tensor,
+    qs_mask: torch.Tensor,
+    ps_signs: torch.Tensor,
+    ps_mask: torch.Tensor,
+    tile_size: int = DEFAULT_TILE_SIZE,
+) -> torch.Tensor:
+    """
+    `binary_max_sim` of the unpacked ±1 sign vectors (see `_unpack_signs`).
+    """
+    max_dot = fused_max_sim(qs_signs, ps_signs, ps_mask=ps_mask, tile_size=tile_size).float()  # (B, C, n)
+
+    valid = qs_mask[:, None, :] & ps_mask.any(dim=1)[None, :, None]
+    max_dot = max_dot.masked_fill(~valid, 0)
+
+    return max_dot.sum(dim=2) / qs_signs.shape[-1]
+
+
+class PassageBlocks:
+    """
+    Padded passage blocks, built once and reused across all the query batches of a scoring call, and across calls
+    when passed in place of the passage embeddings (e.g. repeated evaluations over the same index).
+
+    Each block is a `(passage_indices, padded_passages, passage_mask)` tuple:
+    - with `bucketed=True` (used by `score_multi_vector`), the padding rows are stripped, the passages are sorted into
+      length buckets and `passage_mask` is the boolean token mask of the block.
+    - with `bucketed=False` (used by the `_qtm` / `_special` / `_lexical` variants), the blocks are the contiguous
+      `pad_sequence(ps[j : j + batch_size])` slices and `passage_mask` is `None`. `padded_passages` is `None` for the
+      slices that could not be padded (e.g. passages without embeddings), which are scored as all-zero embeddings.
+
+    With `quantization` ("int8" or "binary", bucketed blocks only), `padded_passages` is stored in the quantized
+    representation of `quantize_embeddings` and decoded block by block at scoring time. Iterating over the instance
+    yields the decoded blocks.
+
+    The blocks can be kept pinned in host memory (`pin_memory`) or resident on the scoring device (`to`).
+    """
+
+    def __init__(
+        self,
+        blocks: List[Tuple[torch.Tensor, Any, Optional[torch.Tensor]]],
+        n_passages: int,
+        batch_size: int,
+        bucketed: bool,
+        quantization: Optional[str] = None,
+    ):
+        self.blocks = blocks
+        self.n_passages = n_passages
+        self.batch_size = batch_size
+        self.bucketed = bucketed
+        self.quantization = quantization
+
+    @classmethod
+    def from_embeddings(
+        cls,
+        ps: Union[torch.Tensor, List[torch.Tensor]],
+        batch_size: int = 128,
+        bucketed: bool = True,
+        device: Optional[Union[str, torch.device]] = None,
+        pin_memory: bool = False,
+        quantization: Optional[str] = None,
+    ) -> "PassageBlocks":
+        """
+        Build the padded passage blocks.
+
+        Args:
+            ps (`Union[torch.Tensor, List[torch.Tensor]]`): Passage embeddings.
+            batch_size (`int`, *optional*, defaults to 128): Number of passages per block.
+            bucketed (`bool`, *optional*, defaults to `True`): Whether to build length-bucketed masked blocks.
+            device (`Union[str, torch.device]`, *optional*): If provided, the blocks are moved to (and stay resident
+                on) this device.
+            pin_memory (`bool`, *optional*, defaults to `False`): Whether to pin the host blocks, so that they are
+                copied asynchronously to the GPU. Ignored if CUDA is not available or if `device` is provided.
+            quantization (`str`, *optional*): Store the blocks as "int8" or "binary" codes (see
+                `quantize_embeddings`). Only supported with `bucketed=True`.
+        """
+        if quantization is not None and not bucketed:
+            raise ValueError("Quantized passage blocks are only supported with `bucketed=True`")
+
+        if bucketed:
+            ps = [strip_padding(p) for p in ps]
+            buckets = get_length_buckets([len(p) for p in ps], batch_size)
+            blocks = []
+            for bucket in buckets:
+                ps_batch, ps_mask = pad_with_mask([ps[idx] for idx in bucket.tolist()])
+                if quantization is not None:
+                    ps_batch = quantize_embeddings(ps_batch, quantization)
+                blocks.append((bucket, ps_batch, ps_mask))
+        else:
+            blocks = []
+            for j in range(0, len(ps), batch_size):
+                try:
+                    ps_batch = torch.nn.utils.rnn.pad_sequence(
+                        ps[j : j + batch_size], batch_first=True, padding_value=0
+                    )
+                except TypeError:
+                    ps_batch = None
+                blocks.append((torch.arange(j, min(j + batch_size, len(ps))), ps_batch, None))
+
+        passage_blocks = cls(
+            blocks,
+            n_passages=len(ps),
+            batch_size=batch_size,
+            bucketed=bucketed,
+            quantization=quantization,
+        )
+
+        if device is not None:
+            return passage_blocks.to(device)
+        if pin_memory and torch.cuda.is_available():
+            return passage_blocks.pin_memory()
+        return passage_blocks
+
+    def _apply(self, fn) -> "PassageBlocks":
+        def apply(item):
+            if item is None:
+                return None
+            if isinstance(item, tuple):
+                return tuple(apply(tensor) for tensor in item)
+            return fn(item)
+
+        return PassageBlocks(
+            [(indices, apply(ps_batch), apply(ps_mask)) for indices, ps_batch, ps_mask in self.blocks],
+            n_passages=self.n_passages,
+            batch_size=self.batch_size,
+            bucketed=self.bucketed,
+            quantization=self.quantization,
+        )
+
+    def to(self, device: Union[str, torch.device]) -> "PassageBlocks":
+        """
+        Return the blocks moved to `device`.
+        """
+        return self._apply(lambda tensor: tensor.to(device))
+
+    def pin_memory(self) -> "PassageBlocks":
+        """
+        Return the blocks in pinned host memory.
+        """
+        return self._apply(lambda tensor: tensor.pin_memory())
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Memory footprint of the (possibly quantized) passage embeddings of the blocks, in bytes.
+        """
+        nbytes = 0
+        for _, ps_batch, _ in self.blocks:
+            for tensor in ps_batch if isinstance(ps_batch, tuple) else (ps_batch,):
+                if tensor is not None:
+                    nbytes += tensor.nbytes
+        return nbytes
+
+    def __len__(self) -> int:
+        return self.n_passages
+
+    def __iter__(self) -> Iterator[Tuple[torch.Tensor, Optional[torch.Tensor], Optional[torch.Tensor]]]:
+        for block in self.blocks:
+            yield _decode_passage_block(block, self.quantization)
+
+
+def get_passage_blocks(
+    ps: Union[torch.Tensor, List[torch.Tensor], PassageBlocks],
+    batch_size: int,
+    bucketed: bool = True,
+    quantization: Optional[str] = None,
+) -> PassageBlocks:
+    """
+    Return `ps` if it already is a `PassageBlocks` instance of the expected kind, else build the blocks.
+    """
+    if isinstance(ps, PassageBlocks):
+        if ps.bucketed != bucketed:
+            raise ValueError(f"The passage blocks must be built with `bucketed={bucketed}` for this scoring function")
+        if quantization is not None and ps.quantization != quantization:
+            raise ValueError(f"The passage blocks must be built with `quantization={quantization!r}`")
+        return ps
+    return PassageBlocks.from_embeddings(ps, batch_size=batch_size, bucketed=bucketed, quantization=quantization)
+
+
+def _decode_passage_block(
+    ps_block: Tuple[torch.Tensor, Any, Optional[torch.Tensor]],
+    quantization: Optional[str],
+) -> Tuple[torch.Tensor, Optional[torch.Tensor], Optional[torch.Tensor]]:
+    """
+    Decode the passages of a (possibly quantized) passage block. The int8 codes are decoded to bf16.
+    """
+    if quantization is None:
+        return ps_block
+    bucket, ps_batch, ps_mask = ps_block
+    return bucket, dequantize_embeddings(ps_batch, quantization, dtype=torch.bfloat16), ps_mask
+
+
+def _get_query_batches(
+    qs: Union[torch.Tensor, List[torch.Tensor]],
+    batch_size: int,
+    quantization: Optional[str] = None,
+) -> List[Tuple[torch.Tensor, torch.Tensor]]:
+    """
+    Strip the query padding and build the `(padded_queries, query_mask)` batches of `batch_size` queries.
+    With `quantization`, the queries go through the same quantization as the passages: the int8 queries are
+    decoded back to bf16, the binary queries are unpacked to bf16 ±1 vectors (see `binary_max_sim`).
+    """
+    qs = [strip_padding(q) for q in qs]
+    qs_batches = [pad_with_mask(qs[i : i + batch_size]) for i in range(0, len(qs), batch_size)]
+
+    if quantization == "int8":
+        qs_batches = [
+            (dequantize_embeddings(quantize_embeddings(qs_batch, quantization), quantization, torch.bfloat16), qs_mask)
+            for qs_batch, qs_mask in qs_batches
+        ]
+    elif quantization == "binary":
+        qs_batches = [
+            (_unpack_signs(quantize_embeddings(qs_batch, quantization), torch.bfloat16), qs_mask)
+            for qs_batch, qs_mask in qs_batches
+        ]
+
+    return qs_batches
+
+
+def _score_passage_block(
+    qs_batches: List[Tuple[torch.Tensor, torch.Tensor]],
+    ps_block: Tuple[torch.Tensor, Any, torch.Tensor],
+    device: Union[str, torch.device],
+    tile_size: int,
+    k: Optional[int] = None,
+    quantization: Optional[str] = None,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Score all the query batches against a single (possibly quantized) passage block. The int8 blocks are decoded to
+    bf16, the binary blocks are unpacked once to bf16 ±1 vectors and scored against the unpacked queries as in
+    `binary_max_sim`.
+
+    Returns the `(passage_indices, scores)` of the block, as float32 tensors on the "cpu" device. If `k` is
+    provided, only the block-local top-k of each query is returned and `passage_indices` is of shape
+    (n_queries, k'); otherwise it is the (C,) bucket and `scores` is of shape (n_queries, C).
+    """
+    if quantization == "binary":
+        bucket, ps_batch, ps_mask = ps_block
+    else:
+        bucket, ps_batch, ps_mask = _decode_passage_block(ps_block, quantization)
+    ps_batch, ps_mask = ps_batch.to(device, non_blocking=True), ps_mask.to(device, non_blocking=True)
+    max_sim = masked_max_sim
+    if quantization == "binary":
+        ps_batch = _unpack_signs(ps_batch, torch.bfloat16)
+        max_sim = _sign_max_sim
+
+    scores: List[torch.Tensor] = []
+    for qs_batch, qs_mask in qs_batches:
+        batch_scores = max_sim(qs_batch.to(device), qs_mask.to(device), ps_batch, ps_mask, tile_size=tile_size)
+        scores.append(batch_scores.to(dtype=torch.float32, device="cpu"))
+    scores = torch.cat(scores)
+
+    if k is None:
+        return bucket, scores
+
+    scores, positions = scores.topk(min(k, scores.shape[1]), dim=1)
+    return bucket[positions], scores
+
+
+# Query batches of a scoring worker process, received once by `_init_scoring_worker`
+_worker_qs_batches: Optional[List[Tuple[torch.Tensor, torch.Tensor]]] = None
+
+
+def _init_scoring_worker(num_threads: int, qs_batches: List[Tuple[torch.Tensor, torch.Tensor]]):
+    """
+    Pin the number of intra-op (BLAS/OpenMP) threads of a scoring worker process, and keep the query batches, so
+    that they are sent once per worker instead of with every passage block.
+    """
+    global _worker_qs_batches
+    torch.set_num_threads(num_threads)
+    _worker_qs_batches = qs_batches
+
+
+def _score_passage_block_in_worker(ps_block: Tuple[torch.Tensor, Any, torch.Tensor], **kwargs):
+    """
+    `_score_passage_block` of the query batches of the scoring worker process (see `_init_scoring_worker`).
+    """
+    return _score_passage_block(_worker_qs_batches, ps_block, **kwargs)
+
+
+def _map_passage_blocks(
+    qs_batches: List[Tuple[torch.Tensor, torch.Tensor]],
+    ps_blocks: PassageBlocks,
+    device: Union[str, torch.device],
+    tile_size: int,
+    k: Optional[int] = None,
+    num_workers: int = 1,
+    backend: str = "thread",
+    num_threads_per_worker: Optional[int] = None,
+    quantization: Optional[str] = None,
+) -> Iterator[Tuple[torch.Tensor, torch.Tensor]]:
+    """
+    Score every passage block with `_score_passage_block`, serially or on a pool of CPU workers.
+
+    With `num_workers > 1`, the passage blocks are split across a pool of workers and the block results are
+    yielded in the block order. Quantized blocks are decoded by the worker that scores them.
+    - with `backend="thread"`, the worker threads share the intra-op thread pool of the process (the torch ops
+      release the GIL), whose size is process-wide: `num_threads_per_worker` is not supported.
+    - with `backend="process"`, every worker process is pinned to `num_threads_per_worker` intra-op threads
+      (defaults to an even split of `torch.get_num_threads()`), so that the workers do not oversubscribe the
+      cores. The query batches are sent once to each worker.
+    """
+    if num_workers < 1:
+        raise ValueError("`num_workers` must be at least one")
+
+    score_kwargs = {"device": device, "tile_size": tile_size, "k": k, "quantization": ps_blocks.quantization}
+
+    if num_workers == 1 or len(ps_blocks.blocks) == 1:
+        yield from (_score_passage_block(qs_batches, ps_block, **score_kwargs) for ps_block in ps_blocks.blocks)
+        return
+
+    if torch.device(device).type != "cpu":
+        raise ValueError('Scoring with several workers is only supported on the "cpu" device')
+
+    if backend == "thread":
+        if num_threads_per_worker is not None:
+            raise ValueError('`num_threads_per_worker` is only supported by the "process" backend')
+        executor = ThreadPoolExecutor(max_workers=num_workers)
+        score_block = partial(_score_passage_block, qs_batches, **score_kwargs)
+    elif backend == "process":
+        executor = ProcessPoolExecutor(
+            max_workers=num_workers,
+            mp_context=torch.multiprocessing.get_context("spawn"),
+            initializer=_init_scoring_worker,
+            initargs=(num_threads_per_worker or max(1, torch.get_num_threads() // num_workers), qs_batches),
+        )
+        score_block = partial(_score_passage_block_in_worker, **score_kwargs)
+    else:
+        raise ValueError(f"Unknown scoring backend `{backend}`. Available backends: ['thread', 'process']")
+
+    with executor:
+        yield from executor.map(score_block, ps_blocks.blocks)
+
+
+def _check_rerank(
+    ps: Union[torch.Tensor, List[torch.Tensor], PassageBlocks],
+    quantization: Optional[str],
+    rerank_top_k: Optional[int],
+):
+    if quantization is not None and quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unknown quantization `{quantization}`. Available quantizations: {QUANTIZATIONS}")
+    if rerank_top_k is None:
+        return
+    if rerank_top_k < 1:
+        raise ValueError("`rerank_top_k` must be at least one")
+    if isinstance(ps, PassageBlocks):
+        raise ValueError("The exact rerank needs the full-precision passage embeddings, not prebuilt passage blocks")
+
+
+def _rerank_top_k(
+    qs: Union[torch.Tensor, List[torch.Tensor]],
+    ps: Union[torch.Tensor, List[torch.Tensor]],
+    candidates: torch.Tensor,
+    batch_size: int,
+    device: Union[str, torch.device],
+    tile_size: int,
+) -> torch.Tensor:
+    """
+    Exact (full-precision) MaxSim scores of the `candidates` passage indices of each query, of shape
+    (n_queries, n_candidates).
+
+    The queries are reranked by batches of `batch_size`: the union of the candidates of a batch is scored against
+    all its queries at once with the length-bucketed engine, and the scores of the candidates of each query are
+    gathered from it.
+    """
+    scores = torch.empty(candidates.shape, dtype=torch.float32)
+    for start in range(0, len(candidates), batch_size):
+        batch_candidates = candidates[start : start + batch_size]
+        unique_candidates, positions = torch.unique(batch_candidates, return_inverse=True)
+        batch_scores = score_multi_vector_bucketed(
+            qs[start : start + batch_size],
+            [ps[j] for j in unique_candidates.tolist()],
+            batch_size=batch_size,
+            device=device,
+            tile_size=tile_size,
+        )
+        scores[start : start + batch_size] = batch_scores.gather(1, positions)
+    return scores
+
+
+def score_multi_vector_bucketed(
+    qs: Union[torch.Tensor, List[torch.Tensor]],
+    ps: Union[torch.Tensor, List[torch.Tensor], PassageBlocks],
+    batch_size: int = 128,
+    device: Union[str, torch.device] = "cpu",
+    tile_size: int = DEFAULT_TILE_SIZE,
+    num_workers: int = 1,
+    backend: str = "thread",
+    num_threads_per_worker: Optional[int] = None,
+    quantization: Optional[str] = None,
+    rerank_top_k: Optional[int] = None,
+) -> torch.Tensor:
+    """
+    Length-bucketed MaxSim engine.
+
+    The padding rows of the queries and passages are stripped, the passages are sorted into buckets of
+    `batch_size` passages of similar lengths, and each bucket is scored at its own width with an explicit
+    token mask. The bucket scores are then scattered back into the original passage order.
+
+    On the "cpu" device, the buckets can be scored in parallel by `num_workers` thread or process workers
+    (see `_map_passage_blocks`).
+
+    With `quantization` ("int8" or "binary", see `quantize_embeddings`), the queries and passages are scored with
+    their quantized representations. If `rerank_top_k` is also provided, the `rerank_top_k` best passages of each
+    query are rescored exactly with the full-precision embeddings.
+
+    Returns:
+        `torch.Tensor`: A float32 tensor of shape `(n_queries, n_passages)` saved on the "cpu" device.
+    """
+    _check_rerank(ps, quantization, rerank_top_k)
+
+    ps_blocks = get_passage_blocks(ps, batch_size, quantization=quantization)
+    # The queries are quantized as the passages, including when the passage blocks were prebuilt
+    qs_batches = _get_query_batches(qs, batch_size, quantization=ps_blocks.quantization)
+
+    scores = torch.empty((len(qs), len(ps)), dtype=torch.float32)
+
+    for bucket, block_scores in _map_passage_blocks(
+        qs_batches,
+        ps_blocks,
+        device,
+        tile_size,
+        num_workers=num_workers,
+        backend=backend,
+        num_threads_per_worker=num_threads_per_worker,
+    ):
+        scores[:, bucket] = block_scores
+
+    if quantization is not None and rerank_top_k is not None:
+        candidates = scores.topk(min(rerank_top_k, scores.shape[1]), dim=1).indices
+        scores.scatter_(1, candidates, _rerank_top_k(qs, ps, candidates, batch_size, device, tile_size))
+
+    return scores
+
+
+def score_multi_vector_top_k(
+    qs: Union[torch.Tensor, List[torch.Tensor]],
+    ps: Union[torch.Tensor, List[torch.Tensor], PassageBlocks],
+    k: int,
+    batch_size: int = 128,
+    device: Union[str, torch.device] = "cpu",
+    tile_size: int = DEFAULT_TILE_SIZE,
+    num_workers: int = 1,
+    backend: str = "thread",
+    num_threads_per_worker: Optional[int] = None,
+    quantization: Optional[str] = None,
+    rerank_top_k: Optional[int] = None,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Streaming counterpart of `score_multi_vector_bucketed` that only keeps the top-k passages of each query.
+
+    The dense `(n_queries, n_passages)` score matrix is never built: each passage bucket is reduced to its
+    local top-k, which is merged into a running top-k per query, so the output memory is O(n_queries · k)
+    regardless of the number of passages.
+
+    With `quantization`, the passages are retrieved with their quantized representations. If `rerank_top_k` is
+    also provided, the top `max(k, rerank_top_k)` quantized candidates of each query are rescored exactly with the
+    full-precision embeddings before keeping the top-k.
+
+    Returns:
+        `Tuple[torch.Tensor, torch.Tensor]`: The passage indices (int64) and the float32 scores of the top-k
+        passages of each query, both of shape `(n_queries, min(k, n_passages))`, sorted by decreasing score
+        and saved on the "cpu" device.
+    """
+    if k < 1:
+        raise ValueError("`k` must be at least one")
+    _check_rerank(ps, quantization, rerank_top_k)
+
+    n_candidates = k
+    if quantization is not None and rerank_top_k is not None:
+        n_candidates = max(k, rerank_top_k)
+
+    ps_blocks = get_passage_blocks(ps, batch_size, quantization=quantization)
+    # The queries are quantized as the passages, including when the passage blocks were prebuilt
+    qs_batches = _get_query_batches(qs, batch_size, quantization=ps_blocks.quantization)
+
+    top_k_scores = torch.empty((len(qs), 0), dtype=torch.float32)
+    top_k_indices = torch.empty((len(qs), 0), dtype=torch.long)
+
+    for block_indices, block_scores in _map_passage_blocks(
+        qs_batches,
+        ps_blocks,
+        device,
+        tile_size,
+        k=n_candidates,
+        num_workers=num_workers,
+        backend=backend,
+        num_threads_per_worker=num_threads_per_worker,
+    ):
+        top_k_scores, top_k_indices = merge_top_k(
+            top_k_scores, top_k_indices, block_scores, block_indices, n_candidates
+        )
+
+    if quantization is not None and rerank_top_k is not None:
+        top_k_scores = _rerank_top_k(qs, ps, top_k_indices, batch_size, device, tile_size)
+        top_k_scores, positions = top_k_scores.topk(min(k, top_k_scores.shape[1]), dim=1)
+        top_k_indices = top_k_indices.gather(1, positions)
+
+    return top_k_indices, top_k_scores
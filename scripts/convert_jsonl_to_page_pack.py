@@ -0,0 +1,19 @@
+import argparse
+
+from vidore_benchmark.utils.pagepack_utils import convert_jsonl_to_page_pack
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a JSONL index collection (base64 images) to a page pack")
+    parser.add_argument("--jsonl-path", type=str, help="JSONL collection written by the former create_index_*.py")
+    parser.add_argument("--output-path", type=str, help="Page pack directory, e.g. `ai_test_index_1k.pagepack`")
+    parser.add_argument("--image-dir", type=str, default=None, help="Read the images from this directory instead")
+    parser.add_argument("--n-workers", type=int, default=None, help="Number of processes parsing the JSONL file")
+    args = parser.parse_args()
+
+    convert_jsonl_to_page_pack(args.jsonl_path, args.output_path, image_dir=args.image_dir, n_workers=args.n_workers)
+    print(f"Page pack saved in {args.output_path}")
+
+
+if __name__ == "__main__":
+    main()
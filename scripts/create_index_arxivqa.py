@@ -7,6 +7,7 @@ import tqdm
 import io 
 import json
 import base64
+from vidore_benchmark.utils.pagepack_utils import PagePackWriter
 import easyocr
 
 def decode_base64_to_pil_image(encoded_str: str) -> Image.Image:
@@ -80,7 +81,7 @@ test_set_500_ocr = load_dataset('vidore/arxivqa_test_subsampled_tesseract', spli
 data_records = []
 
 for entry, entry2 in tqdm.tqdm(zip(test_set_500, test_set_500_ocr)):
-    encoded_image = pil_image_to_base64(entry['image'])
+    encoded_image = pil_image_to_bytes(entry['image'])
     data_records.append({
                 "image": encoded_image,
                 "image_filename": entry['image_filename'],
@@ -95,27 +96,26 @@ for entry, entry2 in tqdm.tqdm(zip(test_set_500, test_set_500_ocr)):
             })  
 
 
-def save_data_to_jsonl(base_path, data_records):
+def save_data_to_page_pack(base_path, data_records):
 
-    output_path = f"{base_path}arxivqa_test_index_{len(data_records)/1000}k.jsonl"
-    with open(output_path, 'w') as file:
+    output_path = f"{base_path}arxivqa_test_index_{len(data_records)/1000}k.pagepack"
+    with PagePackWriter(output_path) as writer:
         for record in data_records[:len(data_records)]:
-            json.dump(record, file)
-            file.write('\n')
-    print(f"Data has been saved to JSONL format with {len(data_records)/1000}k records at: {output_path}")
+            writer.add(record["image"], **{key: value for key, value in record.items() if key != "image"})
+    print(f"Data has been saved to a page pack with {len(data_records)/1000}k records at: {output_path}")
 
 
 # Iterate through entries
 for entry in tqdm.tqdm(arxiv_qa):
 
     if len(data_records) in [500, 2500, 5000, 7500, 10000, 50000]:
-        save_data_to_jsonl(base_path, data_records)
+        save_data_to_page_pack(base_path, data_records)
 
     if entry['image'] not in train_filenames and entry['image'] not in test_500_filenames:
-        # Load the image and convert it to a base64 string
+        # Load the image and encode it to JPEG bytes, stored as-is in the page pack
         image_path = base_path + entry['image']
         image = Image.open(image_path)
-        encoded_image = pil_image_to_base64(image)
+        encoded_image = pil_image_to_bytes(image)
         text_description = extract_text(image_path)
 
         data_records.append({
@@ -5,8 +5,8 @@ import csv
 import os
 import tqdm
 import io 
-import json
 import base64
+from vidore_benchmark.utils.pagepack_utils import PagePackWriter
 
 def decode_base64_to_pil_image(encoded_str: str) -> Image.Image:
     """Convert a base64 string to a PIL Image."""
@@ -53,7 +53,7 @@ test_set_500_ocr = load_dataset('vidore/syntheticDocQA_healthcare_industry_test_
 
 data_records = []
 for entry, entry2 in tqdm.tqdm(zip(test_set_500, test_set_500_ocr)):
-    encoded_image = pil_image_to_base64(entry['image'])
+    encoded_image = pil_image_to_bytes(entry['image'])
     # encoded_image = Image.open(entry['image'])
     data_records.append({
                 "image": encoded_image,
@@ -68,8 +68,8 @@ for entry, entry2 in tqdm.tqdm(zip(test_set_500, test_set_500_ocr)):
                 })
 
 for entry in tqdm.tqdm(pdfvqa_combined):
-    # Load the image and convert it to a base64 string
-    encoded_image = pil_image_to_base64(entry['page'])
+    # Encode the image to JPEG bytes, stored as-is in the page pack
+    encoded_image = pil_image_to_bytes(entry['page'])
     # encoded_image = Image.open(entry['image'])
     data_records.append({
         "image": encoded_image,
@@ -84,9 +84,8 @@ for entry in tqdm.tqdm(pdfvqa_combined):
     })
 
 for size, label in [(1000, "1k"), (2500, "2.5k"), (5000, "5k"), (7500, "7.5k"), (10000, "10k")]:
-    output_path = base_path + f"ai_test_index_{label}.jsonl"
-    with open(output_path, 'w') as file:
+    output_path = base_path + f"ai_test_index_{label}.pagepack"
+    with PagePackWriter(output_path) as writer:
         for record in data_records[:size]:
-            json.dump(record, file)
-            file.write('\n')
-    print("Data has been saved to JSONL format.")
+            writer.add(record["image"], **{key: value for key, value in record.items() if key != "image"})
+    print(f"Data has been saved to a page pack at: {output_path}")
@@ -5,6 +5,11 @@ import torch
 from PIL import Image
 
 from colpali_engine.models import ColQwen2Processor
+from colpali_engine.models.qwen2.colqwen2.processing_colqwen2 import (
+    get_pixel_values_offsets,
+    pad_pixel_values_per_image,
+    unpad_pixel_values_per_image,
+)
 
 
 @pytest.fixture(scope="module")
@@ -33,6 +38,11 @@ def test_process_images(processor_from_pretrained: ColQwen2Processor):
     # Assertions
     assert "pixel_values" in batch_feature
     assert isinstance(batch_feature["pixel_values"], torch.Tensor)
+    assert batch_feature["pixel_values"].shape[0] == get_pixel_values_offsets(batch_feature["image_grid_thw"])[-1]
+    assert batch_feature["pixel_values"].shape[-1] == 1176
+
+    # The pixel values padded per image have one row per image
+    batch_feature = processor_from_pretrained.process_images(images, pad_pixel_values=True)
     assert batch_feature["pixel_values"].shape[0] == 1
     assert batch_feature["pixel_values"].shape[-1] == 1176
 
@@ -50,3 +60,26 @@ def test_process_queries(processor_from_pretrained: ColQwen2Processor):
     assert "input_ids" in batch_encoding
     assert isinstance(batch_encoding["input_ids"], torch.Tensor)
     assert cast(torch.Tensor, batch_encoding["input_ids"]).shape[0] == len(queries)
+
+
+def test_get_image_grid_size(processor_from_pretrained: ColQwen2Processor):
+    images = [Image.new("RGB", (56, 84), color="black"), Image.new("RGB", (2000, 3000), color="black")]
+    batch_feature = processor_from_pretrained.process_images(images)
+
+    # One visual token per 2x2 merged patches of the resized image
+    grid_sizes = [processor_from_pretrained.get_image_grid_size(image.size) for image in images]
+    expected_grid_sizes = (batch_feature["image_grid_thw"][:, 1:] // 2).tolist()
+    assert [list(grid_size) for grid_size in grid_sizes] == expected_grid_sizes
+
+
+def test_pad_unpad_pixel_values_per_image():
+    image_grid_thw = torch.tensor([[1, 2, 2], [1, 4, 6], [1, 2, 4]])
+    pixel_values = torch.randn(4 + 24 + 8, 1176)
+
+    padded_pixel_values = pad_pixel_values_per_image(pixel_values, image_grid_thw)
+    assert padded_pixel_values.shape == (3, 24, 1176)
+    assert torch.equal(padded_pixel_values[2, :8], pixel_values[28:])
+    assert torch.all(padded_pixel_values[2, 8:] == 0)
+
+    assert torch.equal(unpad_pixel_values_per_image(padded_pixel_values, image_grid_thw), pixel_values)
+    assert get_pixel_values_offsets(image_grid_thw).tolist() == [0, 4, 28, 36]
@@ -42,3 +42,24 @@ def test_score_multi_vector_embeddings(processor: BaseVisualRetrieverProcessor):
     assert scores_from_tensor.shape == (len(qs), len(ps))
 
     assert torch.allclose(scores_from_list_input, scores_from_tensor), "Scores from list and tensor inputs should match"
+
+
+def test_score_multi_vector_matches_reference(processor: BaseVisualRetrieverProcessor):
+    qs = [torch.randn(n, EMBEDDING_DIM) for n in (3, 7, 5)]
+    ps = [torch.randn(n, EMBEDDING_DIM) for n in (40, 2, 9, 17, 1, 25)]
+
+    scores = processor.score_multi_vector(qs, ps, batch_size=2, device="cpu")
+
+    expected = torch.tensor([[(q @ p.T).max(dim=1)[0].sum().item() for p in ps] for q in qs])
+    assert scores.shape == (len(qs), len(ps))
+    assert torch.allclose(scores, expected, atol=1e-4)
+
+
+def test_score_multi_vector_ignores_padding_rows(processor: BaseVisualRetrieverProcessor):
+    # Every real similarity is negative: the zero padding rows must not be picked by the max
+    qs = [torch.ones(2, EMBEDDING_DIM)]
+    ps = [-torch.ones(1, EMBEDDING_DIM), -torch.ones(8, EMBEDDING_DIM)]
+
+    scores = processor.score_multi_vector(qs, ps, device="cpu")
+
+    assert torch.allclose(scores, torch.full((1, 2), -2.0 * EMBEDDING_DIM))
@@ -0,0 +1,286 @@
+import time
+
+import pytest
+import torch
+
+from colpali_engine.utils.scoring_utils import (
+    PassageBlocks,
+    binary_max_sim,
+    dequantize_embeddings,
+    fused_max_sim,
+    get_length_buckets,
+    get_lexical_mask,
+    get_token_ids,
+    masked_max_sim,
+    max_sim_scores,
+    merge_top_k,
+    pad_with_mask,
+    quantize_embeddings,
+    score_multi_vector_bucketed,
+    score_multi_vector_top_k,
+    segment_max_sim,
+    strip_padding,
+)
+
+EMBEDDING_DIM = 32
+
+
+def test_strip_padding():
+    emb = torch.randn(5, EMBEDDING_DIM)
+    padded = torch.cat([torch.zeros(3, EMBEDDING_DIM), emb])
+    assert torch.equal(strip_padding(padded), emb)
+
+
+def test_get_length_buckets():
+    buckets = get_length_buckets([5, 1, 4, 2, 3], bucket_size=2)
+    assert [bucket.tolist() for bucket in buckets] == [[1, 3], [4, 2], [0]]
+
+
+def test_pad_with_mask():
+    padded, mask = pad_with_mask([torch.randn(2, EMBEDDING_DIM), torch.randn(4, EMBEDDING_DIM)])
+    assert padded.shape == (2, 4, EMBEDDING_DIM)
+    assert mask.tolist() == [[True, True, False, False], [True, True, True, True]]
+
+
+@pytest.mark.parametrize("tile_size", [1, 3, 64])
+def test_fused_max_sim_matches_einsum(tile_size: int):
+    qs = torch.randn(3, 5, EMBEDDING_DIM)
+    ps = torch.randn(4, 10, EMBEDDING_DIM)
+
+    expected = torch.einsum("bnd,csd->bcns", qs, ps).max(dim=3)[0]
+    assert torch.allclose(fused_max_sim(qs, ps, tile_size=tile_size), expected, atol=1e-5)
+    assert torch.allclose(max_sim_scores(qs, ps, tile_size=tile_size), expected.sum(dim=2), atol=1e-4)
+
+
+def test_fused_max_sim_with_mask():
+    qs = torch.randn(2, 3, EMBEDDING_DIM)
+    ps = torch.randn(2, 6, EMBEDDING_DIM)
+    ps_mask = torch.tensor([[True] * 6, [True] * 2 + [False] * 4])
+
+    max_similarity = fused_max_sim(qs, ps, ps_mask=ps_mask, tile_size=4)
+
+    expected = torch.einsum("bnd,sd->bns", qs, ps[1, :2]).max(dim=2)[0]
+    assert torch.allclose(max_similarity[:, 1], expected, atol=1e-5)
+
+
+def test_max_sim_scores_backward():
+    qs = torch.randn(2, 3, EMBEDDING_DIM, requires_grad=True)
+    ps = torch.randn(2, 7, EMBEDDING_DIM, requires_grad=True)
+
+    max_sim_scores(qs, ps, tile_size=2).sum().backward()
+
+    qs_ref = qs.detach().clone().requires_grad_()
+    ps_ref = ps.detach().clone().requires_grad_()
+    torch.einsum("bnd,csd->bcns", qs_ref, ps_ref).max(dim=3)[0].sum().backward()
+
+    assert torch.allclose(qs.grad, qs_ref.grad, atol=1e-5)
+    assert torch.allclose(ps.grad, ps_ref.grad, atol=1e-5)
+
+
+def test_fused_max_sim_backward_with_mask():
+    qs = torch.randn(2, 3, EMBEDDING_DIM, dtype=torch.float64, requires_grad=True)
+    ps = torch.randn(3, 7, EMBEDDING_DIM, dtype=torch.float64, requires_grad=True)
+    ps_mask = torch.tensor([[True] * 7, [True] * 3 + [False] * 4, [True] * 5 + [False] * 2])
+
+    assert torch.autograd.gradcheck(lambda q, p: fused_max_sim(q, p, ps_mask=ps_mask, tile_size=2), (qs, ps))
+
+
+def test_merge_top_k():
+    scores, indices = merge_top_k(
+        torch.tensor([[3.0, 1.0]]),
+        torch.tensor([[7, 8]]),
+        torch.tensor([[2.0, 0.0, 4.0]]),
+        torch.tensor([0, 1, 2]),
+        k=3,
+    )
+    assert scores.tolist() == [[4.0, 3.0, 2.0]]
+    assert indices.tolist() == [[2, 7, 0]]
+
+
+@pytest.mark.parametrize("k", [1, 5, 50])
+def test_score_multi_vector_top_k_matches_dense(k: int):
+    qs = [torch.randn(n, EMBEDDING_DIM) for n in (3, 6, 2)]
+    ps = [torch.randn(n, EMBEDDING_DIM) for n in (4, 9, 1, 7, 5, 3, 8)]
+
+    indices, scores = score_multi_vector_top_k(qs, ps, k=k, batch_size=2)
+    expected_scores, expected_indices = score_multi_vector_bucketed(qs, ps, batch_size=2).topk(min(k, len(ps)), dim=1)
+
+    assert indices.shape == (len(qs), min(k, len(ps)))
+    assert torch.equal(indices, expected_indices)
+    assert torch.allclose(scores, expected_scores)
+
+
+@pytest.mark.parametrize("backend", ["thread", pytest.param("process", marks=pytest.mark.slow)])
+def test_score_multi_vector_bucketed_with_workers(backend: str):
+    qs = [torch.randn(n, EMBEDDING_DIM) for n in (3, 6, 2)]
+    ps = [torch.randn(n, EMBEDDING_DIM) for n in (4, 9, 1, 7, 5, 3, 8)]
+
+    expected = score_multi_vector_bucketed(qs, ps, batch_size=2)
+    scores = score_multi_vector_bucketed(qs, ps, batch_size=2, num_workers=2, backend=backend)
+    indices, _ = score_multi_vector_top_k(qs, ps, k=3, batch_size=2, num_workers=2, backend=backend)
+
+    assert torch.allclose(scores, expected)
+    assert torch.equal(indices, expected.topk(3, dim=1).indices)
+
+    # The thread workers share the intra-op pool of the process, whose size is process-wide
+    if backend == "thread":
+        with pytest.raises(ValueError):
+            score_multi_vector_bucketed(qs, ps, batch_size=2, num_workers=2, num_threads_per_worker=1)
+
+
+def test_get_token_ids():
+    vocabulary = {}
+    token_ids = get_token_ids([["a", "b"], [], ["b", "c", "a"]], vocabulary)
+
+    assert vocabulary == {"a": 0, "b": 1, "c": 2}
+    assert token_ids.tolist() == [[0, 1, -1], [-1, -1, -1], [1, 2, 0]]
+
+
+@pytest.mark.parametrize("lexical", [True, False])
+def test_get_lexical_mask_matches_loop(lexical: bool):
+    query_tokens = [["a", "b", "c"], ["d"], []]
+    passage_tokens = [["a", "c"], [], ["d", "b", "b"]]
+    n_query_tokens = 4
+
+    vocabulary = {}
+    mask = get_lexical_mask(
+        get_token_ids(query_tokens, vocabulary),
+        get_token_ids(passage_tokens, vocabulary),
+        vocab_size=len(vocabulary),
+        n_query_tokens=n_query_tokens,
+        lexical=lexical,
+    )
+
+    expected = torch.zeros(len(query_tokens), len(passage_tokens), n_query_tokens, dtype=torch.bool)
+    for b, q_tokens in enumerate(query_tokens):
+        for c, p_tokens in enumerate(passage_tokens):
+            for t, token in enumerate(q_tokens[:n_query_tokens]):
+                expected[b, c, t] = (token in p_tokens) == lexical
+
+    assert torch.equal(mask, expected)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1024])
+def test_segment_max_sim_matches_loop(chunk_size: int):
+    qs = [torch.randn(n, EMBEDDING_DIM) for n in (5, 3)]
+    ps = [torch.randn(n, EMBEDDING_DIM) for n in (4, 6, 7)]
+    matching_indices = [
+        [([0, 2], [1, 3]), ([], [0]), ([4], [5, 0, 1])],
+        [([1], []), ([0, 1, 2], [2]), ([2, 0], [0, 1])],
+    ]
+
+    scores = segment_max_sim(qs, ps, matching_indices, chunk_size=chunk_size)
+
+    expected = torch.zeros(len(qs), len(ps))
+    for b, q in enumerate(qs):
+        for c, p in enumerate(ps):
+            q_indices, p_indices = matching_indices[b][c]
+            if q_indices and p_indices:
+                expected[b, c] = (q[q_indices] @ p[p_indices].T).max(dim=1)[0].sum()
+
+    assert torch.allclose(scores, expected, atol=1e-5)
+
+
+def test_passage_blocks_reuse():
+    qs = [torch.randn(n, EMBEDDING_DIM) for n in (3, 6, 2)]
+    ps = [torch.randn(n, EMBEDDING_DIM) for n in (4, 9, 1, 7, 5)]
+
+    passage_blocks = PassageBlocks.from_embeddings(ps, batch_size=2)
+    assert len(passage_blocks) == len(ps)
+    assert torch.equal(
+        score_multi_vector_bucketed(qs, passage_blocks, batch_size=2),
+        score_multi_vector_bucketed(qs, ps, batch_size=2),
+    )
+
+    with pytest.raises(ValueError):
+        score_multi_vector_bucketed(qs, PassageBlocks.from_embeddings(ps, batch_size=2, bucketed=False))
+
+
+def test_passage_blocks_contiguous():
+    ps = [torch.randn(n, EMBEDDING_DIM) for n in (4, 9, 1)]
+    passage_blocks = PassageBlocks.from_embeddings(ps, batch_size=2, bucketed=False)
+
+    assert [indices.tolist() for indices, _, _ in passage_blocks] == [[0, 1], [2]]
+    assert [ps_batch.shape[:2] for _, ps_batch, _ in passage_blocks] == [(2, 9), (1, 1)]
+
+
+def test_quantize_int8_round_trip():
+    emb = torch.nn.functional.normalize(torch.randn(2, 5, EMBEDDING_DIM), dim=-1)
+    emb[1, 3:] = 0
+
+    codes, scales = quantize_embeddings(emb, "int8")
+    assert codes.dtype == torch.int8 and scales.shape == (2, 5, 1)
+
+    decoded = dequantize_embeddings((codes, scales), "int8")
+    assert torch.allclose(decoded, emb, atol=scales.max().item())
+    assert torch.equal(decoded[1, 3:], emb[1, 3:])
+
+
+def test_binary_dot_matches_hamming():
+    a, b = torch.randn(2, 3, EMBEDDING_DIM)
+
+    codes_a, codes_b = quantize_embeddings(a, "binary"), quantize_embeddings(b, "binary")
+    assert codes_a.dtype == torch.uint8 and codes_a.shape == (3, EMBEDDING_DIM // 8)
+
+    hamming = ((a[:, None] > 0) != (b[None] > 0)).sum(dim=-1)
+    dot = dequantize_embeddings(codes_a, "binary") @ dequantize_embeddings(codes_b, "binary").T
+    assert torch.allclose(dot, 1 - 2 * hamming / EMBEDDING_DIM, atol=1e-6)
+
+    with pytest.raises(ValueError):
+        quantize_embeddings(torch.randn(3, 12), "binary")
+
+
+def test_binary_max_sim_matches_decoded():
+    qs_batch, qs_mask = pad_with_mask([torch.randn(n, EMBEDDING_DIM) for n in (3, 5)])
+    ps_batch, ps_mask = pad_with_mask([torch.randn(n, EMBEDDING_DIM) for n in (4, 9, 1)])
+    qs_codes, ps_codes = quantize_embeddings(qs_batch, "binary"), quantize_embeddings(ps_batch, "binary")
+
+    scores = binary_max_sim(qs_codes, qs_mask, ps_codes, ps_mask, tile_size=2)
+
+    expected = masked_max_sim(
+        dequantize_embeddings(qs_codes, "binary"), qs_mask, dequantize_embeddings(ps_codes, "binary"), ps_mask
+    )
+    assert torch.allclose(scores, expected, atol=1e-5)
+
+
+@pytest.mark.parametrize("quantization", ["int8", "binary"])
+def test_quantized_top_k_with_rerank(quantization: str):
+    qs = [torch.randn(n, EMBEDDING_DIM) for n in (3, 6, 2)]
+    ps = [torch.randn(n, EMBEDDING_DIM) for n in (4, 9, 1, 7, 5, 8, 2)]
+
+    expected_indices, expected_scores = score_multi_vector_top_k(qs, ps, k=2, batch_size=3)
+
+    passage_blocks = PassageBlocks.from_embeddings(ps, batch_size=3, quantization=quantization)
+    assert passage_blocks.nbytes < PassageBlocks.from_embeddings(ps, batch_size=3).nbytes
+    assert score_multi_vector_bucketed(qs, passage_blocks, batch_size=3).shape == (len(qs), len(ps))
+
+    # Reranking every passage exactly recovers the full-precision top-k
+    indices, scores = score_multi_vector_top_k(
+        qs, ps, k=2, batch_size=3, quantization=quantization, rerank_top_k=len(ps)
+    )
+    assert torch.equal(indices, expected_indices)
+    assert torch.allclose(scores, expected_scores, atol=1e-5)
+
+    with pytest.raises(ValueError):
+        score_multi_vector_top_k(qs, passage_blocks, k=2, quantization=quantization, rerank_top_k=4)
+
+
+@pytest.mark.slow
+def test_binary_top_k_not_slower_than_float():
+    # bf16 ColPali-sized embeddings, with the passage blocks prepared once as in the evaluation
+    qs = [torch.randn(20, 128, dtype=torch.bfloat16) for _ in range(64)]
+    ps = [torch.randn(700, 128, dtype=torch.bfloat16) for _ in range(256)]
+
+    passage_blocks = {
+        quantization: PassageBlocks.from_embeddings(ps, batch_size=16, quantization=quantization)
+        for quantization in (None, "binary")
+    }
+    timings = {quantization: [] for quantization in passage_blocks}
+    # Interleave the runs, so that both modes see the same machine load
+    for _ in range(5):
+        for quantization, blocks in passage_blocks.items():
+            start_time = time.perf_counter()
+            score_multi_vector_top_k(qs, blocks, k=10, batch_size=16, quantization=quantization)
+            timings[quantization].append(time.perf_counter() - start_time)
+
+    assert min(timings["binary"]) <= 1.25 * min(timings[None])
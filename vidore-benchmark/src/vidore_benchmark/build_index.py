@@ -1,14 +1,21 @@
 import argparse
 import logging
 import os
+import shutil
 from pathlib import Path
-import torch
 from datasets import load_dataset
 from dotenv import load_dotenv
 from vidore_benchmark.compression.token_pooling import HierarchicalEmbeddingPooler
 from vidore_benchmark.evaluation.indexing import indexing
+from vidore_benchmark.index.incremental_index import IncrementalIndex, get_search_index_path, save_content_hashes
 from vidore_benchmark.retrievers.registry_utils import load_vision_retriever_from_registry
+from vidore_benchmark.utils.embedding_cache import EmbeddingCache, hash_passage
+from vidore_benchmark.utils.iter_utils import batched
+from vidore_benchmark.utils.jsonl_utils import PAGE_FIELDS, iter_jsonl_pages
 from vidore_benchmark.utils.logging_utils import setup_logging
+from vidore_benchmark.utils.memmap_utils import ShardedIndexWriter, is_memmap_index
+from vidore_benchmark.utils.pagepack_utils import is_page_pack, iter_page_pack
+from vidore_benchmark.utils.ragged_utils import RaggedEmbeddings, load_embeddings, save_embeddings
 import huggingface_hub
 import json
 import csv
@@ -16,7 +23,6 @@ import os
 import base64
 import tqdm
 from PIL import Image
-from datasets import Dataset
 import re
 import io
 import numpy as np
@@ -59,19 +65,187 @@ def list_to_dict(data_list):
     data_dict = {key: [dic[key] for dic in data_list] for key in keys}
     return data_dict
 
-def process_batch(dataset_dict):
-    """Process the current batch of data."""
-    # Convert the current batch dictionary to a Dataset
-    dataset = Dataset.from_dict(dataset_dict)
-    print("Processed a batch of size:", len(dataset_dict['query']))
-    return dataset
+def pool_passage_embeddings(embedding_pooler, emb_passages):
+    """Pool the passage embeddings (a list or a `RaggedEmbeddings`) if a pooler is provided."""
+    if embedding_pooler is None:
+        return emb_passages
+    if isinstance(emb_passages, RaggedEmbeddings):
+        return embedding_pooler.pool_ragged_embeddings(emb_passages)
+    return [embedding_pooler.pool_embeddings(emb_document)[0] for emb_document in emb_passages]
+
+def hash_page(retriever, page):
+    """Content hash of the passage of a page (its image or its text, see `hash_passage`)."""
+    return hash_passage(page["image"] if retriever.use_visual_embedding else page["text_description"])
+
+def embed_passages(retriever, pages, embedding_pooler, args):
+    """Embed a batch of pages, and pool them if a pooler is provided."""
+    emb_passages = indexing(retriever, pages, batch_passage=args.batch_passage)
+    return pool_passage_embeddings(embedding_pooler, emb_passages)
+
+def finalize_passage_embeddings(args, writer: ShardedIndexWriter, save_path: Path):
+    """
+    Merge the shards into the memmap index directory `save_path`, or into a single `.pt` file with
+    `--index-format torch`. Returns the saved embeddings and their path.
+    """
+    emb_passages = writer.finalize(str(save_path))
+    if args.index_format == "torch":
+        torch_save_path = save_path.with_name(save_path.name + ".pt")
+        save_embeddings(emb_passages, str(torch_save_path))
+        shutil.rmtree(save_path)
+        emb_passages, save_path = load_embeddings(str(torch_save_path)), torch_save_path
+    print("Embeddings saved in ", save_path)
+    return emb_passages, save_path
+
+def save_search_indexes(args, retriever, emb_passages, save_path: Path):
+    """Build the requested search indexes of the passage embeddings and save them next to them."""
+    if args.plaid_index:
+        plaid_index = retriever.build_search_index(
+            emb_passages, "plaid", n_centroids=args.plaid_n_centroids, n_bits=args.plaid_n_bits
+        )
+        plaid_save_path = get_search_index_path(save_path, "plaid")
+        plaid_index.save(str(plaid_save_path))
+        print("PLAID index saved in ", plaid_save_path)
+
+    if args.muvera_index:
+        muvera_index = retriever.build_search_index(emb_passages, "muvera")
+        muvera_save_path = get_search_index_path(save_path, "muvera")
+        muvera_index.save(str(muvera_save_path))
+        print("MUVERA index saved in ", muvera_save_path)
+
+    if args.ann_index:
+        ann_params = json.loads(args.ann_params) if args.ann_params else {}
+        ann_index = retriever.build_search_index(emb_passages, args.ann_index, **ann_params)
+        ann_save_path = get_search_index_path(save_path, args.ann_index)
+        ann_index.save(str(ann_save_path))
+        print(f"{args.ann_index} index saved in ", ann_save_path)
+
+def iter_collection_batches(collection_name, split, skip_page, maybe_skipped=None, n_workers=None, batch_size=500):
+    """
+    Yield the pages of the collection (a page pack, a JSONL file, or a local directory or Hub collection of
+    datasets) in lists of `batch_size` page dicts, skipping the pages for which `skip_page(image_filename)` is True.
+
+    The page pack images are decoded by `n_workers` processes (see `iter_page_pack`). The JSONL pages are parsed
+    and their images decoded by `n_workers` processes (see `iter_jsonl_pages`), except for the images of the
+    `maybe_skipped` filenames.
+    """
+    if is_page_pack(collection_name):
+        pages = iter_page_pack(collection_name, fields=PAGE_FIELDS, skip_page=skip_page, n_workers=n_workers)
+        for batch in batched(tqdm.tqdm(pages), n=batch_size):
+            print("Processed a batch of size:", len(batch))
+            yield list(batch)
+
+    elif collection_name.endswith('.jsonl'):
+        image_dir = "/ivi/ilps/personal/jqiao/colpali/index_data/" if "arxivqa" in collection_name else None
+        pages = iter_jsonl_pages(
+            collection_name,
+            image_dir=image_dir,
+            skip_page=skip_page,
+            maybe_skipped=maybe_skipped,
+            n_workers=n_workers,
+        )
+        for batch in batched(tqdm.tqdm(pages), n=batch_size):
+            print("Processed a batch of size:", len(batch))
+            yield list(batch)
+
+    else:
+        if os.path.isdir(collection_name):
+            print(f"Loading datasets from local directory: `{collection_name}`")
+            dataset_names = os.listdir(collection_name)
+            dataset_names = [os.path.join(collection_name, dataset) for dataset in dataset_names]
+        else:
+            print(f"Loading datasets from the Hf Hub collection: {collection_name}")
+            collection = huggingface_hub.get_collection(collection_name)
+            dataset_names = [dataset_item.item_id for dataset_item in collection.items]
+
+        for dataset_name in dataset_names:
+            print(f"\n ---------------------------\nProcessing {dataset_name}")
+            dataset = load_dataset(dataset_name, split=split)
+            dataset = dataset.select(
+                [idx for idx, filename in enumerate(dataset["image_filename"]) if not skip_page(str(filename))]
+            )
+            for start in range(0, len(dataset), batch_size):
+                yield list(dataset.select(range(start, min(start + batch_size, len(dataset)))))
+
+def update_index(args, retriever, embedding_pooler, save_path: Path):
+    """
+    Bring the memmap index `save_path` up to date with the collection without rebuilding it: only the new pages and
+    the pages whose content hash (see `hash_page`) changed are embedded, the changed ones replacing their current
+    version (`upsert`), and the pages that left the collection are deleted. The search indexes saved next to the
+    index are updated incrementally (see `IncrementalIndex`).
+
+    The pages of the index without a content hash (e.g. those of a resumed build) are re-embedded.
+    """
+    index = IncrementalIndex(str(save_path), max_deleted_fraction=args.max_deleted_fraction)
+    indexed_filenames = set(index.doc_ids)
+    collection_filenames = set()
+    # Several pages can share the same `image_filename`: once it is upserted, its next pages are appended to it
+    upserted_filenames = set()
+
+    def record_filename(image_filename: str) -> bool:
+        # All the pages are decoded to compare their content hashes
+        collection_filenames.add(image_filename)
+        return False
+
+    n_added = n_updated = 0
+    for pages in iter_collection_batches(
+        args.collection_name,
+        args.split,
+        skip_page=record_filename,
+        n_workers=args.ingest_workers,
+    ):
+        upserted_pages, appended_pages = [], []
+        for page in pages:
+            image_filename, page_hash = page["image_filename"], hash_page(retriever, page)
+            if image_filename in upserted_filenames:
+                appended_pages.append((page, page_hash))
+            elif page_hash is None or page_hash not in index.content_hashes.get(image_filename, []):
+                upserted_pages.append((page, page_hash))
+
+        # The changed pages replace the current version of their filename, the next pages of an upserted filename
+        # are appended to it. The search indexes are saved once, after the last batch.
+        for changed_pages, update in ((upserted_pages, index.upsert), (appended_pages, index.add)):
+            if not changed_pages:
+                continue
+            doc_ids = [page["image_filename"] for page, _ in changed_pages]
+            update(
+                embed_passages(retriever, [page for page, _ in changed_pages], embedding_pooler, args),
+                doc_ids,
+                save=False,
+                content_hashes=[page_hash for _, page_hash in changed_pages],
+            )
+            upserted_filenames.update(doc_ids)
+            n_updated += sum(doc_id in indexed_filenames for doc_id in doc_ids)
+            n_added += sum(doc_id not in indexed_filenames for doc_id in doc_ids)
+    if n_added + n_updated > 0:
+        index.save()
+
+    deleted_filenames = sorted(indexed_filenames - collection_filenames)
+    if deleted_filenames:
+        index.delete(deleted_filenames)
+    print(
+        f"Index {save_path} updated: {n_added} passages added, {n_updated} passages updated, "
+        f"{len(deleted_filenames)} filenames deleted"
+    )
 
 def build_index(args):
     # Create the vision retriever
+    # NOTE: The visual-token budget is only passed when needed, as most retrievers do not accept it.
+    retriever_kwargs = {}
+    if args.max_visual_tokens_per_batch is not None:
+        retriever_kwargs.update(max_visual_tokens_per_batch=args.max_visual_tokens_per_batch)
     retriever = load_vision_retriever_from_registry(
         args.model_class,
         pretrained_model_name_or_path=args.model_name,
+        **retriever_kwargs,
     )
+    retriever.set_preprocessing_workers(args.num_preprocessing_workers)
+
+    embedding_cache = None
+    if args.embedding_cache_dir is not None:
+        embedding_cache = EmbeddingCache(
+            args.embedding_cache_dir, max_size_bytes=int(args.embedding_cache_max_size_gb * 1024**3)
+        )
+        retriever.set_passage_embedding_cache(embedding_cache)
 
     # Get the pooling strategy
     embedding_pooler = HierarchicalEmbeddingPooler(args.pool_factor) if args.use_token_pooling else None
@@ -81,103 +255,65 @@ def build_index(args):
     savedir = OUTPUT_DIR / "indexing"
     savedir.mkdir(parents=True, exist_ok=True)
 
-    if collection_name.endswith('.jsonl'):
-        # dataset = []
-        dataset_dict = {'query': [], 'image': [], 'image_filename': [], 'text_description': []}
-
-        emb_passages = []
-        with open(collection_name, 'r') as file:
-            for line in tqdm.tqdm(file):
-                data = json.loads(line)
-                if "arxivqa" in collection_name:
-                    image = Image.open("/ivi/ilps/personal/jqiao/colpali/index_data/" + str(data['image_filename']))
-                    dataset_dict['image'].append(image)
-                else:
-                    # image = Image.open(data['image'])
-                    image = decode_base64_to_pil_image(data['image'])
-                    dataset_dict['image'].append(image)
-                dataset_dict['query'].append(str(data['query']))
-                dataset_dict['image_filename'].append(str(data['image_filename']))
-                dataset_dict['text_description'].append(str(data['text_description']))
-
-                # Check if we've reached the batch size limit
-                if len(dataset_dict['query']) == 500:
-                    dataset = process_batch(dataset_dict)
-                    batch_emb_passages = indexing(retriever,
-                                    dataset,
-                                    batch_passage=args.batch_passage)
-
-                    if isinstance(batch_emb_passages, torch.Tensor):
-                        batch_emb_passages = list(torch.unbind(batch_emb_passages))
-                        emb_passages.extend(batch_emb_passages)
-                    else:
-                        emb_passages.extend(batch_emb_passages)
-
-                    # emb_passages.extend(embs)
-                    # Clear the dictionary for the next batch
-                    dataset_dict = {'query': [], 'image': [], 'image_filename': [], 'text_description': []}
-         
-            if dataset_dict['query']:
-                dataset = process_batch(dataset_dict)
-                batch_emb_passages = indexing(
-                                retriever,
-                                dataset,
-                                batch_passage=args.batch_passage)
-                # emb_passages.extend(embs)
-
-                if isinstance(batch_emb_passages, torch.Tensor):
-                    batch_emb_passages = list(torch.unbind(batch_emb_passages))
-                    emb_passages.extend(batch_emb_passages)
-                else:
-                    emb_passages.extend(batch_emb_passages)
-
-        if embedding_pooler:
-            for idx, emb_document in enumerate(emb_passages):
-                emb_document, _ = embedding_pooler.pool_embeddings(emb_document)
-                emb_passages[idx] = emb_document
-
+    if collection_name.endswith('.jsonl') or is_page_pack(collection_name):
         if "health" in collection_name:
             data_name = "health"
         elif "ai" in collection_name:
             data_name = "ai"
         elif "arxivqa" in collection_name:
             data_name = "arxivqa"
-        
-        print("start saving", len(emb_passages))
-        save_path = savedir / f"{args.model_class}_{data_name}_indexing_results_{args.output_name}.pt"
-        torch.save({"embeddings": emb_passages}, save_path)
-        print("Embeddings saved in ", save_path)
+        save_path = savedir / f"{args.model_class}_{data_name}_indexing_results_{args.output_name}"
+    else:
+        save_path = savedir / f"{args.model_class}_indexing_results_{args.output_name}"
 
+    if args.update:
+        if not is_memmap_index(str(save_path)):
+            raise ValueError(f"`--update` requires an existing memmap index, `{save_path}` is not one")
+        update_index(args, retriever, embedding_pooler, save_path)
     else:
-        if os.path.isdir(collection_name):
-            print(f"Loading datasets from local directory: `{collection_name}`")
-            dataset_names = os.listdir(collection_name)
-            dataset_names = [os.path.join(collection_name, dataset) for dataset in dataset_names]
-        else:
-            print(f"Loading datasets from the Hf Hub collection: {collection_name}")
-            collection = huggingface_hub.get_collection(collection_name)
-            dataset_names = [dataset_item.item_id for dataset_item in collection.items]
+        write_index(args, retriever, embedding_pooler, save_path)
 
-        emb_passages = []
-        for dataset_name in dataset_names:
-            print(f"\n ---------------------------\nProcessing {dataset_name}")
-            dataset = load_dataset(dataset_name, split=args.split)
-            embeddings = indexing(
-                retriever,
-                dataset,
-                batch_passage=args.batch_passage,
-            )
-            emb_passages.extend(embeddings)
+    if embedding_cache is not None:
+        print(f"Passage embedding cache: {embedding_cache.get_stats()}")
+
+def write_index(args, retriever, embedding_pooler, save_path: Path):
+    """Embed all the pages of the collection into a new index, resuming after the completed shards."""
+    collection_name = args.collection_name
 
-        if embedding_pooler:
-            for idx, emb_document in enumerate(emb_passages):
-                emb_document, _ = embedding_pooler.pool_embeddings(emb_document)
-                emb_passages[idx] = emb_document
+    # The embeddings are flushed every `--shard-size` pages, and a restarted run resumes after the last shard
+    writer = ShardedIndexWriter(str(save_path) + ".shards", shard_size=args.shard_size)
+    remaining_completed_doc_ids = writer.completed_doc_ids.copy()
+    if writer.n_completed > 0:
+        print(f"Resuming after {writer.n_completed} passages already embedded in {len(writer.shards)} shards")
 
-        print("start saving")
-        save_path = savedir / f"{args.model_class}_indexing_results_num_{number}.pt"
-        torch.save({"embeddings": emb_passages}, save_path)
-        print("Embeddings saved in ", save_path)
+    def is_completed(image_filename: str) -> bool:
+        # Several passages can share the same `image_filename`: each completed passage is only skipped once
+        if remaining_completed_doc_ids[image_filename] > 0:
+            remaining_completed_doc_ids[image_filename] -= 1
+            return True
+        return False
+
+    # The content hashes of the pages embedded by this run, compared by `update_index`
+    content_hashes = {}
+    for pages in iter_collection_batches(
+        collection_name,
+        args.split,
+        skip_page=is_completed,
+        maybe_skipped=writer.completed_doc_ids.keys(),
+        n_workers=args.ingest_workers,
+    ):
+        writer.add(embed_passages(retriever, pages, embedding_pooler, args), [page["image_filename"] for page in pages])
+        for page in pages:
+            page_hash = hash_page(retriever, page)
+            if page_hash is not None:
+                content_hashes.setdefault(page["image_filename"], []).append(page_hash)
+
+    print("start saving", len(writer))
+    emb_passages, save_path = finalize_passage_embeddings(args, writer, save_path)
+    if is_memmap_index(str(save_path)):
+        save_content_hashes(str(save_path), content_hashes)
+
+    save_search_indexes(args, retriever, emb_passages, save_path)
 
 def main():
     parser = argparse.ArgumentParser(description="Build Index for Vision Retriever")
@@ -188,10 +324,88 @@ def main():
     parser.add_argument("--batch-query", type=int, default=8, help="Batch size for query embedding inference")
     parser.add_argument("--batch-passage", type=int, default=8, help="Batch size for passages embedding inference")
     parser.add_argument("--batch-score", type=int, default=16, help="Batch size for score computation")
-    parser.add_argument("--collection-name", type=str, help="Dataset collection to use for evaluation")
+    parser.add_argument(
+        "--collection-name",
+        type=str,
+        help="Dataset collection to use for evaluation, or a JSONL file or page pack directory of pages",
+    )
     parser.add_argument("--use-token-pooling", action="store_true", help="Whether to use token pooling for text embeddings")
     parser.add_argument("--pool-factor", type=int, default=3, help="Pooling factor for hierarchical token pooling")
     parser.add_argument("--output-name", type=str, help="HuggingFace Hub dataset name")
+    parser.add_argument(
+        "--index-format",
+        type=str,
+        choices=["memmap", "torch"],
+        default="memmap",
+        help="Save the embeddings as a memory-mapped index directory, or as a single `.pt` file (loaded in RAM)",
+    )
+    parser.add_argument(
+        "--shard-size",
+        type=int,
+        default=2000,
+        help="Number of pages embedded between two flushes to disk (a restarted run resumes after the last one)",
+    )
+    parser.add_argument(
+        "--ingest-workers",
+        type=int,
+        default=None,
+        help="Number of processes parsing and decoding the JSONL pages (defaults to the number of CPUs, 0 to disable)",
+    )
+    parser.add_argument(
+        "--num-preprocessing-workers",
+        type=int,
+        default=0,
+        help="Number of DataLoader workers preprocessing the passage batches of the model (0 to disable)",
+    )
+    parser.add_argument(
+        "--max-visual-tokens-per-batch",
+        type=int,
+        default=None,
+        help="Batch the passages by visual-token budget instead of `--batch-passage` (ColQwen2 retriever)",
+    )
+    parser.add_argument(
+        "--embedding-cache-dir",
+        type=str,
+        default=None,
+        help="Persistent passage embedding cache, shared across datasets and runs of the same model",
+    )
+    parser.add_argument(
+        "--embedding-cache-max-size-gb",
+        type=float,
+        default=50.0,
+        help="Size of the passage embedding cache above which the LRU entries are evicted",
+    )
+    parser.add_argument(
+        "--update",
+        action="store_true",
+        help=(
+            "Update an existing memmap index: embed the new and changed pages of the collection and delete the "
+            "removed ones"
+        ),
+    )
+    parser.add_argument(
+        "--max-deleted-fraction",
+        type=float,
+        default=0.2,
+        help="With `--update`, fraction of deleted passages above which the index is compacted",
+    )
+    parser.add_argument("--plaid-index", action="store_true", help="Whether to also build a PLAID centroid index")
+    parser.add_argument("--plaid-n-centroids", type=int, default=None, help="Number of centroids of the PLAID index")
+    parser.add_argument("--plaid-n-bits", type=int, default=2, help="Bits per dimension of the PLAID residuals")
+    parser.add_argument("--muvera-index", action="store_true", help="Whether to also build a MUVERA FDE index")
+    parser.add_argument(
+        "--ann-index",
+        type=str,
+        choices=["ivf_flat", "ivf_pq", "hnsw", "pq", "matryoshka"],
+        default=None,
+        help="Approximate nearest neighbor or product-quantized index to also build (single-vector retrievers)",
+    )
+    parser.add_argument(
+        "--ann-params",
+        type=str,
+        default=None,
+        help='JSON construction and search parameters of the ANN index, e.g. \'{"n_lists": 1024, "n_probe": 16}\'',
+    )
 
     args = parser.parse_args()
 
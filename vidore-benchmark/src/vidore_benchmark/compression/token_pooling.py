@@ -1,9 +1,11 @@
 from abc import ABC, abstractmethod
 from typing import Dict, Tuple
 
+import numpy as np
 import torch
 from scipy.cluster.hierarchy import fcluster, linkage
 
+from vidore_benchmark.utils.ragged_utils import RaggedEmbeddings
 from vidore_benchmark.utils.torch_utils import get_torch_device
 
 
@@ -19,6 +21,14 @@ class BaseEmbeddingPooler(ABC):
         """
         pass
 
+    def pool_ragged_embeddings(self, embeddings: RaggedEmbeddings) -> RaggedEmbeddings:
+        """
+        Pool each embedding of `embeddings`, and return the pooled embeddings on the same device.
+        """
+        return RaggedEmbeddings.from_list(
+            [self.pool_embeddings(embedding)[0].to(embeddings.device) for embedding in embeddings]
+        )
+
 
 class HierarchicalEmbeddingPooler(BaseEmbeddingPooler):
     """
@@ -29,6 +39,25 @@ class HierarchicalEmbeddingPooler(BaseEmbeddingPooler):
         self.pool_factor = pool_factor
         self.device = get_torch_device(device)
 
+    def get_cluster_labels(self, embeddings: torch.Tensor) -> np.ndarray:
+        """
+        Cluster the tokens of an embedding of shape (token_length, embedding_dim) into at most
+        `token_length // pool_factor` clusters, and return the cluster id (starting at 1) of each token.
+        """
+        token_length = embeddings.size(0)
+
+        if token_length == 1:
+            raise ValueError("The input tensor must have more than one token.")
+
+        similarities = torch.mm(embeddings, embeddings.t())
+        if similarities.dtype == torch.bfloat16:
+            similarities = similarities.to(torch.float16)
+        similarities = 1 - similarities.cpu().numpy()
+
+        Z = linkage(similarities, metric="euclidean", method="ward")  # noqa: N806
+        max_clusters = max(token_length // self.pool_factor, 1)
+        return fcluster(Z, t=max_clusters, criterion="maxclust")
+
     def pool_embeddings(self, embeddings: torch.Tensor) -> Tuple[torch.Tensor, Dict[int, torch.Tensor]]:
         """
         Return the pooled embeddings and the mapping from cluster id to token indices.
@@ -44,19 +73,8 @@ class HierarchicalEmbeddingPooler(BaseEmbeddingPooler):
         """
         embeddings = embeddings.to(self.device)
         pooled_embeddings = []
-        token_length = embeddings.size(0)
-
-        if token_length == 1:
-            raise ValueError("The input tensor must have more than one token.")
-
-        similarities = torch.mm(embeddings, embeddings.t())
-        if similarities.dtype == torch.bfloat16:
-            similarities = similarities.to(torch.float16)
-        similarities = 1 - similarities.cpu().numpy()
-
-        Z = linkage(similarities, metric="euclidean", method="ward")  # noqa: N806
-        max_clusters = max(token_length // self.pool_factor, 1)
-        cluster_labels = fcluster(Z, t=max_clusters, criterion="maxclust")
+        cluster_labels = self.get_cluster_labels(embeddings)
+        max_clusters = max(embeddings.size(0) // self.pool_factor, 1)
 
         cluster_id_to_indices: Dict[int, torch.Tensor] = {}
 
@@ -74,6 +92,34 @@ class HierarchicalEmbeddingPooler(BaseEmbeddingPooler):
 
         return pooled_embeddings, cluster_id_to_indices
 
+    def pool_ragged_embeddings(self, embeddings: RaggedEmbeddings) -> RaggedEmbeddings:
+        """
+        Pool each embedding of `embeddings`, and return the pooled embeddings on the same device. Only the
+        clustering runs embedding by embedding: the clusters of all the embeddings are then averaged at once.
+        """
+        device_embeddings = embeddings.to(self.device)
+        values = device_embeddings.values
+        cluster_labels = torch.from_numpy(
+            np.concatenate([self.get_cluster_labels(embedding) for embedding in device_embeddings])
+        ).to(self.device)
+
+        # Number the clusters across the embeddings, in the order of `pool_embeddings`
+        max_label = int(cluster_labels.max()) + 1
+        embedding_ids = torch.repeat_interleave(torch.arange(len(embeddings)), embeddings.lengths).to(self.device)
+        cluster_keys, cluster_ids = torch.unique(embedding_ids * max_label + cluster_labels, return_inverse=True)
+
+        with torch.no_grad():
+            sums = torch.zeros(len(cluster_keys), values.shape[1], device=self.device)
+            sums.index_add_(0, cluster_ids, values.float())
+            pooled_values = sums / torch.bincount(cluster_ids, minlength=len(cluster_keys))[:, None]
+            pooled_values = torch.nn.functional.normalize(pooled_values, p=2, dim=-1).to(values.dtype)
+
+        n_clusters = torch.bincount((cluster_keys // max_label).cpu(), minlength=len(embeddings))
+        return RaggedEmbeddings(
+            pooled_values.to(embeddings.device),
+            torch.cat([torch.zeros(1, dtype=torch.long), n_clusters.cumsum(0)]),
+        )
+
 
 
     def save_embeddings(self, file_path: str, embeddings: torch.Tensor, cluster_map: Dict[int, torch.Tensor]):
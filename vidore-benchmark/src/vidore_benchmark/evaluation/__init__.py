@@ -1,4 +1,4 @@
 from .eval_manager import EvalManager
 from .eval_utils import CustomRetrievalEvaluator
 from .evaluate import evaluate_dataset, evaluate_dataset_from_indexing
-from .scoring import score_multi_vector
+from .scoring import score_multi_vector, score_multi_vector_top_k
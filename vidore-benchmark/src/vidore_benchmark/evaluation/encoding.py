@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import logging
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Union
+
+import torch
+from tqdm import tqdm
+
+from vidore_benchmark.retrievers.vision_retriever import VisionRetriever
+from vidore_benchmark.utils.iter_utils import batched
+from vidore_benchmark.utils.pipeline_utils import Pipeline
+from vidore_benchmark.utils.ragged_utils import RaggedEmbeddings, concat_embeddings
+
+logger = logging.getLogger(__name__)
+
+
+def encode_passages(
+    vision_retriever: VisionRetriever,
+    pages: Iterable[Dict[str, Any]],
+    get_passage: Callable[[Dict[str, Any]], Any],
+    batch_passage: int,
+    n_pages: Optional[int] = None,
+    max_queue_size: int = 4,
+) -> Union[List[torch.Tensor], RaggedEmbeddings]:
+    """
+    Compute the passage embeddings of the pages (rows of a dataset, or page dicts) with a pipelined encoder: the
+    rows are fetched and decoded, preprocessed, forwarded through the model and packed on the CPU concurrently,
+    by stages connected by bounded queues (see `Pipeline`). The throughput of each stage is printed at the end,
+    the slowest one being the bottleneck.
+
+    The stages after the fetch are the ones of `vision_retriever.get_passage_encoding_stages`, run on batches of
+    `batch_passage` passages. For the retrievers without them, or with a passage embedding cache, `forward_passages`
+    is the single stage, run on pre-batches of `10 * batch_passage` passages.
+
+    With preprocessing workers (see `VisionRetriever.set_preprocessing_workers`), the "preprocess" stage is run by
+    the worker processes of the retriever's DataLoader (see `VisionRetriever.get_batch_dataloader`), which the fetch
+    stage iterates over, instead of by a single thread.
+
+    Inputs:
+        - vision_retriever: retriever
+        - pages: dataset or iterable of page dicts
+        - get_passage: passage of a page, e.g. `lambda page: page["image"]`
+        - batch_passage: batch size of the forward pass
+        - n_pages: number of pages, for the progress bar (defaults to `len(pages)` if it has one)
+        - max_queue_size: maximum number of batches waiting between two stages
+
+    Output:
+        - embeddings: as returned by `forward_passages`, concatenated over the batches
+    """
+    stages = vision_retriever.get_passage_encoding_stages()
+    if stages is None or getattr(vision_retriever, "passage_embedding_cache", None) is not None:
+        batch_size = 10 * batch_passage
+        stages = [("forward", lambda passages: vision_retriever.forward_passages(passages, batch_size=batch_passage))]
+    else:
+        batch_size = batch_passage
+
+    if n_pages is None and hasattr(pages, "__len__"):
+        n_pages = len(pages)
+
+    # NOTE: The batch sizes are recorded as the batches are fetched, as a preprocessed batch has no length
+    batch_sizes: Deque[int] = deque()
+
+    def iter_batches() -> Iterator[List[Any]]:
+        for batch in batched(pages, n=batch_size):
+            passages = [get_passage(page) for page in batch]
+            batch_sizes.append(len(passages))
+            yield passages
+
+    source: Iterable[Any] = iter_batches()
+    source_name = "fetch"
+    if stages[0][0] == "preprocess" and getattr(vision_retriever, "num_preprocessing_workers", 0) > 0:
+        (_, preprocess), *stages = stages
+        # The DataLoader consumes the batches in order, from the fetch thread, and yields them in the same order
+        source = vision_retriever.get_batch_dataloader(source, collate_fn=preprocess)
+        source_name = "fetch+preprocess"
+
+    pipeline = Pipeline(stages, max_queue_size=max_queue_size, source_name=source_name, unit_name="passages")
+    emb_passage_batches: List[Union[List[torch.Tensor], RaggedEmbeddings]] = []
+
+    with tqdm(total=n_pages, desc="Encoding passages") as progress_bar:
+        for batch_emb_passages in pipeline.run(source, n_units=lambda _: batch_sizes.popleft()):
+            emb_passage_batches.append(batch_emb_passages)
+            progress_bar.update(len(batch_emb_passages))
+
+    print(pipeline.get_report())
+    return concat_embeddings(emb_passage_batches)
@@ -1,13 +1,16 @@
 from __future__ import annotations
-import math
 from typing import Any, Dict, List, Optional
 import torch
 from datasets import Dataset
 from tqdm import tqdm
 from vidore_benchmark.compression.token_pooling import BaseEmbeddingPooler
+from vidore_benchmark.evaluation.encoding import encode_passages
+from vidore_benchmark.index.base_index import BaseSearchIndex
+from vidore_benchmark.index.utils import recall_at_k
 from vidore_benchmark.retrievers.bm25_retriever import BM25Retriever
 from vidore_benchmark.retrievers.vision_retriever import VisionRetriever
-from vidore_benchmark.utils.iter_utils import batched
+from vidore_benchmark.utils.memmap_utils import MemmapEmbeddings
+from vidore_benchmark.utils.ragged_utils import RaggedEmbeddings
 from transformers import AutoTokenizer
 from typing import Any, Dict, List, Optional, Tuple, Union
 import time
@@ -29,6 +32,68 @@ def keep_top_100_scores(data):
     return data
 
 
+def get_top_100_results(
+    vision_retriever: VisionRetriever,
+    ds: Dataset,
+    queries: List[str],
+    emb_queries: Union[torch.Tensor, List[torch.Tensor]],
+    emb_passages: Union[torch.Tensor, List[torch.Tensor], BaseSearchIndex],
+    batch_score: Optional[int] = None,
+    doc_ids: Optional[List[Optional[str]]] = None,
+) -> Tuple[Dict[str, Dict[str, int]], Dict[str, Dict[str, float]]]:
+    """
+    Get the relevant passages and the top-100 results of each query with a streaming top-k search, or with
+    `emb_passages.search` if `emb_passages` is a search index (e.g. a `PLAIDIndex`).
+
+    The dense (n_queries, n_passages) score matrix is never built. Several passages can share the same
+    `image_filename`, so 100 + (number of duplicated filenames) passages are retrieved: this guarantees that
+    the top-100 distinct filenames are the same as with the dense scores.
+
+    If `doc_ids` is provided, it gives the filename of each passage instead of the rows of `ds` (see
+    `get_relevant_docs_results_from_top_k`). The deleted passages (doc id None) of a memmap index are not searched
+    (see `iter_live_blocks`). The search indexes still return them, so they are retrieved on top of the 100.
+    """
+    filenames = ds["image_filename"] if doc_ids is None else [doc_id for doc_id in doc_ids if doc_id is not None]
+    n_duplicates = len(filenames) - len(set(filenames))
+    n_deleted = 0
+    if doc_ids is not None and not isinstance(emb_passages, MemmapEmbeddings):
+        n_deleted = len(doc_ids) - len(filenames)
+
+    k = min(100 + n_duplicates + n_deleted, len(emb_passages))
+
+    if isinstance(emb_passages, BaseSearchIndex):
+        top_k_indices, top_k_scores = emb_passages.search(emb_queries, k=k)
+    else:
+        top_k_indices, top_k_scores = vision_retriever.get_top_k(
+            emb_queries,
+            emb_passages,
+            k=k,
+            batch_size=batch_score,
+        )
+    relevant_docs, results = vision_retriever.get_relevant_docs_results_from_top_k(
+        ds, queries, top_k_indices, top_k_scores, doc_ids=doc_ids
+    )
+
+    return relevant_docs, keep_top_100_scores(results)
+
+
+def get_search_recall(
+    vision_retriever: VisionRetriever,
+    emb_queries: Union[torch.Tensor, List[torch.Tensor]],
+    search_index: BaseSearchIndex,
+    emb_passages: Union[torch.Tensor, List[torch.Tensor]],
+    k: int = 100,
+    batch_score: Optional[int] = None,
+) -> float:
+    """
+    Recall@k of the approximate search index against the exact (exhaustive) top-k passages of each query.
+    """
+    k = min(k, len(search_index))
+    approximate_indices, _ = search_index.search(emb_queries, k=k)
+    exact_indices, _ = vision_retriever.get_top_k(emb_queries, emb_passages, k=k, batch_size=batch_score)
+    return recall_at_k(approximate_indices, exact_indices)
+
+
 def decode_base64_to_pil_image(encoded_str: str) -> Image.Image:
     """Convert a base64 string to a PIL Image."""
     image_bytes = base64.b64decode(encoded_str)
@@ -245,24 +310,17 @@ def evaluate_dataset_matching(
     # that will be fed to the model in batches (this should be fine for queries as their memory footprint
     # is negligible. This optimization is about efficient data loading, and is not related to the model's
     # forward pass which is also batched.
-    emb_passages: List[torch.Tensor] = []
-
-    dataloader_prebatch_size = 10 * batch_passage
-    for passage_batch in tqdm(
-        batched(ds, n=dataloader_prebatch_size),
-        desc="Dataloader pre-batching",
-        total=math.ceil(len(ds) / (dataloader_prebatch_size)),
-    ):
-        passages: List[Any] = [db[passage_column_name] for db in passage_batch]
-        
-        batch_emb_passages = vision_retriever.forward_passages(passages, batch_size=batch_passage)
-        if isinstance(batch_emb_passages, torch.Tensor):
-            batch_emb_passages = list(torch.unbind(batch_emb_passages))
-            emb_passages.extend(batch_emb_passages)
-        else:
-            emb_passages.extend(batch_emb_passages)
-
-    if embedding_pooler is not None:
+    # The batches are fetched and decoded, preprocessed, forwarded and packed concurrently (see `encode_passages`)
+    emb_passages = encode_passages(
+        vision_retriever,
+        ds,
+        get_passage=lambda db: db[passage_column_name],
+        batch_passage=batch_passage,
+    )
+
+    if isinstance(emb_passages, RaggedEmbeddings) and embedding_pooler is not None:
+        emb_passages = embedding_pooler.pool_ragged_embeddings(emb_passages)
+    elif embedding_pooler is not None:
         for idx, emb_document in tqdm(enumerate(emb_passages), total=len(emb_passages), desc="Pooling embeddings..."):
             emb_document, _ = embedding_pooler.pool_embeddings(emb_document)
             emb_passages[idx] = emb_document
@@ -386,43 +444,34 @@ def evaluate_dataset(
     # that will be fed to the model in batches (this should be fine for queries as their memory footprint
     # is negligible. This optimization is about efficient data loading, and is not related to the model's
     # forward pass which is also batched.
-    emb_passages: List[torch.Tensor] = []
-
-    dataloader_prebatch_size = 10 * batch_passage
-
-    for passage_batch in tqdm(
-        batched(ds, n=dataloader_prebatch_size),
-        desc="Dataloader pre-batching",
-        total=math.ceil(len(ds) / (dataloader_prebatch_size)),
-    ):
-        passages: List[Any] = [db[passage_column_name] for db in passage_batch]
-
-
-        batch_emb_passages = vision_retriever.forward_passages(passages, batch_size=batch_passage)
-
-        if isinstance(batch_emb_passages, torch.Tensor):
-            batch_emb_passages = list(torch.unbind(batch_emb_passages))
-            emb_passages.extend(batch_emb_passages)
-        else:
-            emb_passages.extend(batch_emb_passages)
-
-    if embedding_pooler is not None:
+    # The batches are fetched and decoded, preprocessed, forwarded and packed concurrently (see `encode_passages`)
+    emb_passages = encode_passages(
+        vision_retriever,
+        ds,
+        get_passage=lambda db: db[passage_column_name],
+        batch_passage=batch_passage,
+    )
+
+    if isinstance(emb_passages, RaggedEmbeddings) and embedding_pooler is not None:
+        emb_passages = embedding_pooler.pool_ragged_embeddings(emb_passages)
+    elif embedding_pooler is not None:
         for idx, emb_document in tqdm(enumerate(emb_passages), total=len(emb_passages), desc="Pooling embeddings..."):
             emb_document, _ = embedding_pooler.pool_embeddings(emb_document)
             emb_passages[idx] = emb_document
-    
+
+    # Passage-side scoring structures (e.g. the product-quantized codes of the DSE and GME retrievers)
+    emb_passages = vision_retriever.prepare_passage_embeddings(emb_passages, batch_size=batch_score)
+
     start_time = time.time()
     print("start to search ", start_time, "number of queries ", len(emb_queries), "number of passages ", len(ds), len(emb_passages))
-    # Get the similarity scores
-    scores = vision_retriever.get_scores(emb_queries, emb_passages, batch_size=batch_score)
+    # Get the relevant passages and the top-100 results
+    relevant_docs, top_100_results = get_top_100_results(
+        vision_retriever, ds, queries, emb_queries, emb_passages, batch_score=batch_score
+    )
     end_time = time.time()
     elapsed_time = end_time - start_time
     print(f"Search took {elapsed_time} seconds to complete.")
 
-    # Get the relevant passages and results
-    relevant_docs, results = vision_retriever.get_relevant_docs_results(ds, queries, scores)
-    top_100_results = keep_top_100_scores(results)
-
     # Compute the MTEB metrics
     metrics, query_metrics = vision_retriever.compute_metrics(relevant_docs, top_100_results)
 
@@ -458,46 +507,31 @@ def evaluate_dataset_from_imagetexts(
     # Get the embeddings for the queries and passages
     emb_queries = vision_retriever.forward_queries(queries, batch_size=batch_query)
 
-    emb_passages: List[torch.Tensor] = []
-
-    dataloader_prebatch_size = 10 * batch_passage
-
-    for passage_batch in tqdm(
-        batched(ds, n=dataloader_prebatch_size),
-        desc="Dataloader pre-batching",
-        total=math.ceil(len(ds) / (dataloader_prebatch_size)),
-    ):
-        # passages: List[Any] = [db['text_description'] for db in passage_batch]
-
-        # images: List[Any] = [db["image"] for db in passage_batch]
-        # texts: List[Any] = [db["text_description"] for db in passage_batch]
-        # passages = [(i,t) for i, t in zip(images, texts)]
-        passages: List[Any] = [(db["image"], db["text_description"]) for db in passage_batch]
-        batch_emb_passages = vision_retriever.forward_passages(passages, batch_size=batch_passage)
-
-        if isinstance(batch_emb_passages, torch.Tensor):
-            batch_emb_passages = list(torch.unbind(batch_emb_passages))
-            emb_passages.extend(batch_emb_passages)
-        else:
-            emb_passages.extend(batch_emb_passages)
-
-    if embedding_pooler is not None:
+    # The batches are fetched and decoded, preprocessed, forwarded and packed concurrently (see `encode_passages`)
+    emb_passages = encode_passages(
+        vision_retriever,
+        ds,
+        get_passage=lambda db: (db["image"], db["text_description"]),
+        batch_passage=batch_passage,
+    )
+
+    if isinstance(emb_passages, RaggedEmbeddings) and embedding_pooler is not None:
+        emb_passages = embedding_pooler.pool_ragged_embeddings(emb_passages)
+    elif embedding_pooler is not None:
         for idx, emb_document in tqdm(enumerate(emb_passages), total=len(emb_passages), desc="Pooling embeddings..."):
             emb_document, _ = embedding_pooler.pool_embeddings(emb_document)
             emb_passages[idx] = emb_document
     
     start_time = time.time()
     print("start to search ", start_time, "number of queries ", len(emb_queries), "number of passages ", len(ds), len(emb_passages))
-    # Get the similarity scores
-    scores = vision_retriever.get_scores(emb_queries, emb_passages, batch_size=batch_score)
+    # Get the relevant passages and the top-100 results
+    relevant_docs, top_100_results = get_top_100_results(
+        vision_retriever, ds, queries, emb_queries, emb_passages, batch_score=batch_score
+    )
     end_time = time.time()
     elapsed_time = end_time - start_time
     print(f"Search took {elapsed_time} seconds to complete.")
 
-    # Get the relevant passages and results
-    relevant_docs, results = vision_retriever.get_relevant_docs_results(ds, queries, scores)
-    top_100_results = keep_top_100_scores(results)
-
     # Compute the MTEB metrics
     metrics, query_metrics = vision_retriever.compute_metrics(relevant_docs, top_100_results)
 
@@ -619,7 +653,22 @@ def evaluate_dataset_from_indexing(
     batch_query: int,
     emb_passages: list,
     batch_score: Optional[int] = None,
+    exact_passages: Optional[Any] = None,
+    doc_ids: Optional[List[Optional[str]]] = None,
     ) -> Dict[str, Optional[float]]:
+    """
+    Evaluate the retriever on the query set against the passage embeddings of `build_index.py`, or against a
+    search index built from them. If `exact_passages` is provided with a search index, the recall@100 of the
+    search index against the exact search is added to the metrics as `search_recall_at_100`.
+
+    If the passage embeddings are memory-mapped from a memmap index (see `load_memmap_embeddings`), they are
+    searched block by block without being read into memory first.
+
+    The retrieved passages are mapped to their filename with `doc_ids` (see `load_doc_ids`), which defaults to the
+    doc ids of the memmap index. Without doc ids, the passages must be in the same order as `passages_ds`.
+    """
+    if doc_ids is None and isinstance(emb_passages, MemmapEmbeddings):
+        doc_ids = emb_passages.doc_ids
 
     # Dataset: sanity check
     passage_column_name = "image" if vision_retriever.use_visual_embedding else "text_description"
@@ -651,19 +700,21 @@ def evaluate_dataset_from_indexing(
 
     start_time = time.time()
     print("start to search ", start_time, "number of queries ", len(emb_queries), "number of passages ", len(emb_passages), len(emb_passages))
-    # Get the similarity scores
-    scores = vision_retriever.get_scores(emb_queries, emb_passages, batch_size=batch_score)
+    # Get the relevant passages and the top-100 results
+    relevant_docs, top_100_results = get_top_100_results(
+        vision_retriever, passages_ds, queries, emb_queries, emb_passages, batch_score=batch_score, doc_ids=doc_ids
+    )
     end_time = time.time()
     elapsed_time = end_time - start_time
     print(f"Search took {elapsed_time} seconds to complete.")
 
-    # Get the relevant passages and results
-    print("Get the relevant passages and results")
-    relevant_docs, results = vision_retriever.get_relevant_docs_results(passages_ds, queries, scores)
-
-    top_100_results = keep_top_100_scores(results)
-
     # Compute the MTEB metrics
     metrics, query_metrics = vision_retriever.compute_metrics(relevant_docs, top_100_results)
 
+    if exact_passages is not None and isinstance(emb_passages, BaseSearchIndex):
+        metrics["search_recall_at_100"] = get_search_recall(
+            vision_retriever, emb_queries, emb_passages, exact_passages, k=100, batch_score=batch_score
+        )
+        print(f"Search index recall@100 against the exact search: {metrics['search_recall_at_100']}")
+
     return metrics, query_metrics, top_100_results
\ No newline at end of file
@@ -1,21 +1,21 @@
 from __future__ import annotations
-import math
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Sequence, Union
 import torch
 from datasets import Dataset
-from tqdm import tqdm
+from vidore_benchmark.evaluation.encoding import encode_passages
 from vidore_benchmark.retrievers.vision_retriever import VisionRetriever
-from vidore_benchmark.utils.iter_utils import batched
+from vidore_benchmark.utils.ragged_utils import RaggedEmbeddings
 
 def indexing(
     vision_retriever: VisionRetriever,
-    ds: Dataset,
+    ds: Union[Dataset, Sequence[Dict[str, Any]]],
     batch_passage: int,
-) -> Dict[str, Optional[float]]:
+) -> Union[List[torch.Tensor], RaggedEmbeddings]:
     """
-    Evaluate the model on a given dataset using the MTEB metrics.
+    Compute the passage embeddings of a dataset, or of a list of pages (e.g. from `iter_jsonl_pages`), as a
+    `RaggedEmbeddings` if the retriever returns them.
 
-    NOTE: The dataset should contain the following columns:
+    NOTE: The dataset (or each page) should contain the following columns:
     - query: the query text
     - image_filename: the filename of the image
     - image: the image (PIL.Image) if `use_visual_embedding` is True
@@ -28,25 +28,14 @@ def indexing(
     print("passage_column_name ", passage_column_name)
     required_columns = ["query", passage_column_name, "image_filename"]
 
-    if not all(col in ds.column_names for col in required_columns):
+    column_names = ds.column_names if isinstance(ds, Dataset) else (ds[0].keys() if len(ds) > 0 else required_columns)
+    if not all(col in column_names for col in required_columns):
         raise ValueError(f"Dataset should contain the following columns: {required_columns}")
 
-    emb_passages: List[torch.Tensor] = []
-
-    dataloader_prebatch_size = 10 * batch_passage
-
-    for passage_batch in tqdm(
-        batched(ds, n=dataloader_prebatch_size),
-        desc="Dataloader pre-batching",
-        total=math.ceil(len(ds) / (dataloader_prebatch_size)),
-    ):
-        passages: List[Any] = [db[passage_column_name] for db in passage_batch]
-        batch_emb_passages = vision_retriever.forward_passages(passages, batch_size=batch_passage)
-        
-        if isinstance(batch_emb_passages, torch.Tensor):
-            batch_emb_passages = list(torch.unbind(batch_emb_passages))
-            emb_passages.extend(batch_emb_passages)
-        else:
-            emb_passages.extend(batch_emb_passages)
-
-    return emb_passages
\ No newline at end of file
+    # The batches are fetched and decoded, preprocessed, forwarded and packed concurrently (see `encode_passages`)
+    return encode_passages(
+        vision_retriever,
+        ds,
+        get_passage=lambda db: db[passage_column_name],
+        batch_passage=batch_passage,
+    )
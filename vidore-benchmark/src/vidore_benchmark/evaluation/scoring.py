@@ -1,21 +1,47 @@
-from typing import List, Union
+from typing import List, Tuple, Union
 
 import torch
 
+from vidore_benchmark.utils.ragged_utils import RaggedEmbeddings
 
-def score_multi_vector(
-    emb_queries: Union[torch.Tensor, List[torch.Tensor]],
-    emb_passages: Union[torch.Tensor, List[torch.Tensor]],
-    batch_size: int,
-) -> torch.Tensor:
-    """
-    Evaluate the similarity scores using the MaxSim scoring function.
+try:
+    from colpali_engine.utils.scoring_utils import merge_top_k
+except ImportError:
 
-    Inputs:
-        - emb_queries: List of query embeddings, each of shape (n_seq, emb_dim).
-        - emb_passages: List of document embeddings, each of shape (n_seq, emb_dim).
-        - batch_size: Batch size for the similarity computation.
-    """
+    def merge_top_k(
+        top_k_scores: torch.Tensor,
+        top_k_indices: torch.Tensor,
+        block_scores: torch.Tensor,
+        block_indices: torch.Tensor,
+        k: int,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Merge the scores of a new block of passages into the running top-k of each query. Fallback of
+        `colpali_engine.utils.scoring_utils.merge_top_k` when `colpali-engine` is not installed.
+        """
+        scores = torch.cat([top_k_scores, block_scores], dim=1)
+        if block_indices.dim() == 1:
+            block_indices = block_indices[None, :].expand(block_scores.shape[0], -1)
+        indices = torch.cat([top_k_indices, block_indices], dim=1)
+
+        top_k_scores, positions = scores.topk(min(k, scores.shape[1]), dim=1)
+        return top_k_scores, indices.gather(1, positions)
+
+
+def _pad_embeddings(embeddings: Union[List[torch.Tensor], RaggedEmbeddings]) -> torch.Tensor:
+    if isinstance(embeddings, RaggedEmbeddings):
+        return embeddings.to_padded()[0]
+    return torch.nn.utils.rnn.pad_sequence(embeddings, batch_first=True, padding_value=0)
+
+
+def _einsum_max_sim_scores(qs_batch: torch.Tensor, ps_batch: torch.Tensor, tile_size: int) -> torch.Tensor:
+    return torch.einsum("bnd,csd->bcns", qs_batch, ps_batch).max(dim=3)[0].sum(dim=2)
+
+
+def _check_embeddings(
+    emb_queries: Union[torch.Tensor, List[torch.Tensor], RaggedEmbeddings],
+    emb_passages: Union[torch.Tensor, List[torch.Tensor], RaggedEmbeddings],
+):
     if len(emb_queries) == 0:
         raise ValueError("No queries provided")
     if len(emb_passages) == 0:
@@ -27,23 +53,99 @@ def score_multi_vector(
     if emb_queries[0].dtype != emb_passages[0].dtype:
         raise ValueError("Queries and passages must have the same dtype")
 
+
+def _get_max_sim_scores():
+    try:
+        from colpali_engine.utils.scoring_utils import max_sim_scores
+    except ImportError:
+        max_sim_scores = _einsum_max_sim_scores
+    return max_sim_scores
+
+
+def score_multi_vector(
+    emb_queries: Union[torch.Tensor, List[torch.Tensor], RaggedEmbeddings],
+    emb_passages: Union[torch.Tensor, List[torch.Tensor], RaggedEmbeddings],
+    batch_size: int,
+    tile_size: int = 64,
+) -> torch.Tensor:
+    """
+    Evaluate the similarity scores using the MaxSim scoring function.
+
+    If `colpali-engine` is installed, the MaxSim is computed with its fused kernel, which never materializes the
+    (batch_size, batch_size, n_seq_query, n_seq_passage) similarity tensor. The memory footprint of a block thus
+    does not depend on the passage length, and larger `batch_size` values can be used. Otherwise, the similarity
+    tensor of each block is computed with `einsum`.
+
+    Inputs:
+        - emb_queries: List of query embeddings, each of shape (n_seq, emb_dim), or `RaggedEmbeddings`.
+        - emb_passages: List of document embeddings, each of shape (n_seq, emb_dim), or `RaggedEmbeddings`.
+        - batch_size: Batch size for the similarity computation.
+        - tile_size: Number of passage tokens processed at once by the fused MaxSim kernel (ignored without
+            `colpali-engine`).
+    """
+    max_sim_scores = _get_max_sim_scores()
+    _check_embeddings(emb_queries, emb_passages)
+
     scores: List[torch.Tensor] = []
 
     for i in range(0, len(emb_queries), batch_size):
         batch_scores = []
-        qs_batch = torch.nn.utils.rnn.pad_sequence(
-            emb_queries[i : i + batch_size],
-            batch_first=True,
-            padding_value=0,
-        )
+        qs_batch = _pad_embeddings(emb_queries[i : i + batch_size])
         for j in range(0, len(emb_passages), batch_size):
-            ps_batch = torch.nn.utils.rnn.pad_sequence(
-                emb_passages[j : j + batch_size],
-                batch_first=True,
-                padding_value=0,
-            )
-            batch_scores.append(torch.einsum("bnd,csd->bcns", qs_batch, ps_batch).max(dim=3)[0].sum(dim=2))
+            ps_batch = _pad_embeddings(emb_passages[j : j + batch_size])
+            batch_scores.append(max_sim_scores(qs_batch, ps_batch, tile_size=tile_size))
         batch_scores = torch.cat(batch_scores, dim=1)
         scores.append(batch_scores)
 
     return torch.cat(scores, dim=0)
+
+
+def score_multi_vector_top_k(
+    emb_queries: Union[torch.Tensor, List[torch.Tensor], RaggedEmbeddings],
+    emb_passages: Union[torch.Tensor, List[torch.Tensor], RaggedEmbeddings],
+    k: int,
+    batch_size: int,
+    tile_size: int = 64,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Top-k passages of each query by MaxSim score. Same scoring as `score_multi_vector`, but the scores of each
+    block of passages are merged into a running top-k per query (see `merge_top_k`), so that the memory footprint
+    is O(n_queries * k) instead of the dense (n_queries, n_passages) score matrix.
+
+    Inputs:
+        - emb_queries: List of query embeddings, each of shape (n_seq, emb_dim), or `RaggedEmbeddings`.
+        - emb_passages: List of document embeddings, each of shape (n_seq, emb_dim), or `RaggedEmbeddings`.
+        - k: Number of passages to keep per query.
+        - batch_size: Batch size for the similarity computation.
+        - tile_size: Number of passage tokens processed at once by the fused MaxSim kernel (ignored without
+            `colpali-engine`).
+
+    Output:
+        - top_k_indices, top_k_scores: tensors of shape (n_queries, min(k, n_passages)), sorted by decreasing score
+    """
+    if k < 1:
+        raise ValueError("`k` must be at least one")
+    max_sim_scores = _get_max_sim_scores()
+    _check_embeddings(emb_queries, emb_passages)
+
+    all_indices: List[torch.Tensor] = []
+    all_scores: List[torch.Tensor] = []
+
+    for i in range(0, len(emb_queries), batch_size):
+        qs_batch = _pad_embeddings(emb_queries[i : i + batch_size])
+        top_k_scores = torch.empty((len(qs_batch), 0), dtype=torch.float32)
+        top_k_indices = torch.empty((len(qs_batch), 0), dtype=torch.long)
+        for j in range(0, len(emb_passages), batch_size):
+            ps_batch = _pad_embeddings(emb_passages[j : j + batch_size])
+            block_scores = max_sim_scores(qs_batch, ps_batch, tile_size=tile_size)
+            top_k_scores, top_k_indices = merge_top_k(
+                top_k_scores,
+                top_k_indices,
+                block_scores.to(dtype=torch.float32, device="cpu"),
+                torch.arange(j, j + len(ps_batch)),
+                k,
+            )
+        all_indices.append(top_k_indices)
+        all_scores.append(top_k_scores)
+
+    return torch.cat(all_indices, dim=0), torch.cat(all_scores, dim=0)
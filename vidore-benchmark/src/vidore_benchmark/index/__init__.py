@@ -0,0 +1,10 @@
+from .ann_index import HNSWIndex, IVFFlatIndex, IVFPQIndex
+from .base_index import BaseSearchIndex, load_search_index, register_search_index
+from .incremental_index import IncrementalIndex
+from .kmeans import assign_to_centroids, kmeans
+from .matryoshka_index import MatryoshkaIndex, truncate_embeddings
+from .muvera_index import FixedDimensionalEncoder, MuveraIndex
+from .plaid_index import PLAIDIndex
+from .pq_index import PQIndex
+from .product_quantizer import ProductQuantizer
+from .utils import recall_at_k
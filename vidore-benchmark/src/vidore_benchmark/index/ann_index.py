@@ -0,0 +1,645 @@
+from __future__ import annotations
+
+import heapq
+import logging
+import math
+from abc import abstractmethod
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import torch
+
+from vidore_benchmark.index.base_index import BaseSearchIndex, register_search_index
+from vidore_benchmark.index.kmeans import assign_to_centroids, kmeans
+from vidore_benchmark.index.product_quantizer import ProductQuantizer
+from vidore_benchmark.index.utils import (
+    get_kept_mask,
+    lengths_to_offsets,
+    pad_top_k,
+    ragged_arange,
+    stack_vectors,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class BaseIVFIndex(BaseSearchIndex):
+    """
+    Base class of the inverted-file (IVF) indexes for single-vector retrievers.
+
+    The passage vectors are partitioned into `n_lists` k-means clusters. At query time, only the inverted lists of
+    the `n_probe` closest centroids of the query are scanned.
+    """
+
+    search_params = ("n_probe",)
+
+    def __init__(
+        self,
+        centroids: torch.Tensor,
+        list_offsets: torch.Tensor,
+        passage_ids: torch.Tensor,
+        n_probe: int = 8,
+    ):
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.passage_ids = passage_ids
+        self.n_probe = n_probe
+
+    @staticmethod
+    def build_inverted_lists(
+        vectors: torch.Tensor,
+        n_lists: Optional[int] = None,
+        n_iterations: int = 10,
+        max_training_points: Optional[int] = 1 << 18,
+        seed: int = 0,
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+        """
+        Cluster the vectors and sort them by inverted list.
+
+        Output:
+            - centroids: tensor of shape (n_lists, emb_dim)
+            - list_ids: int64 tensor of shape (n_vectors,), the inverted list of each vector
+            - list_offsets: int64 tensor of shape (n_lists + 1,)
+            - passage_ids: int64 tensor of shape (n_vectors,), the vector ids sorted by inverted list
+        """
+        if n_lists is None:
+            n_lists = max(1, round(4 * math.sqrt(len(vectors))))
+        n_lists = min(n_lists, len(vectors))
+
+        centroids = kmeans(
+            vectors,
+            n_lists,
+            n_iterations=n_iterations,
+            max_training_points=max_training_points,
+            seed=seed,
+        )
+        list_ids = assign_to_centroids(vectors, centroids)
+        list_offsets = torch.cat(
+            [torch.zeros(1, dtype=torch.long), torch.bincount(list_ids, minlength=n_lists).cumsum(0)]
+        )
+        passage_ids = torch.argsort(list_ids, stable=True)
+        return centroids, list_ids, list_offsets, passage_ids
+
+    def insert_into_lists(self, list_ids: torch.Tensor) -> torch.Tensor:
+        """
+        Insert new vectors, numbered after the indexed ones, into the inverted lists `list_ids`.
+
+        Output:
+            - order: int64 tensor, the new list order of the concatenation of the old (list-ordered) vectors and the
+                new vectors. The subclasses reorder their per-vector data with it.
+        """
+        old_list_ids = torch.repeat_interleave(torch.arange(len(self.centroids)), self.list_offsets.diff())
+        all_list_ids = torch.cat([old_list_ids, list_ids])
+        order = torch.argsort(all_list_ids, stable=True)
+
+        new_passage_ids = torch.arange(len(self), len(self) + len(list_ids))
+        self.passage_ids = torch.cat([self.passage_ids, new_passage_ids])[order]
+        self.list_offsets = lengths_to_offsets(torch.bincount(all_list_ids, minlength=len(self.centroids)))
+        return order
+
+    def remove_from_lists(self, passage_ids: Union[torch.Tensor, List[int]]) -> torch.Tensor:
+        """
+        Remove vectors from the inverted lists and renumber the remaining ones.
+
+        Output:
+            - kept_positions: boolean mask of the kept vectors, in the (old) list order. The subclasses filter their
+                per-vector data with it.
+        """
+        kept = get_kept_mask(len(self), passage_ids)
+        kept_positions = kept[self.passage_ids]
+
+        list_ids = torch.repeat_interleave(torch.arange(len(self.centroids)), self.list_offsets.diff())
+        self.list_offsets = lengths_to_offsets(torch.bincount(list_ids[kept_positions], minlength=len(self.centroids)))
+        self.passage_ids = (kept.cumsum(0) - 1)[self.passage_ids[kept_positions]]
+        return kept_positions
+
+    def probe(self, query: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Return the probed inverted lists of the query and the positions (in the list order) of their vectors.
+        """
+        probed = (self.centroids @ query).topk(min(self.n_probe, len(self.centroids))).indices
+        starts = self.list_offsets[probed]
+        lengths = self.list_offsets[probed + 1] - starts
+        return torch.repeat_interleave(probed, lengths), ragged_arange(starts, lengths)
+
+    @abstractmethod
+    def score_lists(self, query: torch.Tensor, list_ids: torch.Tensor, positions: torch.Tensor) -> torch.Tensor:
+        """
+        Scores of the vectors at `positions` (in the list order) of the probed lists `list_ids`.
+        """
+        pass
+
+    def search(
+        self,
+        query_embeddings: Union[torch.Tensor, List[torch.Tensor]],
+        k: int,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        all_indices: List[torch.Tensor] = []
+        all_scores: List[torch.Tensor] = []
+
+        for query in stack_vectors(query_embeddings):
+            list_ids, positions = self.probe(query)
+            scores = self.score_lists(query, list_ids, positions)
+            scores, top_k = scores.topk(min(k, len(scores)))
+            all_indices.append(self.passage_ids[positions[top_k]])
+            all_scores.append(scores)
+
+        return pad_top_k(all_indices, all_scores, k)
+
+    def __len__(self) -> int:
+        return len(self.passage_ids)
+
+
+@register_search_index("ivf_flat")
+class IVFFlatIndex(BaseIVFIndex):
+    """
+    IVF index that stores the full-precision (float16) vectors of each inverted list.
+    """
+
+    def __init__(self, vectors: torch.Tensor, **kwargs):
+        super().__init__(**kwargs)
+        self.vectors = vectors
+
+    @classmethod
+    def build(
+        cls,
+        passage_embeddings: Union[torch.Tensor, List[torch.Tensor]],
+        n_lists: Optional[int] = None,
+        n_iterations: int = 10,
+        seed: int = 0,
+        **search_kwargs,
+    ) -> IVFFlatIndex:
+        """
+        Inputs:
+            - passage_embeddings: single-vector passage embeddings, of shape (n_passages, emb_dim).
+            - n_lists: number of inverted lists. Defaults to 4 * sqrt(n_passages).
+            - n_iterations, seed: k-means parameters.
+            - search_kwargs: default search parameters (`n_probe`).
+        """
+        vectors = stack_vectors(passage_embeddings)
+        centroids, _, list_offsets, passage_ids = cls.build_inverted_lists(
+            vectors, n_lists=n_lists, n_iterations=n_iterations, seed=seed
+        )
+        return cls(
+            vectors=vectors[passage_ids].half(),
+            centroids=centroids,
+            list_offsets=list_offsets,
+            passage_ids=passage_ids,
+            **search_kwargs,
+        )
+
+    def score_lists(self, query: torch.Tensor, list_ids: torch.Tensor, positions: torch.Tensor) -> torch.Tensor:
+        return self.vectors[positions].float() @ query
+
+    def add(self, passage_embeddings: Union[torch.Tensor, List[torch.Tensor]]):
+        vectors = stack_vectors(passage_embeddings)
+        order = self.insert_into_lists(assign_to_centroids(vectors, self.centroids))
+        self.vectors = torch.cat([self.vectors, vectors.half()])[order]
+
+    def remove(self, passage_ids: Union[torch.Tensor, List[int]]):
+        self.vectors = self.vectors[self.remove_from_lists(passage_ids)]
+
+    def state_dict(self) -> Dict[str, Any]:
+        return {
+            "vectors": self.vectors,
+            "centroids": self.centroids,
+            "list_offsets": self.list_offsets,
+            "passage_ids": self.passage_ids,
+            "n_probe": self.n_probe,
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any], **kwargs) -> IVFFlatIndex:
+        return cls(**{**state, **kwargs})
+
+
+@register_search_index("ivf_pq")
+class IVFPQIndex(BaseIVFIndex):
+    """
+    IVF index that stores the product-quantized residuals (vector - centroid of its list) of each inverted list.
+
+    The score of a vector is `query · centroid + ADC(query, residual code)` (see `ProductQuantizer`).
+    """
+
+    def __init__(self, quantizer: ProductQuantizer, codes: torch.Tensor, **kwargs):
+        super().__init__(**kwargs)
+        self.quantizer = quantizer
+        self.codes = codes
+
+    @classmethod
+    def build(
+        cls,
+        passage_embeddings: Union[torch.Tensor, List[torch.Tensor]],
+        n_lists: Optional[int] = None,
+        n_subquantizers: int = 64,
+        n_bits: int = 8,
+        n_iterations: int = 10,
+        seed: int = 0,
+        **search_kwargs,
+    ) -> IVFPQIndex:
+        """
+        Inputs:
+            - passage_embeddings: single-vector passage embeddings, of shape (n_passages, emb_dim).
+            - n_lists: number of inverted lists. Defaults to 4 * sqrt(n_passages).
+            - n_subquantizers, n_bits: product quantizer parameters (see `ProductQuantizer.train`).
+            - n_iterations, seed: k-means parameters.
+            - search_kwargs: default search parameters (`n_probe`).
+        """
+        vectors = stack_vectors(passage_embeddings)
+        centroids, list_ids, list_offsets, passage_ids = cls.build_inverted_lists(
+            vectors, n_lists=n_lists, n_iterations=n_iterations, seed=seed
+        )
+        residuals = (vectors - centroids[list_ids])[passage_ids]
+        quantizer = ProductQuantizer.train(
+            residuals,
+            n_subquantizers=n_subquantizers,
+            n_bits=n_bits,
+            n_iterations=n_iterations,
+            seed=seed,
+        )
+        return cls(
+            quantizer=quantizer,
+            codes=quantizer.encode(residuals),
+            centroids=centroids,
+            list_offsets=list_offsets,
+            passage_ids=passage_ids,
+            **search_kwargs,
+        )
+
+    def score_lists(self, query: torch.Tensor, list_ids: torch.Tensor, positions: torch.Tensor) -> torch.Tensor:
+        lookup_tables = self.quantizer.compute_lookup_tables(query[None])
+        return self.centroids[list_ids] @ query + self.quantizer.score(lookup_tables, self.codes[positions])[0]
+
+    def add(self, passage_embeddings: Union[torch.Tensor, List[torch.Tensor]]):
+        vectors = stack_vectors(passage_embeddings)
+        list_ids = assign_to_centroids(vectors, self.centroids)
+        codes = self.quantizer.encode(vectors - self.centroids[list_ids])
+        order = self.insert_into_lists(list_ids)
+        self.codes = torch.cat([self.codes, codes])[order]
+
+    def remove(self, passage_ids: Union[torch.Tensor, List[int]]):
+        self.codes = self.codes[self.remove_from_lists(passage_ids)]
+
+    def state_dict(self) -> Dict[str, Any]:
+        return {
+            "quantizer": self.quantizer.get_config(),
+            "codes": self.codes,
+            "centroids": self.centroids,
+            "list_offsets": self.list_offsets,
+            "passage_ids": self.passage_ids,
+            "n_probe": self.n_probe,
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any], **kwargs) -> IVFPQIndex:
+        state = {**state, **kwargs}
+        state["quantizer"] = ProductQuantizer(**state["quantizer"])
+        return cls(**state)
+
+
+@register_search_index("hnsw")
+class HNSWIndex(BaseSearchIndex):
+    """
+    Hierarchical navigable small world (HNSW) graph index for single-vector retrievers, with the dot product as
+    similarity.
+
+    Each vector is inserted at a random level (exponentially decaying distribution), and is linked on every level
+    up to its own to at most `m` (2 * `m` on level 0) of the most similar neighbors found by a beam search of width
+    `ef_construction`, selected with the HNSW diversity heuristic (so that clustered data stays connected). At
+    query time, the graph is greedily descended from the entry point down to level 0, where a beam search of width
+    `ef_search` returns the top-k vectors.
+
+    Removed vectors are tombstoned: they stay in the graph to route the searches but are never returned, and the
+    neighbors linking to them are relinked to their live two-hop neighbors (see `_repair_neighbors`).
+
+    NOTE: The construction is a pure Python/NumPy loop over the vectors, it is meant for up to ~1e5 passages.
+    """
+
+    search_params = ("ef_search",)
+
+    def __init__(
+        self,
+        vectors: torch.Tensor,
+        neighbors: List[torch.Tensor],
+        entry_point: int,
+        ef_search: int = 64,
+        deleted: Optional[torch.Tensor] = None,
+    ):
+        """
+        Inputs:
+            - vectors: tensor of shape (n_nodes, emb_dim)
+            - neighbors: for each level, an int32 tensor of shape (n_nodes, max_degree) with the neighbor ids of
+                each vector, padded with -1
+            - entry_point: id of the entry vector, on the top level
+            - deleted: boolean tensor of shape (n_nodes,), the tombstoned vectors. Defaults to none.
+        """
+        self.vectors = vectors
+        self.entry_point = entry_point
+        self.ef_search = ef_search
+        self.m = neighbors[0].shape[1] // 2
+        self.deleted = deleted if deleted is not None else torch.zeros(len(vectors), dtype=torch.bool)
+
+        self._vectors = vectors.float().numpy()
+        # Per-level adjacency lists, updated in place by `add` and `remove`
+        self._graph = _unpad_graph(neighbors)
+
+    @classmethod
+    def build(
+        cls,
+        passage_embeddings: Union[torch.Tensor, List[torch.Tensor]],
+        m: int = 16,
+        ef_construction: int = 100,
+        seed: int = 0,
+        **search_kwargs,
+    ) -> HNSWIndex:
+        """
+        Inputs:
+            - passage_embeddings: single-vector passage embeddings, of shape (n_passages, emb_dim).
+            - m: number of neighbors of each vector on the upper levels (2 * m on level 0).
+            - ef_construction: beam width of the construction.
+            - seed: seed of the level sampling.
+            - search_kwargs: default search parameters (`ef_search`).
+        """
+        vectors = stack_vectors(passage_embeddings).numpy()
+        levels = _sample_levels(len(vectors), m, seed)
+
+        graph: List[List[List[int]]] = [[[] for _ in range(len(vectors))] for _ in range(levels.max() + 1)]
+        entry_point, _ = _insert_nodes(
+            vectors, graph, levels, range(1, len(vectors)), 0, levels[0], m=m, ef_construction=ef_construction
+        )
+        neighbors = _pad_graph(graph, m)
+
+        return cls(torch.from_numpy(vectors).half(), neighbors, entry_point, **search_kwargs)
+
+    @property
+    def neighbors(self) -> List[torch.Tensor]:
+        return _pad_graph(self._graph, self.m)
+
+    def search(
+        self,
+        query_embeddings: Union[torch.Tensor, List[torch.Tensor]],
+        k: int,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        all_indices: List[torch.Tensor] = []
+        all_scores: List[torch.Tensor] = []
+
+        deleted = self.deleted.numpy()
+        # Passage id of each live node, the tombstones being skipped
+        passage_ids = torch.from_numpy(np.cumsum(~deleted) - 1)
+
+        for query in stack_vectors(query_embeddings).numpy():
+            nearest = self.entry_point
+            for level in range(len(self._graph) - 1, 0, -1):
+                nearest = _greedy_search(self._vectors, self._graph[level], query, nearest)
+
+            candidates = _beam_search(
+                self._vectors, self._graph[0], query, [nearest], max(self.ef_search, k), deleted=deleted
+            )[:k]
+            all_indices.append(passage_ids[[node for _, node in candidates]].long())
+            all_scores.append(torch.tensor([-distance for distance, _ in candidates], dtype=torch.float32))
+
+        return pad_top_k(all_indices, all_scores, k)
+
+    def __len__(self) -> int:
+        return len(self.vectors) - int(self.deleted.sum())
+
+    def add(self, passage_embeddings: Union[torch.Tensor, List[torch.Tensor]], ef_construction: int = 100):
+        """
+        Insert new vectors into the graph, as in the construction. They are linked to live vectors only.
+        """
+        new_vectors = stack_vectors(passage_embeddings).numpy()
+        n_nodes = len(self.vectors)
+
+        levels = np.zeros(n_nodes + len(new_vectors), dtype=int)
+        levels[n_nodes:] = _sample_levels(len(new_vectors), self.m, seed=n_nodes)
+
+        for level_graph in self._graph:
+            level_graph.extend([] for _ in new_vectors)
+        top_level = len(self._graph) - 1
+        while len(self._graph) <= levels.max():
+            self._graph.append([[] for _ in range(len(levels))])
+
+        self.vectors = torch.cat([self.vectors, torch.from_numpy(new_vectors).half()])
+        self.deleted = torch.cat([self.deleted, torch.zeros(len(new_vectors), dtype=torch.bool)])
+        self._vectors = np.concatenate([self._vectors, new_vectors])
+
+        self.entry_point, _ = _insert_nodes(
+            self._vectors,
+            self._graph,
+            levels,
+            range(n_nodes, len(levels)),
+            self.entry_point,
+            top_level,
+            m=self.m,
+            ef_construction=ef_construction,
+            deleted=self.deleted.numpy(),
+        )
+
+    def remove(self, passage_ids: Union[torch.Tensor, List[int]]):
+        """
+        Tombstone vectors, and repair the links of their neighbors. The remaining passages are renumbered in order.
+        """
+        live_nodes = torch.nonzero(~self.deleted).flatten()
+        removed = live_nodes[~get_kept_mask(len(self), passage_ids)]
+        self.deleted[removed] = True
+        _repair_neighbors(self._vectors, self._graph, removed.tolist(), self.deleted.numpy(), self.m)
+
+    def state_dict(self) -> Dict[str, Any]:
+        return {
+            "vectors": self.vectors,
+            "neighbors": self.neighbors,
+            "entry_point": self.entry_point,
+            "ef_search": self.ef_search,
+            "deleted": self.deleted,
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any], **kwargs) -> HNSWIndex:
+        return cls(**{**state, **kwargs})
+
+
+def _sample_levels(n_nodes: int, m: int, seed: int) -> np.ndarray:
+    """
+    Random HNSW levels of the nodes, with an exponentially decaying distribution.
+    """
+    rng = np.random.default_rng(seed)
+    return np.floor(-np.log(1 - rng.random(n_nodes)) / math.log(m)).astype(int)
+
+
+def _insert_nodes(
+    vectors: np.ndarray,
+    graph: List[List[List[int]]],
+    levels: np.ndarray,
+    nodes: Sequence[int],
+    entry_point: int,
+    top_level: int,
+    m: int,
+    ef_construction: int,
+    deleted: Optional[np.ndarray] = None,
+) -> Tuple[int, int]:
+    """
+    Insert the nodes into the per-level adjacency lists `graph` (in place), and return the new entry point and
+    top level. The `deleted` nodes are traversed but never linked to.
+    """
+    for node in nodes:
+        query = vectors[node]
+        nearest = entry_point
+
+        for level in range(top_level, levels[node], -1):
+            nearest = _greedy_search(vectors, graph[level], query, nearest)
+
+        for level in range(min(levels[node], top_level), -1, -1):
+            candidates = _beam_search(vectors, graph[level], query, [nearest], ef_construction, deleted=deleted)
+            max_degree = 2 * m if level == 0 else m
+
+            graph[level][node] = _select_neighbors(vectors, query, [neighbor for _, neighbor in candidates], max_degree)
+            for neighbor in graph[level][node]:
+                links = graph[level][neighbor]
+                links.append(node)
+                if len(links) > max_degree:
+                    similarities = vectors[links] @ vectors[neighbor]
+                    links = [links[i] for i in np.argsort(-similarities)]
+                    graph[level][neighbor] = _select_neighbors(vectors, vectors[neighbor], links, max_degree)
+
+            if candidates:
+                nearest = candidates[0][1]
+
+        if levels[node] > top_level:
+            entry_point, top_level = node, levels[node]
+
+    return entry_point, top_level
+
+
+def _repair_neighbors(
+    vectors: np.ndarray,
+    graph: List[List[List[int]]],
+    removed: List[int],
+    deleted: np.ndarray,
+    m: int,
+):
+    """
+    Relink (in place) the live neighbors of the removed nodes: their links to tombstones are replaced by the live
+    neighbors of the removed nodes, selected with the HNSW heuristic. The removed nodes keep their own links, so
+    that the searches can still route through them.
+    """
+    for level, level_graph in enumerate(graph):
+        max_degree = 2 * m if level == 0 else m
+        for node in removed:
+            for neighbor in level_graph[node]:
+                if deleted[neighbor] or node not in level_graph[neighbor]:
+                    continue
+                candidates = {link for link in level_graph[neighbor] if not deleted[link]}
+                candidates.update(link for link in level_graph[node] if link != neighbor and not deleted[link])
+                candidates = list(candidates)
+                similarities = vectors[candidates] @ vectors[neighbor] if candidates else np.zeros(0)
+                candidates = [candidates[i] for i in np.argsort(-similarities)]
+                level_graph[neighbor] = _select_neighbors(vectors, vectors[neighbor], candidates, max_degree)
+
+
+def _pad_graph(graph: List[List[List[int]]], m: int) -> List[torch.Tensor]:
+    """
+    Convert the per-level adjacency lists into padded int32 tensors of shape (n_nodes, max_degree).
+    """
+    neighbors = []
+    for level, level_graph in enumerate(graph):
+        max_degree = 2 * m if level == 0 else m
+        level_neighbors = np.full((len(level_graph), max_degree), -1, dtype=np.int32)
+        for node, links in enumerate(level_graph):
+            level_neighbors[node, : len(links)] = links
+        neighbors.append(torch.from_numpy(level_neighbors))
+    return neighbors
+
+
+def _unpad_graph(neighbors: List[torch.Tensor]) -> List[List[List[int]]]:
+    """
+    Convert padded neighbor tensors (see `_pad_graph`) back into per-level adjacency lists.
+    """
+    return [
+        [[int(link) for link in links if link >= 0] for links in level_neighbors.tolist()]
+        for level_neighbors in neighbors
+    ]
+
+
+def _select_neighbors(vectors: np.ndarray, query: np.ndarray, candidates: List[int], max_degree: int) -> List[int]:
+    """
+    HNSW neighbor selection heuristic: a candidate (sorted by decreasing similarity to the query) is linked only if
+    it is more similar to the query than to all the already selected neighbors. The remaining slots are then
+    filled with the most similar discarded candidates.
+    """
+    if len(candidates) <= max_degree:
+        return list(candidates)
+
+    candidate_vectors = vectors[candidates]
+    similarities = candidate_vectors @ query
+    pairwise_similarities = candidate_vectors @ candidate_vectors.T
+
+    selected: List[int] = []
+    discarded: List[int] = []
+    for position in range(len(candidates)):
+        if len(selected) == max_degree:
+            break
+        if selected and pairwise_similarities[position, selected].max() > similarities[position]:
+            discarded.append(position)
+        else:
+            selected.append(position)
+
+    selected += discarded[: max_degree - len(selected)]
+    return [candidates[position] for position in selected]
+
+
+def _greedy_search(vectors: np.ndarray, graph, query: np.ndarray, node: int) -> int:
+    """
+    Follow the most similar neighbor until no neighbor is more similar to the query than the current node.
+    """
+    similarity = vectors[node] @ query
+    while True:
+        links = graph[node]
+        if len(links) == 0:
+            return node
+        similarities = vectors[links] @ query
+        best = int(np.argmax(similarities))
+        if similarities[best] <= similarity:
+            return node
+        node, similarity = int(links[best]), similarities[best]
+
+
+def _beam_search(
+    vectors: np.ndarray,
+    graph,
+    query: np.ndarray,
+    entry_points: List[int],
+    ef: int,
+    deleted: Optional[np.ndarray] = None,
+) -> List[Tuple[float, int]]:
+    """
+    HNSW layer search: return the (up to) `ef` nodes most similar to the query as (-similarity, node) pairs,
+    sorted by decreasing similarity. The `deleted` nodes are expanded but left out of the results.
+    """
+    visited = set(entry_points)
+    # Min-heap of the candidates to expand (by distance), and max-heap of the results (by negative distance)
+    candidates = [(-float(vectors[node] @ query), node) for node in entry_points]
+    heapq.heapify(candidates)
+    results = [(-distance, node) for distance, node in candidates if deleted is None or not deleted[node]]
+    heapq.heapify(results)
+
+    while candidates:
+        distance, node = heapq.heappop(candidates)
+        if len(results) >= ef and distance > -results[0][0]:
+            break
+
+        links = [link for link in graph[node] if link not in visited]
+        if not links:
+            continue
+        visited.update(links)
+
+        for link, similarity in zip(links, vectors[links] @ query):
+            link_distance = -float(similarity)
+            if len(results) < ef or link_distance < -results[0][0]:
+                heapq.heappush(candidates, (link_distance, int(link)))
+                if deleted is not None and deleted[link]:
+                    continue
+                heapq.heappush(results, (-link_distance, int(link)))
+                if len(results) > ef:
+                    heapq.heappop(results)
+
+    return sorted((-negative_distance, node) for negative_distance, node in results)
@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import logging
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Tuple, Type, Union
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+SEARCH_INDEX_REGISTRY: Dict[str, Type[BaseSearchIndex]] = {}
+
+
+def register_search_index(index_type: str):
+    def decorator(cls):
+        SEARCH_INDEX_REGISTRY[index_type] = cls
+        cls.index_type = index_type
+
+        logger.debug("Registered search index `%s`", index_type)
+
+        return cls
+
+    return decorator
+
+
+class BaseSearchIndex(ABC):
+    """
+    Abstract class for the passage-side search indexes.
+
+    A search index can be used in place of the passage embeddings in the evaluation functions: the top-k
+    passages of each query are then retrieved with `search` instead of the exhaustive `get_top_k`.
+
+    The indexes are saved as a `torch.save` dictionary of their state (see `state_dict`) tagged with their
+    registered `index_type`, so that `load_search_index` can load any of them.
+    """
+
+    index_type: str
+
+    # Whether the index needs the full-precision passage embeddings at search time (e.g. for an exact rerank)
+    requires_passage_embeddings: bool = False
+
+    # Keyword arguments of `load` that override the saved search parameters
+    search_params: Tuple[str, ...] = ()
+
+    @abstractmethod
+    def search(
+        self,
+        query_embeddings: Union[torch.Tensor, List[torch.Tensor]],
+        k: int,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Return the passage indices and the scores of the top-k passages of each query, both of shape
+        (n_queries, k) and sorted by decreasing score. When less than k passages are retrieved for a query,
+        the missing entries have the index -1 and the score -inf.
+        """
+        pass
+
+    @abstractmethod
+    def state_dict(self) -> Dict[str, Any]:
+        """
+        Return the tensors and the parameters needed to rebuild the index with `from_state`.
+        """
+        pass
+
+    @classmethod
+    @abstractmethod
+    def from_state(cls, state: Dict[str, Any], **kwargs) -> BaseSearchIndex:
+        """
+        Rebuild the index from `state`. The keyword arguments override the saved search parameters.
+        """
+        pass
+
+    @abstractmethod
+    def __len__(self) -> int:
+        """
+        Number of indexed passages.
+        """
+        pass
+
+    def add(self, passage_embeddings: Union[torch.Tensor, List[torch.Tensor]]):
+        """
+        Append new passages to the index, numbered after the indexed ones, without retraining it (the centroids,
+        quantizers and encoders are kept as-is).
+
+        NOTE: Override this method if the index supports incremental updates.
+        """
+        raise NotImplementedError(f"The `{self.index_type}` index does not support incremental updates")
+
+    def remove(self, passage_ids: Union[torch.Tensor, List[int]]):
+        """
+        Remove passages from the index. The remaining passages are renumbered in order, as if the removed passages
+        were deleted from the passage embeddings.
+
+        NOTE: Override this method if the index supports incremental updates.
+        """
+        raise NotImplementedError(f"The `{self.index_type}` index does not support incremental updates")
+
+    def save(self, path: str):
+        """
+        Save the index to `path`.
+        """
+        torch.save({"index_type": self.index_type, **self.state_dict()}, path)
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> BaseSearchIndex:
+        """
+        Load the index from `path`. The keyword arguments that are not `None` override the saved search parameters,
+        they must be in `search_params`.
+        """
+        kwargs = {key: value for key, value in kwargs.items() if value is not None}
+        unknown_params = [key for key in kwargs if key not in cls.search_params]
+        if unknown_params:
+            raise ValueError(
+                f"The `{cls.index_type}` index does not accept the search parameters {unknown_params}. "
+                f"Available parameters: {list(cls.search_params)}"
+            )
+
+        state = torch.load(path)
+        index_type = state.pop("index_type", cls.index_type)
+        if index_type != cls.index_type:
+            raise ValueError(f"`{path}` is a `{index_type}` index, not a `{cls.index_type}` index")
+        return cls.from_state(state, **kwargs)
+
+
+def load_search_index_class(path: str) -> Type[BaseSearchIndex]:
+    """
+    Get the class of the search index saved at `path`.
+    """
+    index_type = torch.load(path, mmap=True)["index_type"]
+    if index_type not in SEARCH_INDEX_REGISTRY:
+        raise ValueError(
+            f"Unknown search index `{index_type}`. Available indexes: {list(SEARCH_INDEX_REGISTRY.keys())}"
+        )
+    return SEARCH_INDEX_REGISTRY[index_type]
+
+
+def load_search_index(path: str, **kwargs) -> BaseSearchIndex:
+    """
+    Load a search index of any registered type. The keyword arguments that are not `None` override the saved
+    search parameters.
+    """
+    return load_search_index_class(path).load(path, **kwargs)
@@ -0,0 +1,312 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import shutil
+from typing import Dict, List, Optional, Sequence, Union
+
+import torch
+
+from vidore_benchmark.index.base_index import SEARCH_INDEX_REGISTRY, BaseSearchIndex, load_search_index
+from vidore_benchmark.utils.memmap_utils import (
+    MemmapEmbeddings,
+    MemmapIndexWriter,
+    load_doc_ids,
+    load_memmap_embeddings,
+    load_tombstones,
+    save_memmap_embeddings,
+    save_tombstones,
+)
+from vidore_benchmark.utils.ragged_utils import RaggedEmbeddings
+
+logger = logging.getLogger(__name__)
+
+
+def get_search_index_path(path: Union[str, os.PathLike], index_type: str) -> str:
+    """
+    Path of the `index_type` search index saved next to the passage embeddings `path` (a memmap index directory or
+    a `.pt` file, as saved by `build_index.py`), e.g. `<name>.plaid.pt`.
+    """
+    return f"{os.fspath(path).removesuffix('.pt')}.{index_type}.pt"
+
+
+def get_content_hashes_path(path: str) -> str:
+    """
+    Path of the content hashes of the passages of the memmap index `path` (see `IncrementalIndex.content_hashes`).
+    """
+    return f"{path}.content_hashes.json"
+
+
+def save_content_hashes(path: str, content_hashes: Dict[str, List[str]]):
+    """
+    Save the content hashes of the passages of the memmap index `path`, by doc id.
+    """
+    # Write then rename, so that a crash never leaves a truncated file
+    hashes_path = get_content_hashes_path(path)
+    with open(hashes_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(content_hashes, f)
+    os.replace(hashes_path + ".tmp", hashes_path)
+
+
+class IncrementalIndex:
+    """
+    Mutable passage index: a memmap index (see `MemmapIndexWriter`) whose passages are identified by stable doc
+    ids, along with the search indexes derived from it (`<path>.<index_type>.pt`, e.g. the PLAID or HNSW index of
+    `build_index.py`), which are kept in sync.
+
+    - `add` appends the new passages to the memmap index and to the search indexes, without retraining them: the
+        cost of an update is the encoding of the new pages only.
+    - `delete` marks the passages as deleted (tombstones). They are still searched, but `load_doc_ids` no longer
+        returns their ids, so that the evaluation skips them.
+    - `upsert` deletes the current version of the passages (if any) and adds the new one.
+    - `compact` rewrites the memmap index without the deleted passages and removes them from the search indexes.
+        It runs automatically once the deleted passages exceed `max_deleted_fraction` of the index.
+
+    The positions of the passages change on compaction, their doc ids never do.
+
+    `content_hashes` maps each doc id to the content hashes of its passages (see `hash_passage`), as given to `add`
+    and saved in `<path>.content_hashes.json`, so that `build_index.py --update` only re-embeds the changed pages.
+
+    The search indexes that rerank with the full-precision embeddings (`requires_passage_embeddings`, e.g. MUVERA)
+    are given the memory-mapped embeddings of the index, which are re-opened after each update.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_deleted_fraction: float = 0.2,
+        block_size: int = 1024,
+    ):
+        """
+        Inputs:
+            - path: memmap index directory, with doc ids
+            - max_deleted_fraction: fraction of deleted passages above which the index is compacted
+            - block_size: number of passages copied at once by the compaction
+        """
+        self.path = path
+        self.max_deleted_fraction = max_deleted_fraction
+        self.block_size = block_size
+
+        self._load()
+        self.content_hashes: Dict[str, List[str]] = {}
+        if os.path.exists(get_content_hashes_path(path)):
+            with open(get_content_hashes_path(path), "r", encoding="utf-8") as f:
+                content_hashes = json.load(f)
+            self.content_hashes = {
+                doc_id: hashes for doc_id, hashes in content_hashes.items() if doc_id in self.doc_id_to_positions
+            }
+
+        self.search_indexes: Dict[str, BaseSearchIndex] = {}
+        for index_type in SEARCH_INDEX_REGISTRY:
+            if os.path.exists(get_search_index_path(path, index_type)):
+                self.search_indexes[index_type] = load_search_index(get_search_index_path(path, index_type))
+        self._sync_search_indexes()
+        self._set_passage_embeddings(self.embeddings)
+
+    @classmethod
+    def create(
+        cls,
+        path: str,
+        passage_embeddings: Union[RaggedEmbeddings, torch.Tensor, List[torch.Tensor]],
+        doc_ids: Sequence[str],
+        search_indexes: Optional[Dict[str, BaseSearchIndex]] = None,
+        content_hashes: Optional[Sequence[Optional[str]]] = None,
+        **kwargs,
+    ) -> IncrementalIndex:
+        """
+        Save the passage embeddings, their search indexes and their content hashes as a new incremental index.
+        """
+        save_memmap_embeddings(passage_embeddings, path, doc_ids=doc_ids)
+        for index_type, search_index in (search_indexes or {}).items():
+            search_index.save(get_search_index_path(path, index_type))
+        if content_hashes is not None:
+            if len(content_hashes) != len(doc_ids):
+                raise ValueError(f"Got {len(content_hashes)} content hashes for {len(doc_ids)} passages")
+            hashes_by_doc_id: Dict[str, List[str]] = {}
+            for doc_id, content_hash in zip(doc_ids, content_hashes):
+                if content_hash is not None:
+                    hashes_by_doc_id.setdefault(str(doc_id), []).append(content_hash)
+            save_content_hashes(path, hashes_by_doc_id)
+        return cls(path, **kwargs)
+
+    def _load(self):
+        doc_ids = load_doc_ids(self.path, include_deleted=True)
+        if doc_ids is None:
+            raise ValueError(f"The memmap index `{self.path}` has no doc ids")
+
+        self.n_passages = len(doc_ids)
+        self.tombstones = set(load_tombstones(self.path))
+        # Several passages can share the same doc id (e.g. the same `image_filename`)
+        self.doc_id_to_positions: Dict[str, List[int]] = {}
+        for position, doc_id in enumerate(doc_ids):
+            if position not in self.tombstones:
+                self.doc_id_to_positions.setdefault(doc_id, []).append(position)
+
+    def _sync_search_indexes(self):
+        """
+        Catch up the search indexes that were not saved after the last `add` (e.g. after a crash).
+        """
+        for index_type, search_index in self.search_indexes.items():
+            if len(search_index) > self.n_passages:
+                raise ValueError(f"The `{index_type}` index has more passages than `{self.path}`, it must be rebuilt")
+            if len(search_index) < self.n_passages:
+                logger.warning(
+                    f"Adding {self.n_passages - len(search_index)} missing passages to the `{index_type}` index"
+                )
+                search_index.add(self.embeddings[len(search_index) :])
+                search_index.save(get_search_index_path(self.path, index_type))
+
+    def _set_passage_embeddings(self, embeddings: Optional[Union[MemmapEmbeddings, torch.Tensor]]):
+        """
+        Point the search indexes that require the passage embeddings to `embeddings`. They are detached (`None`)
+        while the search indexes are updated, as the memmap index is updated on its own.
+        """
+        for search_index in self.search_indexes.values():
+            if search_index.requires_passage_embeddings:
+                search_index.passage_embeddings = embeddings
+
+    def __len__(self) -> int:
+        """
+        Number of passages that are not deleted.
+        """
+        return self.n_passages - len(self.tombstones)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self.doc_id_to_positions
+
+    @property
+    def doc_ids(self) -> List[str]:
+        """
+        Ids of the passages that are not deleted.
+        """
+        return list(self.doc_id_to_positions.keys())
+
+    @property
+    def embeddings(self) -> Union[MemmapEmbeddings, torch.Tensor]:
+        """
+        Memory-mapped embeddings of all the passages, including the deleted ones that are not compacted yet.
+        """
+        return load_memmap_embeddings(self.path)
+
+    def save_search_indexes(self):
+        """
+        Save the search indexes next to the memmap index.
+        """
+        for index_type, search_index in self.search_indexes.items():
+            search_index.save(get_search_index_path(self.path, index_type))
+
+    def save(self):
+        """
+        Save the search indexes and the content hashes next to the memmap index.
+        """
+        self.save_search_indexes()
+        save_content_hashes(self.path, self.content_hashes)
+
+    def add(
+        self,
+        passage_embeddings: Union[RaggedEmbeddings, torch.Tensor, List[torch.Tensor]],
+        doc_ids: Sequence[str],
+        save: bool = True,
+        content_hashes: Optional[Sequence[Optional[str]]] = None,
+    ):
+        """
+        Append new passages to the index and to its search indexes. Use `upsert` to replace existing passages.
+
+        With `save=False`, the search indexes and the content hashes are only updated in memory: call `save` once
+        after a series of additions. If they are not saved, the search indexes catch up with the memmap index when
+        it is next opened, and the passages without a content hash are re-embedded by the next update.
+        """
+        if len(doc_ids) != len(passage_embeddings):
+            raise ValueError(f"Got {len(doc_ids)} doc ids for {len(passage_embeddings)} passages")
+        if content_hashes is not None and len(content_hashes) != len(doc_ids):
+            raise ValueError(f"Got {len(content_hashes)} content hashes for {len(doc_ids)} passages")
+        if len(doc_ids) == 0:
+            return
+
+        with MemmapIndexWriter(self.path, append=True) as writer:
+            writer.add(passage_embeddings, doc_ids)
+
+        self._set_passage_embeddings(None)
+        for search_index in self.search_indexes.values():
+            search_index.add(passage_embeddings)
+        self._set_passage_embeddings(self.embeddings)
+
+        for position, doc_id in enumerate(doc_ids, start=self.n_passages):
+            self.doc_id_to_positions.setdefault(str(doc_id), []).append(position)
+        self.n_passages += len(doc_ids)
+        for doc_id, content_hash in zip(doc_ids, content_hashes or []):
+            if content_hash is not None:
+                self.content_hashes.setdefault(str(doc_id), []).append(content_hash)
+
+        if save:
+            self.save()
+
+    def delete(self, doc_ids: Sequence[str], compact: bool = True):
+        """
+        Mark all the passages of the given doc ids as deleted, and compact the index if needed.
+        """
+        missing_doc_ids = [doc_id for doc_id in doc_ids if doc_id not in self.doc_id_to_positions]
+        if missing_doc_ids:
+            raise KeyError(f"Unknown doc ids: {missing_doc_ids[:10]}")
+
+        for doc_id in set(doc_ids):
+            self.tombstones.update(self.doc_id_to_positions.pop(doc_id))
+            self.content_hashes.pop(doc_id, None)
+        save_tombstones(self.path, sorted(self.tombstones))
+        save_content_hashes(self.path, self.content_hashes)
+
+        if compact and len(self.tombstones) > self.max_deleted_fraction * self.n_passages:
+            self.compact()
+
+    def upsert(
+        self,
+        passage_embeddings: Union[RaggedEmbeddings, torch.Tensor, List[torch.Tensor]],
+        doc_ids: Sequence[str],
+        save: bool = True,
+        content_hashes: Optional[Sequence[Optional[str]]] = None,
+    ):
+        """
+        Add the passages, replacing the current passages with the same doc ids. See `add` for `save` and
+        `content_hashes`.
+        """
+        existing_doc_ids = [doc_id for doc_id in set(doc_ids) if doc_id in self.doc_id_to_positions]
+        if existing_doc_ids:
+            self.delete(existing_doc_ids, compact=False)
+        self.add(passage_embeddings, doc_ids, save=save, content_hashes=content_hashes)
+
+        if len(self.tombstones) > self.max_deleted_fraction * self.n_passages:
+            self.compact()
+
+    def compact(self):
+        """
+        Rewrite the memmap index without the deleted passages, and remove them from the search indexes.
+        """
+        if not self.tombstones:
+            return
+
+        logger.info(f"Compacting `{self.path}`: removing {len(self.tombstones)} deleted passages")
+        kept_positions = sorted(set(range(self.n_passages)) - self.tombstones)
+        embeddings = self.embeddings
+        doc_ids = load_doc_ids(self.path, include_deleted=True)
+
+        # Copy the remaining passages block by block into a new index, then swap it with the current one
+        compacted_path = self.path + ".compact"
+        with MemmapIndexWriter(compacted_path) as writer:
+            for start in range(0, len(kept_positions), self.block_size):
+                block_positions = kept_positions[start : start + self.block_size]
+                writer.add(embeddings[torch.tensor(block_positions)], [doc_ids[idx] for idx in block_positions])
+        del embeddings
+
+        os.rename(self.path, self.path + ".old")
+        os.rename(compacted_path, self.path)
+        shutil.rmtree(self.path + ".old")
+
+        removed_ids = sorted(self.tombstones)
+        self._set_passage_embeddings(None)
+        for search_index in self.search_indexes.values():
+            search_index.remove(removed_ids)
+        self.save_search_indexes()
+
+        self._load()
+        self._set_passage_embeddings(self.embeddings)
@@ -0,0 +1,77 @@
+from typing import Optional
+
+import torch
+
+
+def assign_to_centroids(
+    embeddings: torch.Tensor,
+    centroids: torch.Tensor,
+    spherical: bool = True,
+    chunk_size: int = 1 << 14,
+) -> torch.Tensor:
+    """
+    Return the id of the most similar (largest dot product) centroid of each embedding, or of the closest
+    (smallest L2 distance) centroid if `spherical` is False.
+
+    Inputs:
+        - embeddings: tensor of shape (n_embeddings, emb_dim)
+        - centroids: tensor of shape (n_centroids, emb_dim)
+        - spherical: whether to use the dot product instead of the L2 distance
+    Output:
+        - codes: int64 tensor of shape (n_embeddings,)
+    """
+    # argmin ||x - c||² = argmax (x·c - ||c||² / 2)
+    bias = 0 if spherical else centroids.pow(2).sum(dim=1) / 2
+    codes = [
+        (embeddings[i : i + chunk_size] @ centroids.T - bias).argmax(dim=1)
+        for i in range(0, len(embeddings), chunk_size)
+    ]
+    return torch.cat(codes) if codes else torch.empty(0, dtype=torch.long)
+
+
+def kmeans(
+    embeddings: torch.Tensor,
+    n_centroids: int,
+    n_iterations: int = 10,
+    max_training_points: Optional[int] = None,
+    seed: int = 0,
+    spherical: bool = True,
+) -> torch.Tensor:
+    """
+    Spherical k-means: the embeddings are assigned to the centroid with the largest dot product, and the
+    centroids are the L2-normalized means of their assigned embeddings. With `spherical=False`, this is the
+    usual (L2) k-means.
+
+    Inputs:
+        - embeddings: float tensor of shape (n_embeddings, emb_dim)
+        - n_centroids: number of centroids
+        - n_iterations: number of Lloyd iterations
+        - max_training_points: if provided, the centroids are trained on a random sample of embeddings
+        - seed: seed of the initialization and of the sampling
+        - spherical: whether to run the spherical or the L2 k-means
+    Output:
+        - centroids: float32 tensor of shape (n_centroids, emb_dim)
+    """
+    if n_centroids < 1 or n_centroids > len(embeddings):
+        raise ValueError(f"`n_centroids` must be between 1 and the number of embeddings ({len(embeddings)})")
+
+    generator = torch.Generator().manual_seed(seed)
+    embeddings = embeddings.float()
+
+    if max_training_points is not None and len(embeddings) > max_training_points:
+        embeddings = embeddings[torch.randperm(len(embeddings), generator=generator)[:max_training_points]]
+
+    centroids = embeddings[torch.randperm(len(embeddings), generator=generator)[:n_centroids]].clone()
+
+    for _ in range(n_iterations):
+        codes = assign_to_centroids(embeddings, centroids, spherical=spherical)
+        sums = torch.zeros_like(centroids).index_add_(0, codes, embeddings)
+        counts = torch.bincount(codes, minlength=n_centroids)
+
+        # Empty clusters keep their previous centroid
+        non_empty = counts > 0
+        centroids[non_empty] = sums[non_empty] / counts[non_empty, None]
+        if spherical:
+            centroids = torch.nn.functional.normalize(centroids, dim=-1)
+
+    return centroids
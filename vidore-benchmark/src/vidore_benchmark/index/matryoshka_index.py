@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import logging
+from typing import Any, Dict, List, Sequence, Tuple, Union
+
+import torch
+
+from vidore_benchmark.evaluation.scoring import merge_top_k
+from vidore_benchmark.index.base_index import BaseSearchIndex, register_search_index
+from vidore_benchmark.index.utils import get_kept_mask, stack_vectors
+
+logger = logging.getLogger(__name__)
+
+
+def truncate_embeddings(embeddings: torch.Tensor, dimension: int) -> torch.Tensor:
+    """
+    Matryoshka (MRL) truncation: keep the first `dimension` dimensions and L2-normalize them again.
+    """
+    return torch.nn.functional.normalize(embeddings[..., :dimension].float(), p=2, dim=-1)
+
+
+@register_search_index("matryoshka")
+class MatryoshkaIndex(BaseSearchIndex):
+    """
+    Cascaded search over Matryoshka (MRL-trained) single-vector embeddings, e.g. the DSE embeddings.
+
+    The full vectors are stored, along with a contiguous copy of their normalized `dims[0]`-d prefixes. The whole
+    corpus is scanned with the low-dimensional prefixes only, then the `n_candidates[i]` best passages of stage `i`
+    are rescored at `dims[i + 1]` dimensions, the last stage giving the top-k. With the default 256 → 768 → 1536
+    cascade, the full-corpus scan reads 6x less memory than an exhaustive 1536-d search.
+    """
+
+    search_params = ("dims", "n_candidates", "block_size")
+
+    def __init__(
+        self,
+        passage_embeddings: torch.Tensor,
+        dims: Sequence[int] = (256, 768, 1536),
+        n_candidates: Sequence[int] = (1000, 200),
+        block_size: int = 65536,
+    ):
+        """
+        Inputs:
+            - passage_embeddings: full-dimension passage embeddings, of shape (n_passages, emb_dim)
+            - dims: increasing embedding dimensions of the stages
+            - n_candidates: number of candidates per query passed from each stage to the next, one per stage
+                except the last one
+            - block_size: number of passages scanned at once by the first stage
+        """
+        dims, n_candidates = list(dims), list(n_candidates)
+        if len(n_candidates) != len(dims) - 1:
+            raise ValueError("`n_candidates` must have one entry per stage except the last one")
+        if dims != sorted(set(dims)) or dims[-1] > passage_embeddings.shape[-1]:
+            raise ValueError(f"`dims` must be increasing and at most {passage_embeddings.shape[-1]}")
+
+        self.passage_embeddings = passage_embeddings
+        self.dims = dims
+        self.n_candidates = n_candidates
+        self.block_size = block_size
+
+        self.prefix_embeddings = truncate_embeddings(passage_embeddings, dims[0]).to(passage_embeddings.dtype)
+
+    @classmethod
+    def build(
+        cls,
+        passage_embeddings: Union[torch.Tensor, List[torch.Tensor]],
+        **search_kwargs,
+    ) -> MatryoshkaIndex:
+        """
+        Inputs:
+            - passage_embeddings: single-vector passage embeddings, of shape (n_passages, emb_dim).
+            - search_kwargs: default search parameters (`dims`, `n_candidates`, `block_size`).
+        """
+        if isinstance(passage_embeddings, list):
+            passage_embeddings = torch.stack(passage_embeddings)
+        if passage_embeddings.dim() != 2:
+            raise ValueError("The embeddings must be single vectors")
+        return cls(passage_embeddings, **search_kwargs)
+
+    def __len__(self) -> int:
+        return len(self.passage_embeddings)
+
+    def add(self, passage_embeddings: Union[torch.Tensor, List[torch.Tensor]]):
+        passage_embeddings = stack_vectors(passage_embeddings).to(self.passage_embeddings.dtype)
+        self.passage_embeddings = torch.cat([self.passage_embeddings, passage_embeddings])
+        self.prefix_embeddings = torch.cat(
+            [self.prefix_embeddings, truncate_embeddings(passage_embeddings, self.dims[0]).to(passage_embeddings.dtype)]
+        )
+
+    def remove(self, passage_ids: Union[torch.Tensor, List[int]]):
+        kept = get_kept_mask(len(self), passage_ids)
+        self.passage_embeddings = self.passage_embeddings[kept]
+        self.prefix_embeddings = self.prefix_embeddings[kept]
+
+    def search_prefix(
+        self,
+        query_embeddings: torch.Tensor,
+        k: int,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        First stage: top-k passages of each query at `dims[0]` dimensions, streamed over blocks of `block_size`
+        passages.
+        """
+        queries = truncate_embeddings(query_embeddings, self.dims[0])
+
+        top_k_scores = torch.empty((len(queries), 0), dtype=torch.float32)
+        top_k_indices = torch.empty((len(queries), 0), dtype=torch.long)
+
+        for start in range(0, len(self.prefix_embeddings), self.block_size):
+            block_scores = queries @ self.prefix_embeddings[start : start + self.block_size].float().T
+            block_indices = torch.arange(start, start + block_scores.shape[1])
+            top_k_scores, top_k_indices = merge_top_k(top_k_scores, top_k_indices, block_scores, block_indices, k)
+
+        return top_k_indices, top_k_scores
+
+    def search(
+        self,
+        query_embeddings: Union[torch.Tensor, List[torch.Tensor]],
+        k: int,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        query_embeddings = stack_vectors(query_embeddings)
+        stage_k = [max(k, n_candidates) for n_candidates in self.n_candidates] + [k]
+
+        candidates, scores = self.search_prefix(query_embeddings, stage_k[0])
+
+        for dimension, n_candidates in zip(self.dims[1:], stage_k[1:]):
+            queries = truncate_embeddings(query_embeddings, dimension)
+            candidate_embeddings = truncate_embeddings(self.passage_embeddings[candidates], dimension)
+            scores = torch.einsum("qd,qcd->qc", queries, candidate_embeddings)
+
+            scores, positions = scores.topk(min(n_candidates, scores.shape[1]), dim=1)
+            candidates = candidates.gather(1, positions)
+
+        return candidates, scores
+
+    def state_dict(self) -> Dict[str, Any]:
+        # NOTE: The prefix embeddings are derived from the full embeddings when loading
+        return {
+            "passage_embeddings": self.passage_embeddings,
+            "dims": self.dims,
+            "n_candidates": self.n_candidates,
+            "block_size": self.block_size,
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any], **kwargs) -> MatryoshkaIndex:
+        return cls(**{**state, **kwargs})
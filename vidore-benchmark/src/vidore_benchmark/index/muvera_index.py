@@ -0,0 +1,274 @@
+from __future__ import annotations
+
+import logging
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import torch
+
+from vidore_benchmark.evaluation.scoring import merge_top_k, score_multi_vector
+from vidore_benchmark.index.base_index import BaseSearchIndex, register_search_index
+from vidore_benchmark.index.utils import (
+    append_embeddings,
+    flatten_embeddings,
+    get_kept_mask,
+    pad_top_k,
+    select_embeddings,
+)
+
+logger = logging.getLogger(__name__)
+
+# Number of candidate passages padded and scored at once by the exact rerank
+RERANK_BATCH_SIZE = 128
+
+
+class FixedDimensionalEncoder:
+    """
+    MUVERA fixed-dimensional encodings (FDE) of multi-vector embeddings.
+
+    For each of the `n_repetitions` repetitions, the token space is split into 2^`n_simhash_bits` partitions by
+    SimHash (the signs of random Gaussian projections), and the tokens are projected to `projection_dim`
+    dimensions with a random ±1 matrix. A query FDE block is the sum of the query tokens of each partition,
+    and a passage FDE block is the mean of the passage tokens of each partition, so that the dot product of
+    the FDEs approximates the MaxSim. The empty passage partitions are filled with the passage token whose
+    SimHash is the closest (in Hamming distance) to the partition.
+
+    The FDE dimension is `n_repetitions * 2^n_simhash_bits * projection_dim`.
+    """
+
+    def __init__(
+        self,
+        embedding_dim: int,
+        n_simhash_bits: int = 4,
+        n_repetitions: int = 20,
+        projection_dim: Optional[int] = 32,
+        seed: int = 0,
+    ):
+        self.embedding_dim = embedding_dim
+        self.n_simhash_bits = n_simhash_bits
+        self.n_repetitions = n_repetitions
+        self.projection_dim = projection_dim or embedding_dim
+        self.seed = seed
+
+        generator = torch.Generator().manual_seed(seed)
+        self.simhash_projections = torch.randn(n_repetitions, embedding_dim, n_simhash_bits, generator=generator)
+
+        if projection_dim is None:
+            self.projections = None
+        else:
+            signs = torch.randint(0, 2, (n_repetitions, embedding_dim, projection_dim), generator=generator)
+            self.projections = (2 * signs - 1).float() / projection_dim**0.5
+
+    @property
+    def n_partitions(self) -> int:
+        return 1 << self.n_simhash_bits
+
+    @property
+    def fde_dim(self) -> int:
+        return self.n_repetitions * self.n_partitions * self.projection_dim
+
+    def get_config(self) -> Dict[str, Any]:
+        return {
+            "embedding_dim": self.embedding_dim,
+            "n_simhash_bits": self.n_simhash_bits,
+            "n_repetitions": self.n_repetitions,
+            "projection_dim": None if self.projections is None else self.projection_dim,
+            "seed": self.seed,
+        }
+
+    def encode(self, embeddings: Union[torch.Tensor, List[torch.Tensor]], is_query: bool) -> torch.Tensor:
+        """
+        Return the FDEs of the multi-vector embeddings.
+
+        Inputs:
+            - embeddings: list of embeddings, each of shape (n_seq, emb_dim). The all-zero padding rows are ignored.
+            - is_query: whether to build the query FDEs (partition sums) or the passage FDEs (partition means with
+                the empty partitions filled).
+        Output:
+            - fdes: float32 tensor of shape (n_embeddings, fde_dim)
+        """
+        tokens, offsets = flatten_embeddings(embeddings)
+        n_embeddings, n_partitions = len(offsets) - 1, self.n_partitions
+        embedding_ids = torch.repeat_interleave(torch.arange(n_embeddings), offsets.diff())
+        bit_weights = 1 << torch.arange(self.n_simhash_bits)
+
+        fdes = []
+        for repetition in range(self.n_repetitions):
+            bits = (tokens @ self.simhash_projections[repetition]) > 0
+            partition_ids = (bits.long() * bit_weights).sum(dim=1)
+            projected = tokens if self.projections is None else tokens @ self.projections[repetition]
+
+            segment_ids = embedding_ids * n_partitions + partition_ids
+            blocks = torch.zeros(n_embeddings * n_partitions, self.projection_dim).index_add_(0, segment_ids, projected)
+
+            if not is_query:
+                counts = torch.bincount(segment_ids, minlength=n_embeddings * n_partitions)
+                blocks /= counts.clamp_min(1)[:, None]
+
+                # Fill each empty partition with the passage token of closest SimHash
+                keys = _hamming_distances(partition_ids, self.n_simhash_bits) * len(tokens)
+                keys += torch.arange(len(tokens))[:, None]
+                closest = torch.full((n_embeddings, n_partitions), keys.max() + 1).scatter_reduce(
+                    0, embedding_ids[:, None].expand_as(keys), keys, reduce="amin"
+                )
+                closest = closest.flatten() % len(tokens)
+                empty = counts == 0
+                blocks[empty] = projected[closest[empty]]
+
+            fdes.append(blocks.view(n_embeddings, -1))
+
+        return torch.cat(fdes, dim=1)
+
+
+def _hamming_distances(partition_ids: torch.Tensor, n_bits: int) -> torch.Tensor:
+    """
+    Hamming distances between the partition id of each token and all the partition ids, of shape (n_tokens, 2^n_bits).
+    """
+    xor = partition_ids[:, None] ^ torch.arange(1 << n_bits)
+    return sum((xor >> bit) & 1 for bit in range(n_bits))
+
+
+@register_search_index("muvera")
+class MuveraIndex(BaseSearchIndex):
+    """
+    MUVERA first-stage index for multi-vector retrievers (ColPali, ColQwen2).
+
+    Each passage is stored as a single FDE vector (see `FixedDimensionalEncoder`). At query time, the query FDE
+    is scored against all the passage FDEs with a single matrix product, and the `n_candidates` best passages are
+    reranked with the exact MaxSim over the full-precision `passage_embeddings`. Without `passage_embeddings`,
+    the approximate FDE scores are returned, with a warning.
+    """
+
+    requires_passage_embeddings = True
+    search_params = ("passage_embeddings", "n_candidates", "block_size")
+
+    def __init__(
+        self,
+        encoder: FixedDimensionalEncoder,
+        passage_fdes: torch.Tensor,
+        passage_embeddings: Optional[Union[torch.Tensor, List[torch.Tensor]]] = None,
+        n_candidates: int = 256,
+        block_size: int = 16384,
+    ):
+        self.encoder = encoder
+        self.passage_fdes = passage_fdes
+        self.passage_embeddings = passage_embeddings
+        self.n_candidates = n_candidates
+        self.block_size = block_size
+
+    @classmethod
+    def build(
+        cls,
+        passage_embeddings: Union[torch.Tensor, List[torch.Tensor]],
+        n_simhash_bits: int = 4,
+        n_repetitions: int = 20,
+        projection_dim: Optional[int] = 32,
+        seed: int = 0,
+        batch_size: int = 1024,
+        **search_kwargs,
+    ) -> MuveraIndex:
+        """
+        Encode the passage embeddings (e.g. the `build_index.py` output) into FDEs, stored in float16.
+
+        Inputs:
+            - passage_embeddings: list of passage embeddings, each of shape (n_seq, emb_dim).
+            - n_simhash_bits, n_repetitions, projection_dim, seed: see `FixedDimensionalEncoder`.
+            - batch_size: number of passages encoded at once.
+            - search_kwargs: default search parameters (`n_candidates`, `block_size`).
+        """
+        encoder = FixedDimensionalEncoder(
+            embedding_dim=passage_embeddings[0].shape[-1],
+            n_simhash_bits=n_simhash_bits,
+            n_repetitions=n_repetitions,
+            projection_dim=projection_dim,
+            seed=seed,
+        )
+        logger.info(f"Building a MUVERA index with {encoder.fde_dim}-d FDEs")
+
+        passage_fdes = torch.cat(
+            [
+                encoder.encode(passage_embeddings[i : i + batch_size], is_query=False).half()
+                for i in range(0, len(passage_embeddings), batch_size)
+            ]
+        )
+        return cls(encoder, passage_fdes, passage_embeddings=passage_embeddings, **search_kwargs)
+
+    def __len__(self) -> int:
+        return len(self.passage_fdes)
+
+    def add(self, passage_embeddings: Union[torch.Tensor, List[torch.Tensor]], batch_size: int = 1024):
+        passage_fdes = [
+            self.encoder.encode(passage_embeddings[i : i + batch_size], is_query=False).half()
+            for i in range(0, len(passage_embeddings), batch_size)
+        ]
+        self.passage_fdes = torch.cat([self.passage_fdes, *passage_fdes])
+        if self.passage_embeddings is not None:
+            self.passage_embeddings = append_embeddings(self.passage_embeddings, passage_embeddings)
+
+    def remove(self, passage_ids: Union[torch.Tensor, List[int]]):
+        kept = get_kept_mask(len(self), passage_ids)
+        self.passage_fdes = self.passage_fdes[kept]
+        if self.passage_embeddings is not None:
+            self.passage_embeddings = select_embeddings(self.passage_embeddings, kept)
+
+    def search_fde(
+        self, query_embeddings: Union[torch.Tensor, List[torch.Tensor]], k: int
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        First stage: top-k passages of each query by FDE dot product, streamed over blocks of `block_size` passages.
+        """
+        query_fdes = self.encoder.encode(query_embeddings, is_query=True)
+
+        top_k_scores = torch.empty((len(query_fdes), 0), dtype=torch.float32)
+        top_k_indices = torch.empty((len(query_fdes), 0), dtype=torch.long)
+
+        for start in range(0, len(self.passage_fdes), self.block_size):
+            block_scores = query_fdes @ self.passage_fdes[start : start + self.block_size].float().T
+            block_indices = torch.arange(start, start + block_scores.shape[1])
+            top_k_scores, top_k_indices = merge_top_k(top_k_scores, top_k_indices, block_scores, block_indices, k)
+
+        return top_k_indices, top_k_scores
+
+    def search(
+        self,
+        query_embeddings: Union[torch.Tensor, List[torch.Tensor]],
+        k: int,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        if self.passage_embeddings is None:
+            logger.warning(
+                "The MUVERA index has no `passage_embeddings`: returning the FDE scores without the exact MaxSim "
+                "rerank, which lowers the retrieval quality"
+            )
+            return self.search_fde(query_embeddings, k)
+
+        candidates, _ = self.search_fde(query_embeddings, max(k, self.n_candidates))
+
+        all_indices: List[torch.Tensor] = []
+        all_scores: List[torch.Tensor] = []
+
+        for query_embedding, passage_ids in zip(query_embeddings, candidates):
+            scores = score_multi_vector(
+                [query_embedding.float()],
+                [self.passage_embeddings[idx].float() for idx in passage_ids.tolist()],
+                batch_size=RERANK_BATCH_SIZE,
+            )[0]
+            scores, positions = scores.topk(min(k, len(scores)))
+            all_indices.append(passage_ids[positions])
+            all_scores.append(scores)
+
+        return pad_top_k(all_indices, all_scores, k)
+
+    def state_dict(self) -> Dict[str, Any]:
+        # NOTE: The passage embeddings are not saved, they are passed back to `load` (they are already saved by
+        # `build_index.py`).
+        return {
+            "encoder": self.encoder.get_config(),
+            "passage_fdes": self.passage_fdes,
+            "n_candidates": self.n_candidates,
+            "block_size": self.block_size,
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any], **kwargs) -> MuveraIndex:
+        state = {**state, **kwargs}
+        state["encoder"] = FixedDimensionalEncoder(**state["encoder"])
+        return cls(**state)
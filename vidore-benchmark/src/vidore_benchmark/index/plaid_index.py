@@ -0,0 +1,376 @@
+from __future__ import annotations
+
+import logging
+import math
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import torch
+
+from vidore_benchmark.index.base_index import BaseSearchIndex, register_search_index
+from vidore_benchmark.index.kmeans import assign_to_centroids, kmeans
+from vidore_benchmark.index.utils import (
+    flatten_embeddings,
+    get_kept_mask,
+    lengths_to_offsets,
+    pad_top_k,
+    ragged_arange,
+    score_max_sim,
+    segment_max_sum,
+    strip_padding,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def pack_bits(codes: torch.Tensor, n_bits: int) -> torch.Tensor:
+    """
+    Pack the `n_bits`-bit codes of shape (n, dim) into uint8 bytes of shape (n, dim * n_bits // 8).
+    """
+    values_per_byte = 8 // n_bits
+    shifts = torch.arange(values_per_byte - 1, -1, -1, dtype=torch.uint8) * n_bits
+    codes = codes.to(torch.uint8).view(codes.shape[0], -1, values_per_byte)
+    return (codes << shifts).sum(dim=-1, dtype=torch.uint8)
+
+
+def unpack_bits(packed: torch.Tensor, n_bits: int) -> torch.Tensor:
+    """
+    Inverse of `pack_bits`: return the int64 codes of shape (n, dim).
+    """
+    values_per_byte = 8 // n_bits
+    shifts = torch.arange(values_per_byte - 1, -1, -1, dtype=torch.uint8) * n_bits
+    codes = (packed[..., None] >> shifts) & ((1 << n_bits) - 1)
+    return codes.flatten(start_dim=-2).long()
+
+
+def get_passage_centroid_pairs(
+    codes: torch.Tensor,
+    doc_offsets: torch.Tensor,
+    n_centroids: int,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Distinct (passage id, centroid id) pairs of the tokens, sorted by passage id then centroid id.
+    """
+    passage_ids = torch.repeat_interleave(torch.arange(len(doc_offsets) - 1), doc_offsets.diff())
+    pairs = torch.unique(passage_ids * n_centroids + codes)
+    return pairs // n_centroids, pairs % n_centroids
+
+
+def build_inverted_lists(
+    pair_passage_ids: torch.Tensor,
+    pair_centroid_ids: torch.Tensor,
+    n_centroids: int,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Inverted lists from each centroid to the passages that contain it.
+
+    Output:
+        - ivf_passage_ids: int32 tensor of the passage ids, sorted by centroid
+        - ivf_offsets: int64 tensor of shape (n_centroids + 1,)
+    """
+    ivf_offsets = lengths_to_offsets(torch.bincount(pair_centroid_ids, minlength=n_centroids))
+    ivf_passage_ids = pair_passage_ids[torch.argsort(pair_centroid_ids, stable=True)]
+    return ivf_passage_ids.to(torch.int32), ivf_offsets
+
+
+@register_search_index("plaid")
+class PLAIDIndex(BaseSearchIndex):
+    """
+    PLAID / ColBERTv2-style centroid index for late-interaction retrieval.
+
+    All the passage tokens are clustered with k-means. Each token is stored as its centroid id plus its residual
+    to the centroid, compressed to `n_bits` per dimension with quantile buckets. The index also keeps, for each
+    passage, the set of distinct centroids of its tokens, and the inverted lists from each centroid to the
+    passages that contain it.
+
+    At query time:
+    1. candidate generation: the passages in the inverted lists of the `n_probe` closest centroids of each query
+        token are retrieved.
+    2. centroid interaction: the candidates are scored with an approximate MaxSim in which every passage token is
+        replaced by its centroid. The centroids whose best query-token similarity is below
+        `centroid_score_threshold` are pruned. Only the `n_candidates` best candidates survive.
+    3. the survivors are scored with the MaxSim over their decompressed token embeddings (or over the
+        full-precision embeddings passed to `search`), and the top-k passages are returned.
+    """
+
+    search_params = ("n_probe", "n_candidates", "centroid_score_threshold")
+
+    def __init__(
+        self,
+        centroids: torch.Tensor,
+        codes: torch.Tensor,
+        residuals: torch.Tensor,
+        doc_offsets: torch.Tensor,
+        bucket_cutoffs: torch.Tensor,
+        bucket_weights: torch.Tensor,
+        passage_centroid_ids: torch.Tensor,
+        passage_centroid_offsets: torch.Tensor,
+        ivf_passage_ids: torch.Tensor,
+        ivf_offsets: torch.Tensor,
+        n_bits: int = 2,
+        n_probe: int = 2,
+        n_candidates: int = 256,
+        centroid_score_threshold: Optional[float] = 0.45,
+    ):
+        self.centroids = centroids
+        self.codes = codes
+        self.residuals = residuals
+        self.doc_offsets = doc_offsets
+        self.bucket_cutoffs = bucket_cutoffs
+        self.bucket_weights = bucket_weights
+        self.passage_centroid_ids = passage_centroid_ids
+        self.passage_centroid_offsets = passage_centroid_offsets
+        self.ivf_passage_ids = ivf_passage_ids
+        self.ivf_offsets = ivf_offsets
+        self.n_bits = n_bits
+
+        # Search parameters
+        self.n_probe = n_probe
+        self.n_candidates = n_candidates
+        self.centroid_score_threshold = centroid_score_threshold
+
+    @classmethod
+    def build(
+        cls,
+        passage_embeddings: Union[torch.Tensor, List[torch.Tensor]],
+        n_centroids: Optional[int] = None,
+        n_bits: int = 2,
+        n_iterations: int = 10,
+        max_training_points: Optional[int] = 1 << 18,
+        seed: int = 0,
+        **search_kwargs,
+    ) -> PLAIDIndex:
+        """
+        Build the index from the multi-vector passage embeddings (e.g. the `build_index.py` output).
+
+        Inputs:
+            - passage_embeddings: list of L2-normalized passage embeddings, each of shape (n_seq, emb_dim). The
+                all-zero padding rows are ignored.
+            - n_centroids: number of k-means centroids. Defaults to the power of 2 closest to
+                16 * sqrt(n_tokens), as in ColBERTv2.
+            - n_bits: number of bits per dimension of the compressed residuals (1, 2, 4 or 8).
+            - n_iterations: number of k-means iterations.
+            - max_training_points: number of tokens sampled to train the k-means and the residual buckets.
+            - seed: seed of the k-means.
+            - search_kwargs: default search parameters (`n_probe`, `n_candidates`, `centroid_score_threshold`).
+        """
+        if n_bits not in (1, 2, 4, 8):
+            raise ValueError("`n_bits` must be 1, 2, 4 or 8")
+
+        tokens, doc_offsets = flatten_embeddings(passage_embeddings)
+        n_tokens, embedding_dim = tokens.shape
+        n_passages = len(doc_offsets) - 1
+
+        if (embedding_dim * n_bits) % 8 != 0:
+            raise ValueError("`emb_dim * n_bits` must be a multiple of 8")
+
+        if n_centroids is None:
+            n_centroids = 2 ** round(math.log2(16 * math.sqrt(n_tokens)))
+        n_centroids = min(n_centroids, n_tokens)
+
+        logger.info(f"Building a PLAID index with {n_centroids} centroids over {n_tokens} tokens")
+
+        centroids = kmeans(
+            tokens,
+            n_centroids,
+            n_iterations=n_iterations,
+            max_training_points=max_training_points,
+            seed=seed,
+        )
+        codes = assign_to_centroids(tokens, centroids)
+
+        # Quantile buckets of the residuals, shared by all the dimensions
+        residuals = tokens - centroids[codes]
+        generator = torch.Generator().manual_seed(seed)
+        sample = residuals[torch.randperm(n_tokens, generator=generator)[: max_training_points or n_tokens]]
+        sample = sample.flatten()[: 1 << 24]  # `torch.quantile` input size limit
+        n_buckets = 1 << n_bits
+        bucket_cutoffs = torch.quantile(sample, torch.arange(1, n_buckets) / n_buckets)
+        bucket_weights = torch.quantile(sample, (torch.arange(n_buckets) + 0.5) / n_buckets)
+        residual_codes = pack_bits(torch.bucketize(residuals, bucket_cutoffs), n_bits)
+
+        # Distinct centroids of each passage, and the inverted lists from each centroid to its passages
+        pair_passage_ids, pair_centroid_ids = get_passage_centroid_pairs(codes, doc_offsets, n_centroids)
+        ivf_passage_ids, ivf_offsets = build_inverted_lists(pair_passage_ids, pair_centroid_ids, n_centroids)
+
+        return cls(
+            centroids=centroids,
+            codes=codes.to(torch.int32),
+            residuals=residual_codes,
+            doc_offsets=doc_offsets,
+            bucket_cutoffs=bucket_cutoffs,
+            bucket_weights=bucket_weights,
+            passage_centroid_ids=pair_centroid_ids.to(torch.int32),
+            passage_centroid_offsets=lengths_to_offsets(torch.bincount(pair_passage_ids, minlength=n_passages)),
+            ivf_passage_ids=ivf_passage_ids,
+            ivf_offsets=ivf_offsets,
+            n_bits=n_bits,
+            **search_kwargs,
+        )
+
+    def __len__(self) -> int:
+        return len(self.doc_offsets) - 1
+
+    def get_ivf_centroid_ids(self) -> torch.Tensor:
+        """
+        Centroid id of each entry of the inverted lists.
+        """
+        return torch.repeat_interleave(torch.arange(len(self.centroids)), self.ivf_offsets.diff())
+
+    def add(self, passage_embeddings: Union[torch.Tensor, List[torch.Tensor]]):
+        """
+        Append new passages: their tokens are assigned to the existing centroids, their residuals are compressed
+        with the existing buckets, and they are inserted into the inverted lists.
+        """
+        tokens, doc_offsets = flatten_embeddings(passage_embeddings)
+        n_passages, n_centroids = len(doc_offsets) - 1, len(self.centroids)
+
+        codes = assign_to_centroids(tokens, self.centroids)
+        residuals = pack_bits(torch.bucketize(tokens - self.centroids[codes], self.bucket_cutoffs), self.n_bits)
+        pair_passage_ids, pair_centroid_ids = get_passage_centroid_pairs(codes, doc_offsets, n_centroids)
+
+        self.ivf_passage_ids, self.ivf_offsets = build_inverted_lists(
+            torch.cat([self.ivf_passage_ids.long(), pair_passage_ids + len(self)]),
+            torch.cat([self.get_ivf_centroid_ids(), pair_centroid_ids]),
+            n_centroids,
+        )
+        self.codes = torch.cat([self.codes, codes.to(torch.int32)])
+        self.residuals = torch.cat([self.residuals, residuals])
+        self.doc_offsets = torch.cat([self.doc_offsets, doc_offsets[1:] + self.doc_offsets[-1]])
+        self.passage_centroid_ids = torch.cat([self.passage_centroid_ids, pair_centroid_ids.to(torch.int32)])
+        self.passage_centroid_offsets = torch.cat(
+            [
+                self.passage_centroid_offsets,
+                torch.bincount(pair_passage_ids, minlength=n_passages).cumsum(0) + self.passage_centroid_offsets[-1],
+            ]
+        )
+
+    def remove(self, passage_ids: Union[torch.Tensor, List[int]]):
+        kept = get_kept_mask(len(self), passage_ids)
+        new_ids = kept.cumsum(0) - 1
+
+        doc_lengths = self.doc_offsets.diff()
+        kept_tokens = torch.repeat_interleave(kept, doc_lengths)
+        self.codes, self.residuals = self.codes[kept_tokens], self.residuals[kept_tokens]
+        self.doc_offsets = lengths_to_offsets(doc_lengths[kept])
+
+        pair_lengths = self.passage_centroid_offsets.diff()
+        self.passage_centroid_ids = self.passage_centroid_ids[torch.repeat_interleave(kept, pair_lengths)]
+        self.passage_centroid_offsets = lengths_to_offsets(pair_lengths[kept])
+
+        ivf_passage_ids = self.ivf_passage_ids.long()
+        kept_entries = kept[ivf_passage_ids]
+        self.ivf_passage_ids = new_ids[ivf_passage_ids[kept_entries]].to(torch.int32)
+        self.ivf_offsets = lengths_to_offsets(
+            torch.bincount(self.get_ivf_centroid_ids()[kept_entries], minlength=len(self.centroids))
+        )
+
+    def decompress(self, token_ids: torch.Tensor) -> torch.Tensor:
+        """
+        Return the (L2-normalized) decompressed embeddings of the given tokens: centroid + bucketed residual.
+        """
+        residuals = self.bucket_weights[unpack_bits(self.residuals[token_ids], self.n_bits)]
+        embeddings = self.centroids[self.codes[token_ids].long()] + residuals
+        return torch.nn.functional.normalize(embeddings, dim=-1)
+
+    def get_candidates(self, centroid_scores: torch.Tensor) -> torch.Tensor:
+        """
+        Return the ids of the passages in the inverted lists of the `n_probe` closest centroids of each query token.
+        """
+        n_probe = min(self.n_probe, centroid_scores.shape[1])
+        probed = centroid_scores.topk(n_probe, dim=1).indices.unique()
+        starts = self.ivf_offsets[probed]
+        lengths = self.ivf_offsets[probed + 1] - starts
+        return self.ivf_passage_ids[ragged_arange(starts, lengths)].long().unique()
+
+    def score_centroid_interaction(self, centroid_scores: torch.Tensor, passage_ids: torch.Tensor) -> torch.Tensor:
+        """
+        Approximate MaxSim of the given passages, in which every passage token is replaced by its centroid and the
+        centroids below `centroid_score_threshold` are pruned.
+        """
+        starts = self.passage_centroid_offsets[passage_ids]
+        lengths = self.passage_centroid_offsets[passage_ids + 1] - starts
+        centroid_ids = self.passage_centroid_ids[ragged_arange(starts, lengths)].long()
+        segment_ids = torch.repeat_interleave(torch.arange(len(passage_ids)), lengths)
+
+        if self.centroid_score_threshold is not None:
+            kept = centroid_scores.max(dim=0).values[centroid_ids] >= self.centroid_score_threshold
+            centroid_ids, segment_ids = centroid_ids[kept], segment_ids[kept]
+
+        return segment_max_sum(centroid_scores[:, centroid_ids], segment_ids, len(passage_ids))
+
+    def score_exact(
+        self,
+        query_embedding: torch.Tensor,
+        passage_ids: torch.Tensor,
+        passage_embeddings: Optional[Union[torch.Tensor, List[torch.Tensor]]] = None,
+    ) -> torch.Tensor:
+        """
+        MaxSim of the given passages over their decompressed token embeddings, or over `passage_embeddings` if
+        provided.
+        """
+        if passage_embeddings is not None:
+            return score_max_sim(query_embedding, [passage_embeddings[idx] for idx in passage_ids.tolist()])
+
+        starts = self.doc_offsets[passage_ids]
+        lengths = self.doc_offsets[passage_ids + 1] - starts
+        embeddings = self.decompress(ragged_arange(starts, lengths))
+
+        segment_ids = torch.repeat_interleave(torch.arange(len(passage_ids)), lengths)
+        return segment_max_sum(query_embedding @ embeddings.T, segment_ids, len(passage_ids))
+
+    def search(
+        self,
+        query_embeddings: Union[torch.Tensor, List[torch.Tensor]],
+        k: int,
+        passage_embeddings: Optional[Union[torch.Tensor, List[torch.Tensor]]] = None,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Retrieve the top-k passages of each query (see the class docstring).
+
+        Inputs:
+            - query_embeddings: list of query embeddings, each of shape (n_seq, emb_dim).
+            - k: number of passages to retrieve per query.
+            - passage_embeddings: optional full-precision passage embeddings used to score the survivors.
+        Output:
+            - top_k_indices, top_k_scores: tensors of shape (n_queries, k), see `BaseSearchIndex.search`.
+        """
+        all_indices: List[torch.Tensor] = []
+        all_scores: List[torch.Tensor] = []
+
+        for query_embedding in query_embeddings:
+            query_embedding = strip_padding(query_embedding).float()
+            centroid_scores = query_embedding @ self.centroids.T
+
+            passage_ids = self.get_candidates(centroid_scores)
+            if len(passage_ids) > self.n_candidates:
+                approximate_scores = self.score_centroid_interaction(centroid_scores, passage_ids)
+                passage_ids = passage_ids[approximate_scores.topk(self.n_candidates).indices]
+
+            scores = self.score_exact(query_embedding, passage_ids, passage_embeddings)
+            scores, positions = scores.topk(min(k, len(scores)))
+            all_indices.append(passage_ids[positions])
+            all_scores.append(scores)
+
+        return pad_top_k(all_indices, all_scores, k)
+
+    def state_dict(self) -> Dict[str, Any]:
+        return {
+            "centroids": self.centroids,
+            "codes": self.codes,
+            "residuals": self.residuals,
+            "doc_offsets": self.doc_offsets,
+            "bucket_cutoffs": self.bucket_cutoffs,
+            "bucket_weights": self.bucket_weights,
+            "passage_centroid_ids": self.passage_centroid_ids,
+            "passage_centroid_offsets": self.passage_centroid_offsets,
+            "ivf_passage_ids": self.ivf_passage_ids,
+            "ivf_offsets": self.ivf_offsets,
+            "n_bits": self.n_bits,
+            "n_probe": self.n_probe,
+            "n_candidates": self.n_candidates,
+            "centroid_score_threshold": self.centroid_score_threshold,
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any], **kwargs) -> PLAIDIndex:
+        return cls(**{**state, **kwargs})
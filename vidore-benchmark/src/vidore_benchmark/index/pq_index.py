@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import logging
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import torch
+
+from vidore_benchmark.evaluation.scoring import merge_top_k
+from vidore_benchmark.index.base_index import BaseSearchIndex, register_search_index
+from vidore_benchmark.index.product_quantizer import ProductQuantizer
+from vidore_benchmark.index.utils import append_embeddings, get_kept_mask, select_embeddings, stack_vectors
+
+logger = logging.getLogger(__name__)
+
+
+@register_search_index("pq")
+class PQIndex(BaseSearchIndex):
+    """
+    Flat product-quantized index for single-vector retrievers (e.g. the 1536-d DSE and GME embeddings).
+
+    Each passage is stored as `n_subquantizers` uint8 codes (see `ProductQuantizer`), e.g. 64 or 128 bytes per
+    page instead of ~3 KB for a bfloat16 1536-d vector. All the codes are scanned with the asymmetric (ADC) lookup
+    tables of the queries. If `rerank_top_k` is set and the full-precision `passage_embeddings` are provided, the
+    `rerank_top_k` best passages of each query are rescored with the exact dot product.
+    """
+
+    search_params = ("passage_embeddings", "rerank_top_k", "block_size")
+
+    def __init__(
+        self,
+        quantizer: ProductQuantizer,
+        codes: torch.Tensor,
+        passage_embeddings: Optional[Union[torch.Tensor, List[torch.Tensor]]] = None,
+        rerank_top_k: Optional[int] = None,
+        block_size: int = 65536,
+    ):
+        """
+        Inputs:
+            - quantizer: trained product quantizer
+            - codes: uint8 tensor of shape (n_passages, n_subquantizers)
+            - passage_embeddings: full-precision passage embeddings, only needed for the exact rerank
+            - rerank_top_k: number of candidates per query rescored with the exact dot product
+            - block_size: number of passages scored at once
+        """
+        if rerank_top_k is not None and rerank_top_k < 1:
+            raise ValueError("`rerank_top_k` must be at least one")
+
+        self.quantizer = quantizer
+        self.codes = codes
+        self.passage_embeddings = passage_embeddings
+        self.rerank_top_k = rerank_top_k
+        self.block_size = block_size
+
+    @classmethod
+    def build(
+        cls,
+        passage_embeddings: Union[torch.Tensor, List[torch.Tensor]],
+        n_subquantizers: int = 64,
+        n_bits: int = 8,
+        n_iterations: int = 20,
+        max_training_points: Optional[int] = 1 << 16,
+        seed: int = 0,
+        **search_kwargs,
+    ) -> PQIndex:
+        """
+        Train the product quantizer on the passage embeddings and encode them.
+
+        Inputs:
+            - passage_embeddings: single-vector passage embeddings, of shape (n_passages, emb_dim).
+            - n_subquantizers, n_bits, n_iterations, max_training_points, seed: see `ProductQuantizer.train`.
+            - search_kwargs: default search parameters (`rerank_top_k`, `block_size`).
+        """
+        vectors = stack_vectors(passage_embeddings)
+        quantizer = ProductQuantizer.train(
+            vectors,
+            n_subquantizers=n_subquantizers,
+            n_bits=n_bits,
+            n_iterations=n_iterations,
+            max_training_points=max_training_points,
+            seed=seed,
+        )
+        codes = quantizer.encode(vectors)
+        logger.info(f"Encoded {len(codes)} passages with {codes.shape[1]} bytes each")
+
+        if search_kwargs.get("rerank_top_k") is None:
+            passage_embeddings = None
+        return cls(quantizer, codes, passage_embeddings=passage_embeddings, **search_kwargs)
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def add(self, passage_embeddings: Union[torch.Tensor, List[torch.Tensor]]):
+        self.codes = torch.cat([self.codes, self.quantizer.encode(stack_vectors(passage_embeddings))])
+        if self.passage_embeddings is not None:
+            self.passage_embeddings = append_embeddings(self.passage_embeddings, passage_embeddings)
+
+    def remove(self, passage_ids: Union[torch.Tensor, List[int]]):
+        kept = get_kept_mask(len(self), passage_ids)
+        self.codes = self.codes[kept]
+        if self.passage_embeddings is not None:
+            self.passage_embeddings = select_embeddings(self.passage_embeddings, kept)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Memory footprint of the codes and codebooks (without the optional full-precision embeddings).
+        """
+        return self.codes.nbytes + self.quantizer.codebooks.nbytes
+
+    def score(self, query_embeddings: Union[torch.Tensor, List[torch.Tensor]]) -> torch.Tensor:
+        """
+        ADC scores between the queries and all the passages, of shape (n_queries, n_passages).
+        """
+        lookup_tables = self.quantizer.compute_lookup_tables(stack_vectors(query_embeddings))
+        return torch.cat(
+            [
+                self.quantizer.score(lookup_tables, self.codes[start : start + self.block_size])
+                for start in range(0, len(self.codes), self.block_size)
+            ],
+            dim=1,
+        )
+
+    def search_adc(
+        self,
+        query_embeddings: Union[torch.Tensor, List[torch.Tensor]],
+        k: int,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Top-k passages of each query by ADC score, streamed over blocks of `block_size` passages.
+        """
+        lookup_tables = self.quantizer.compute_lookup_tables(stack_vectors(query_embeddings))
+
+        top_k_scores = torch.empty((len(lookup_tables), 0), dtype=torch.float32)
+        top_k_indices = torch.empty((len(lookup_tables), 0), dtype=torch.long)
+
+        for start in range(0, len(self.codes), self.block_size):
+            block_scores = self.quantizer.score(lookup_tables, self.codes[start : start + self.block_size])
+            block_indices = torch.arange(start, start + block_scores.shape[1])
+            top_k_scores, top_k_indices = merge_top_k(top_k_scores, top_k_indices, block_scores, block_indices, k)
+
+        return top_k_indices, top_k_scores
+
+    def search(
+        self,
+        query_embeddings: Union[torch.Tensor, List[torch.Tensor]],
+        k: int,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        if self.rerank_top_k is None or self.passage_embeddings is None:
+            return self.search_adc(query_embeddings, k)
+
+        candidates, _ = self.search_adc(query_embeddings, max(k, self.rerank_top_k))
+
+        queries = stack_vectors(query_embeddings)
+        candidate_embeddings = torch.stack(
+            [self.passage_embeddings[idx] for idx in candidates.flatten().tolist()]
+        ).float()
+        scores = torch.einsum("qd,qcd->qc", queries, candidate_embeddings.view(*candidates.shape, -1))
+
+        scores, positions = scores.topk(min(k, scores.shape[1]), dim=1)
+        return candidates.gather(1, positions), scores
+
+    def state_dict(self) -> Dict[str, Any]:
+        # NOTE: The passage embeddings are not saved, they are passed back to `load` for the exact rerank (they
+        # are already saved by `build_index.py`).
+        return {
+            "quantizer": self.quantizer.get_config(),
+            "codes": self.codes,
+            "rerank_top_k": self.rerank_top_k,
+            "block_size": self.block_size,
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any], **kwargs) -> PQIndex:
+        state = {**state, **kwargs}
+        state["quantizer"] = ProductQuantizer(**state["quantizer"])
+        return cls(**state)
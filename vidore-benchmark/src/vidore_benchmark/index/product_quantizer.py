@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+from typing import Any, Dict, Optional
+
+import torch
+
+from vidore_benchmark.index.kmeans import assign_to_centroids, kmeans
+
+
+class ProductQuantizer:
+    """
+    Product quantization (PQ) codec.
+
+    The vectors are split into `n_subquantizers` sub-vectors of `emb_dim // n_subquantizers` dimensions, and each
+    sub-vector is encoded as the id of its closest centroid in a k-means codebook of 2^`n_bits` centroids trained
+    for its subspace. With `n_bits=8`, a vector is stored in `n_subquantizers` bytes.
+
+    The dot products between full-precision queries and encoded vectors are computed asymmetrically (ADC): the
+    dot products between each query sub-vector and all the centroids of its subspace are precomputed once in a
+    (n_subquantizers, 2^n_bits) lookup table, and the score of a code is the sum of its `n_subquantizers` table
+    entries.
+    """
+
+    def __init__(self, codebooks: torch.Tensor):
+        """
+        Inputs:
+            - codebooks: float32 tensor of shape (n_subquantizers, 2^n_bits, emb_dim // n_subquantizers)
+        """
+        self.codebooks = codebooks
+
+    @property
+    def n_subquantizers(self) -> int:
+        return self.codebooks.shape[0]
+
+    @property
+    def n_centroids(self) -> int:
+        return self.codebooks.shape[1]
+
+    @property
+    def embedding_dim(self) -> int:
+        return self.codebooks.shape[0] * self.codebooks.shape[2]
+
+    @classmethod
+    def train(
+        cls,
+        vectors: torch.Tensor,
+        n_subquantizers: int = 64,
+        n_bits: int = 8,
+        n_iterations: int = 20,
+        max_training_points: Optional[int] = 1 << 16,
+        seed: int = 0,
+    ) -> ProductQuantizer:
+        """
+        Train the codebooks with one L2 k-means per subspace.
+
+        Inputs:
+            - vectors: float tensor of shape (n_vectors, emb_dim)
+            - n_subquantizers: number of subspaces, must divide `emb_dim`
+            - n_bits: number of bits per code (at most 8)
+            - n_iterations: number of k-means iterations
+            - max_training_points: number of vectors sampled to train the codebooks
+            - seed: seed of the k-means
+        """
+        if vectors.shape[1] % n_subquantizers != 0:
+            raise ValueError("`n_subquantizers` must divide the embedding dimension")
+        if not 1 <= n_bits <= 8:
+            raise ValueError("`n_bits` must be between 1 and 8")
+
+        n_centroids = min(1 << n_bits, len(vectors))
+        subvectors = vectors.float().view(len(vectors), n_subquantizers, -1)
+        codebooks = torch.stack(
+            [
+                kmeans(
+                    subvectors[:, j],
+                    n_centroids,
+                    n_iterations=n_iterations,
+                    max_training_points=max_training_points,
+                    seed=seed + j,
+                    spherical=False,
+                )
+                for j in range(n_subquantizers)
+            ]
+        )
+        return cls(codebooks)
+
+    def encode(self, vectors: torch.Tensor) -> torch.Tensor:
+        """
+        Return the uint8 codes of shape (n_vectors, n_subquantizers) of the vectors.
+        """
+        subvectors = vectors.float().view(len(vectors), self.n_subquantizers, -1)
+        codes = [
+            assign_to_centroids(subvectors[:, j], self.codebooks[j], spherical=False)
+            for j in range(self.n_subquantizers)
+        ]
+        return torch.stack(codes, dim=1).to(torch.uint8)
+
+    def decode(self, codes: torch.Tensor) -> torch.Tensor:
+        """
+        Return the float32 vectors of shape (n_vectors, emb_dim) reconstructed from the codes.
+        """
+        subvectors = self.codebooks[torch.arange(self.n_subquantizers), codes.long()]
+        return subvectors.flatten(start_dim=1)
+
+    def compute_lookup_tables(self, queries: torch.Tensor) -> torch.Tensor:
+        """
+        Return the ADC lookup tables of the queries, of shape (n_queries, n_subquantizers, 2^n_bits): the dot
+        products between each query sub-vector and the centroids of its subspace.
+        """
+        subqueries = queries.float().view(len(queries), self.n_subquantizers, -1)
+        return torch.einsum("qmd,mkd->qmk", subqueries, self.codebooks)
+
+    def score(self, lookup_tables: torch.Tensor, codes: torch.Tensor) -> torch.Tensor:
+        """
+        Asymmetric dot products between the queries of `lookup_tables` and the encoded vectors, of shape
+        (n_queries, n_vectors).
+        """
+        scores = torch.zeros((len(lookup_tables), len(codes)), dtype=lookup_tables.dtype)
+        for j in range(self.n_subquantizers):
+            scores += lookup_tables[:, j, codes[:, j].long()]
+        return scores
+
+    def get_config(self) -> Dict[str, Any]:
+        return {"codebooks": self.codebooks}
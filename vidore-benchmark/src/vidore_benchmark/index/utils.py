@@ -0,0 +1,160 @@
+from typing import List, Tuple, Union
+
+import torch
+
+from vidore_benchmark.utils.ragged_utils import RaggedEmbeddings
+
+try:
+    from colpali_engine.utils.scoring_utils import strip_padding
+except ImportError:
+
+    def strip_padding(embeddings: torch.Tensor) -> torch.Tensor:
+        """
+        Remove the all-zero padding rows of a multi-vector embedding of shape (n_seq, emb_dim). Fallback of
+        `colpali_engine.utils.scoring_utils.strip_padding` when `colpali-engine` is not installed.
+        """
+        return embeddings[embeddings.ne(0).any(dim=-1)]
+
+
+def flatten_embeddings(
+    embeddings: Union[torch.Tensor, List[torch.Tensor], RaggedEmbeddings],
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Concatenate the (unpadded) tokens of multi-vector embeddings. `RaggedEmbeddings` are used as-is.
+
+    Output:
+        - tokens: float32 tensor of shape (n_tokens, emb_dim)
+        - offsets: int64 tensor of shape (n_embeddings + 1,), the tokens of the i-th embedding are
+            `tokens[offsets[i] : offsets[i + 1]]`
+    """
+    if isinstance(embeddings, RaggedEmbeddings):
+        return embeddings.values.float(), embeddings.offsets
+
+    embeddings = [strip_padding(emb).float() for emb in embeddings]
+    lengths = torch.tensor([len(emb) for emb in embeddings], dtype=torch.long)
+    offsets = torch.cat([torch.zeros(1, dtype=torch.long), lengths.cumsum(0)])
+    return torch.cat(embeddings), offsets
+
+
+def stack_vectors(embeddings: Union[torch.Tensor, List[torch.Tensor]]) -> torch.Tensor:
+    """
+    Stack single-vector embeddings into a float32 tensor of shape (n_embeddings, emb_dim).
+    """
+    if isinstance(embeddings, list):
+        embeddings = torch.stack(embeddings)
+    if embeddings.dim() != 2:
+        raise ValueError("The embeddings must be single vectors, use a multi-vector index (PLAID, MUVERA) otherwise")
+    return embeddings.float()
+
+
+def get_kept_mask(n_passages: int, removed_ids: Union[torch.Tensor, List[int]]) -> torch.Tensor:
+    """
+    Boolean mask of shape (n_passages,) of the passages that are not in `removed_ids`.
+    """
+    kept = torch.ones(n_passages, dtype=torch.bool)
+    kept[torch.as_tensor(removed_ids, dtype=torch.long)] = False
+    return kept
+
+
+def lengths_to_offsets(lengths: torch.Tensor) -> torch.Tensor:
+    return torch.cat([torch.zeros(1, dtype=torch.long), lengths.long().cumsum(0)])
+
+
+def append_embeddings(
+    embeddings: Union[torch.Tensor, List[torch.Tensor], RaggedEmbeddings],
+    new_embeddings: Union[torch.Tensor, List[torch.Tensor], RaggedEmbeddings],
+) -> Union[torch.Tensor, List[torch.Tensor], RaggedEmbeddings]:
+    """
+    Concatenate two sets of passage embeddings, keeping the type of `embeddings`.
+    """
+    if isinstance(embeddings, RaggedEmbeddings):
+        if not isinstance(new_embeddings, RaggedEmbeddings):
+            new_embeddings = RaggedEmbeddings.from_list([strip_padding(emb) for emb in new_embeddings])
+        return RaggedEmbeddings.cat([embeddings, new_embeddings.to(embeddings.dtype)])
+    if isinstance(embeddings, torch.Tensor):
+        return torch.cat([embeddings, stack_vectors(new_embeddings).to(embeddings.dtype)])
+    return list(embeddings) + list(new_embeddings)
+
+
+def select_embeddings(
+    embeddings: Union[torch.Tensor, List[torch.Tensor], RaggedEmbeddings],
+    kept: torch.Tensor,
+) -> Union[torch.Tensor, List[torch.Tensor], RaggedEmbeddings]:
+    """
+    Keep the passage embeddings of the boolean mask `kept`, keeping the type of `embeddings`.
+    """
+    if isinstance(embeddings, (torch.Tensor, RaggedEmbeddings)):
+        return embeddings[kept.nonzero().flatten()]
+    return [emb for emb, is_kept in zip(embeddings, kept.tolist()) if is_kept]
+
+
+def ragged_arange(starts: torch.Tensor, lengths: torch.Tensor) -> torch.Tensor:
+    """
+    Concatenation of `arange(start, start + length)` for each (start, length) pair, without a Python loop.
+    """
+    total = int(lengths.sum())
+    segment_starts = lengths.cumsum(0) - lengths
+    return torch.repeat_interleave(starts - segment_starts, lengths, output_size=total) + torch.arange(total)
+
+
+def segment_max_sum(similarities: torch.Tensor, segment_ids: torch.Tensor, n_segments: int) -> torch.Tensor:
+    """
+    MaxSim reduction over ragged segments.
+
+    Inputs:
+        - similarities: tensor of shape (n_query_tokens, n_tokens)
+        - segment_ids: int64 tensor of shape (n_tokens,), the segment (passage) of each token
+        - n_segments: number of segments
+    Output:
+        - scores: tensor of shape (n_segments,), the sum over the query tokens of the max similarity within each
+            segment. The query tokens without any token in a segment contribute 0.
+    """
+    maxima = torch.full(
+        (similarities.shape[0], n_segments),
+        float("-inf"),
+        dtype=similarities.dtype,
+    ).scatter_reduce(1, segment_ids.expand_as(similarities), similarities, reduce="amax")
+    return maxima.masked_fill_(maxima == float("-inf"), 0).sum(dim=0)
+
+
+def score_max_sim(query_embedding: torch.Tensor, passage_embeddings: List[torch.Tensor]) -> torch.Tensor:
+    """
+    Exact MaxSim scores of a single query against a list of passages, without padding the passages.
+
+    Inputs:
+        - query_embedding: tensor of shape (n_seq, emb_dim)
+        - passage_embeddings: list of passage embeddings, each of shape (n_seq_i, emb_dim)
+    Output:
+        - scores: float32 tensor of shape (n_passages,)
+    """
+    tokens, offsets = flatten_embeddings(passage_embeddings)
+    segment_ids = torch.repeat_interleave(torch.arange(len(passage_embeddings)), offsets.diff())
+    return segment_max_sum(strip_padding(query_embedding).float() @ tokens.T, segment_ids, len(passage_embeddings))
+
+
+def pad_top_k(
+    indices: List[torch.Tensor],
+    scores: List[torch.Tensor],
+    k: int,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Stack the per-query top-k results into (n_queries, k) tensors, padded with the index -1 and the score -inf.
+    """
+    top_k_indices = torch.full((len(indices), k), -1, dtype=torch.long)
+    top_k_scores = torch.full((len(scores), k), float("-inf"), dtype=torch.float32)
+    for i, (query_indices, query_scores) in enumerate(zip(indices, scores)):
+        top_k_indices[i, : len(query_indices)] = query_indices
+        top_k_scores[i, : len(query_scores)] = query_scores
+    return top_k_indices, top_k_scores
+
+
+def recall_at_k(approximate_indices: torch.Tensor, exact_indices: torch.Tensor) -> float:
+    """
+    Fraction of the exact top-k passages of each query retrieved by the approximate search, averaged over the
+    queries. `k` is the number of columns of `exact_indices`.
+    """
+    hits = [
+        len(set(approximate.tolist()) & set(exact.tolist())) / exact_indices.shape[1]
+        for approximate, exact in zip(approximate_indices, exact_indices)
+    ]
+    return sum(hits) / len(hits)
@@ -13,9 +13,14 @@ import json
 from vidore_benchmark.compression.token_pooling import HierarchicalEmbeddingPooler
 from vidore_benchmark.evaluation.evaluate import evaluate_dataset, evaluate_dataset_from_indexing, evaluate_dataset_matching, evaluate_dataset_from_imagetexts
 from vidore_benchmark.evaluation.interfaces import MetadataModel, ViDoReBenchmarkResults
+from vidore_benchmark.index.base_index import load_search_index, load_search_index_class
 from vidore_benchmark.retrievers.registry_utils import load_vision_retriever_from_registry
+from vidore_benchmark.utils.embedding_cache import EmbeddingCache
+from vidore_benchmark.utils.jsonl_utils import iter_jsonl_pages
 from vidore_benchmark.utils.logging_utils import setup_logging
-import torch
+from vidore_benchmark.utils.memmap_utils import is_memmap_index, load_doc_ids
+from vidore_benchmark.utils.pagepack_utils import is_page_pack, iter_page_pack
+from vidore_benchmark.utils.ragged_utils import load_embeddings
 import tqdm
 import time
 import pandas as pd
@@ -48,6 +53,39 @@ def sanitize_model_id(model_class: str, pretrained_model_name_or_path: Optional[
     model_id = model_id.replace("/", "_")
     return model_id
 
+def load_passage_index(
+    retriever,
+    indexing_path: str,
+    batch_score: Optional[int] = None,
+    search_index_path: Optional[str] = None,
+    search_n_probe: Optional[int] = None,
+    search_n_candidates: Optional[int] = None,
+    search_ef_search: Optional[int] = None,
+    rerank_top_k: Optional[int] = None,
+):
+    """
+    Load the passage-side search structure: the search index (PLAID, MUVERA, IVF, HNSW) if `search_index_path` is
+    provided, else the `build_index.py` embeddings prepared once for all the query sets.
+
+    `indexing_path` is either a memmap index directory, whose embeddings are memory-mapped rather than read, or a
+    `.pt` file of embeddings.
+    """
+    if search_index_path is not None:
+        print(f"Loading the search index {search_index_path}")
+        search_index_class = load_search_index_class(search_index_path)
+        # NOTE: `load` raises a `ValueError` if a search parameter is not accepted by the index
+        search_kwargs = {"n_probe": search_n_probe, "n_candidates": search_n_candidates, "ef_search": search_ef_search}
+        # NOTE: `--rerank-top-k` is also the exact rerank of the quantized multi-vector scoring, it is only forwarded
+        # to the indexes that rerank their candidates
+        if "rerank_top_k" in search_index_class.search_params:
+            search_kwargs["rerank_top_k"] = rerank_top_k
+        if search_index_class.requires_passage_embeddings or search_kwargs.get("rerank_top_k") is not None:
+            search_kwargs["passage_embeddings"] = load_embeddings(indexing_path)
+        return load_search_index(search_index_path, **search_kwargs)
+
+    indexing = load_embeddings(indexing_path)
+    return retriever.prepare_passage_embeddings(indexing, batch_size=batch_score)
+
 def add_column(examples):
     # Compute the length of each query in the batch
     examples["text_description"] = ['' for query in examples["query"]]
@@ -84,10 +122,78 @@ def evaluate_retriever(
     ] = None,
     use_token_pooling: Annotated[bool, typer.Option(help="Whether to use token pooling for text embeddings")] = False,
     pool_factor: Annotated[int, typer.Option(help="Pooling factor for hierarchical token pooling")] = 3,
-    indexing_path: Annotated[str, typer.Option(help="INDEX")] = None,
+    indexing_path: Annotated[
+        str, typer.Option(help="Passage embeddings of `build_index.py`: memmap index directory or `.pt` file")
+    ] = None,
     data_index_name: Annotated[str, typer.Option(help="INDEX")] = None,
     use_visual: Annotated[bool, typer.Option(help="x")] = False,
     matching_type: Annotated[str, typer.Option(help="matching type")] = "",
+    num_scoring_workers: Annotated[
+        int,
+        typer.Option(help="Number of CPU workers for the multi-vector scoring (ColPali and ColQwen2 retrievers)"),
+    ] = 1,
+    scoring_backend: Annotated[str, typer.Option(help="CPU scoring worker pool: `thread` or `process`")] = "thread",
+    num_preprocessing_workers: Annotated[
+        int,
+        typer.Option(help="Number of DataLoader workers preprocessing the query and passage batches (0 to disable)"),
+    ] = 0,
+    quantization: Annotated[
+        Optional[str],
+        typer.Option(help="Quantized multi-vector scoring: `int8` or `binary` (ColPali and ColQwen2 retrievers)"),
+    ] = None,
+    rerank_top_k: Annotated[
+        Optional[int],
+        typer.Option(help="Number of quantized (or PQ index) candidates per query rescored in full precision"),
+    ] = None,
+    pq_n_subquantizers: Annotated[
+        Optional[int],
+        typer.Option(help="Product-quantize the passage embeddings with this many bytes each (DSE and GME retrievers)"),
+    ] = None,
+    matryoshka_dims: Annotated[
+        Optional[List[int]],
+        typer.Option(help="Embedding dimension of each Matryoshka cascade stage, repeated (DSEQwen2 retriever)"),
+    ] = None,
+    matryoshka_n_candidates: Annotated[
+        Optional[List[int]],
+        typer.Option(help="Number of candidates passed from each Matryoshka cascade stage to the next, repeated"),
+    ] = None,
+    max_visual_tokens_per_batch: Annotated[
+        Optional[int],
+        typer.Option(help="Batch the passages by visual-token budget instead of `batch-passage` (ColQwen2 retriever)"),
+    ] = None,
+    search_index_path: Annotated[
+        Optional[str],
+        typer.Option(
+            help="Search index built by `build_index.py` (`--plaid-index`, `--muvera-index`, `--ann-index`), searched "
+            "instead of scoring all the `indexing_path` embeddings"
+        ),
+    ] = None,
+    search_n_probe: Annotated[
+        Optional[int],
+        typer.Option(help="Number of centroids probed per query token (PLAID index) or per query (IVF indexes)"),
+    ] = None,
+    search_n_candidates: Annotated[
+        Optional[int], typer.Option(help="Number of search index candidates rescored with the MaxSim")
+    ] = None,
+    search_ef_search: Annotated[Optional[int], typer.Option(help="Beam width of the HNSW index search")] = None,
+    search_recall: Annotated[
+        bool,
+        typer.Option(help="Whether to report the recall@100 of the search index against the exact search"),
+    ] = False,
+    embedding_cache_dir: Annotated[
+        Optional[str],
+        typer.Option(help="Persistent passage embedding cache, shared across datasets and runs of the same model"),
+    ] = None,
+    embedding_cache_max_size_gb: Annotated[
+        float, typer.Option(help="Size of the passage embedding cache above which the LRU entries are evicted")
+    ] = 50.0,
+    query_cache_dir: Annotated[
+        Optional[str],
+        typer.Option(help="Persistent query embedding cache, shared across datasets and runs of the same model"),
+    ] = None,
+    query_cache_memory_size: Annotated[
+        int, typer.Option(help="Number of query embeddings kept in memory (0 to disable the in-memory cache)")
+    ] = 0,
 ):
     """
     Evaluate the retriever on the given dataset or collection.
@@ -109,6 +215,20 @@ def evaluate_retriever(
         logging.info(f"Collection Name: {collection_name}")
     logging.info(f"Use Token Pooling: {use_token_pooling}")
     logging.info(f"Pooling Factor: {pool_factor}")
+    if num_scoring_workers > 1:
+        logging.info(f"Scoring Workers: {num_scoring_workers} ({scoring_backend})")
+    if num_preprocessing_workers > 0:
+        logging.info(f"Preprocessing Workers: {num_preprocessing_workers}")
+    if search_index_path:
+        logging.info(f"Search Index: {search_index_path}")
+    if quantization:
+        logging.info(f"Quantization: {quantization} (rerank top-k: {rerank_top_k})")
+    if pq_n_subquantizers:
+        logging.info(f"Product Quantization: {pq_n_subquantizers} bytes per passage (rerank top-k: {rerank_top_k})")
+    if matryoshka_dims:
+        logging.info(f"Matryoshka Cascade: dims {matryoshka_dims} (candidates: {matryoshka_n_candidates})")
+    if max_visual_tokens_per_batch is not None:
+        logging.info(f"Visual-Token Budget per Batch: {max_visual_tokens_per_batch}")
 
     logging.info(f"Evaluating retriever `{model_class}`")
     print(f"Use Token Pooling: {use_token_pooling}")
@@ -120,10 +240,40 @@ def evaluate_retriever(
         raise ValueError("Please provide only one of dataset name or collection name")
 
     # Create the vision retriever
+    # NOTE: The scoring backend kwargs are only passed when needed, as most retrievers do not accept them.
+    retriever_kwargs = {}
+    if num_scoring_workers > 1:
+        retriever_kwargs.update(num_scoring_workers=num_scoring_workers, scoring_backend=scoring_backend)
+    if quantization is not None:
+        retriever_kwargs.update(quantization=quantization, rerank_top_k=rerank_top_k)
+    if pq_n_subquantizers is not None:
+        retriever_kwargs.update(pq_n_subquantizers=pq_n_subquantizers, rerank_top_k=rerank_top_k)
+    if matryoshka_dims:
+        retriever_kwargs.update(
+            matryoshka_dims=matryoshka_dims,
+            matryoshka_n_candidates=matryoshka_n_candidates or None,
+        )
+    if max_visual_tokens_per_batch is not None:
+        retriever_kwargs.update(max_visual_tokens_per_batch=max_visual_tokens_per_batch)
+
     retriever = load_vision_retriever_from_registry(
         model_class,
         pretrained_model_name_or_path=pretrained_model_name_or_path,
+        **retriever_kwargs,
     )
+    retriever.set_preprocessing_workers(num_preprocessing_workers)
+
+    embedding_cache = None
+    if embedding_cache_dir is not None:
+        embedding_cache = EmbeddingCache(embedding_cache_dir, max_size_bytes=int(embedding_cache_max_size_gb * 1024**3))
+        retriever.set_passage_embedding_cache(embedding_cache)
+        logging.info(f"Passage embedding cache: {embedding_cache_dir}")
+
+    query_cache = None
+    if query_cache_dir is not None or query_cache_memory_size > 0:
+        query_cache = EmbeddingCache(query_cache_dir, memory_max_entries=query_cache_memory_size, name="Query")
+        retriever.set_query_embedding_cache(query_cache)
+        logging.info(f"Query embedding cache: {query_cache_dir} ({query_cache_memory_size} entries in memory)")
 
     # Sanitize the model ID to use as a filename
     model_id = sanitize_model_id(model_class, pretrained_model_name_or_path)
@@ -289,7 +439,7 @@ def evaluate_retriever(
         print(f"Concatenated metrics saved to `{savepath_all}`")
 
     elif indexing_path is not None:
-        if collection_name.endswith(".jsonl"):
+        if collection_name.endswith(".jsonl") or is_page_pack(collection_name):
             # Placeholder for all metrics
             metrics_all: Dict[str, Dict[str, float]] = {}
             results_all: List[ViDoReBenchmarkResults] = []
@@ -299,20 +449,40 @@ def evaluate_retriever(
 
             print(f"\n ---------------------------\nLoading passages and index {indexing_path}")
             passages = []
-            indexing = torch.load(indexing_path)["embeddings"]
+            # Build the passage-side scoring structures once for all the query sets
+            indexing = load_passage_index(
+                retriever,
+                indexing_path,
+                batch_score=batch_score,
+                search_index_path=search_index_path,
+                search_n_probe=search_n_probe,
+                search_n_candidates=search_n_candidates,
+                search_ef_search=search_ef_search,
+                rerank_top_k=rerank_top_k,
+            )
+            exact_passages = (
+                retriever.prepare_passage_embeddings(load_embeddings(indexing_path), batch_size=batch_score)
+                if search_index_path and search_recall
+                else None
+            )
+            # Map the retrieved passages to their filename with the doc ids of the index, when it has some
+            doc_ids = load_doc_ids(indexing_path) if is_memmap_index(indexing_path) else None
             query_ds = {'query': []}
             
             passages_ds = {'query': [], 'image_filename': []}
             number_of_queries = 100 if "health" or "ai" in collection_name else 500 if "arxivqa" in collection_name else 0
       
-            with open(collection_name, 'r') as file:
-                for line in tqdm.tqdm(file, desc="Processing indexing path"):
-                    data = json.loads(line)
-                    if len(query_ds['query']) < number_of_queries:
-                        query_ds['query'].append(str(data['query']))
-                    
-                    passages_ds['query'].append(str(data['query']))
-                    passages_ds['image_filename'].append(str(data['image_filename']))
+            # Only the metadata is read: the page pack images or the JSONL base64 images are not decoded
+            if is_page_pack(collection_name):
+                pages = iter_page_pack(collection_name, fields=("query", "image_filename"))
+            else:
+                pages = iter_jsonl_pages(collection_name, fields=("query", "image_filename"))
+            for data in tqdm.tqdm(pages, desc="Processing indexing path"):
+                if len(query_ds['query']) < number_of_queries:
+                    query_ds['query'].append(data['query'])
+
+                passages_ds['query'].append(data['query'])
+                passages_ds['image_filename'].append(data['image_filename'])
 
             query_ds = Dataset.from_dict(query_ds)
             passages_ds = Dataset.from_dict(passages_ds)
@@ -325,6 +495,8 @@ def evaluate_retriever(
                     batch_query=batch_query,
                     emb_passages=indexing,
                     batch_score=batch_score,
+                    exact_passages=exact_passages,
+                    doc_ids=doc_ids,
                 )
             # end_time = time.time()
             # elapsed_time = end_time - start_time
@@ -379,7 +551,24 @@ def evaluate_retriever(
             for dataset_name in dataset_names:
                 passages.append(load_dataset(dataset_name, split=split))
             passages_ds = concatenate_datasets(passages)
-            indexing = torch.load(indexing_path)["embeddings"]
+            # Build the passage-side scoring structures once for all the query sets
+            indexing = load_passage_index(
+                retriever,
+                indexing_path,
+                batch_score=batch_score,
+                search_index_path=search_index_path,
+                search_n_probe=search_n_probe,
+                search_n_candidates=search_n_candidates,
+                search_ef_search=search_ef_search,
+                rerank_top_k=rerank_top_k,
+            )
+            exact_passages = (
+                retriever.prepare_passage_embeddings(load_embeddings(indexing_path), batch_size=batch_score)
+                if search_index_path and search_recall
+                else None
+            )
+            # Map the retrieved passages to their filename with the doc ids of the index, when it has some
+            doc_ids = load_doc_ids(indexing_path) if is_memmap_index(indexing_path) else None
 
             for dataset_name in dataset_names:
                 print(f"\n ---------------------------\nEvaluating {dataset_name}")
@@ -393,6 +582,8 @@ def evaluate_retriever(
                         batch_query=batch_query,
                         emb_passages=indexing,
                         batch_score=batch_score,
+                        exact_passages=exact_passages,
+                        doc_ids=doc_ids,
                     )
 
                 metrics = {
@@ -553,6 +744,10 @@ def evaluate_retriever(
 
         print(f"Concatenated metrics saved to `{savepath_all}`")
 
+    if embedding_cache is not None:
+        print(f"Passage embedding cache: {embedding_cache.get_stats()}")
+    if query_cache is not None:
+        print(f"Query embedding cache: {query_cache.get_stats()}")
 
     print("Done.")
 
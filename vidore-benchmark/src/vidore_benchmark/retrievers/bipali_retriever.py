@@ -4,13 +4,12 @@ from typing import List, Optional, Union, cast
 import torch
 from dotenv import load_dotenv
 from PIL import Image
-from torch.utils.data import DataLoader
 from tqdm import tqdm
 
 from vidore_benchmark.retrievers.registry_utils import register_vision_retriever
 from vidore_benchmark.retrievers.vision_retriever import VisionRetriever
 from vidore_benchmark.utils.data_utils import ListDataset
-from vidore_benchmark.utils.torch_utils import get_torch_device
+from vidore_benchmark.utils.torch_utils import get_torch_device, move_to_device
 
 logger = logging.getLogger(__name__)
 
@@ -63,16 +62,15 @@ class BiPaliRetriever(VisionRetriever):
         return True
 
     def process_images(self, images: List[Image.Image], **kwargs):
-        return self.processor.process_images(images=images).to(self.device)
+        return self.processor.process_images(images=images)
 
     def process_queries(self, queries: List[str], **kwargs):
-        return self.processor.process_queries(queries=queries).to(self.device)
+        return self.processor.process_queries(queries=queries)
 
     def forward_queries(self, queries: List[str], batch_size: int, **kwargs) -> List[torch.Tensor]:
-        dataloader = DataLoader(
-            dataset=ListDataset[str](queries),
+        dataloader = self.get_dataloader(
+            ListDataset[str](queries),
             batch_size=batch_size,
-            shuffle=False,
             collate_fn=self.process_queries,
         )
 
@@ -80,16 +78,15 @@ class BiPaliRetriever(VisionRetriever):
 
         with torch.no_grad():
             for batch_query in tqdm(dataloader, desc="Forward pass queries...", leave=False):
-                embeddings_query = self.model(**batch_query).to("cpu")
+                embeddings_query = self.model(**move_to_device(batch_query, self.device)).to("cpu")
                 query_embeddings.extend(list(torch.unbind(embeddings_query)))
 
         return query_embeddings
 
     def forward_passages(self, passages: List[Image.Image], batch_size: int, **kwargs) -> List[torch.Tensor]:
-        dataloader = DataLoader(
-            dataset=ListDataset[Image.Image](passages),
+        dataloader = self.get_dataloader(
+            ListDataset[Image.Image](passages),
             batch_size=batch_size,
-            shuffle=False,
             collate_fn=self.process_images,
         )
 
@@ -97,7 +94,7 @@ class BiPaliRetriever(VisionRetriever):
 
         with torch.no_grad():
             for batch_doc in tqdm(dataloader, desc="Forward pass documents...", leave=False):
-                embeddings_doc = self.model(**batch_doc).to("cpu")
+                embeddings_doc = self.model(**move_to_device(batch_doc, self.device)).to("cpu")
                 passage_embeddings.extend(list(torch.unbind(embeddings_doc)))
 
         return passage_embeddings
@@ -6,13 +6,12 @@ from typing import List, Optional, Union, cast
 import torch
 from dotenv import load_dotenv
 from PIL import Image
-from torch.utils.data import DataLoader
 from tqdm import tqdm
 
 from vidore_benchmark.retrievers.registry_utils import register_vision_retriever
 from vidore_benchmark.retrievers.vision_retriever import VisionRetriever
 from vidore_benchmark.utils.data_utils import ListDataset
-from vidore_benchmark.utils.torch_utils import get_torch_device
+from vidore_benchmark.utils.torch_utils import get_torch_device, move_to_device
 
 logger = logging.getLogger(__name__)
 
@@ -64,13 +63,13 @@ class BiQwen2RetrieverText(VisionRetriever):
         return False
 
     def process_images(self, images: List[Image.Image], **kwargs):
-        return self.processor.process_images(images=images).to(self.device)
+        return self.processor.process_images(images=images)
 
     def process_queries(self, queries: List[str], **kwargs):
-        return self.processor.process_queries(queries=queries).to(self.device)
+        return self.processor.process_queries(queries=queries)
 
     def process_passages(self, passages: List[str], **kwargs):
-        return self.processor.process_passages(passages=passages).to(self.device)
+        return self.processor.process_passages(passages=passages)
 
     def forward_queries(
         self,
@@ -78,10 +77,9 @@ class BiQwen2RetrieverText(VisionRetriever):
         batch_size: int,
         **kwargs,
     ) -> List[torch.Tensor]:
-        dataloader = DataLoader(
-            dataset=ListDataset[str](queries),
+        dataloader = self.get_dataloader(
+            ListDataset[str](queries),
             batch_size=batch_size,
-            shuffle=False,
             collate_fn=self.process_queries,
         )
 
@@ -89,17 +87,15 @@ class BiQwen2RetrieverText(VisionRetriever):
 
         for batch_query in tqdm(dataloader, desc="Forward pass queries...", leave=False):
             with torch.no_grad():
-                batch_query = {k: v.to(self.device) for k, v in batch_query.items()}
-                embeddings_query = self.model(**batch_query)
+                embeddings_query = self.model(**move_to_device(batch_query, self.device))
                 query_embeddings.extend(list(torch.unbind(embeddings_query.to("cpu"))))
 
         return query_embeddings
 
     def forward_passages(self, passages: List[str], batch_size: int, **kwargs) -> List[torch.Tensor]:
-        dataloader = DataLoader(
-            dataset=ListDataset[str](passages),
+        dataloader = self.get_dataloader(
+            ListDataset[str](passages),
             batch_size=batch_size,
-            shuffle=False,
             collate_fn=self.process_passages,
         )
 
@@ -107,7 +103,7 @@ class BiQwen2RetrieverText(VisionRetriever):
 
         with torch.no_grad():
             for batch_doc in tqdm(dataloader, desc="Forward pass documents...", leave=False):
-                embeddings_doc = self.model(**batch_doc).to("cpu")
+                embeddings_doc = self.model(**move_to_device(batch_doc, self.device)).to("cpu")
                 passage_embeddings.extend(list(torch.unbind(embeddings_doc)))
 
         return passage_embeddings
@@ -6,13 +6,12 @@ from typing import List, Optional, Union, cast
 import torch
 from dotenv import load_dotenv
 from PIL import Image
-from torch.utils.data import DataLoader
 from tqdm import tqdm
 from typing import List, Optional, Union, cast, Any, Dict, List, Optional
 from vidore_benchmark.retrievers.registry_utils import register_vision_retriever
 from vidore_benchmark.retrievers.vision_retriever import VisionRetriever
 from vidore_benchmark.utils.data_utils import ListDataset
-from vidore_benchmark.utils.torch_utils import get_torch_device
+from vidore_benchmark.utils.torch_utils import get_torch_device, move_to_device
 from typing import List, TypeVar
 from typing import List, Tuple, Any
 from torch.utils.data import Dataset as TorchDataset
@@ -77,16 +76,16 @@ class BiQwen2RetrieverTextImage(VisionRetriever):
         return False
 
     def process_images_texts(self, passages: List, **kwargs):
-        return self.processor.process_images_texts(passages=passages).to(self.device)
+        return self.processor.process_images_texts(passages=passages)
 
     def process_images(self, images: List[Image.Image], **kwargs):
-        return self.processor.process_images(images=images).to(self.device)
+        return self.processor.process_images(images=images)
 
     def process_queries(self, queries: List[str], **kwargs):
-        return self.processor.process_queries(queries=queries).to(self.device)
+        return self.processor.process_queries(queries=queries)
 
     def process_passages(self, passages: List[str], **kwargs):
-        return self.processor.process_passages(passages=passages).to(self.device)
+        return self.processor.process_passages(passages=passages)
 
     def forward_queries(
         self,
@@ -94,10 +93,9 @@ class BiQwen2RetrieverTextImage(VisionRetriever):
         batch_size: int,
         **kwargs,
     ) -> List[torch.Tensor]:
-        dataloader = DataLoader(
-            dataset=ListDataset[str](queries),
+        dataloader = self.get_dataloader(
+            ListDataset[str](queries),
             batch_size=batch_size,
-            shuffle=False,
             collate_fn=self.process_queries,
         )
 
@@ -105,17 +103,15 @@ class BiQwen2RetrieverTextImage(VisionRetriever):
 
         for batch_query in tqdm(dataloader, desc="Forward pass queries...", leave=False):
             with torch.no_grad():
-                batch_query = {k: v.to(self.device) for k, v in batch_query.items()}
-                embeddings_query = self.model(**batch_query)
+                embeddings_query = self.model(**move_to_device(batch_query, self.device))
                 query_embeddings.extend(list(torch.unbind(embeddings_query.to("cpu"))))
 
         return query_embeddings
 
     def forward_passages(self, passages: List[Any], batch_size: int, **kwargs) -> List[torch.Tensor]:
-        dataloader = DataLoader(
-            dataset=ImagesTextDataset(passages),
+        dataloader = self.get_dataloader(
+            ImagesTextDataset(passages),
             batch_size=batch_size,
-            shuffle=False,
             collate_fn=self.process_images_texts,
         )
 
@@ -123,7 +119,7 @@ class BiQwen2RetrieverTextImage(VisionRetriever):
 
         with torch.no_grad():
             for batch_doc in tqdm(dataloader, desc="Forward pass documents...", leave=False):
-                embeddings_doc = self.model(**batch_doc).to("cpu")
+                embeddings_doc = self.model(**move_to_device(batch_doc, self.device)).to("cpu")
                 passage_embeddings.extend(list(torch.unbind(embeddings_doc)))
 
         return passage_embeddings
@@ -1,18 +1,19 @@
 from __future__ import annotations
 
 import logging
-from typing import List, Optional, Union, cast
+from typing import Any, Callable, List, Optional, Tuple, Union, cast
 
 import torch
 from dotenv import load_dotenv
 from PIL import Image
-from torch.utils.data import DataLoader
 from tqdm import tqdm
 
 from vidore_benchmark.retrievers.registry_utils import register_vision_retriever
 from vidore_benchmark.retrievers.vision_retriever import VisionRetriever
 from vidore_benchmark.utils.data_utils import ListDataset
-from vidore_benchmark.utils.torch_utils import get_torch_device
+from vidore_benchmark.utils.memmap_utils import MemmapEmbeddings, blockwise_top_k
+from vidore_benchmark.utils.ragged_utils import RaggedEmbeddings, concat_embeddings
+from vidore_benchmark.utils.torch_utils import get_torch_device, move_to_device
 
 logger = logging.getLogger(__name__)
 
@@ -30,6 +31,10 @@ class ColPaliRetriever(VisionRetriever):
         self,
         pretrained_model_name_or_path: str,
         device: str = "auto",
+        num_scoring_workers: int = 1,
+        scoring_backend: str = "thread",
+        quantization: Optional[str] = None,
+        rerank_top_k: Optional[int] = None,
     ):
         super().__init__()
 
@@ -44,6 +49,10 @@ class ColPaliRetriever(VisionRetriever):
         self.device = get_torch_device(device)
         logger.info(f"Using device: {self.device}")
 
+        # CPU scoring backend (see `processor.score_multi_vector`)
+        self.num_scoring_workers = num_scoring_workers
+        self.scoring_backend = scoring_backend
+
         # Load the model
         self.model = cast(
             ColPali,
@@ -60,21 +69,24 @@ class ColPaliRetriever(VisionRetriever):
             ColPaliProcessor.from_pretrained(pretrained_model_name_or_path),
         )
 
+        # Quantized multi-vector scoring (see `processor.score_multi_vector`)
+        self.processor.quantization = quantization
+        self.processor.rerank_top_k = rerank_top_k
+
     @property
     def use_visual_embedding(self) -> bool:
         return True
 
     def process_images(self, images: List[Image.Image], **kwargs):
-        return self.processor.process_images(images=images).to(self.device)
+        return self.processor.process_images(images=images)
 
     def process_queries(self, queries: List[str], **kwargs):
-        return self.processor.process_queries(queries=queries).to(self.device)
+        return self.processor.process_queries(queries=queries)
 
     def forward_queries(self, queries: List[str], batch_size: int, **kwargs) -> List[torch.Tensor]:
-        dataloader = DataLoader(
-            dataset=ListDataset[str](queries),
+        dataloader = self.get_dataloader(
+            ListDataset[str](queries),
             batch_size=batch_size,
-            shuffle=False,
             collate_fn=self.process_queries,
         )
 
@@ -82,27 +94,52 @@ class ColPaliRetriever(VisionRetriever):
 
         with torch.no_grad():
             for batch_query in tqdm(dataloader, desc="Forward pass queries...", leave=False):
-                embeddings_query = self.model(**batch_query).to("cpu")
+                embeddings_query = self.model(**move_to_device(batch_query, self.device)).to("cpu")
                 query_embeddings.extend(list(torch.unbind(embeddings_query)))
 
         return query_embeddings
 
-    def forward_passages(self, passages: List[Image.Image], batch_size: int, **kwargs) -> List[torch.Tensor]:
-        dataloader = DataLoader(
-            dataset=ListDataset[Image.Image](passages),
+    def forward_passages(self, passages: List[Image.Image], batch_size: int, **kwargs) -> RaggedEmbeddings:
+        dataloader = self.get_dataloader(
+            ListDataset[Image.Image](passages),
             batch_size=batch_size,
-            shuffle=False,
             collate_fn=self.process_images,
         )
 
-        passage_embeddings: List[torch.Tensor] = []
+        passage_embeddings: List[RaggedEmbeddings] = []
 
-        with torch.no_grad():
-            for batch_doc in tqdm(dataloader, desc="Forward pass documents...", leave=False):
-                embeddings_doc = self.model(**batch_doc).to("cpu")
-                passage_embeddings.extend(list(torch.unbind(embeddings_doc)))
+        for batch_doc in tqdm(dataloader, desc="Forward pass documents...", leave=False):
+            passage_embeddings.append(self.pack_passage_batch(self.forward_passage_batch(batch_doc)))
 
-        return passage_embeddings
+        return concat_embeddings(passage_embeddings)
+
+    def forward_passage_batch(self, batch_doc) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Forward pass of a preprocessed batch of passages. Returns the padded embeddings, on the model device, along
+        with the attention mask of the batch.
+        """
+        # NOTE: The grad mode is thread-local, set it here as the pipelined encoder calls this in its own thread
+        with torch.no_grad():
+            embeddings_doc = self.model(**move_to_device(batch_doc, self.device))
+        if str(self.device).startswith("cuda"):
+            # Wait for the kernels, so that the pipelined encoder measures the forward pass in this stage
+            torch.cuda.synchronize(self.device)
+        return embeddings_doc, batch_doc["attention_mask"]
+
+    def pack_passage_batch(self, outputs: Tuple[torch.Tensor, torch.Tensor]) -> RaggedEmbeddings:
+        """
+        Offload the padded embeddings of `forward_passage_batch` to the CPU, and strip the padding tokens, which
+        are zeroed by the model but would still be stored.
+        """
+        embeddings_doc, attention_mask = outputs
+        return RaggedEmbeddings.from_padded(embeddings_doc.to("cpu"), attention_mask)
+
+    def get_passage_encoding_stages(self) -> List[Tuple[str, Callable[[Any], Any]]]:
+        return [
+            ("preprocess", self.process_images),
+            ("forward", self.forward_passage_batch),
+            ("pack", self.pack_passage_batch),
+        ]
 
     def get_scores(
         self,
@@ -112,14 +149,75 @@ class ColPaliRetriever(VisionRetriever):
     ) -> torch.Tensor:
         if batch_size is None:
             raise ValueError("`batch_size` must be provided for ColPaliRetriever's scoring")
+        if isinstance(passage_embeddings, RaggedEmbeddings):
+            passage_embeddings = passage_embeddings.to_list()
         scores = self.processor.score(
             query_embeddings,
             passage_embeddings,
             batch_size=batch_size,
             device="cpu",
+            num_workers=self.num_scoring_workers,
+            backend=self.scoring_backend,
         )
         return scores
 
+    def prepare_passage_embeddings(
+        self,
+        passage_embeddings: Union[torch.Tensor, List[torch.Tensor]],
+        batch_size: Optional[int] = 128,
+    ) -> Any:
+        """
+        Pad the passage embeddings into reusable (possibly quantized) passage blocks. They are not pinned, as they
+        are scored on the CPU. The embeddings are kept as-is when the exact rerank is enabled, as it needs the
+        full-precision passage embeddings, and when they are memory-mapped, as they are then scored block by block
+        without being read into memory at once.
+        """
+        from colpali_engine.utils.scoring_utils import PassageBlocks
+
+        if batch_size is None:
+            raise ValueError("`batch_size` must be provided for ColPaliRetriever's scoring")
+        if self.processor.rerank_top_k is not None or isinstance(passage_embeddings, MemmapEmbeddings):
+            return passage_embeddings
+        if isinstance(passage_embeddings, RaggedEmbeddings):
+            passage_embeddings = passage_embeddings.to_list()
+        return PassageBlocks.from_embeddings(
+            passage_embeddings,
+            batch_size=batch_size,
+            quantization=self.processor.quantization,
+        )
+
+    def get_top_k(
+        self,
+        query_embeddings: Union[torch.Tensor, List[torch.Tensor]],
+        passage_embeddings: Union[torch.Tensor, List[torch.Tensor]],
+        k: int,
+        batch_size: Optional[int] = 128,
+        block_size: int = 1024,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        if batch_size is None:
+            raise ValueError("`batch_size` must be provided for ColPaliRetriever's scoring")
+        if isinstance(passage_embeddings, MemmapEmbeddings):
+            # Only read one block of `block_size` memory-mapped passages at a time
+            return blockwise_top_k(
+                passage_embeddings,
+                lambda block: self.get_top_k(query_embeddings, block, k=k, batch_size=batch_size),
+                k=k,
+                block_size=block_size,
+            )
+        if isinstance(passage_embeddings, RaggedEmbeddings):
+            passage_embeddings = passage_embeddings.to_list()
+        return self.processor.score_multi_vector_top_k(
+            query_embeddings,
+            passage_embeddings,
+            k=k,
+            batch_size=batch_size,
+            device="cpu",
+            num_workers=self.num_scoring_workers,
+            backend=self.scoring_backend,
+            quantization=self.processor.quantization,
+            rerank_top_k=self.processor.rerank_top_k,
+        )
+
 
     def get_matching_scores(
         self,
@@ -131,6 +229,8 @@ class ColPaliRetriever(VisionRetriever):
     ) -> torch.Tensor:
         if batch_size is None:
             raise ValueError("`batch_size` must be provided for ColQwenRetriever's scoring")
+        if isinstance(passage_embeddings, RaggedEmbeddings):
+            passage_embeddings = passage_embeddings.to_list()
         scores = self.processor.matching_score(
             qs=query_embeddings,
             ps=passage_embeddings,
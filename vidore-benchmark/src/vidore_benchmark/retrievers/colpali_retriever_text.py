@@ -6,13 +6,12 @@ from typing import List, Optional, Union, cast
 import torch
 from dotenv import load_dotenv
 from PIL import Image
-from torch.utils.data import DataLoader
 from tqdm import tqdm
 
 from vidore_benchmark.retrievers.registry_utils import register_vision_retriever
 from vidore_benchmark.retrievers.vision_retriever import VisionRetriever
 from vidore_benchmark.utils.data_utils import ListDataset
-from vidore_benchmark.utils.torch_utils import get_torch_device
+from vidore_benchmark.utils.torch_utils import get_torch_device, move_to_device
 
 logger = logging.getLogger(__name__)
 
@@ -31,7 +30,8 @@ class ColPaliRetrieverText(VisionRetriever):
         pretrained_model_name_or_path: str,
         device: str = "auto",
         use_visual: bool = False,
-
+        num_scoring_workers: int = 1,
+        scoring_backend: str = "thread",
     ):
         super().__init__()
 
@@ -46,6 +46,10 @@ class ColPaliRetrieverText(VisionRetriever):
         self.device = get_torch_device(device)
         logger.info(f"Using device: {self.device}")
 
+        # CPU scoring backend (see `processor.score_multi_vector`)
+        self.num_scoring_workers = num_scoring_workers
+        self.scoring_backend = scoring_backend
+
         # Load the model
         self.model = cast(
             ColPali,
@@ -68,19 +72,18 @@ class ColPaliRetrieverText(VisionRetriever):
         return self._use_visual
 
     def process_passages(self, passages: List[str], **kwargs):
-        return self.processor.process_passages(passages=passages).to(self.device)
+        return self.processor.process_passages(passages=passages)
 
     # def process_images(self, images: List[Image.Image], **kwargs):
-    #     return self.processor.process_images(images=images).to(self.device)
+    #     return self.processor.process_images(images=images)
 
     def process_queries(self, queries: List[str], **kwargs):
-        return self.processor.process_queries(queries=queries).to(self.device)
+        return self.processor.process_queries(queries=queries)
 
     def forward_queries(self, queries: List[str], batch_size: int, **kwargs) -> List[torch.Tensor]:
-        dataloader = DataLoader(
-            dataset=ListDataset[str](queries),
+        dataloader = self.get_dataloader(
+            ListDataset[str](queries),
             batch_size=batch_size,
-            shuffle=False,
             collate_fn=self.process_queries,
         )
 
@@ -88,7 +91,7 @@ class ColPaliRetrieverText(VisionRetriever):
 
         with torch.no_grad():
             for batch_query in tqdm(dataloader, desc="Forward pass queries...", leave=False):
-                embeddings_query = self.model(**batch_query).to("cpu")
+                embeddings_query = self.model(**move_to_device(batch_query, self.device)).to("cpu")
                 query_embeddings.extend(list(torch.unbind(embeddings_query)))
 
         return query_embeddings
@@ -99,10 +102,9 @@ class ColPaliRetrieverText(VisionRetriever):
             batch_size: int, 
             **kwargs
         ) -> List[torch.Tensor]:
-        dataloader = DataLoader(
-            dataset=ListDataset[str](passages),
+        dataloader = self.get_dataloader(
+            ListDataset[str](passages),
             batch_size=batch_size,
-            shuffle=False,
             collate_fn=self.process_passages,
         )
 
@@ -110,7 +112,7 @@ class ColPaliRetrieverText(VisionRetriever):
 
         with torch.no_grad():
             for batch_doc in tqdm(dataloader, desc="Forward pass documents...", leave=False):
-                embeddings_doc = self.model(**batch_doc).to("cpu")
+                embeddings_doc = self.model(**move_to_device(batch_doc, self.device)).to("cpu")
                 passage_embeddings.extend(list(torch.unbind(embeddings_doc)))
 
         return passage_embeddings
@@ -130,6 +132,8 @@ class ColPaliRetrieverText(VisionRetriever):
             passage_embeddings,
             batch_size=batch_size,
             device="cpu",
+            num_workers=self.num_scoring_workers,
+            backend=self.scoring_backend,
         )
         return scores
 
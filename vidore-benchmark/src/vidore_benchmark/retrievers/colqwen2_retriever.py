@@ -1,18 +1,20 @@
 from __future__ import annotations
 
 import logging
-from typing import List, Optional, Union, cast
+from typing import Any, Callable, List, Optional, Tuple, Union, cast
 
 import torch
 from dotenv import load_dotenv
 from PIL import Image
-from torch.utils.data import DataLoader
 from tqdm import tqdm
 
 from vidore_benchmark.retrievers.registry_utils import register_vision_retriever
 from vidore_benchmark.retrievers.vision_retriever import VisionRetriever
 from vidore_benchmark.utils.data_utils import ListDataset
-from vidore_benchmark.utils.torch_utils import get_torch_device
+from vidore_benchmark.utils.iter_utils import get_token_budget_batches
+from vidore_benchmark.utils.memmap_utils import MemmapEmbeddings, blockwise_top_k
+from vidore_benchmark.utils.ragged_utils import RaggedEmbeddings, concat_embeddings
+from vidore_benchmark.utils.torch_utils import get_torch_device, move_to_device
 
 logger = logging.getLogger(__name__)
 
@@ -31,6 +33,11 @@ class ColQwen2Retriever(VisionRetriever):
         pretrained_model_name_or_path: str = "vidore/colpali-v1.3",
         device: str = "auto",
         use_visual: bool = True,
+        num_scoring_workers: int = 1,
+        scoring_backend: str = "thread",
+        quantization: Optional[str] = None,
+        rerank_top_k: Optional[int] = None,
+        max_visual_tokens_per_batch: Optional[int] = None,
     ):
         super().__init__()
 
@@ -45,6 +52,10 @@ class ColQwen2Retriever(VisionRetriever):
         self.device = get_torch_device(device)
         logger.info(f"Using device: {self.device}")
 
+        # CPU scoring backend (see `processor.score_multi_vector`)
+        self.num_scoring_workers = num_scoring_workers
+        self.scoring_backend = scoring_backend
+
         # Load the model and LORA adapter
         self.model = cast(
             ColQwen2,
@@ -61,24 +72,29 @@ class ColQwen2Retriever(VisionRetriever):
             ColQwen2Processor,
             ColQwen2Processor.from_pretrained(pretrained_model_name_or_path),
         )
+
+        # Quantized multi-vector scoring (see `processor.score_multi_vector`)
+        self.processor.quantization = quantization
+        self.processor.rerank_top_k = rerank_top_k
         print("Loaded custom processor.\n")
         self._use_visual = use_visual
+        # Batch the passages by visual-token budget instead of by `batch_size` (see `get_passage_batches`)
+        self.max_visual_tokens_per_batch = max_visual_tokens_per_batch
 
     @property
     def use_visual_embedding(self) -> bool:
         return self._use_visual
 
     def process_images(self, images: List[Image.Image], **kwargs):
-        return self.processor.process_images(images=images).to(self.device)
+        return self.processor.process_images(images=images)
 
     def process_queries(self, queries: List[str], **kwargs):
-        return self.processor.process_queries(queries=queries).to(self.device)
+        return self.processor.process_queries(queries=queries)
 
     def forward_queries(self, queries: List[str], batch_size: int, **kwargs) -> List[torch.Tensor]:
-        dataloader = DataLoader(
-            dataset=ListDataset[str](queries),
+        dataloader = self.get_dataloader(
+            ListDataset[str](queries),
             batch_size=batch_size,
-            shuffle=False,
             collate_fn=self.process_queries,
         )
 
@@ -86,27 +102,76 @@ class ColQwen2Retriever(VisionRetriever):
 
         with torch.no_grad():
             for batch_query in tqdm(dataloader, desc="Forward pass queries...", leave=False):
-                embeddings_query = self.model(**batch_query).to("cpu")
+                embeddings_query = self.model(**move_to_device(batch_query, self.device)).to("cpu")
                 query_embeddings.extend(list(torch.unbind(embeddings_query)))
 
         return query_embeddings
 
-    def forward_passages(self, passages: List[Image.Image], batch_size: int, **kwargs) -> List[torch.Tensor]:
-        dataloader = DataLoader(
-            dataset=ListDataset[Image.Image](passages),
+    def get_passage_batches(self, passages: List[Image.Image]) -> Optional[List[List[int]]]:
+        """
+        Batches of passage indices filled up to `max_visual_tokens_per_batch` visual tokens, padding included, the
+        pages being grouped by the grid size of their resized image (see `processor.get_image_grid_size`): many
+        thumbnails fit in a batch, a few tall pages only. None if the passages are batched by `batch_size`.
+        """
+        if self.max_visual_tokens_per_batch is None:
+            return None
+        grid_sizes = [self.processor.get_image_grid_size(image.size) for image in passages]
+        return get_token_budget_batches(
+            [height * width for height, width in grid_sizes],
+            max_tokens_per_batch=self.max_visual_tokens_per_batch,
+            group_keys=grid_sizes,
+        )
+
+    def forward_passages(self, passages: List[Image.Image], batch_size: int, **kwargs) -> RaggedEmbeddings:
+        batches = self.get_passage_batches(passages)
+        dataloader = self.get_dataloader(
+            ListDataset[Image.Image](passages),
             batch_size=batch_size,
-            shuffle=False,
             collate_fn=self.process_images,
+            batches=batches,
         )
 
-        passage_embeddings: List[torch.Tensor] = []
+        passage_embeddings: List[RaggedEmbeddings] = []
 
+        for batch_doc in tqdm(dataloader, desc="Forward pass documents...", leave=False):
+            passage_embeddings.append(self.pack_passage_batch(self.forward_passage_batch(batch_doc)))
+
+        embeddings = concat_embeddings(passage_embeddings)
+        if batches:
+            # Restore the original order of the passages
+            embeddings = embeddings[torch.argsort(torch.tensor([idx for batch in batches for idx in batch]))]
+        return embeddings
+
+    def forward_passage_batch(self, batch_doc) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Forward pass of a preprocessed batch of passages. Returns the padded embeddings, on the model device, along
+        with the attention mask of the batch.
+        """
+        # NOTE: The grad mode is thread-local, set it here as the pipelined encoder calls this in its own thread
         with torch.no_grad():
-            for batch_doc in tqdm(dataloader, desc="Forward pass documents...", leave=False):
-                embeddings_doc = self.model(**batch_doc).to("cpu")
-                passage_embeddings.extend(list(torch.unbind(embeddings_doc)))
+            embeddings_doc = self.model(**move_to_device(batch_doc, self.device))
+        if str(self.device).startswith("cuda"):
+            # Wait for the kernels, so that the pipelined encoder measures the forward pass in this stage
+            torch.cuda.synchronize(self.device)
+        return embeddings_doc, batch_doc["attention_mask"]
 
-        return passage_embeddings
+    def pack_passage_batch(self, outputs: Tuple[torch.Tensor, torch.Tensor]) -> RaggedEmbeddings:
+        """
+        Offload the padded embeddings of `forward_passage_batch` to the CPU, and strip the padding tokens, which
+        are zeroed by the model but would still be stored.
+        """
+        embeddings_doc, attention_mask = outputs
+        return RaggedEmbeddings.from_padded(embeddings_doc.to("cpu"), attention_mask)
+
+    def get_passage_encoding_stages(self) -> Optional[List[Tuple[str, Callable[[Any], Any]]]]:
+        if self.max_visual_tokens_per_batch is not None:
+            # The pipelined encoder batches by count, let `forward_passages` batch its pre-batches by token budget
+            return None
+        return [
+            ("preprocess", self.process_images),
+            ("forward", self.forward_passage_batch),
+            ("pack", self.pack_passage_batch),
+        ]
 
     def get_scores(
         self,
@@ -116,14 +181,75 @@ class ColQwen2Retriever(VisionRetriever):
     ) -> torch.Tensor:
         if batch_size is None:
             raise ValueError("`batch_size` must be provided for ColQwenRetriever's scoring")
+        if isinstance(passage_embeddings, RaggedEmbeddings):
+            passage_embeddings = passage_embeddings.to_list()
         scores = self.processor.score(
             query_embeddings,
             passage_embeddings,
             batch_size=batch_size,
             device="cpu",
+            num_workers=self.num_scoring_workers,
+            backend=self.scoring_backend,
         )
         return scores
 
+    def prepare_passage_embeddings(
+        self,
+        passage_embeddings: Union[torch.Tensor, List[torch.Tensor]],
+        batch_size: Optional[int] = 128,
+    ) -> Any:
+        """
+        Pad the passage embeddings into reusable (possibly quantized) passage blocks. They are not pinned, as they
+        are scored on the CPU. The embeddings are kept as-is when the exact rerank is enabled, as it needs the
+        full-precision passage embeddings, and when they are memory-mapped, as they are then scored block by block
+        without being read into memory at once.
+        """
+        from colpali_engine.utils.scoring_utils import PassageBlocks
+
+        if batch_size is None:
+            raise ValueError("`batch_size` must be provided for ColQwen2Retriever's scoring")
+        if self.processor.rerank_top_k is not None or isinstance(passage_embeddings, MemmapEmbeddings):
+            return passage_embeddings
+        if isinstance(passage_embeddings, RaggedEmbeddings):
+            passage_embeddings = passage_embeddings.to_list()
+        return PassageBlocks.from_embeddings(
+            passage_embeddings,
+            batch_size=batch_size,
+            quantization=self.processor.quantization,
+        )
+
+    def get_top_k(
+        self,
+        query_embeddings: Union[torch.Tensor, List[torch.Tensor]],
+        passage_embeddings: Union[torch.Tensor, List[torch.Tensor]],
+        k: int,
+        batch_size: Optional[int] = 128,
+        block_size: int = 1024,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        if batch_size is None:
+            raise ValueError("`batch_size` must be provided for ColQwenRetriever's scoring")
+        if isinstance(passage_embeddings, MemmapEmbeddings):
+            # Only read one block of `block_size` memory-mapped passages at a time
+            return blockwise_top_k(
+                passage_embeddings,
+                lambda block: self.get_top_k(query_embeddings, block, k=k, batch_size=batch_size),
+                k=k,
+                block_size=block_size,
+            )
+        if isinstance(passage_embeddings, RaggedEmbeddings):
+            passage_embeddings = passage_embeddings.to_list()
+        return self.processor.score_multi_vector_top_k(
+            query_embeddings,
+            passage_embeddings,
+            k=k,
+            batch_size=batch_size,
+            device="cpu",
+            num_workers=self.num_scoring_workers,
+            backend=self.scoring_backend,
+            quantization=self.processor.quantization,
+            rerank_top_k=self.processor.rerank_top_k,
+        )
+
     # def get_matching_scores(
     #     self,
     #     matching_type: str,
@@ -152,6 +278,8 @@ class ColQwen2Retriever(VisionRetriever):
     ) -> torch.Tensor:
         if batch_size is None:
             raise ValueError("`batch_size` must be provided for ColQwenRetriever's scoring")
+        if isinstance(passage_embeddings, RaggedEmbeddings):
+            passage_embeddings = passage_embeddings.to_list()
         scores = self.processor.matching_score(
             qs=query_embeddings,
             ps=passage_embeddings,
@@ -6,12 +6,11 @@ from PIL import Image
 import torch
 from dotenv import load_dotenv
 from PIL import Image
-from torch.utils.data import DataLoader
 from tqdm import tqdm
 from vidore_benchmark.retrievers.registry_utils import register_vision_retriever
 from vidore_benchmark.retrievers.vision_retriever import VisionRetriever
 from vidore_benchmark.utils.data_utils import ListDataset
-from vidore_benchmark.utils.torch_utils import get_torch_device
+from vidore_benchmark.utils.torch_utils import get_torch_device, move_to_device
 from torch.utils.data import Dataset
 from typing import List, TypeVar
 from typing import List, Tuple, Any
@@ -57,6 +56,8 @@ class ColQwen2RetrieverTextImage(VisionRetriever):
         pretrained_model_name_or_path: str = "vidore/colqwen2-v0.1",
         device: str = "auto",
         use_visual: bool = False,
+        num_scoring_workers: int = 1,
+        scoring_backend: str = "thread",
     ):
         super().__init__()
 
@@ -71,6 +72,10 @@ class ColQwen2RetrieverTextImage(VisionRetriever):
         self.device = get_torch_device(device)
         logger.info(f"Using device: {self.device}")
 
+        # CPU scoring backend (see `processor.score_multi_vector`)
+        self.num_scoring_workers = num_scoring_workers
+        self.scoring_backend = scoring_backend
+
         # Load the model and LORA adapter
         self.model = cast(
             ColQwen2,
@@ -95,22 +100,21 @@ class ColQwen2RetrieverTextImage(VisionRetriever):
         return self._use_visual
 
     def process_images_texts(self, passages: List, **kwargs):
-        return self.processor.process_images_texts(passages=passages).to(self.device)
+        return self.processor.process_images_texts(passages=passages)
 
     def process_images(self, images: List[Image.Image], **kwargs):
-        return self.processor.process_images(images=images).to(self.device)
+        return self.processor.process_images(images=images)
 
     def process_queries(self, queries: List[str], **kwargs):
-        return self.processor.process_queries(queries=queries).to(self.device)
+        return self.processor.process_queries(queries=queries)
 
     def process_passages(self, passages: List[str], **kwargs):
-        return self.processor.process_passages(passages=passages).to(self.device)
+        return self.processor.process_passages(passages=passages)
 
     def forward_queries(self, queries: List[str], batch_size: int, **kwargs) -> List[torch.Tensor]:
-        dataloader = DataLoader(
-            dataset=ListDataset[str](queries),
+        dataloader = self.get_dataloader(
+            ListDataset[str](queries),
             batch_size=batch_size,
-            shuffle=False,
             collate_fn=self.process_queries,
         )
 
@@ -118,16 +122,15 @@ class ColQwen2RetrieverTextImage(VisionRetriever):
 
         with torch.no_grad():
             for batch_query in tqdm(dataloader, desc="Forward pass queries...", leave=False):
-                embeddings_query = self.model(**batch_query).to("cpu")
+                embeddings_query = self.model(**move_to_device(batch_query, self.device)).to("cpu")
                 query_embeddings.extend(list(torch.unbind(embeddings_query)))
 
         return query_embeddings
 
     def forward_passages(self, passages: List[Any], batch_size: int, **kwargs) -> List[torch.Tensor]:
-        dataloader = DataLoader(
-            dataset=ImagesTextDataset(passages),
+        dataloader = self.get_dataloader(
+            ImagesTextDataset(passages),
             batch_size=batch_size,
-            shuffle=False,
             collate_fn=self.process_images_texts,
         )
 
@@ -135,7 +138,7 @@ class ColQwen2RetrieverTextImage(VisionRetriever):
 
         with torch.no_grad():
             for batch_doc in tqdm(dataloader, desc="Forward pass documents...", leave=False):
-                embeddings_doc = self.model(**batch_doc).to("cpu")
+                embeddings_doc = self.model(**move_to_device(batch_doc, self.device)).to("cpu")
                 passage_embeddings.extend(list(torch.unbind(embeddings_doc)))
 
         return passage_embeddings
@@ -153,6 +156,8 @@ class ColQwen2RetrieverTextImage(VisionRetriever):
             passage_embeddings,
             batch_size=batch_size,
             device="cpu",
+            num_workers=self.num_scoring_workers,
+            backend=self.scoring_backend,
         )
         return scores
 
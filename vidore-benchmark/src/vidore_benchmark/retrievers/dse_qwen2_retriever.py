@@ -2,7 +2,7 @@ from __future__ import annotations
 
 import logging
 import math
-from typing import List, Optional, Union
+from typing import TYPE_CHECKING, List, Optional, Union
 
 import torch
 from dotenv import load_dotenv
@@ -10,11 +10,16 @@ from PIL import Image
 from tqdm import tqdm
 from transformers import AutoProcessor, Qwen2VLForConditionalGeneration
 
+from vidore_benchmark.retrievers.pq_retriever_mixin import PQRetrieverMixin
 from vidore_benchmark.retrievers.registry_utils import register_vision_retriever
 from vidore_benchmark.retrievers.vision_retriever import VisionRetriever
 from vidore_benchmark.utils.iter_utils import batched
 from vidore_benchmark.utils.torch_utils import get_torch_device
 
+if TYPE_CHECKING:
+    from vidore_benchmark.index.matryoshka_index import MatryoshkaIndex
+    from vidore_benchmark.index.pq_index import PQIndex
+
 logger = logging.getLogger(__name__)
 
 
@@ -22,15 +27,22 @@ load_dotenv(override=True)
 
 
 @register_vision_retriever("dse-qwen2")
-class DSEQwen2Retriever(VisionRetriever):
+class DSEQwen2Retriever(PQRetrieverMixin, VisionRetriever):
     def __init__(
         self,
         pretrained_model_name_or_path: str = "MrLight/dse-qwen2-2b-mrl-v1",
         num_image_tokens: int = 1024,  # 2560 is the original value
         device: str = "auto",
+        pq_n_subquantizers: Optional[int] = None,
+        rerank_top_k: Optional[int] = None,
+        matryoshka_dims: Optional[List[int]] = None,
+        matryoshka_n_candidates: Optional[List[int]] = None,
     ):
         super().__init__()
 
+        if pq_n_subquantizers is not None and matryoshka_dims is not None:
+            raise ValueError("Product quantization and the Matryoshka cascade cannot be combined")
+
         try:
             from qwen_vl_utils import process_vision_info
         except ImportError:
@@ -62,6 +74,14 @@ class DSEQwen2Retriever(VisionRetriever):
         self.processor.tokenizer.padding_side = "left"
         self.model.padding_side = "left"
 
+        # Product-quantized passage storage (see `prepare_passage_embeddings`)
+        self.pq_n_subquantizers = pq_n_subquantizers
+        self.rerank_top_k = rerank_top_k
+
+        # Matryoshka cascaded search (see `prepare_passage_embeddings`)
+        self.matryoshka_dims = matryoshka_dims
+        self.matryoshka_n_candidates = matryoshka_n_candidates
+
         print("Loaded custom processor.\n")
 
     def get_embedding(self, last_hidden_state: torch.Tensor, dimension: int) -> torch.Tensor:
@@ -186,23 +206,25 @@ class DSEQwen2Retriever(VisionRetriever):
 
         return ds
 
-    def get_scores(
+    def prepare_passage_embeddings(
         self,
-        query_embeddings: Union[torch.Tensor, List[torch.Tensor]],
         passage_embeddings: Union[torch.Tensor, List[torch.Tensor]],
         batch_size: Optional[int] = None,
-    ) -> torch.Tensor:
+    ) -> Union[torch.Tensor, List[torch.Tensor], PQIndex, MatryoshkaIndex]:
         """
-        Dot-product similarity between queries and passages.
+        If `matryoshka_dims` is set (e.g. [256, 768, 1536]), the passages are searched with a cascade over the
+        truncated embeddings: the corpus is scanned at `matryoshka_dims[0]` dimensions, and the
+        `matryoshka_n_candidates[i]` best passages of each stage are rescored at the next dimension. Otherwise, they
+        are product-quantized if enabled (see `PQRetrieverMixin`).
         """
-        if isinstance(query_embeddings, list):
-            query_embeddings = torch.stack(query_embeddings)
-        if isinstance(passage_embeddings, list):
-            passage_embeddings = torch.stack(passage_embeddings)
-
-        scores = torch.einsum("bd,cd->bc", query_embeddings, passage_embeddings)
-
-        return scores
+        from vidore_benchmark.index.matryoshka_index import MatryoshkaIndex
+
+        if self.matryoshka_dims is not None:
+            search_kwargs = {"dims": self.matryoshka_dims}
+            if self.matryoshka_n_candidates is not None:
+                search_kwargs["n_candidates"] = self.matryoshka_n_candidates
+            return MatryoshkaIndex.build(passage_embeddings, **search_kwargs)
+        return super().prepare_passage_embeddings(passage_embeddings, batch_size=batch_size)
 
 
     # def get_matching_scores(
@@ -2,7 +2,7 @@ from __future__ import annotations
 
 import logging
 import math
-from typing import List, Optional, Union
+from typing import List, Optional
 
 import torch
 from dotenv import load_dotenv
@@ -10,6 +10,7 @@ from PIL import Image
 from tqdm import tqdm
 from transformers import AutoProcessor, Qwen2VLForConditionalGeneration
 
+from vidore_benchmark.retrievers.pq_retriever_mixin import PQRetrieverMixin
 from vidore_benchmark.retrievers.registry_utils import register_vision_retriever
 from vidore_benchmark.retrievers.vision_retriever import VisionRetriever
 from vidore_benchmark.utils.iter_utils import batched
@@ -22,13 +23,15 @@ load_dotenv(override=True)
 
 
 @register_vision_retriever("gme-qwen2-text")
-class GMEQwen2TextRetriever(VisionRetriever):
+class GMEQwen2TextRetriever(PQRetrieverMixin, VisionRetriever):
     def __init__(
         self,
         pretrained_model_name_or_path: str = "Alibaba-NLP/gme-Qwen2-VL-2B-Instruct",
         num_image_tokens: int = 1024,  # 2560 is the original value
         device: str = "auto",
         use_visual: bool = False,
+        pq_n_subquantizers: Optional[int] = None,
+        rerank_top_k: Optional[int] = None,
     ):
         super().__init__()
 
@@ -62,6 +65,10 @@ class GMEQwen2TextRetriever(VisionRetriever):
         )
         self.processor.tokenizer.padding_side = "left"
         self.model.padding_side = "left"
+
+        # Product-quantized passage storage (see `prepare_passage_embeddings`)
+        self.pq_n_subquantizers = pq_n_subquantizers
+        self.rerank_top_k = rerank_top_k
         self._use_visual = use_visual
 
         print("Loaded custom processor.\n")
@@ -188,21 +195,3 @@ class GMEQwen2TextRetriever(VisionRetriever):
             ds.extend(list(torch.unbind(doc_embeddings.to("cpu"))))
 
         return ds
-
-    def get_scores(
-        self,
-        query_embeddings: Union[torch.Tensor, List[torch.Tensor]],
-        passage_embeddings: Union[torch.Tensor, List[torch.Tensor]],
-        batch_size: Optional[int] = None,
-    ) -> torch.Tensor:
-        """
-        Dot-product similarity between queries and passages.
-        """
-        if isinstance(query_embeddings, list):
-            query_embeddings = torch.stack(query_embeddings)
-        if isinstance(passage_embeddings, list):
-            passage_embeddings = torch.stack(passage_embeddings)
-
-        scores = torch.einsum("bd,cd->bc", query_embeddings, passage_embeddings)
-
-        return scores
@@ -1,11 +1,12 @@
 import math
-from typing import List, Optional, Union, cast
+from typing import List, Optional, Tuple, Union, cast
 import torch
 from tqdm import tqdm
-from vidore_benchmark.evaluation.scoring import score_multi_vector
+from vidore_benchmark.evaluation.scoring import score_multi_vector, score_multi_vector_top_k
 from vidore_benchmark.retrievers.registry_utils import register_vision_retriever
 from vidore_benchmark.retrievers.vision_retriever import VisionRetriever
 from vidore_benchmark.utils.iter_utils import batched
+from vidore_benchmark.utils.memmap_utils import MemmapEmbeddings, blockwise_top_k
 from vidore_benchmark.utils.torch_utils import get_torch_device
 
 
@@ -102,3 +103,23 @@ class JinaaiColbertRetriever(VisionRetriever):
             raise ValueError("The batch size must be specified for the ColBERT scoring.")
         scores = score_multi_vector(query_embeddings, passage_embeddings, batch_size=batch_size)
         return scores
+
+    def get_top_k(
+        self,
+        query_embeddings: Union[torch.Tensor, List[torch.Tensor]],
+        passage_embeddings: Union[torch.Tensor, List[torch.Tensor]],
+        k: int,
+        batch_size: Optional[int] = 4,
+        block_size: int = 1024,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        if batch_size is None:
+            raise ValueError("The batch size must be specified for the ColBERT scoring.")
+        if isinstance(passage_embeddings, MemmapEmbeddings):
+            # Only read one block of `block_size` memory-mapped passages at a time
+            return blockwise_top_k(
+                passage_embeddings,
+                lambda block: self.get_top_k(query_embeddings, block, k=k, batch_size=batch_size),
+                k=k,
+                block_size=block_size,
+            )
+        return score_multi_vector_top_k(query_embeddings, passage_embeddings, k=k, batch_size=batch_size)
@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, List, Optional, Union
+
+import torch
+
+if TYPE_CHECKING:
+    from vidore_benchmark.index.pq_index import PQIndex
+
+
+class PQRetrieverMixin:
+    """
+    Product-quantized passage storage, with asymmetric (ADC) scoring, for the single-vector retrievers. The
+    retriever sets `pq_n_subquantizers` (None to disable the quantization) and `rerank_top_k` in its `__init__`.
+
+    NOTE: `vidore_benchmark.index` is imported lazily, as it imports the retrievers.
+    """
+
+    pq_n_subquantizers: Optional[int] = None
+    rerank_top_k: Optional[int] = None
+
+    def prepare_passage_embeddings(
+        self,
+        passage_embeddings: Union[torch.Tensor, List[torch.Tensor]],
+        batch_size: Optional[int] = None,
+    ) -> Union[torch.Tensor, List[torch.Tensor], PQIndex]:
+        """
+        Encode the passage embeddings with `pq_n_subquantizers` bytes each if product quantization is enabled.
+        The full-precision embeddings are only kept for the exact rerank of the `rerank_top_k` best candidates.
+        """
+        from vidore_benchmark.index.pq_index import PQIndex
+
+        if self.pq_n_subquantizers is None:
+            return passage_embeddings
+        return PQIndex.build(
+            passage_embeddings,
+            n_subquantizers=self.pq_n_subquantizers,
+            rerank_top_k=self.rerank_top_k,
+        )
+
+    def get_scores(
+        self,
+        query_embeddings: Union[torch.Tensor, List[torch.Tensor]],
+        passage_embeddings: Union[torch.Tensor, List[torch.Tensor], PQIndex],
+        batch_size: Optional[int] = None,
+    ) -> torch.Tensor:
+        """
+        Dot-product similarity between queries and passages. If `passage_embeddings` is a `PQIndex`, the
+        asymmetric (ADC) scores of its product-quantized passages are returned.
+        """
+        from vidore_benchmark.index.pq_index import PQIndex
+
+        if isinstance(passage_embeddings, PQIndex):
+            return passage_embeddings.score(query_embeddings)
+        if isinstance(query_embeddings, list):
+            query_embeddings = torch.stack(query_embeddings)
+        if isinstance(passage_embeddings, list):
+            passage_embeddings = torch.stack(passage_embeddings)
+
+        scores = torch.einsum("bd,cd->bc", query_embeddings, passage_embeddings)
+
+        return scores
@@ -1,22 +1,106 @@
 from __future__ import annotations
 
+import functools
+import hashlib
+import json
 import logging
 from abc import ABC, abstractmethod
-from typing import Any, Dict, List, Optional, Tuple, Union
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sized, Tuple, Union
 
 import torch
 from datasets import Dataset
+from torch.utils.data import DataLoader
 
 from vidore_benchmark.evaluation.eval_utils import CustomRetrievalEvaluator
+from vidore_benchmark.evaluation.scoring import merge_top_k
+from vidore_benchmark.index.base_index import SEARCH_INDEX_REGISTRY, BaseSearchIndex
+from vidore_benchmark.utils.embedding_cache import EmbeddingCache
+from vidore_benchmark.utils.memmap_utils import iter_live_blocks
 
 logger = logging.getLogger(__name__)
 
+# Processor attributes that change the query embeddings (see `VisionRetriever.get_query_cache_namespace`)
+QUERY_PROCESSOR_ATTRIBUTES = ("query_prefix", "query_augmentation_token", "query_suffix", "mock_image")
+
+
+def _with_embedding_cache(forward_fn, cache_attribute: str, get_namespace_attribute: str):
+    """
+    Make `forward_fn` (`forward_queries` or `forward_passages`) look up the embedding cache stored in the
+    `cache_attribute` attribute of the retriever first, if it has one, and encode the cache misses only.
+    """
+    in_forward_attribute = f"_in_cached_{forward_fn.__name__}"
+
+    @functools.wraps(forward_fn)
+    def wrapper(self, inputs, batch_size: int, **kwargs):
+        cache = getattr(self, cache_attribute, None)
+        # NOTE: A retriever subclassing another one calls the wrapped method of its parent
+        if cache is None or getattr(self, in_forward_attribute, False):
+            return forward_fn(self, inputs, batch_size, **kwargs)
+
+        setattr(self, in_forward_attribute, True)
+        try:
+            return cache.embed(
+                getattr(self, get_namespace_attribute)(),
+                inputs,
+                lambda missing_inputs: forward_fn(self, missing_inputs, batch_size, **kwargs),
+            )
+        finally:
+            setattr(self, in_forward_attribute, False)
+
+    return wrapper
+
+
+class _ItemDataset(torch.utils.data.Dataset):
+    """
+    Dataset whose "indices" are the items themselves, for the streamed batches of items of
+    `VisionRetriever.get_batch_dataloader`.
+    """
+
+    def __getitem__(self, item: Any) -> Any:
+        return item
+
+
+_ITEM_DATASET = _ItemDataset()
+
+
+class _PassBatchSampler:
+    """
+    Batch sampler yielding the batches of the current pass of a `DataLoader` (see `VisionRetriever.get_dataloader`).
+    The batches are replaced between the passes, so that a `DataLoader` with persistent workers is iterated again
+    over new batches.
+    """
+
+    def __init__(self):
+        self.batches: Iterable[List[Any]] = []
+
+    def __iter__(self):
+        return iter(self.batches)
+
+    def __len__(self) -> int:
+        if not isinstance(self.batches, Sized):
+            raise TypeError("The batches of the current pass are streamed, their number is unknown")
+        return len(self.batches)
+
 
 class VisionRetriever(ABC):
     """
     Abstract class for vision retrievers used in the ViDoRe benchmark.
+
+    The `forward_queries` and `forward_passages` methods of every retriever go through the query and passage
+    embedding caches, if they are set with `set_query_embedding_cache` and `set_passage_embedding_cache`.
     """
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if "forward_queries" in cls.__dict__:
+            cls.forward_queries = _with_embedding_cache(
+                cls.__dict__["forward_queries"], "query_embedding_cache", "get_query_cache_namespace"
+            )
+        if "forward_passages" in cls.__dict__:
+            cls.forward_passages = _with_embedding_cache(
+                cls.__dict__["forward_passages"], "passage_embedding_cache", "get_embedding_cache_namespace"
+            )
+
     @abstractmethod
     def __init__(self, **kwargs):
         """
@@ -87,6 +171,264 @@ class VisionRetriever(ABC):
         """
         pass
 
+    def get_passage_encoding_stages(self) -> Optional[List[Tuple[str, Callable[[Any], Any]]]]:
+        """
+        Stages of `forward_passages` on a batch of passages, run concurrently by the pipelined encoder (see
+        `evaluation.encoding.encode_passages`), e.g. the preprocessing, the model forward pass and the packing of
+        the outputs. The first stage is called on a list of passages, each stage on the output of the previous
+        one, and the last one returns the embeddings of the batch, as `forward_passages` does.
+
+        NOTE: Override this method if the preprocessing and the forward pass of the retriever can be split. By
+        default (None), the pipelined encoder runs `forward_passages` as a single stage.
+        """
+        return None
+
+    def set_preprocessing_workers(self, num_workers: int, prefetch_factor: int = 2):
+        """
+        Preprocess the queries and passages (image conversion and resizing, tokenization) in `num_workers` worker
+        processes of the `DataLoader`s of `forward_queries` and `forward_passages` (see `get_dataloader`), each
+        preparing up to `prefetch_factor` batches ahead. With 0, the batches are preprocessed in the main process.
+        """
+        self.num_preprocessing_workers = num_workers
+        self.preprocessing_prefetch_factor = prefetch_factor
+        # The worker processes of the current loaders are shut down with them
+        self._dataloaders: Dict[Callable[[List[Any]], Any], DataLoader] = {}
+
+    def get_dataloader(
+        self,
+        dataset: Any,
+        batch_size: int,
+        collate_fn: Callable[[List[Any]], Any],
+        batches: Optional[List[List[int]]] = None,
+    ) -> DataLoader:
+        """
+        `DataLoader` of the batches of a forward pass, preprocessed by `collate_fn` in the preprocessing workers
+        (see `set_preprocessing_workers`). The batches are consecutive items of `dataset`, or the given lists of
+        indices `batches` (e.g. from `get_token_budget_batches`).
+
+        Only the indices of the batches are sent to the workers, which fetch the items from `dataset` themselves:
+        they inherit it when they are forked (it is pickled once per worker with the other start methods). The
+        loader of each `collate_fn` is kept for the next passes over the same dataset, with persistent workers.
+
+        The batches are CPU tensors, pinned when the model is on a CUDA device so that they are moved to it
+        asynchronously (see `torch_utils.move_to_device`) while the next batches are preprocessed.
+        """
+        if batches is None:
+            batches = [
+                list(range(start, min(start + batch_size, len(dataset))))
+                for start in range(0, len(dataset), batch_size)
+            ]
+        return self._get_pass_dataloader(dataset, batches, collate_fn)
+
+    def get_batch_dataloader(self, batches: Iterable[List[Any]], collate_fn: Callable[[List[Any]], Any]) -> DataLoader:
+        """
+        Same as `get_dataloader`, for the given batches of items, e.g. the batches of pages streamed by the
+        pipelined encoder (see `evaluation.encoding.encode_passages`). `batches` can be a generator: it is consumed
+        as the preprocessing workers need new batches, and the items of each batch are sent to the workers. The
+        loader is kept across the calls, with persistent workers.
+        """
+        return self._get_pass_dataloader(_ITEM_DATASET, batches, collate_fn)
+
+    def _get_pass_dataloader(
+        self,
+        dataset: Any,
+        batches: Iterable[List[Any]],
+        collate_fn: Callable[[List[Any]], Any],
+    ) -> DataLoader:
+        """
+        Loader of `collate_fn` set to iterate over `batches`, rebuilt if its dataset is not `dataset`.
+        """
+        if not hasattr(self, "_dataloaders"):
+            self._dataloaders = {}
+        dataloader = self._dataloaders.get(collate_fn)
+        if dataloader is None or dataloader.dataset is not dataset:
+            # NOTE: The workers of the previous loader are shut down with it
+            num_workers = getattr(self, "num_preprocessing_workers", 0)
+            dataloader = self._dataloaders[collate_fn] = DataLoader(
+                dataset=dataset,
+                batch_sampler=_PassBatchSampler(),
+                collate_fn=collate_fn,
+                num_workers=num_workers,
+                pin_memory=str(getattr(self, "device", "cpu")).startswith("cuda"),
+                prefetch_factor=getattr(self, "preprocessing_prefetch_factor", 2) if num_workers > 0 else None,
+                persistent_workers=num_workers > 0,
+            )
+
+        dataloader.batch_sampler.batches = batches
+        return dataloader
+
+    def set_passage_embedding_cache(self, cache: Optional[EmbeddingCache]):
+        """
+        Look up the passage embeddings in `cache` before encoding them (see `EmbeddingCache`), or stop using the
+        cache if None.
+        """
+        self.passage_embedding_cache = cache
+
+    def set_query_embedding_cache(self, cache: Optional[EmbeddingCache]):
+        """
+        Look up the query embeddings in `cache` before encoding them (see `EmbeddingCache`), or stop using the
+        cache if None.
+        """
+        self.query_embedding_cache = cache
+
+    def get_query_cache_namespace(self) -> str:
+        """
+        Namespace of the query embeddings of the retriever in the embedding cache: the passage namespace (see
+        `get_embedding_cache_namespace`) and the query prefix / suffix config of the processor.
+        """
+        processor = getattr(self, "processor", None)
+        query_config = {
+            attribute: str(getattr(processor, attribute))
+            for attribute in QUERY_PROCESSOR_ATTRIBUTES
+            if hasattr(processor, attribute)
+        }
+        query_config_hash = hashlib.sha256(json.dumps(query_config, sort_keys=True).encode()).hexdigest()
+        return f"query:{self.get_embedding_cache_namespace()}:{query_config_hash}"
+
+    def get_embedding_cache_namespace(self) -> str:
+        """
+        Namespace of the passage embeddings of the retriever in the embedding cache: the hash of the retriever
+        class, the model id and the processor config. Two retrievers with the same namespace must produce the
+        same passage embeddings.
+
+        NOTE: Override this method if the passage embeddings depend on other parameters of the retriever.
+        """
+        model = getattr(self, "model", None)
+        model_id = getattr(self, "pretrained_model_name_or_path", None) or getattr(model, "name_or_path", None)
+
+        processor = getattr(self, "processor", None)
+        try:
+            processor_config = processor.to_json_string() if processor is not None else None
+        except (TypeError, ValueError, AttributeError):
+            # Processors without a JSON config: fall back on their image processor config
+            image_processor = getattr(processor, "image_processor", None)
+            processor_config = image_processor.to_json_string() if image_processor is not None else repr(processor)
+
+        processor_config_hash = hashlib.sha256(str(processor_config).encode()).hexdigest()
+        return f"{type(self).__name__}:{model_id}:{processor_config_hash}"
+
+    def prepare_passage_embeddings(
+        self,
+        passage_embeddings: Union[torch.Tensor, List[torch.Tensor]],
+        batch_size: Optional[int] = None,
+    ) -> Any:
+        """
+        Prepare the passage embeddings once for repeated scoring (e.g. evaluating several query sets against the same
+        index). The output can be passed to `get_scores` and `get_top_k` in place of the passage embeddings.
+
+        NOTE: Override this method if the retriever can precompute passage-side scoring structures.
+        """
+        return passage_embeddings
+
+    def build_search_index(
+        self,
+        passage_embeddings: Union[torch.Tensor, List[torch.Tensor]],
+        index_type: str,
+        **kwargs,
+    ) -> BaseSearchIndex:
+        """
+        Build an approximate search index of the passage embeddings. The index can be saved next to the embeddings
+        and passed to the evaluation functions in place of them.
+
+        Inputs:
+        - passage_embeddings: torch.Tensor (n_passages, emb_dim_doc) or List[torch.Tensor] (emb_dim_doc)
+        - index_type: str, registered search index (e.g. `ivf_flat`, `ivf_pq`, `hnsw` for the single-vector
+            retrievers, `plaid`, `muvera` for the multi-vector retrievers)
+        - kwargs: construction and default search parameters of the index
+
+        Output:
+        - search_index: BaseSearchIndex
+
+        NOTE: Override this method if the retriever needs to transform its embeddings before indexing.
+        """
+        if index_type not in SEARCH_INDEX_REGISTRY:
+            raise ValueError(
+                f"Unknown search index `{index_type}`. Available indexes: {list(SEARCH_INDEX_REGISTRY.keys())}"
+            )
+        return SEARCH_INDEX_REGISTRY[index_type].build(passage_embeddings, **kwargs)
+
+    def get_top_k(
+        self,
+        query_embeddings: Union[torch.Tensor, List[torch.Tensor]],
+        passage_embeddings: Union[torch.Tensor, List[torch.Tensor]],
+        k: int,
+        batch_size: Optional[int] = None,
+        block_size: int = 1024,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Get the top-k passages of each query.
+
+        The passages are scored in blocks of `block_size` passages with `get_scores`, and each block is merged
+        into a running top-k per query. The dense (n_queries, n_passages) score matrix is thus never built. The
+        deleted passages of a memmap index are skipped (see `iter_live_blocks`).
+
+        NOTE: Override this method if the retriever has a native streaming top-k search.
+
+        Inputs:
+        - query_embeddings: torch.Tensor (n_queries, emb_dim_query) or List[torch.Tensor] (emb_dim_query)
+        - passage_embeddings: torch.Tensor (n_passages, emb_dim_doc) or List[torch.Tensor] (emb_dim_doc)
+        - k: int
+        - batch_size: Optional[int]
+        - block_size: int
+
+        Output:
+        - top_k_indices: torch.Tensor (n_queries, min(k, n_passages)), sorted by decreasing score
+        - top_k_scores: torch.Tensor (n_queries, min(k, n_passages))
+        """
+        if k < 1:
+            raise ValueError("`k` must be at least one")
+
+        top_k_scores = torch.empty((len(query_embeddings), 0), dtype=torch.float32)
+        top_k_indices = torch.empty((len(query_embeddings), 0), dtype=torch.long)
+
+        for block_indices, block_embeddings in iter_live_blocks(passage_embeddings, block_size):
+            block_scores = self.get_scores(query_embeddings, block_embeddings, batch_size=batch_size)
+
+            top_k_scores, top_k_indices = merge_top_k(
+                top_k_scores,
+                top_k_indices,
+                block_scores.to(dtype=torch.float32, device="cpu"),
+                block_indices,
+                k,
+            )
+
+        return top_k_indices, top_k_scores
+
+    def get_relevant_docs_results_from_top_k(
+        self,
+        ds: Dataset,
+        queries: List[str],
+        top_k_indices: torch.Tensor,
+        top_k_scores: torch.Tensor,
+        doc_ids: Optional[List[Optional[str]]] = None,
+    ) -> Tuple[Dict[str, float], Dict[str, Dict[str, float]]]:
+        """
+        Same as `get_relevant_docs_results`, but from the output of `get_top_k` instead of the dense scores.
+
+        When several passages share the same filename, the best score is kept. The padding entries of the
+        search indexes (index -1) are skipped.
+
+        By default, the passages are the rows of `ds`. If `doc_ids` is provided, the filename of the i-th passage
+        is `doc_ids[i]` instead, and the passages whose doc id is None (deleted passages) are skipped.
+        """
+        relevant_docs = {}
+        results = {}
+
+        queries2filename = {query: image_filename for query, image_filename in zip(ds["query"], ds["image_filename"])}
+        passages2filename = ds["image_filename"] if doc_ids is None else doc_ids
+
+        for query, indices_per_query, scores_per_query in zip(queries, top_k_indices.tolist(), top_k_scores.tolist()):
+            relevant_docs[query] = {queries2filename[query]: 1}
+            results[query] = {}
+
+            # The passages are sorted by decreasing score, so the first occurrence of a filename is its best score
+            for docidx, score_passage in zip(indices_per_query, scores_per_query):
+                if docidx < 0 or passages2filename[docidx] is None:
+                    continue
+                results[query].setdefault(passages2filename[docidx], score_passage)
+
+        return relevant_docs, results
+
     def get_relevant_docs_results(
         self,
         ds: Dataset,
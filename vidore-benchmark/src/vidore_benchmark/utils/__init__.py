@@ -1,4 +1,17 @@
 from .data_utils import ListDataset
+from .embedding_cache import EmbeddingCache
 from .iter_utils import batched, islice
+from .jsonl_utils import iter_jsonl_pages
 from .logging_utils import setup_logging
+from .memmap_utils import (
+    MemmapEmbeddings,
+    MemmapIndexWriter,
+    ShardedIndexWriter,
+    is_memmap_index,
+    load_doc_ids,
+    load_memmap_embeddings,
+    save_memmap_embeddings,
+)
+from .pagepack_utils import PagePack, PagePackWriter, is_page_pack, iter_page_pack
+from .ragged_utils import RaggedEmbeddings, concat_embeddings, load_embeddings, save_embeddings
 from .torch_utils import get_torch_device, tear_down_torch
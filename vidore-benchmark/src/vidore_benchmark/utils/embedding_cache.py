@@ -0,0 +1,257 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, List, Optional, Sequence, Tuple, Union
+
+import torch
+from PIL import Image
+
+from vidore_benchmark.utils.ragged_utils import RaggedEmbeddings
+
+logger = logging.getLogger(__name__)
+
+CACHE_ENTRY_SUFFIX = ".pt"
+
+
+def hash_passage(passage: Any) -> Optional[str]:
+    """
+    Content hash of a passage: the decoded pixels of an image (so that the same page stored as PNG or JPEG-decoded
+    pixels hashes the same), the text of a text passage, or the contents of a tuple, list or dict of them (e.g.
+    the image-text passages). Returns None for the passages that cannot be hashed, which are never cached.
+    """
+    hasher = hashlib.blake2b(digest_size=32)
+
+    def update(value: Any) -> bool:
+        if isinstance(value, Image.Image):
+            hasher.update(f"image:{value.mode}:{value.size}".encode())
+            hasher.update(value.tobytes())
+        elif isinstance(value, str):
+            hasher.update(b"str:" + value.encode("utf-8"))
+        elif isinstance(value, bytes):
+            hasher.update(b"bytes:" + value)
+        elif isinstance(value, (int, float, bool)) or value is None:
+            hasher.update(f"{type(value).__name__}:{value}".encode())
+        elif isinstance(value, (list, tuple)):
+            hasher.update(f"seq:{len(value)}".encode())
+            return all(update(item) for item in value)
+        elif isinstance(value, dict):
+            hasher.update(f"dict:{len(value)}".encode())
+            return all(update(str(key)) and update(value[key]) for key in sorted(value, key=str))
+        else:
+            return False
+        return True
+
+    return hasher.hexdigest() if update(passage) else None
+
+
+def split_embeddings(
+    embeddings: Union[RaggedEmbeddings, torch.Tensor, List[torch.Tensor]],
+) -> Tuple[str, List[torch.Tensor]]:
+    """
+    Split the output of `forward_passages` into per-passage tensors, along with its kind (`ragged`, `tensor` or
+    `list`) to join them back with `join_embeddings`.
+    """
+    if isinstance(embeddings, RaggedEmbeddings):
+        return "ragged", list(embeddings)
+    if isinstance(embeddings, torch.Tensor):
+        return "tensor", list(torch.unbind(embeddings))
+    return "list", list(embeddings)
+
+
+def join_embeddings(
+    kind: str, embeddings: List[torch.Tensor]
+) -> Union[RaggedEmbeddings, torch.Tensor, List[torch.Tensor]]:
+    if kind == "ragged":
+        return RaggedEmbeddings.from_list(embeddings)
+    if kind == "tensor" and len({emb.shape for emb in embeddings}) == 1:
+        return torch.stack(embeddings)
+    return embeddings
+
+
+class EmbeddingCache:
+    """
+    Persistent, content-addressed cache of passage (or query) embeddings, shared across datasets and runs.
+
+    An entry is keyed by the namespace of the retriever (model id and processor config hash, see
+    `VisionRetriever.get_embedding_cache_namespace`) and the content hash of the passage (see `hash_passage`), so
+    a page is encoded once per model, even if it appears in several datasets or collections.
+
+    The cache has two tiers:
+    - on disk (if `cache_dir` is provided): each entry is a small `.pt` file, and the least recently used entries
+        are evicted once the cache exceeds `max_size_bytes`.
+    - in memory (if `memory_max_entries` > 0): the `memory_max_entries` most recently used entries, e.g. for the
+        queries of a serving process.
+
+    The numbers of hits and misses are counted to report the hit rate.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Optional[str] = None,
+        max_size_bytes: int = 50 * 1024**3,
+        memory_max_entries: int = 0,
+        name: str = "Passage",
+    ):
+        """
+        Inputs:
+            - cache_dir: cache directory, created if needed. Without it, the cache is in memory only.
+            - max_size_bytes: size of the cache directory above which the least recently used entries are evicted
+            - memory_max_entries: number of entries kept in memory
+            - name: name of the embeddings in the logs
+        """
+        if cache_dir is None and memory_max_entries <= 0:
+            raise ValueError("The cache needs a `cache_dir` or a positive `memory_max_entries`")
+
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        self.memory_max_entries = memory_max_entries
+        self.name = name
+        self.n_hits = 0
+        self.n_misses = 0
+
+        self.memory: OrderedDict[str, Tuple[str, torch.Tensor]] = OrderedDict()
+        self.size_bytes = 0
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            self.size_bytes = sum(os.path.getsize(path) for path in self._list_entries())
+
+    def _list_entries(self) -> List[str]:
+        return [
+            os.path.join(root, filename)
+            for root, _, filenames in os.walk(self.cache_dir)
+            for filename in filenames
+            if filename.endswith(CACHE_ENTRY_SUFFIX)
+        ]
+
+    def _get_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key + CACHE_ENTRY_SUFFIX)
+
+    @staticmethod
+    def get_key(namespace: str, passage: Any) -> Optional[str]:
+        passage_hash = hash_passage(passage)
+        if passage_hash is None:
+            return None
+        return hashlib.blake2b(f"{namespace}:{passage_hash}".encode(), digest_size=32).hexdigest()
+
+    @property
+    def hit_rate(self) -> float:
+        n_lookups = self.n_hits + self.n_misses
+        return self.n_hits / n_lookups if n_lookups > 0 else 0.0
+
+    def get(self, key: str) -> Optional[Tuple[str, torch.Tensor]]:
+        """
+        Returns the kind and the embedding of an entry, or None if it is not cached.
+        """
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return self.memory[key]
+        if self.cache_dir is None:
+            return None
+
+        path = self._get_path(key)
+        try:
+            entry = torch.load(path, weights_only=True)
+        except (FileNotFoundError, RuntimeError, EOFError):
+            # Missing, or evicted / corrupted by another process
+            return None
+        # Mark the entry as recently used
+        os.utime(path)
+        self._put_in_memory(key, entry["kind"], entry["embedding"])
+        return entry["kind"], entry["embedding"]
+
+    def _put_in_memory(self, key: str, kind: str, embedding: torch.Tensor):
+        if self.memory_max_entries <= 0:
+            return
+        self.memory[key] = (kind, embedding)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_max_entries:
+            self.memory.popitem(last=False)
+
+    def put(self, key: str, kind: str, embedding: torch.Tensor):
+        # NOTE: Clone to keep the tokens of this passage only, not the whole storage the view belongs to
+        embedding = embedding.detach().cpu().clone()
+        self._put_in_memory(key, kind, embedding)
+        if self.cache_dir is None:
+            return
+
+        path = self._get_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        torch.save({"kind": kind, "embedding": embedding}, tmp_path)
+        os.replace(tmp_path, path)
+
+        self.size_bytes += os.path.getsize(path)
+        if self.size_bytes > self.max_size_bytes:
+            self.evict()
+
+    def evict(self, target_fraction: float = 0.9):
+        """
+        Remove the least recently used entries until the cache is below `target_fraction` of its maximum size.
+        """
+        entries = []
+        for path in self._list_entries():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+
+        self.size_bytes = sum(size for _, size, _ in entries)
+        n_evicted = 0
+        for _, size, path in entries:
+            if self.size_bytes <= target_fraction * self.max_size_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.size_bytes -= size
+            n_evicted += 1
+        logger.info(f"Evicted {n_evicted} {self.name.lower()} embeddings from the cache `{self.cache_dir}`")
+
+    def embed(
+        self,
+        namespace: str,
+        passages: Sequence[Any],
+        forward_fn: Callable[[List[Any]], Union[RaggedEmbeddings, torch.Tensor, List[torch.Tensor]]],
+    ) -> Union[RaggedEmbeddings, torch.Tensor, List[torch.Tensor]]:
+        """
+        Embed the passages with the cached embeddings, calling `forward_fn` on the cache misses only. The output
+        has the same type as the output of `forward_fn`.
+        """
+        keys = [self.get_key(namespace, passage) for passage in passages]
+        embeddings: List[Optional[torch.Tensor]] = [None] * len(passages)
+        kind = None
+
+        for idx, key in enumerate(keys):
+            entry = self.get(key) if key is not None else None
+            if entry is not None:
+                kind, embeddings[idx] = entry
+
+        missing_ids = [idx for idx, embedding in enumerate(embeddings) if embedding is None]
+        self.n_hits += len(passages) - len(missing_ids)
+        self.n_misses += len(missing_ids)
+        logger.info(f"{self.name} embedding cache: {len(passages) - len(missing_ids)}/{len(passages)} hits")
+
+        if missing_ids:
+            kind, missing_embeddings = split_embeddings(forward_fn([passages[idx] for idx in missing_ids]))
+            for idx, embedding in zip(missing_ids, missing_embeddings):
+                embeddings[idx] = embedding
+                if keys[idx] is not None:
+                    self.put(keys[idx], kind, embedding)
+
+        if kind is None:
+            # No passages
+            return forward_fn([])
+        return join_embeddings(kind, embeddings)
+
+    def get_stats(self) -> str:
+        stats = f"{self.n_hits} hits, {self.n_misses} misses (hit rate: {self.hit_rate:.1%})"
+        if self.cache_dir is not None:
+            stats += f", {self.size_bytes / 1024**3:.2f} GB in `{self.cache_dir}`"
+        return stats
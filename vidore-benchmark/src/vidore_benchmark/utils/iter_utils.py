@@ -1,4 +1,8 @@
+import multiprocessing
 import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Hashable, List, Optional, Sequence
 
 
 def islice(iterable, *args):
@@ -40,3 +44,82 @@ def batched(iterable, n: int):
     it = iter(iterable)
     while batch := tuple(islice(it, n)):
         yield batch
+
+
+def get_token_budget_batches(
+    n_tokens: Sequence[int],
+    max_tokens_per_batch: int,
+    group_keys: Optional[Sequence[Hashable]] = None,
+    max_batch_size: Optional[int] = None,
+) -> List[List[int]]:
+    """
+    Group items of different numbers of tokens into batches of indices whose padded size (number of items times
+    the largest number of tokens of the batch) fits in `max_tokens_per_batch`, instead of batches of a fixed
+    number of items: many small items fit in a batch, a few large ones only.
+
+    The items are sorted by number of tokens, then by `group_keys` (e.g. the image grid size), so that the items
+    of a batch have close sizes and little padding. An item larger than the budget is alone in its batch. The
+    outputs of the batches are in the sorted order, restore the original one with the concatenated indices.
+    >>> get_token_budget_batches([4, 1, 2, 1], max_tokens_per_batch=4) → [[1, 3], [2], [0]]
+    """
+    if max_tokens_per_batch < 1:
+        raise ValueError("max_tokens_per_batch must be at least one")
+
+    order = sorted(
+        range(len(n_tokens)),
+        key=lambda idx: (n_tokens[idx], group_keys[idx] if group_keys is not None else 0, idx),
+    )
+    batches: List[List[int]] = []
+    batch: List[int] = []
+    for idx in order:
+        # NOTE: The items are sorted, the current one is the largest of the batch
+        is_full = max_batch_size is not None and len(batch) >= max_batch_size
+        if batch and (is_full or (len(batch) + 1) * n_tokens[idx] > max_tokens_per_batch):
+            batches.append(batch)
+            batch = []
+        batch.append(idx)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def parallel_map_ordered(
+    fn,
+    tasks,
+    n_workers: int,
+    max_pending: Optional[int] = None,
+    initializer=None,
+    initargs=(),
+):
+    """
+    Yield `fn(*task)` for each task, in order, computed by a pool of `n_workers` processes. At most
+    `max_pending` tasks (defaults to twice the number of workers) are submitted ahead of the consumer, so that
+    the results waiting to be consumed stay bounded in memory. With 0 workers, the tasks run in the calling
+    process.
+    >>> parallel_map_ordered(pow, [(2, 3), (3, 2)], n_workers=2) → 8 9
+    """
+    if n_workers == 0:
+        if initializer is not None:
+            initializer(*initargs)
+        for task in tasks:
+            yield fn(*task)
+        return
+
+    # NOTE: "spawn" workers do not inherit the CUDA context or the threads of the main process
+    executor = ProcessPoolExecutor(
+        max_workers=n_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=initializer,
+        initargs=initargs,
+    )
+    try:
+        tasks = iter(tasks)
+        pending = deque()
+        for task in tasks:
+            pending.append(executor.submit(fn, *task))
+            if len(pending) >= (max_pending or 2 * n_workers):
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,188 @@
+from __future__ import annotations
+
+import base64
+import io
+import json
+import os
+from typing import Any, Callable, Collection, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from PIL import Image
+
+from vidore_benchmark.utils.iter_utils import parallel_map_ordered
+
+try:
+    import orjson
+
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+PAGE_FIELDS = ("query", "image", "image_filename", "text_description")
+
+# Filenames whose image is not decoded by the workers (see `iter_jsonl_pages`), set once per worker process
+_worker_maybe_skipped: Collection[str] = frozenset()
+
+
+def decode_page_image(data: Dict[str, Any], image_dir: Optional[str] = None) -> Image.Image:
+    """
+    Decode the image of a JSONL page: the base64-encoded `image` field, or the `image_filename` file of
+    `image_dir` if provided.
+    """
+    if image_dir is not None:
+        image = Image.open(os.path.join(image_dir, str(data["image_filename"])))
+    else:
+        image = Image.open(io.BytesIO(base64.b64decode(data["image"])))
+    # NOTE: PIL decodes the pixels lazily, force it so that it runs in the calling (worker) process
+    image.load()
+    return image
+
+
+def parse_page(
+    line: bytes,
+    fields: Sequence[str] = PAGE_FIELDS,
+    image_dir: Optional[str] = None,
+    decode_image: bool = True,
+) -> Dict[str, Any]:
+    """
+    Parse a JSONL page into a dict with the given fields, the text fields being cast to `str`. The `image`
+    field is a PIL image, or None if `decode_image` is False.
+    """
+    return _get_page(json_loads(line), fields, image_dir, decode_image)
+
+
+def _get_page(data: Dict[str, Any], fields: Sequence[str], image_dir: Optional[str], decode_image: bool):
+    page = {field: str(data[field]) for field in fields if field != "image"}
+    if "image" in fields:
+        page["image"] = decode_page_image(data, image_dir=image_dir) if decode_image else None
+    return page
+
+
+def _parse_chunk(
+    path: str,
+    start: int,
+    end: int,
+    fields: Sequence[str],
+    image_dir: Optional[str],
+    maybe_skipped: Collection[str],
+) -> List[Tuple[int, Dict[str, Any]]]:
+    """
+    Parse the lines of `path` starting in the byte range [start, end). Returns the offset of each line along
+    with its page.
+    """
+    pages = []
+    for offset, line in _iter_chunk_lines(path, start, end):
+        data = json_loads(line)
+        decode_image = str(data["image_filename"]) not in maybe_skipped
+        pages.append((offset, _get_page(data, fields, image_dir, decode_image)))
+    return pages
+
+
+def _iter_chunk_lines(path: str, start: int, end: int) -> Iterator[Tuple[int, bytes]]:
+    """
+    Yield the non-empty lines of `path` starting in the byte range [start, end), with their offset.
+    """
+    with open(path, "rb") as f:
+        if start > 0:
+            # Skip the line that started in the previous chunk (or the newline ending it)
+            f.seek(start - 1)
+            f.readline()
+        while f.tell() < end:
+            offset = f.tell()
+            line = f.readline()
+            if not line:
+                break
+            if line.strip():
+                yield offset, line
+
+
+def _get_chunks(path: str, chunk_bytes: int) -> List[Tuple[int, int]]:
+    file_size = os.path.getsize(path)
+    return [(start, min(start + chunk_bytes, file_size)) for start in range(0, file_size, chunk_bytes)]
+
+
+def _read_records_chunk(path: str, start: int, end: int) -> List[Dict[str, Any]]:
+    records = []
+    for _, line in _iter_chunk_lines(path, start, end):
+        record = json_loads(line)
+        if "image" in record:
+            record["image"] = base64.b64decode(record["image"])
+        records.append(record)
+    return records
+
+
+def _init_worker(maybe_skipped: Collection[str]):
+    global _worker_maybe_skipped
+    _worker_maybe_skipped = maybe_skipped
+
+
+def _parse_chunk_in_worker(path: str, start: int, end: int, fields: Sequence[str], image_dir: Optional[str]):
+    return _parse_chunk(path, start, end, fields, image_dir, _worker_maybe_skipped)
+
+
+def iter_jsonl_pages(
+    path: str,
+    fields: Sequence[str] = PAGE_FIELDS,
+    image_dir: Optional[str] = None,
+    skip_page: Optional[Callable[[str], bool]] = None,
+    maybe_skipped: Optional[Collection[str]] = None,
+    n_workers: Optional[int] = None,
+    chunk_bytes: int = 8 * 1024 * 1024,
+    max_pending_chunks: Optional[int] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Iterate over the pages of a JSONL collection, in order, parsing and decoding them in worker processes.
+
+    The file is split into chunks of `chunk_bytes` bytes, each read, JSON-parsed (with `orjson` if it is
+    installed) and image-decoded by a worker. At most `max_pending_chunks` chunks are in flight, so that the
+    decoded images waiting to be consumed stay bounded in memory.
+
+    Inputs:
+        - path: JSONL file, one page per line
+        - fields: page fields to return, see `parse_page`. Without `image`, no image is decoded.
+        - image_dir: directory of the page images, if they are not base64-encoded in the `image` field
+        - skip_page: called on the `image_filename` of each page in order, the page is skipped if it returns True
+        - maybe_skipped: filenames that `skip_page` may skip. Their image is not decoded by the workers (it is
+            decoded in the main process if the page is eventually kept).
+        - n_workers: number of worker processes, defaults to the number of CPUs. With 0, the pages are parsed
+            in the main process.
+        - chunk_bytes: size of the chunks of the file sent to the workers
+        - max_pending_chunks: maximum number of chunks parsed ahead, defaults to twice the number of workers
+    """
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    maybe_skipped = frozenset(maybe_skipped or ())
+
+    chunk_pages = parallel_map_ordered(
+        _parse_chunk_in_worker,
+        [(path, start, end, fields, image_dir) for start, end in _get_chunks(path, chunk_bytes)],
+        n_workers=n_workers,
+        max_pending=max_pending_chunks,
+        initializer=_init_worker,
+        initargs=(maybe_skipped,),
+    )
+
+    with open(path, "rb") as f:
+        for chunk in chunk_pages:
+            for offset, page in chunk:
+                if skip_page is not None and skip_page(page["image_filename"]):
+                    continue
+                if "image" in fields and page["image"] is None:
+                    f.seek(offset)
+                    page = parse_page(f.readline(), fields=fields, image_dir=image_dir)
+                yield page
+
+
+def iter_jsonl_records(
+    path: str,
+    n_workers: Optional[int] = None,
+    chunk_bytes: int = 8 * 1024 * 1024,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Iterate over the raw records of a JSONL collection, in order, parsed in worker processes (see
+    `iter_jsonl_pages`). The base64 `image` field is decoded to the encoded image bytes, not to a PIL image.
+    """
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    chunks = [(path, start, end) for start, end in _get_chunks(path, chunk_bytes)]
+    for records in parallel_map_ordered(_read_records_chunk, chunks, n_workers=n_workers):
+        yield from records
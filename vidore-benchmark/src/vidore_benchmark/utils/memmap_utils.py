@@ -0,0 +1,487 @@
+from __future__ import annotations
+
+import json
+import os
+import shutil
+from collections import Counter
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import torch
+
+from vidore_benchmark.utils.ragged_utils import RaggedEmbeddings
+
+MEMMAP_FORMAT_VERSION = 1
+
+MANIFEST_FILENAME = "manifest.json"
+VALUES_FILENAME = "values.bin"
+OFFSETS_FILENAME = "offsets.bin"
+DOC_IDS_FILENAME = "doc_ids.json"
+TOMBSTONES_FILENAME = "tombstones.json"
+SHARDS_MANIFEST_FILENAME = "shards.json"
+
+
+class MemmapEmbeddings(RaggedEmbeddings):
+    """
+    Multi-vector passage embeddings memory-mapped from a memmap index directory (see `save_memmap_embeddings`).
+
+    Opening the index does not read the token matrix: its pages are faulted in on demand when the embeddings are
+    indexed, so a retriever can score the passages block by block without ever holding the whole index in RAM.
+
+    `doc_ids` is the id of each passage, `None` for the deleted passages that are not compacted yet.
+    """
+
+    def __init__(
+        self,
+        values: torch.Tensor,
+        offsets: torch.Tensor,
+        path: str,
+        doc_ids: Optional[List[Optional[str]]] = None,
+    ):
+        super().__init__(values, offsets)
+        self.path = path
+        self.doc_ids = doc_ids
+
+
+class MemmapIndexWriter:
+    """
+    Append-only writer of a memmap index directory, made of:
+    - `values.bin`: the raw (n_tokens, emb_dim) token matrix of all the passages, in their native dtype
+    - `offsets.bin`: the int64 (n_passages + 1,) offsets of the passages in the token matrix
+    - `doc_ids.json`: the id (e.g. the `image_filename`) of each passage
+    - `tombstones.json` (optional): the positions of the deleted passages, see `save_tombstones`
+    - `manifest.json`: the format version, dtype, shapes and file names, written by `close`
+
+    The directory is only readable by `load_memmap_embeddings` once the manifest is written. With `append=True`,
+    the passages are appended to an existing index, which stays readable (with its former passages) until the new
+    manifest is written.
+
+    Example:
+        with MemmapIndexWriter("outputs/indexing/colqwen2_health") as writer:
+            for batch_embeddings, batch_doc_ids in batches:
+                writer.add(batch_embeddings, batch_doc_ids)
+    """
+
+    def __init__(self, path: str, multi_vector: Optional[bool] = None, append: bool = False):
+        """
+        Inputs:
+            - path: index directory, created if needed
+            - multi_vector: whether the passages are multi-vector (one (n_tokens, emb_dim) tensor per passage) or
+                single-vector (one (emb_dim,) vector per passage). Inferred from the first batch by default.
+            - append: whether to append the passages to the existing index `path`
+        """
+        self.path = path
+        self.multi_vector = multi_vector
+        self.dtype: Optional[torch.dtype] = None
+        self.emb_dim: Optional[int] = None
+        self.n_tokens = 0
+        self.offsets: List[int] = [0]
+        self.doc_ids: List[Optional[str]] = []
+        # Manifest entries that are not managed by the writer (e.g. the tombstones), kept when appending
+        self._extra_manifest: Dict[str, Any] = {}
+
+        if append:
+            manifest = load_memmap_manifest(path)
+            self.multi_vector = manifest["multi_vector"]
+            self.dtype = getattr(torch, manifest["dtype"]) if manifest["dtype"] is not None else None
+            self.emb_dim = manifest["emb_dim"]
+            self.n_tokens = manifest["n_tokens"]
+            self.offsets = _map_file(
+                os.path.join(path, manifest["offsets_file"]), manifest["n_passages"] + 1, torch.long
+            ).tolist()
+            self.doc_ids = load_doc_ids(path, include_deleted=True) or []
+            self._extra_manifest = manifest
+
+            # Drop the tokens of an interrupted append, which are not referenced by the manifest
+            self._values_file = open(os.path.join(path, manifest["values_file"]), "r+b")
+            self._values_file.truncate(self.n_tokens * (self.emb_dim or 0) * _get_itemsize(self.dtype))
+            self._values_file.seek(0, os.SEEK_END)
+        else:
+            os.makedirs(path, exist_ok=True)
+            for filename in [MANIFEST_FILENAME, TOMBSTONES_FILENAME]:
+                if os.path.exists(os.path.join(path, filename)):
+                    os.remove(os.path.join(path, filename))
+            self._values_file = open(os.path.join(path, VALUES_FILENAME), "wb")
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __enter__(self) -> MemmapIndexWriter:
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._values_file.close()
+
+    def add(
+        self,
+        embeddings: Union[RaggedEmbeddings, torch.Tensor, List[torch.Tensor]],
+        doc_ids: Optional[Sequence[Any]] = None,
+    ):
+        """
+        Append a batch of passage embeddings (as returned by `forward_passages`) and their ids.
+        """
+        if isinstance(embeddings, RaggedEmbeddings):
+            values, lengths = embeddings.values, embeddings.lengths.tolist()
+            multi_vector = True
+        elif isinstance(embeddings, torch.Tensor) and embeddings.dim() == 2:
+            values, lengths = embeddings, [1] * len(embeddings)
+            multi_vector = False
+        else:
+            embeddings = list(embeddings)
+            if len(embeddings) == 0:
+                return
+            multi_vector = embeddings[0].dim() == 2
+            values = torch.cat(embeddings) if multi_vector else torch.stack(embeddings)
+            lengths = [len(emb) for emb in embeddings] if multi_vector else [1] * len(embeddings)
+
+        if doc_ids is not None and len(doc_ids) != len(lengths):
+            raise ValueError(f"Got {len(doc_ids)} doc ids for {len(lengths)} passages")
+        if len(self) > 0 and (doc_ids is not None) != (len(self.doc_ids) > 0):
+            raise ValueError("The doc ids must be provided for all the passages or for none of them")
+
+        if self.multi_vector is None:
+            self.multi_vector = multi_vector
+        if self.dtype is None:
+            self.dtype, self.emb_dim = values.dtype, values.shape[-1]
+        if multi_vector != self.multi_vector or values.dtype != self.dtype or values.shape[-1] != self.emb_dim:
+            raise ValueError(
+                f"Expected {'multi' if self.multi_vector else 'single'}-vector {self.dtype} embeddings of "
+                f"dimension {self.emb_dim}"
+            )
+
+        # Write the raw bytes of the tokens, reinterpreted as uint8 so that any dtype (e.g. bfloat16) is supported
+        values = values.detach().to("cpu").contiguous().view(-1)
+        self._values_file.write(values.view(torch.uint8).numpy())
+
+        for length in lengths:
+            self.offsets.append(self.offsets[-1] + length)
+        self.n_tokens = self.offsets[-1]
+        if doc_ids is not None:
+            self.doc_ids.extend(str(doc_id) for doc_id in doc_ids)
+
+    def close(self):
+        """
+        Flush the token matrix and write the offsets, the doc ids and the manifest.
+        """
+        self._values_file.close()
+
+        offsets = torch.tensor(self.offsets, dtype=torch.long)
+        with open(os.path.join(self.path, OFFSETS_FILENAME), "wb") as f:
+            f.write(offsets.numpy().tobytes())
+
+        if self.doc_ids:
+            _write_json(os.path.join(self.path, DOC_IDS_FILENAME), self.doc_ids)
+
+        manifest = {
+            **self._extra_manifest,
+            "format_version": MEMMAP_FORMAT_VERSION,
+            "multi_vector": bool(self.multi_vector),
+            "dtype": str(self.dtype).replace("torch.", "") if self.dtype is not None else None,
+            "emb_dim": self.emb_dim,
+            "n_passages": len(self),
+            "n_tokens": self.n_tokens,
+            "values_file": VALUES_FILENAME,
+            "offsets_file": OFFSETS_FILENAME,
+            "doc_ids_file": DOC_IDS_FILENAME if self.doc_ids else None,
+        }
+        _write_json(os.path.join(self.path, MANIFEST_FILENAME), manifest, indent=4)
+
+
+def _write_json(filename: str, obj: Any, indent: Optional[int] = None):
+    # Write then rename, so that a crash never leaves a truncated file
+    with open(filename + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(obj, f, indent=indent)
+    os.replace(filename + ".tmp", filename)
+
+
+def _get_itemsize(dtype: Optional[torch.dtype]) -> int:
+    return torch.empty(0, dtype=dtype).element_size() if dtype is not None else 0
+
+
+def is_memmap_index(path: str) -> bool:
+    """
+    Whether `path` is a (complete) memmap index directory.
+    """
+    return os.path.isfile(os.path.join(path, MANIFEST_FILENAME))
+
+
+def load_memmap_manifest(path: str) -> Dict[str, Any]:
+    with open(os.path.join(path, MANIFEST_FILENAME), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest["format_version"] > MEMMAP_FORMAT_VERSION:
+        raise ValueError(f"Unsupported memmap index format version: {manifest['format_version']}")
+    return manifest
+
+
+def load_doc_ids(path: str, include_deleted: bool = False) -> Optional[List[Optional[str]]]:
+    """
+    Load the passage ids of a memmap index, if they were saved. The ids of the deleted passages (see
+    `save_tombstones`) are replaced by `None`, unless `include_deleted` is True.
+    """
+    manifest = load_memmap_manifest(path)
+    if manifest["doc_ids_file"] is None:
+        return None
+    with open(os.path.join(path, manifest["doc_ids_file"]), "r", encoding="utf-8") as f:
+        # NOTE: The ids of an interrupted append may follow the ids referenced by the manifest
+        doc_ids = json.load(f)[: manifest["n_passages"]]
+
+    if not include_deleted:
+        for position in load_tombstones(path):
+            doc_ids[position] = None
+    return doc_ids
+
+
+def load_tombstones(path: str) -> List[int]:
+    """
+    Load the positions of the deleted passages of a memmap index.
+    """
+    manifest = load_memmap_manifest(path)
+    if manifest.get("tombstones_file") is None:
+        return []
+    with open(os.path.join(path, manifest["tombstones_file"]), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_tombstones(path: str, positions: Sequence[int]):
+    """
+    Mark the passages at `positions` of a memmap index as deleted. Their embeddings are kept until the index is
+    compacted, but their doc ids are no longer returned by `load_doc_ids`.
+    """
+    _write_json(os.path.join(path, TOMBSTONES_FILENAME), sorted(set(positions)))
+    manifest = load_memmap_manifest(path)
+    if manifest.get("tombstones_file") != TOMBSTONES_FILENAME:
+        manifest["tombstones_file"] = TOMBSTONES_FILENAME
+        _write_json(os.path.join(path, MANIFEST_FILENAME), manifest, indent=4)
+
+
+def _map_file(filename: str, size: int, dtype: torch.dtype) -> torch.Tensor:
+    if size == 0:
+        return torch.empty(0, dtype=dtype)
+    # NOTE: With `shared=False`, the file is mapped copy-on-write: it is never modified by in-place operations
+    return torch.from_file(filename, shared=False, size=size, dtype=dtype)
+
+
+def load_memmap_embeddings(path: str) -> Union[MemmapEmbeddings, torch.Tensor]:
+    """
+    Memory-map the passage embeddings of a memmap index directory, without reading them.
+
+    Output:
+        - a `MemmapEmbeddings` for multi-vector embeddings, or a memory-mapped (n_passages, emb_dim) tensor for
+            single-vector embeddings
+    """
+    manifest = load_memmap_manifest(path)
+    if manifest["dtype"] is None:
+        raise ValueError(f"The memmap index `{path}` is empty")
+
+    dtype = getattr(torch, manifest["dtype"])
+    values = _map_file(
+        os.path.join(path, manifest["values_file"]), manifest["n_tokens"] * manifest["emb_dim"], dtype
+    ).view(manifest["n_tokens"], manifest["emb_dim"])
+
+    if not manifest["multi_vector"]:
+        return values
+
+    offsets = _map_file(os.path.join(path, manifest["offsets_file"]), manifest["n_passages"] + 1, torch.long)
+    return MemmapEmbeddings(values, offsets, path=path, doc_ids=load_doc_ids(path))
+
+
+def save_memmap_embeddings(
+    embeddings: Union[RaggedEmbeddings, torch.Tensor, List[torch.Tensor]],
+    path: str,
+    doc_ids: Optional[Sequence[Any]] = None,
+):
+    """
+    Save the passage embeddings as a memmap index directory (see `MemmapIndexWriter`).
+    """
+    with MemmapIndexWriter(path) as writer:
+        writer.add(embeddings, doc_ids)
+
+
+class ShardedIndexWriter:
+    """
+    Streaming, resumable writer of a memmap index.
+
+    The passages are buffered until `shard_size` of them are added, then flushed into a memmap shard
+    (`shard_00000`, `shard_00001`, ...) of the shard directory, and the shard is recorded in its `shards.json`
+    manifest. The peak memory is thus one shard, and a crash only loses the passages of the current shard: when
+    the writer is re-created on the same shard directory, the recorded shards are kept (an unrecorded, partially
+    written shard is discarded) and `completed_doc_ids` lists the passages that do not need to be embedded again.
+    `finalize` merges the shards into the searchable memmap index.
+
+    Example:
+        writer = ShardedIndexWriter("outputs/indexing/colqwen2_health.shards", shard_size=2000)
+        for images, doc_ids in batches:  # without the passages of `writer.completed_doc_ids`
+            writer.add(retriever.forward_passages(images, batch_size=8), doc_ids)
+        writer.finalize("outputs/indexing/colqwen2_health")
+    """
+
+    def __init__(self, shards_path: str, shard_size: int = 2000):
+        """
+        Inputs:
+            - shards_path: shard directory, created if needed, resumed if it already contains shards
+            - shard_size: number of passages per shard
+        """
+        if shard_size < 1:
+            raise ValueError("`shard_size` must be at least one")
+
+        os.makedirs(shards_path, exist_ok=True)
+        self.shards_path = shards_path
+        self.shard_size = shard_size
+        self.shards: List[Dict[str, Any]] = []
+
+        manifest_path = os.path.join(shards_path, SHARDS_MANIFEST_FILENAME)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                self.shards = json.load(f)["shards"]
+
+        # Discard the shards that were not recorded in the manifest, e.g. a shard interrupted during its flush
+        recorded_shards = {shard["name"] for shard in self.shards}
+        for name in os.listdir(shards_path):
+            if name.startswith("shard_") and name not in recorded_shards:
+                shutil.rmtree(os.path.join(shards_path, name))
+
+        self.completed_doc_ids: Counter = Counter()
+        for shard in self.shards:
+            self.completed_doc_ids.update(load_doc_ids(os.path.join(shards_path, shard["name"])) or [])
+
+        self._buffer: List[Tuple[Union[RaggedEmbeddings, torch.Tensor, List[torch.Tensor]], List[str]]] = []
+        self._n_buffered = 0
+
+    def __len__(self) -> int:
+        """
+        Number of passages added, saved in the shards or buffered.
+        """
+        return self.n_completed + self._n_buffered
+
+    @property
+    def n_completed(self) -> int:
+        """
+        Number of passages saved in the shards.
+        """
+        return sum(shard["n_passages"] for shard in self.shards)
+
+    def add(
+        self,
+        embeddings: Union[RaggedEmbeddings, torch.Tensor, List[torch.Tensor]],
+        doc_ids: Sequence[Any],
+    ):
+        """
+        Buffer a batch of passage embeddings and their ids, and flush a shard once `shard_size` passages are
+        buffered.
+        """
+        if len(doc_ids) != len(embeddings):
+            raise ValueError(f"Got {len(doc_ids)} doc ids for {len(embeddings)} passages")
+        if len(doc_ids) == 0:
+            return
+
+        self._buffer.append((embeddings, [str(doc_id) for doc_id in doc_ids]))
+        self._n_buffered += len(doc_ids)
+        if self._n_buffered >= self.shard_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered passages into a new shard and record it in the manifest.
+        """
+        if self._n_buffered == 0:
+            return
+
+        name = f"shard_{len(self.shards):05d}"
+        with MemmapIndexWriter(os.path.join(self.shards_path, name)) as writer:
+            for embeddings, doc_ids in self._buffer:
+                writer.add(embeddings, doc_ids)
+                self.completed_doc_ids.update(doc_ids)
+
+        self.shards.append({"name": name, "n_passages": self._n_buffered})
+        self._write_manifest()
+        self._buffer, self._n_buffered = [], 0
+
+    def _write_manifest(self):
+        _write_json(
+            os.path.join(self.shards_path, SHARDS_MANIFEST_FILENAME),
+            {"shard_size": self.shard_size, "shards": self.shards},
+            indent=4,
+        )
+
+    def finalize(self, path: str, remove_shards: bool = True) -> Union[MemmapEmbeddings, torch.Tensor]:
+        """
+        Flush the buffered passages and merge all the shards, in order, into the memmap index `path`.
+
+        Output:
+            - the memory-mapped embeddings of the merged index (see `load_memmap_embeddings`)
+        """
+        self.flush()
+        if len(self.shards) == 0:
+            raise ValueError(f"No passages were written to `{self.shards_path}`")
+
+        with MemmapIndexWriter(path) as writer:
+            for shard in self.shards:
+                shard_path = os.path.join(self.shards_path, shard["name"])
+                writer.add(load_memmap_embeddings(shard_path), load_doc_ids(shard_path))
+
+        if remove_shards:
+            shutil.rmtree(self.shards_path)
+        return load_memmap_embeddings(path)
+
+
+def iter_live_blocks(
+    passage_embeddings: Union[RaggedEmbeddings, torch.Tensor, List[torch.Tensor]],
+    block_size: int,
+) -> Iterator[Tuple[torch.Tensor, Any]]:
+    """
+    Iterate over consecutive blocks of `block_size` passages, as (positions, block embeddings) pairs. The deleted
+    passages of a `MemmapEmbeddings` (doc id None) are left out of the blocks, so that they are never scored.
+    """
+    deleted = None
+    if isinstance(passage_embeddings, MemmapEmbeddings) and passage_embeddings.doc_ids is not None:
+        deleted = torch.tensor([doc_id is None for doc_id in passage_embeddings.doc_ids], dtype=torch.bool)
+
+    for start in range(0, len(passage_embeddings), block_size):
+        end = min(start + block_size, len(passage_embeddings))
+        if deleted is None or not deleted[start:end].any():
+            yield torch.arange(start, end), passage_embeddings[start:end]
+            continue
+        positions = torch.nonzero(~deleted[start:end]).flatten() + start
+        if len(positions) > 0:
+            yield positions, passage_embeddings[positions]
+
+
+def blockwise_top_k(
+    passage_embeddings: RaggedEmbeddings,
+    search_fn: Callable[[RaggedEmbeddings], Tuple[torch.Tensor, torch.Tensor]],
+    k: int,
+    block_size: int,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Run a top-k search over consecutive blocks of `block_size` passages and merge the per-block results, so that
+    only one block of (e.g. memory-mapped) passages is read at a time. The deleted passages of a memmap index are
+    not searched (see `iter_live_blocks`).
+
+    Inputs:
+        - passage_embeddings: passage embeddings
+        - search_fn: function returning the top-k (indices, scores) within a block of passages, with indices local
+            to the block
+        - k: number of passages to keep per query
+        - block_size: number of passages per block
+
+    Output:
+        - top_k_indices, top_k_scores: tensors of shape (n_queries, min(k, n_passages)), sorted by decreasing score
+    """
+    top_k_indices: Optional[torch.Tensor] = None
+    top_k_scores: Optional[torch.Tensor] = None
+
+    for positions, block_embeddings in iter_live_blocks(passage_embeddings, block_size):
+        block_indices, block_scores = search_fn(block_embeddings)
+        block_indices = positions[block_indices]
+
+        if top_k_scores is not None:
+            block_scores = torch.cat([top_k_scores, block_scores.float()], dim=1)
+            block_indices = torch.cat([top_k_indices, block_indices], dim=1)
+        top_k_scores, positions = block_scores.float().topk(min(k, block_scores.shape[1]), dim=1)
+        top_k_indices = block_indices.gather(1, positions)
+
+    if top_k_indices is None:
+        raise ValueError("No passages provided")
+    return top_k_indices, top_k_scores
@@ -0,0 +1,265 @@
+from __future__ import annotations
+
+import io
+import json
+import mmap
+import os
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from PIL import Image
+
+from vidore_benchmark.utils.iter_utils import parallel_map_ordered
+from vidore_benchmark.utils.jsonl_utils import iter_jsonl_records
+
+PAGE_PACK_FORMAT_VERSION = 1
+PAGE_PACK_MANIFEST_FILENAME = "manifest.json"
+PAGE_PACK_IMAGES_FILENAME = "images.bin"
+PAGE_PACK_OFFSETS_FILENAME = "offsets.bin"
+PAGE_PACK_METADATA_FILENAME = "metadata.parquet"
+
+# Opened page packs of the worker processes of `iter_page_pack`
+_worker_page_packs: Dict[Tuple[str, int], PagePack] = {}
+
+
+def is_page_pack(path: str) -> bool:
+    return os.path.isfile(os.path.join(path, PAGE_PACK_MANIFEST_FILENAME))
+
+
+def encode_image(image: Image.Image, format: str = "JPEG") -> bytes:
+    """
+    Encode a PIL image, converted to RGB first for the formats without alpha channel.
+    """
+    buffered = io.BytesIO()
+    if format == "JPEG" and image.mode != "RGB":
+        image = image.convert("RGB")
+    image.save(buffered, format=format)
+    return buffered.getvalue()
+
+
+class PagePackWriter:
+    """
+    Write a page pack: a directory with
+    - `images.bin`: the encoded page images (e.g. JPEG bytes), one after the other
+    - `offsets.bin`: the int64 start of each image in `images.bin`, plus the end of the last one
+    - `metadata.parquet`: one row of metadata per page (`image_filename`, `query`, `text_description`, ...)
+    - `manifest.json`: the format version and the number of pages, written last
+
+    Compared to base64 images embedded in JSONL, the images take 25% less space, a page is read with a single
+    slice of the memory-mapped blob, and the metadata columns are read without touching the images.
+
+    Usage:
+        with PagePackWriter(path) as writer:
+            writer.add(image, image_filename=..., query=..., text_description=...)
+    """
+
+    def __init__(self, path: str, image_format: str = "JPEG", append: bool = False):
+        """
+        Inputs:
+            - path: page pack directory
+            - image_format: PIL format of the images added as PIL images
+            - append: whether to append the pages to the existing page pack `path`
+        """
+        self.path = path
+        self.image_format = image_format
+        self.offsets: List[int] = [0]
+        self.metadata: List[Dict[str, Any]] = []
+
+        if append:
+            pack = PagePack(path)
+            self.offsets = pack.offsets.tolist()
+            self.metadata = pack.metadata.to_pylist()
+            self.image_format = pack.manifest["image_format"]
+            del pack
+            # Drop the bytes of an interrupted append
+            with open(os.path.join(path, PAGE_PACK_IMAGES_FILENAME), "r+b") as f:
+                f.truncate(self.offsets[-1])
+        else:
+            os.makedirs(path, exist_ok=True)
+            for filename in [PAGE_PACK_MANIFEST_FILENAME, PAGE_PACK_IMAGES_FILENAME]:
+                if os.path.exists(os.path.join(path, filename)):
+                    os.remove(os.path.join(path, filename))
+
+        self._images_file = open(os.path.join(path, PAGE_PACK_IMAGES_FILENAME), "ab")
+
+    def __len__(self) -> int:
+        return len(self.metadata)
+
+    def add(self, image: Union[Image.Image, bytes], **metadata: Any):
+        """
+        Append a page. `image` is either a PIL image, encoded with `image_format`, or already encoded image
+        bytes, stored as-is (no re-encoding).
+
+        The metadata values are stored as `str(value)`, as the fields of the JSONL pages are read, so that pages
+        from different sources (e.g. a list or a string `query`) fit in the same table.
+        """
+        image_bytes = image if isinstance(image, bytes) else encode_image(image, format=self.image_format)
+        self._images_file.write(image_bytes)
+        self.offsets.append(self.offsets[-1] + len(image_bytes))
+        self.metadata.append({key: str(value) for key, value in metadata.items()})
+
+    def close(self):
+        self._images_file.close()
+        np.asarray(self.offsets, dtype=np.int64).tofile(os.path.join(self.path, PAGE_PACK_OFFSETS_FILENAME))
+        pq.write_table(pa.Table.from_pylist(self.metadata), os.path.join(self.path, PAGE_PACK_METADATA_FILENAME))
+
+        manifest = {
+            "format_version": PAGE_PACK_FORMAT_VERSION,
+            "n_pages": len(self),
+            "image_format": self.image_format,
+            "images_file": PAGE_PACK_IMAGES_FILENAME,
+            "offsets_file": PAGE_PACK_OFFSETS_FILENAME,
+            "metadata_file": PAGE_PACK_METADATA_FILENAME,
+        }
+        with open(os.path.join(self.path, PAGE_PACK_MANIFEST_FILENAME), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+
+    def __enter__(self) -> PagePackWriter:
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # NOTE: On error, the manifest is not written, so that a partial page pack is not mistaken for a complete one
+        if exc_type is None:
+            self.close()
+        else:
+            self._images_file.close()
+
+
+class PagePack:
+    """
+    Random-access reader of a page pack (see `PagePackWriter`). The images are memory-mapped: reading a page
+    only reads its own bytes, and the OS page cache is shared by the processes reading the same pack.
+    """
+
+    def __init__(self, path: str):
+        if not is_page_pack(path):
+            raise FileNotFoundError(f"`{path}` is not a page pack")
+        with open(os.path.join(path, PAGE_PACK_MANIFEST_FILENAME), "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        if self.manifest["format_version"] != PAGE_PACK_FORMAT_VERSION:
+            raise ValueError(f"Unsupported page pack format version: {self.manifest['format_version']}")
+
+        self.path = path
+        n_pages = self.manifest["n_pages"]
+        self.offsets = np.fromfile(os.path.join(path, self.manifest["offsets_file"]), dtype=np.int64)[: n_pages + 1]
+        self.metadata = pq.read_table(os.path.join(path, self.manifest["metadata_file"]))
+
+        with open(os.path.join(path, self.manifest["images_file"]), "rb") as f:
+            # NOTE: `mmap` cannot map an empty file
+            self._images = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.offsets[-1] > 0 else b""
+
+    def __len__(self) -> int:
+        return self.manifest["n_pages"]
+
+    @property
+    def column_names(self) -> List[str]:
+        return self.metadata.column_names
+
+    def column(self, name: str) -> List[Any]:
+        """
+        Metadata column of all the pages, e.g. `pack.column("image_filename")`. The images are not read.
+        """
+        return self.metadata.column(name).to_pylist()
+
+    def get_image_bytes(self, index: int) -> bytes:
+        if not 0 <= index < len(self):
+            raise IndexError(f"Index {index} out of range for {len(self)} pages")
+        return self._images[self.offsets[index] : self.offsets[index + 1]]
+
+    def get_image(self, index: int) -> Image.Image:
+        image = Image.open(io.BytesIO(self.get_image_bytes(index)))
+        # NOTE: PIL decodes the pixels lazily, force it so that it runs in the calling (worker) process
+        image.load()
+        return image
+
+    def __getitem__(self, index: int) -> Dict[str, Any]:
+        """
+        Metadata of the page along with its decoded `image`.
+        """
+        page = {name: self.metadata.column(name)[index].as_py() for name in self.column_names}
+        page["image"] = self.get_image(index)
+        return page
+
+
+def _decode_images_in_worker(path: str, indices: Sequence[int]) -> List[Image.Image]:
+    # The manifest is rewritten on each write, a rewritten page pack is opened again
+    key = (path, os.stat(os.path.join(path, PAGE_PACK_MANIFEST_FILENAME)).st_mtime_ns)
+    if key not in _worker_page_packs:
+        _worker_page_packs[key] = PagePack(path)
+    return [_worker_page_packs[key].get_image(index) for index in indices]
+
+
+def iter_page_pack(
+    path: str,
+    fields: Optional[Sequence[str]] = None,
+    skip_page: Optional[Callable[[str], bool]] = None,
+    n_workers: Optional[int] = None,
+    chunk_size: int = 32,
+    max_pending_chunks: Optional[int] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Iterate over the pages of a page pack in order, with their images decoded in worker processes (same
+    ordering and memory bound as `iter_jsonl_pages`).
+
+    Inputs:
+        - path: page pack directory
+        - fields: page fields to return (metadata columns and `image`), defaults to all of them. Without
+            `image`, no image is read.
+        - skip_page: called on the `image_filename` of each page in order, the page is skipped if it returns
+            True. The skipped images are never read.
+        - n_workers: number of worker processes, defaults to the number of CPUs. With 0, the images are decoded
+            in the main process.
+        - chunk_size: number of pages decoded per task
+        - max_pending_chunks: maximum number of chunks decoded ahead, defaults to twice the number of workers
+    """
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+
+    pack = PagePack(path)
+    fields = list(fields) if fields is not None else pack.column_names + ["image"]
+    columns = {field: pack.column(field) for field in fields if field != "image"}
+
+    image_filenames = pack.column("image_filename")
+    kept_indices = [
+        index for index in range(len(pack)) if skip_page is None or not skip_page(str(image_filenames[index]))
+    ]
+    chunks = [kept_indices[start : start + chunk_size] for start in range(0, len(kept_indices), chunk_size)]
+
+    if "image" in fields:
+        chunk_images = parallel_map_ordered(
+            _decode_images_in_worker,
+            [(path, chunk) for chunk in chunks],
+            n_workers=n_workers,
+            max_pending=max_pending_chunks,
+        )
+    else:
+        chunk_images = ([None] * len(chunk) for chunk in chunks)
+
+    for chunk, images in zip(chunks, chunk_images):
+        for index, image in zip(chunk, images):
+            page = {field: column[index] for field, column in columns.items()}
+            if "image" in fields:
+                page["image"] = image
+            yield page
+
+
+def convert_jsonl_to_page_pack(
+    jsonl_path: str,
+    path: str,
+    image_dir: Optional[str] = None,
+    n_workers: Optional[int] = None,
+):
+    """
+    Convert a JSONL collection with base64-encoded images (see `iter_jsonl_pages`) to a page pack. The image
+    bytes are stored as-is, all the other fields are kept as metadata.
+    """
+    with PagePackWriter(path) as writer:
+        for record in iter_jsonl_records(jsonl_path, n_workers=n_workers):
+            if image_dir is not None:
+                with open(os.path.join(image_dir, str(record["image_filename"])), "rb") as f:
+                    image_bytes = f.read()
+            else:
+                image_bytes = record["image"]
+            writer.add(image_bytes, **{key: value for key, value in record.items() if key != "image"})
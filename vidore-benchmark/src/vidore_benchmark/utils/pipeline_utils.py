@@ -0,0 +1,184 @@
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# Marks the end of the items of a stage queue
+_END = object()
+
+
+@dataclass
+class StageStats:
+    """
+    Number of items and units (e.g. passages) processed by a pipeline stage, and the time spent processing them
+    (excluding the time spent waiting for the other stages).
+    """
+
+    name: str
+    n_items: int = 0
+    n_units: int = 0
+    busy_seconds: float = 0.0
+
+    @property
+    def throughput(self) -> float:
+        """
+        Units per second the stage could process on its own.
+        """
+        return self.n_units / self.busy_seconds if self.busy_seconds > 0 else float("inf")
+
+
+class _StageFailure:
+    def __init__(self, exception: BaseException):
+        self.exception = exception
+
+
+class Pipeline:
+    """
+    Run the stages of a computation concurrently, each in its own thread, connected by bounded queues: while the
+    model runs on a batch, the next batches are already fetched and preprocessed, and the previous outputs are
+    packed. Each stage maps the items of the previous one in order, and at most `max_queue_size` items wait
+    between two stages, so that the memory stays bounded when a stage is slower than the others.
+
+    The busy time of each stage is measured, its throughput shows the bottleneck of the pipeline (see
+    `get_report`).
+
+    Usage:
+        pipeline = Pipeline([("preprocess", preprocess), ("forward", forward)], max_queue_size=4)
+        for output in pipeline.run(batches, n_units=len):
+            ...
+        print(pipeline.get_report())
+    """
+
+    def __init__(
+        self,
+        stages: Sequence[Tuple[str, Callable[[Any], Any]]],
+        max_queue_size: int = 4,
+        source_name: str = "fetch",
+        unit_name: str = "items",
+    ):
+        """
+        Inputs:
+            - stages: name and function of each stage, in order
+            - max_queue_size: maximum number of items waiting between two stages
+            - source_name: name of the stage iterating over the input items
+            - unit_name: name of the units in the report
+        """
+        if max_queue_size < 1:
+            raise ValueError("`max_queue_size` must be at least 1")
+        self.stages = list(stages)
+        self.max_queue_size = max_queue_size
+        self.source_name = source_name
+        self.unit_name = unit_name
+        self.stats: List[StageStats] = []
+        self.wall_seconds = 0.0
+
+    def run(self, source: Iterable[Any], n_units: Optional[Callable[[Any], int]] = None) -> Iterator[Any]:
+        """
+        Yield the output of the last stage for each item of `source`, in order. `n_units` counts the units of an
+        input item for the report (1 per item by default). An exception raised by a stage is raised here.
+        """
+        self.stats = [StageStats(self.source_name)] + [StageStats(name) for name, _ in self.stages]
+        queues = [queue.Queue(maxsize=self.max_queue_size) for _ in range(len(self.stages) + 1)]
+        stop = threading.Event()
+
+        def put(output_queue: queue.Queue, item: Any) -> bool:
+            # NOTE: Give up if the consumer stopped, instead of blocking forever on a full queue
+            while not stop.is_set():
+                try:
+                    output_queue.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def get(input_queue: queue.Queue) -> Any:
+            while not stop.is_set():
+                try:
+                    return input_queue.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+            return _END
+
+        def run_source():
+            stats = self.stats[0]
+            try:
+                iterator = iter(source)
+                while True:
+                    start_time = time.perf_counter()
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        break
+                    stats.busy_seconds += time.perf_counter() - start_time
+                    units = n_units(item) if n_units is not None else 1
+                    stats.n_items += 1
+                    stats.n_units += units
+                    if not put(queues[0], (units, item)):
+                        return
+                put(queues[0], _END)
+            except BaseException as e:
+                put(queues[0], _StageFailure(e))
+
+        def run_stage(stage_idx: int):
+            _, fn = self.stages[stage_idx]
+            stats = self.stats[stage_idx + 1]
+            input_queue, output_queue = queues[stage_idx], queues[stage_idx + 1]
+            while True:
+                entry = get(input_queue)
+                if entry is _END or isinstance(entry, _StageFailure):
+                    put(output_queue, entry)
+                    return
+                units, item = entry
+                start_time = time.perf_counter()
+                try:
+                    output = fn(item)
+                except BaseException as e:
+                    put(output_queue, _StageFailure(e))
+                    return
+                stats.busy_seconds += time.perf_counter() - start_time
+                stats.n_items += 1
+                stats.n_units += units
+                if not put(output_queue, (units, output)):
+                    return
+
+        threads = [threading.Thread(target=run_source, daemon=True)]
+        threads += [threading.Thread(target=run_stage, args=(idx,), daemon=True) for idx in range(len(self.stages))]
+
+        start_time = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                entry = queues[-1].get()
+                if entry is _END:
+                    break
+                if isinstance(entry, _StageFailure):
+                    raise entry.exception
+                yield entry[1]
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+            self.wall_seconds = time.perf_counter() - start_time
+
+    def get_report(self) -> str:
+        """
+        Throughput of each stage, the slowest one being the bottleneck of the pipeline.
+        """
+        if not self.stats:
+            return "Pipeline not run"
+        bottleneck = min(self.stats, key=lambda stats: stats.throughput)
+        n_units = self.stats[-1].n_units
+        lines = [
+            f"Pipeline: {n_units} {self.unit_name} in {self.wall_seconds:.2f} s "
+            f"({n_units / self.wall_seconds if self.wall_seconds > 0 else 0.0:.2f} {self.unit_name}/s)"
+        ]
+        for stats in self.stats:
+            lines.append(
+                f"- {stats.name}: {stats.busy_seconds:.2f} s busy, {stats.throughput:.2f} {self.unit_name}/s"
+                + (" (bottleneck)" if stats is bottleneck else "")
+            )
+        return "\n".join(lines)
@@ -0,0 +1,195 @@
+from __future__ import annotations
+
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import torch
+
+
+class RaggedEmbeddings:
+    """
+    Variable-length multi-vector embeddings stored as one contiguous buffer of tokens.
+
+    The tokens of the i-th embedding are `values[offsets[i] : offsets[i + 1]]`. Compared to a list of padded
+    per-passage tensors, this stores no padding and a single allocation, and the whole collection can be moved
+    or saved at once.
+
+    `RaggedEmbeddings` behaves like a sequence of (n_tokens, emb_dim) tensors: integer indexing and iteration
+    return views of `values`, and slicing returns a `RaggedEmbeddings` view.
+    """
+
+    def __init__(self, values: torch.Tensor, offsets: torch.Tensor):
+        """
+        Inputs:
+            - values: tensor of shape (n_tokens, emb_dim)
+            - offsets: int64 CPU tensor of shape (n_embeddings + 1,), starting with 0 and ending with n_tokens
+        """
+        if offsets.dim() != 1 or len(offsets) == 0 or offsets[0] != 0 or offsets[-1] != len(values):
+            raise ValueError("`offsets` must start with 0 and end with the number of tokens")
+        self.values = values
+        self.offsets = offsets
+
+    @classmethod
+    def from_padded(
+        cls,
+        embeddings: torch.Tensor,
+        attention_mask: Optional[torch.Tensor] = None,
+    ) -> RaggedEmbeddings:
+        """
+        Strip the padding of a batch of embeddings.
+
+        Inputs:
+            - embeddings: tensor of shape (batch_size, n_seq, emb_dim)
+            - attention_mask: tensor of shape (batch_size, n_seq), the padding tokens are 0. Defaults to the non
+                all-zero tokens.
+        """
+        if attention_mask is None:
+            mask = embeddings.ne(0).any(dim=-1)
+        else:
+            mask = attention_mask.to(device=embeddings.device, dtype=torch.bool)
+        lengths = mask.sum(dim=1).cpu()
+        return cls(embeddings[mask], _lengths_to_offsets(lengths))
+
+    @classmethod
+    def from_list(cls, embeddings: Sequence[torch.Tensor]) -> RaggedEmbeddings:
+        """
+        Concatenate a list of embeddings of shape (n_tokens, emb_dim). The tokens are kept as-is.
+        """
+        if len(embeddings) == 0:
+            raise ValueError("No embeddings provided")
+        lengths = torch.tensor([len(emb) for emb in embeddings], dtype=torch.long)
+        return cls(torch.cat(list(embeddings)), _lengths_to_offsets(lengths))
+
+    @classmethod
+    def cat(cls, embeddings: Sequence[RaggedEmbeddings]) -> RaggedEmbeddings:
+        """
+        Concatenate several `RaggedEmbeddings`.
+        """
+        if len(embeddings) == 0:
+            raise ValueError("No embeddings provided")
+        lengths = torch.cat([emb.lengths for emb in embeddings])
+        return cls(torch.cat([emb.values for emb in embeddings]), _lengths_to_offsets(lengths))
+
+    @property
+    def lengths(self) -> torch.Tensor:
+        return self.offsets.diff()
+
+    @property
+    def dtype(self) -> torch.dtype:
+        return self.values.dtype
+
+    @property
+    def device(self) -> torch.device:
+        return self.values.device
+
+    @property
+    def nbytes(self) -> int:
+        return self.values.nbytes + self.offsets.nbytes
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index: Union[int, slice, Sequence[int], torch.Tensor]):
+        if isinstance(index, torch.Tensor) and index.dim() == 0:
+            index = int(index)
+        if isinstance(index, int):
+            if index < 0:
+                index += len(self)
+            if not 0 <= index < len(self):
+                raise IndexError(f"Index {index} out of range for {len(self)} embeddings")
+            return self.values[self.offsets[index] : self.offsets[index + 1]]
+
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1:
+                stop = max(start, stop)
+                offsets = self.offsets[start : stop + 1]
+                return RaggedEmbeddings(self.values[offsets[0] : offsets[-1]], offsets - offsets[0])
+            index = range(start, stop, step)
+
+        # Gather a list of embeddings (copies the tokens)
+        index = torch.as_tensor(index, dtype=torch.long)
+        lengths = self.lengths[index]
+        token_ids = torch.repeat_interleave(self.offsets[index] - (lengths.cumsum(0) - lengths), lengths)
+        token_ids += torch.arange(int(lengths.sum()))
+        return RaggedEmbeddings(self.values[token_ids.to(self.device)], _lengths_to_offsets(lengths))
+
+    def __iter__(self) -> Iterator[torch.Tensor]:
+        for start, end in zip(self.offsets[:-1].tolist(), self.offsets[1:].tolist()):
+            yield self.values[start:end]
+
+    def to(self, *args, **kwargs) -> RaggedEmbeddings:
+        """
+        Move or cast the values (same arguments as `torch.Tensor.to`). The offsets stay on the CPU.
+        """
+        return RaggedEmbeddings(self.values.to(*args, **kwargs), self.offsets)
+
+    def to_padded(self, padding_value: float = 0) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Return the padded embeddings of shape (n_embeddings, max_n_tokens, emb_dim) and their attention mask.
+        """
+        lengths = self.lengths
+        max_length = int(lengths.max()) if len(lengths) > 0 else 0
+        attention_mask = torch.arange(max_length) < lengths[:, None]
+
+        padded = self.values.new_full((len(self), max_length, self.values.shape[-1]), padding_value)
+        attention_mask = attention_mask.to(self.device)
+        padded[attention_mask] = self.values
+        return padded, attention_mask
+
+    def to_list(self) -> List[torch.Tensor]:
+        return list(self)
+
+    def state_dict(self) -> Dict[str, torch.Tensor]:
+        return {"values": self.values, "offsets": self.offsets}
+
+    @classmethod
+    def from_state(cls, state: Dict[str, torch.Tensor]) -> RaggedEmbeddings:
+        return cls(state["values"], state["offsets"])
+
+
+def _lengths_to_offsets(lengths: torch.Tensor) -> torch.Tensor:
+    return torch.cat([torch.zeros(1, dtype=torch.long), lengths.long().cumsum(0)])
+
+
+def concat_embeddings(
+    batches: Sequence[Union[RaggedEmbeddings, torch.Tensor, List[torch.Tensor]]],
+) -> Union[RaggedEmbeddings, List[torch.Tensor]]:
+    """
+    Concatenate the outputs of several `forward_passages` calls: `RaggedEmbeddings` are concatenated into a
+    single `RaggedEmbeddings`, and the other outputs into a list of per-passage tensors.
+    """
+    if len(batches) > 0 and all(isinstance(batch, RaggedEmbeddings) for batch in batches):
+        return RaggedEmbeddings.cat(batches)
+
+    embeddings: List[torch.Tensor] = []
+    for batch in batches:
+        embeddings.extend(torch.unbind(batch) if isinstance(batch, torch.Tensor) else batch)
+    return embeddings
+
+
+def save_embeddings(embeddings: Union[RaggedEmbeddings, List[torch.Tensor]], path: str):
+    """
+    Save passage embeddings: a `RaggedEmbeddings` is saved as its values and offsets, a list as-is.
+    """
+    if isinstance(embeddings, RaggedEmbeddings):
+        torch.save({"embeddings": embeddings.state_dict(), "ragged": True}, path)
+    else:
+        torch.save({"embeddings": embeddings}, path)
+
+
+def load_embeddings(path: str, **kwargs) -> Union[RaggedEmbeddings, List[torch.Tensor]]:
+    """
+    Load passage embeddings saved by `save_embeddings` (or by the former `torch.save({"embeddings": ...})`).
+    The keyword arguments are passed to `torch.load`.
+
+    If `path` is a memmap index directory, the embeddings are memory-mapped instead (see `load_memmap_embeddings`).
+    """
+    from vidore_benchmark.utils.memmap_utils import is_memmap_index, load_memmap_embeddings
+
+    if is_memmap_index(path):
+        return load_memmap_embeddings(path)
+
+    state = torch.load(path, **kwargs)
+    if state.get("ragged", False):
+        return RaggedEmbeddings.from_state(state["embeddings"])
+    return state["embeddings"]
@@ -1,5 +1,6 @@
 import gc
 import logging
+from typing import Any, Dict, Mapping
 
 import torch
 
@@ -28,6 +29,17 @@ def get_torch_device(device: str = "auto") -> str:
     return device
 
 
+def move_to_device(batch: Mapping[str, Any], device: str, non_blocking: bool = True) -> Dict[str, Any]:
+    """
+    Move the tensors of a preprocessed batch (e.g. a `BatchFeature`) to `device`. The copies of pinned CPU tensors
+    to a CUDA device are asynchronous with `non_blocking`, so that the main process does not wait for them.
+    """
+    return {
+        key: value.to(device, non_blocking=non_blocking) if isinstance(value, torch.Tensor) else value
+        for key, value in batch.items()
+    }
+
+
 def tear_down_torch():
     """
     Teardown for PyTorch.
@@ -0,0 +1,50 @@
+from pathlib import Path
+
+import pytest
+import torch
+
+from vidore_benchmark.index.ann_index import HNSWIndex, IVFFlatIndex, IVFPQIndex
+from vidore_benchmark.index.matryoshka_index import MatryoshkaIndex
+from vidore_benchmark.index.muvera_index import MuveraIndex
+from vidore_benchmark.index.plaid_index import PLAIDIndex
+from vidore_benchmark.index.pq_index import PQIndex
+from vidore_benchmark.main import load_passage_index
+from vidore_benchmark.utils.ragged_utils import save_embeddings
+
+EMBEDDING_DIM = 32
+
+
+@pytest.mark.parametrize(
+    "index_class,build_kwargs,search_kwargs,multi_vector",
+    [
+        (PLAIDIndex, {"n_centroids": 8}, {"search_n_probe": 2, "search_n_candidates": 16}, True),
+        (MuveraIndex, {}, {"search_n_candidates": 16}, True),
+        (IVFFlatIndex, {"n_lists": 4}, {"search_n_probe": 2}, False),
+        (IVFPQIndex, {"n_lists": 4, "n_subquantizers": 8}, {"search_n_probe": 2}, False),
+        (HNSWIndex, {}, {"search_ef_search": 16}, False),
+        (PQIndex, {"n_subquantizers": 8}, {}, False),
+        (MatryoshkaIndex, {"dims": [16, EMBEDDING_DIM], "n_candidates": [20]}, {}, False),
+    ],
+)
+def test_load_passage_index(index_class, build_kwargs, search_kwargs, multi_vector: bool, tmp_path: Path):
+    torch.manual_seed(0)
+    if multi_vector:
+        passage_embeddings = [torch.randn(n_tokens, EMBEDDING_DIM) for n_tokens in range(3, 43)]
+    else:
+        passage_embeddings = list(torch.randn(40, EMBEDDING_DIM))
+    indexing_path = str(tmp_path / "embeddings.pt")
+    search_index_path = str(tmp_path / "index.pt")
+    save_embeddings(passage_embeddings, indexing_path)
+    index_class.build(passage_embeddings, **build_kwargs).save(search_index_path)
+
+    # `--rerank-top-k` is also set for the quantized multi-vector scoring, it only applies to the indexes that rerank
+    search_index = load_passage_index(
+        None, indexing_path, search_index_path=search_index_path, rerank_top_k=10, **search_kwargs
+    )
+    assert isinstance(search_index, index_class)
+    assert (getattr(search_index, "rerank_top_k", None) == 10) == ("rerank_top_k" in index_class.search_params)
+
+    # The search flags of the other indexes are rejected
+    invalid_kwargs = {"search_n_probe": 2} if "n_probe" not in index_class.search_params else {"search_ef_search": 16}
+    with pytest.raises(ValueError, match="does not accept the search parameters"):
+        load_passage_index(None, indexing_path, search_index_path=search_index_path, **invalid_kwargs)
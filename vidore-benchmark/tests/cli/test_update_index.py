@@ -0,0 +1,69 @@
+from argparse import Namespace
+from pathlib import Path
+from typing import List
+
+import torch
+
+import vidore_benchmark.build_index as build_index
+from vidore_benchmark.index.incremental_index import IncrementalIndex
+from vidore_benchmark.index.plaid_index import PLAIDIndex
+from vidore_benchmark.utils.embedding_cache import hash_passage
+
+EMBEDDING_DIM = 16
+
+
+class TextRetriever:
+    use_visual_embedding = False
+
+
+def embed_text(text: str) -> torch.Tensor:
+    torch.manual_seed(sum(map(ord, text)))
+    return torch.nn.functional.normalize(torch.randn(4, EMBEDDING_DIM), dim=-1)
+
+
+def test_update_index_upserts_changed_pages(tmp_path: Path, monkeypatch):
+    path = str(tmp_path / "index")
+    texts = {"a.png": "page a", "b.png": "page b", "c.png": "page c"}
+    passage_embeddings = [embed_text(text) for text in texts.values()]
+    IncrementalIndex.create(
+        path,
+        passage_embeddings,
+        list(texts),
+        search_indexes={"plaid": PLAIDIndex.build(passage_embeddings, n_centroids=2, n_bits=8)},
+        content_hashes=[hash_passage(text) for text in texts.values()],
+    )
+
+    # `a.png` is unchanged, `b.png` is edited, `c.png` is removed and `d.png` is new
+    collection = {"a.png": "page a", "b.png": "page b, edited", "d.png": "page d"}
+    embedded_filenames: List[str] = []
+
+    def iter_collection_batches(collection_name, split, skip_page, **kwargs):
+        yield [
+            {"image_filename": filename, "text_description": text}
+            for filename, text in collection.items()
+            if not skip_page(filename)
+        ]
+
+    def embed_passages(retriever, pages, embedding_pooler, args):
+        embedded_filenames.extend(page["image_filename"] for page in pages)
+        return [embed_text(page["text_description"]) for page in pages]
+
+    monkeypatch.setattr(build_index, "iter_collection_batches", iter_collection_batches)
+    monkeypatch.setattr(build_index, "embed_passages", embed_passages)
+    args = Namespace(collection_name="collection", split="test", ingest_workers=0, max_deleted_fraction=0.5)
+    build_index.update_index(args, TextRetriever(), None, Path(path))
+
+    assert embedded_filenames == ["b.png", "d.png"]
+    index = IncrementalIndex(path)
+    assert sorted(index.doc_ids) == ["a.png", "b.png", "d.png"]
+    assert index.content_hashes == {filename: [hash_passage(text)] for filename, text in collection.items()}
+    assert len(index.search_indexes["plaid"]) == index.n_passages
+
+    # The edited page replaced its previous version
+    position = index.doc_id_to_positions["b.png"][0]
+    assert torch.equal(index.embeddings[position], embed_text("page b, edited"))
+
+    # A second update has nothing to embed
+    embedded_filenames.clear()
+    build_index.update_index(args, TextRetriever(), None, Path(path))
+    assert embedded_filenames == []
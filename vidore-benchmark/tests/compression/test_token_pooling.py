@@ -2,6 +2,7 @@ import pytest
 import torch
 
 from vidore_benchmark.compression.token_pooling import HierarchicalEmbeddingPooler
+from vidore_benchmark.utils.ragged_utils import RaggedEmbeddings
 
 
 @pytest.fixture
@@ -86,3 +87,14 @@ def test_hierarchical_embedding_pooler_large_input():
 
     assert pooled_embeddings.shape[0] < large_embeddings.shape[0]
     assert pooled_embeddings.shape[0] <= len(cluster_id_to_indices)
+
+
+def test_hierarchical_embedding_pooler_ragged_embeddings():
+    embeddings = [torch.nn.functional.normalize(torch.randn(n_tokens, 16), dim=-1) for n_tokens in [2, 7, 12, 30]]
+
+    pooler = HierarchicalEmbeddingPooler(pool_factor=3, device="cpu")
+    pooled_embeddings = pooler.pool_ragged_embeddings(RaggedEmbeddings.from_list(embeddings))
+
+    assert len(pooled_embeddings) == len(embeddings)
+    for pooled_embedding, embedding in zip(pooled_embeddings, embeddings):
+        torch.testing.assert_close(pooled_embedding, pooler.pool_embeddings(embedding)[0])
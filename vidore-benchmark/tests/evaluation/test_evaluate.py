@@ -21,20 +21,20 @@ def mock_vision_retriever():
     # Mock the scoring methods
     retriever.forward_queries.return_value = torch.rand(2, EMBEDDING_DIM)
     retriever.forward_passages.return_value = torch.rand(3, EMBEDDING_DIM)
-    retriever.get_scores.return_value = torch.tensor(
-        [
-            [0.8, 0.6, 0.3],
-            [0.7, 0.5, 0.4],
-        ]
+    retriever.get_passage_encoding_stages.return_value = None
+    retriever.prepare_passage_embeddings.side_effect = lambda passage_embeddings, **kwargs: passage_embeddings
+    retriever.get_top_k.return_value = (
+        torch.tensor([[0, 1], [1, 0]]),  # top_k_indices
+        torch.tensor([[0.8, 0.6], [0.7, 0.5]]),  # top_k_scores
     )
 
     # Mock the results processing methods
-    retriever.get_relevant_docs_results.return_value = (
-        {"query1": [0], "query2": [1]},  # relevant_docs
-        {"query1": [0, 1, 2], "query2": [0, 1, 2]},  # results
+    retriever.get_relevant_docs_results_from_top_k.return_value = (
+        {"query1": {"img1.jpg": 1}, "query2": {"img2.jpg": 1}},  # relevant_docs
+        {"query1": {"img1.jpg": 0.8, "img2.jpg": 0.6}, "query2": {"img2.jpg": 0.7, "img1.jpg": 0.5}},  # results
     )
 
-    retriever.compute_metrics.return_value = {"ndcg": 0.85, "map": 0.75, "recall": 0.90}
+    retriever.compute_metrics.return_value = ({"ndcg": 0.85, "map": 0.75, "recall": 0.90}, {})
 
     return retriever
 
@@ -61,7 +61,7 @@ def mock_pooler():
 
 
 def test_evaluate_dataset_basic(mock_vision_retriever, mock_dataset):
-    metrics = evaluate_dataset(
+    metrics, _, _ = evaluate_dataset(
         vision_retriever=mock_vision_retriever,
         ds=mock_dataset,
         batch_query=2,
@@ -71,8 +71,8 @@ def test_evaluate_dataset_basic(mock_vision_retriever, mock_dataset):
     # Verify the expected calls
     mock_vision_retriever.forward_queries.assert_called_once()
     mock_vision_retriever.forward_passages.assert_called()
-    mock_vision_retriever.get_scores.assert_called_once()
-    mock_vision_retriever.get_relevant_docs_results.assert_called_once()
+    mock_vision_retriever.get_top_k.assert_called_once()
+    mock_vision_retriever.get_relevant_docs_results_from_top_k.assert_called_once()
     mock_vision_retriever.compute_metrics.assert_called_once()
 
     # Check if metrics are returned correctly
@@ -83,7 +83,7 @@ def test_evaluate_dataset_basic(mock_vision_retriever, mock_dataset):
 
 
 def test_evaluate_dataset_with_pooler(mock_vision_retriever, mock_dataset, mock_pooler):
-    metrics = evaluate_dataset(
+    metrics, _, _ = evaluate_dataset(
         vision_retriever=mock_vision_retriever,
         ds=mock_dataset,
         batch_query=2,
@@ -0,0 +1,44 @@
+import torch
+
+from vidore_benchmark.evaluation.scoring import merge_top_k, score_multi_vector, score_multi_vector_top_k
+
+EMBEDDING_DIM = 32
+
+
+def test_score_multi_vector():
+    emb_queries = [torch.randn(n, EMBEDDING_DIM) for n in (3, 5)]
+    emb_passages = [torch.randn(n, EMBEDDING_DIM) for n in (8, 4, 16)]
+
+    scores = score_multi_vector(emb_queries, emb_passages, batch_size=2, tile_size=3)
+
+    qs_padded = torch.nn.utils.rnn.pad_sequence(emb_queries, batch_first=True)
+    ps_padded = torch.nn.utils.rnn.pad_sequence(emb_passages, batch_first=True)
+    expected = torch.einsum("bnd,csd->bcns", qs_padded, ps_padded).max(dim=3)[0].sum(dim=2)
+
+    assert scores.shape == (len(emb_queries), len(emb_passages))
+    assert torch.allclose(scores, expected, atol=1e-4)
+
+
+def test_score_multi_vector_top_k():
+    torch.manual_seed(0)
+    emb_queries = [torch.randn(n, EMBEDDING_DIM) for n in (3, 5, 4)]
+    emb_passages = [torch.randn(n, EMBEDDING_DIM) for n in range(2, 20)]
+
+    top_k_indices, top_k_scores = score_multi_vector_top_k(emb_queries, emb_passages, k=4, batch_size=2)
+
+    expected_scores, expected_indices = score_multi_vector(emb_queries, emb_passages, batch_size=2).topk(4, dim=1)
+    assert torch.equal(top_k_indices, expected_indices)
+    torch.testing.assert_close(top_k_scores, expected_scores)
+
+
+def test_merge_top_k():
+    top_k_scores, top_k_indices = merge_top_k(
+        torch.tensor([[3.0, 1.0], [2.0, 0.5]]),
+        torch.tensor([[7, 8], [7, 8]]),
+        torch.tensor([[2.0, 0.0], [1.0, 4.0]]),
+        torch.tensor([0, 1]),
+        k=2,
+    )
+
+    assert top_k_scores.tolist() == [[3.0, 2.0], [4.0, 2.0]]
+    assert top_k_indices.tolist() == [[7, 0], [1, 7]]
@@ -0,0 +1,34 @@
+from typing import List
+
+import pytest
+import torch
+
+EMBEDDING_DIM = 32
+
+
+def get_embedding_dim(request: pytest.FixtureRequest) -> int:
+    """
+    Embedding dimension of the test module (`EMBEDDING_DIM` of the module if it defines one).
+    """
+    return getattr(request.module, "EMBEDDING_DIM", EMBEDDING_DIM)
+
+
+@pytest.fixture
+def passage_embeddings(request: pytest.FixtureRequest) -> torch.Tensor:
+    torch.manual_seed(0)
+    return torch.nn.functional.normalize(torch.randn(300, get_embedding_dim(request)), dim=-1)
+
+
+@pytest.fixture
+def query_embeddings(request: pytest.FixtureRequest) -> torch.Tensor:
+    torch.manual_seed(1)
+    return torch.nn.functional.normalize(torch.randn(10, get_embedding_dim(request)), dim=-1)
+
+
+@pytest.fixture
+def multi_vector_embeddings(request: pytest.FixtureRequest) -> List[torch.Tensor]:
+    torch.manual_seed(0)
+    return [
+        torch.nn.functional.normalize(torch.randn(n_tokens, get_embedding_dim(request)), dim=-1)
+        for n_tokens in torch.randint(3, 12, (40,)).tolist()
+    ]
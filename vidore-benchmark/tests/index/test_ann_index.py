@@ -0,0 +1,89 @@
+from pathlib import Path
+
+import pytest
+import torch
+
+from vidore_benchmark.index.ann_index import HNSWIndex, IVFFlatIndex, IVFPQIndex
+from vidore_benchmark.index.base_index import load_search_index
+from vidore_benchmark.index.product_quantizer import ProductQuantizer
+from vidore_benchmark.index.utils import recall_at_k
+
+EMBEDDING_DIM = 32
+
+
+def get_exact_top_k(query_embeddings: torch.Tensor, passage_embeddings: torch.Tensor, k: int) -> torch.Tensor:
+    return (query_embeddings @ passage_embeddings.T).topk(k).indices
+
+
+def test_product_quantizer_adc_matches_decoded_dot(passage_embeddings: torch.Tensor, query_embeddings: torch.Tensor):
+    quantizer = ProductQuantizer.train(passage_embeddings, n_subquantizers=8, n_bits=4)
+    codes = quantizer.encode(passage_embeddings)
+    assert codes.shape == (len(passage_embeddings), 8)
+    assert codes.dtype == torch.uint8
+
+    lookup_tables = quantizer.compute_lookup_tables(query_embeddings)
+    expected_scores = query_embeddings @ quantizer.decode(codes).T
+    torch.testing.assert_close(quantizer.score(lookup_tables, codes), expected_scores, rtol=1e-4, atol=1e-5)
+
+
+def test_ivf_flat_index_probing_all_lists_is_exact(passage_embeddings: torch.Tensor, query_embeddings: torch.Tensor):
+    index = IVFFlatIndex.build(passage_embeddings, n_lists=8, n_probe=8)
+    indices, scores = index.search(query_embeddings, k=10)
+
+    assert torch.equal(indices, get_exact_top_k(query_embeddings, passage_embeddings, 10))
+    assert torch.all(scores[:, :-1] >= scores[:, 1:])
+
+
+def test_ivf_pq_index_search(passage_embeddings: torch.Tensor, query_embeddings: torch.Tensor):
+    index = IVFPQIndex.build(passage_embeddings, n_lists=8, n_subquantizers=16, n_probe=8)
+    indices, _ = index.search(query_embeddings, k=10)
+
+    assert indices.shape == (10, 10)
+    assert recall_at_k(indices, get_exact_top_k(query_embeddings, passage_embeddings, 10)) > 0.5
+
+
+def test_hnsw_index_search(passage_embeddings: torch.Tensor, query_embeddings: torch.Tensor):
+    index = HNSWIndex.build(passage_embeddings, m=8, ef_construction=64, ef_search=64)
+    indices, scores = index.search(query_embeddings, k=10)
+
+    assert recall_at_k(indices, get_exact_top_k(query_embeddings, passage_embeddings, 10)) > 0.9
+    assert torch.all(scores[:, :-1] >= scores[:, 1:])
+
+
+@pytest.mark.parametrize("index_class", [IVFFlatIndex, IVFPQIndex, HNSWIndex])
+def test_ann_index_save_load(
+    index_class, passage_embeddings: torch.Tensor, query_embeddings: torch.Tensor, tmp_path: Path
+):
+    build_kwargs = {"n_subquantizers": 8} if index_class is IVFPQIndex else {}
+    index = index_class.build(passage_embeddings, **build_kwargs)
+    indices, scores = index.search(query_embeddings, k=5)
+
+    path = str(tmp_path / "index.pt")
+    index.save(path)
+    loaded_index = load_search_index(path)
+    loaded_indices, loaded_scores = loaded_index.search(query_embeddings, k=5)
+
+    assert isinstance(loaded_index, index_class)
+    assert torch.equal(loaded_indices, indices)
+    torch.testing.assert_close(loaded_scores, scores)
+
+
+@pytest.mark.parametrize(
+    "index_class,search_kwargs,invalid_kwargs",
+    [
+        (IVFFlatIndex, {"n_probe": 2}, {"ef_search": 16}),
+        (IVFPQIndex, {"n_probe": 2}, {"n_candidates": 16}),
+        (HNSWIndex, {"ef_search": 16}, {"n_probe": 2}),
+    ],
+)
+def test_ann_index_load_search_params(
+    index_class, search_kwargs, invalid_kwargs, passage_embeddings: torch.Tensor, tmp_path: Path
+):
+    build_kwargs = {"n_subquantizers": 8} if index_class is IVFPQIndex else {}
+    path = str(tmp_path / "index.pt")
+    index_class.build(passage_embeddings, **build_kwargs).save(path)
+
+    loaded_index = load_search_index(path, **search_kwargs, n_candidates=None)
+    assert all(getattr(loaded_index, key) == value for key, value in search_kwargs.items())
+    with pytest.raises(ValueError, match="does not accept the search parameters"):
+        load_search_index(path, **invalid_kwargs)
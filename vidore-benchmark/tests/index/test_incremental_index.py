@@ -0,0 +1,177 @@
+from pathlib import Path
+from typing import List
+
+import pytest
+import torch
+
+from vidore_benchmark.index.ann_index import HNSWIndex, IVFFlatIndex, IVFPQIndex
+from vidore_benchmark.index.base_index import load_search_index
+from vidore_benchmark.index.incremental_index import IncrementalIndex, get_search_index_path
+from vidore_benchmark.index.matryoshka_index import MatryoshkaIndex
+from vidore_benchmark.index.muvera_index import MuveraIndex
+from vidore_benchmark.index.plaid_index import PLAIDIndex
+from vidore_benchmark.index.pq_index import PQIndex
+from vidore_benchmark.index.utils import recall_at_k
+from vidore_benchmark.utils.memmap_utils import load_doc_ids
+
+EMBEDDING_DIM = 32
+
+
+def get_single_vector_embeddings(n: int, seed: int) -> torch.Tensor:
+    torch.manual_seed(seed)
+    return torch.nn.functional.normalize(torch.randn(n, EMBEDDING_DIM), dim=-1)
+
+
+def get_multi_vector_embeddings(n: int, seed: int) -> List[torch.Tensor]:
+    torch.manual_seed(seed)
+    return [
+        torch.nn.functional.normalize(torch.randn(n_tokens, EMBEDDING_DIM), dim=-1)
+        for n_tokens in torch.randint(3, 12, (n,)).tolist()
+    ]
+
+
+@pytest.mark.parametrize(
+    "index_class,build_kwargs,multi_vector",
+    [
+        (PLAIDIndex, {"n_centroids": 16, "n_bits": 8}, True),
+        (MuveraIndex, {"block_size": 16}, True),
+        (IVFFlatIndex, {"n_lists": 8, "n_probe": 4}, False),
+        (IVFPQIndex, {"n_lists": 8, "n_subquantizers": 8, "n_probe": 4}, False),
+        (PQIndex, {"n_subquantizers": 8}, False),
+        (MatryoshkaIndex, {"dims": [16, EMBEDDING_DIM], "n_candidates": [20]}, False),
+    ],
+)
+def test_search_index_remove_then_add(index_class, build_kwargs, multi_vector: bool):
+    if multi_vector:
+        passage_embeddings = get_multi_vector_embeddings(60, seed=0)
+        query_embeddings = get_multi_vector_embeddings(5, seed=1)
+    else:
+        passage_embeddings = get_single_vector_embeddings(200, seed=0)
+        query_embeddings = get_single_vector_embeddings(5, seed=1)
+
+    index = index_class.build(passage_embeddings, **build_kwargs)
+    indices, scores = index.search(query_embeddings, k=10)
+
+    # Removing the last passages then adding them back gives the same index, as they use the frozen quantizers
+    n_removed = 15
+    index.remove(list(range(len(passage_embeddings) - n_removed, len(passage_embeddings))))
+    assert len(index) == len(passage_embeddings) - n_removed
+    index.add(passage_embeddings[-n_removed:])
+    assert len(index) == len(passage_embeddings)
+
+    updated_indices, updated_scores = index.search(query_embeddings, k=10)
+    assert torch.equal(updated_indices, indices)
+    torch.testing.assert_close(updated_scores, scores)
+
+
+def test_hnsw_index_add_remove():
+    passage_embeddings = get_single_vector_embeddings(300, seed=0)
+    query_embeddings = get_single_vector_embeddings(10, seed=1)
+
+    index = HNSWIndex.build(passage_embeddings[:200], m=8, ef_construction=64, ef_search=64)
+    index.add(passage_embeddings[200:], ef_construction=64)
+    assert len(index) == 300
+
+    exact_indices = (query_embeddings @ passage_embeddings.T).topk(10, dim=1).indices
+    indices, _ = index.search(query_embeddings, k=10)
+    assert recall_at_k(indices, exact_indices) > 0.9
+
+    # The remaining passages are renumbered in order
+    index.remove(list(range(0, 300, 2)))
+    kept_embeddings = passage_embeddings[1::2]
+    exact_indices = (query_embeddings @ kept_embeddings.T).topk(10, dim=1).indices
+    indices, _ = index.search(query_embeddings, k=10)
+    assert len(index) == 150
+    assert recall_at_k(indices, exact_indices) > 0.9
+
+    # The tombstones are never returned, and new passages are numbered after the remaining ones
+    index.add(passage_embeddings[:10:2], ef_construction=64)
+    indices, _ = index.search(passage_embeddings[:10:2], k=1)
+    assert torch.equal(indices[:, 0], torch.arange(150, 155))
+
+
+def test_incremental_index(tmp_path: Path):
+    passage_embeddings = get_multi_vector_embeddings(50, seed=0)
+    new_embeddings = get_multi_vector_embeddings(10, seed=2)
+    doc_ids = [f"page_{idx}.png" for idx in range(50)]
+    path = str(tmp_path / "index")
+
+    index = IncrementalIndex.create(
+        path,
+        passage_embeddings[:40],
+        doc_ids[:40],
+        search_indexes={"plaid": PLAIDIndex.build(passage_embeddings[:40], n_centroids=8, n_bits=8)},
+        max_deleted_fraction=0.2,
+    )
+    index.add(passage_embeddings[40:], doc_ids[40:])
+    assert len(index) == 50
+    assert len(index.search_indexes["plaid"]) == 50
+
+    # Deletions are tombstones until the index is compacted
+    index.delete(["page_3.png", "page_7.png"])
+    assert len(index) == 48 and index.n_passages == 50
+    assert "page_3.png" not in index
+    assert load_doc_ids(path)[3] is None
+
+    index.upsert(new_embeddings[:2], ["page_10.png", "new_page.png"])
+    assert len(index) == 49 and index.n_passages == 52
+    assert index.doc_ids[-2:] == ["page_10.png", "new_page.png"]
+
+    index.compact()
+    expected_doc_ids = [doc_id for doc_id in doc_ids if doc_id not in {"page_3.png", "page_7.png", "page_10.png"}]
+    expected_doc_ids += ["page_10.png", "new_page.png"]
+    assert load_doc_ids(path) == expected_doc_ids
+    assert index.n_passages == 49 and not index.tombstones
+
+    embeddings = index.embeddings
+    assert torch.equal(embeddings[2], passage_embeddings[2])
+    assert torch.equal(embeddings[3], passage_embeddings[4])
+    assert torch.equal(embeddings[-1], new_embeddings[1])
+
+    # The search index is saved after each change, and its positions follow the compacted index
+    reloaded_index = IncrementalIndex(path)
+    plaid_index = reloaded_index.search_indexes["plaid"]
+    assert len(plaid_index) == 49
+    indices, _ = plaid_index.search([new_embeddings[1]], k=1)
+    assert indices[0, 0] == 48
+
+    # Deleting more than `max_deleted_fraction` of the passages compacts the index
+    reloaded_index.delete([f"page_{idx}.png" for idx in range(20, 40)])
+    assert reloaded_index.n_passages == 29 and not reloaded_index.tombstones
+    assert len(load_search_index(get_search_index_path(path, "plaid"))) == 29
+
+    # Unsaved additions are caught up when the index is next opened
+    reloaded_index.add(new_embeddings[2:], [f"new_page_{idx}.png" for idx in range(2, 10)], save=False)
+    assert len(load_search_index(get_search_index_path(path, "plaid"))) == 29
+    assert len(IncrementalIndex(path).search_indexes["plaid"]) == 37
+
+
+def test_incremental_index_muvera_rerank(tmp_path: Path):
+    passage_embeddings = get_multi_vector_embeddings(40, seed=0)
+    new_embeddings = get_multi_vector_embeddings(10, seed=2)
+    path = str(tmp_path / "index")
+
+    index = IncrementalIndex.create(
+        path,
+        passage_embeddings,
+        [f"page_{idx}.png" for idx in range(40)],
+        search_indexes={"muvera": MuveraIndex.build(passage_embeddings, block_size=16)},
+    )
+    index.add(new_embeddings, [f"new_page_{idx}.png" for idx in range(10)])
+    index.delete([f"page_{idx}.png" for idx in range(10)])
+    index.compact()
+
+    # The MUVERA index reranks with the memmap embeddings, which follow the additions and the compaction
+    muvera_index = IncrementalIndex(path).search_indexes["muvera"]
+    assert muvera_index.passage_embeddings is not None
+    assert len(muvera_index.passage_embeddings) == len(muvera_index) == 40
+
+    indices, scores = muvera_index.search(new_embeddings, k=1)
+    assert torch.equal(indices[:, 0], torch.arange(30, 40))
+    expected_scores = torch.stack([(emb @ emb.T).max(dim=1).values.sum() for emb in new_embeddings])
+    torch.testing.assert_close(scores[:, 0], expected_scores)
+
+
+def test_get_search_index_path():
+    assert get_search_index_path("outputs/index", "plaid") == "outputs/index.plaid.pt"
+    assert get_search_index_path(Path("outputs/embeddings.pt"), "hnsw") == "outputs/embeddings.hnsw.pt"
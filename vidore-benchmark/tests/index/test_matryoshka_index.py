@@ -0,0 +1,63 @@
+from pathlib import Path
+
+import pytest
+import torch
+
+from vidore_benchmark.index.base_index import load_search_index
+from vidore_benchmark.index.matryoshka_index import MatryoshkaIndex, truncate_embeddings
+
+EMBEDDING_DIM = 64
+
+
+def test_truncate_embeddings(passage_embeddings: torch.Tensor):
+    truncated = truncate_embeddings(passage_embeddings, 16)
+    assert truncated.shape == (len(passage_embeddings), 16)
+    torch.testing.assert_close(truncated.norm(dim=-1), torch.ones(len(passage_embeddings)))
+
+
+def test_matryoshka_index_full_budget_is_exact(passage_embeddings: torch.Tensor, query_embeddings: torch.Tensor):
+    # Every stage keeps all the passages, so the last (full-dimension) stage ranks the whole corpus
+    index = MatryoshkaIndex.build(
+        list(passage_embeddings),
+        dims=[16, 32, EMBEDDING_DIM],
+        n_candidates=[len(passage_embeddings), len(passage_embeddings)],
+        block_size=64,
+    )
+    indices, scores = index.search(query_embeddings, k=10)
+
+    expected_scores, expected_indices = (query_embeddings @ passage_embeddings.T).topk(10, dim=1)
+    assert torch.equal(indices, expected_indices)
+    torch.testing.assert_close(scores, expected_scores)
+
+
+def test_matryoshka_index_first_stage(passage_embeddings: torch.Tensor, query_embeddings: torch.Tensor):
+    index = MatryoshkaIndex.build(passage_embeddings, dims=[16, EMBEDDING_DIM], n_candidates=[20])
+    candidates, _ = index.search_prefix(query_embeddings, k=20)
+
+    prefix_scores = truncate_embeddings(query_embeddings, 16) @ truncate_embeddings(passage_embeddings, 16).T
+    assert torch.equal(candidates, prefix_scores.topk(20, dim=1).indices)
+
+    # The final top-k is a reranking of the first stage candidates
+    indices, _ = index.search(query_embeddings, k=5)
+    for query_indices, query_candidates in zip(indices, candidates):
+        assert set(query_indices.tolist()) <= set(query_candidates.tolist())
+
+
+def test_matryoshka_index_invalid_stages(passage_embeddings: torch.Tensor):
+    with pytest.raises(ValueError):
+        MatryoshkaIndex.build(passage_embeddings, dims=[16, 32, EMBEDDING_DIM], n_candidates=[20])
+    with pytest.raises(ValueError):
+        MatryoshkaIndex.build(passage_embeddings, dims=[32, 16], n_candidates=[20])
+
+
+def test_matryoshka_index_save_load(passage_embeddings: torch.Tensor, query_embeddings: torch.Tensor, tmp_path: Path):
+    index = MatryoshkaIndex.build(passage_embeddings, dims=[16, EMBEDDING_DIM], n_candidates=[30])
+    indices, scores = index.search(query_embeddings, k=5)
+
+    path = str(tmp_path / "index.matryoshka.pt")
+    index.save(path)
+    loaded_index = load_search_index(path)
+    loaded_indices, loaded_scores = loaded_index.search(query_embeddings, k=5)
+
+    assert torch.equal(loaded_indices, indices)
+    torch.testing.assert_close(loaded_scores, scores)
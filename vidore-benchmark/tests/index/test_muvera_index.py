@@ -0,0 +1,47 @@
+from pathlib import Path
+from typing import List
+
+import torch
+
+from vidore_benchmark.index import FixedDimensionalEncoder, MuveraIndex, load_search_index
+
+EMBEDDING_DIM = 32
+
+
+def test_fixed_dimensional_encoder(multi_vector_embeddings: List[torch.Tensor]):
+    encoder = FixedDimensionalEncoder(EMBEDDING_DIM, n_simhash_bits=3, n_repetitions=4, projection_dim=None)
+    assert encoder.fde_dim == 4 * 8 * EMBEDDING_DIM
+
+    query_fdes = encoder.encode(multi_vector_embeddings[:2], is_query=True)
+    passage_fdes = encoder.encode(multi_vector_embeddings, is_query=False)
+    assert query_fdes.shape == (2, encoder.fde_dim)
+    assert passage_fdes.shape == (len(multi_vector_embeddings), encoder.fde_dim)
+
+    # The query blocks sum the tokens, and the empty passage partitions are filled
+    blocks = query_fdes.view(2, 4, 8, EMBEDDING_DIM)
+    for query_blocks, query_embedding in zip(blocks, multi_vector_embeddings[:2]):
+        assert torch.allclose(query_blocks.sum(dim=1), query_embedding.sum(dim=0).expand(4, -1), atol=1e-5)
+    assert passage_fdes.view(len(multi_vector_embeddings), 4 * 8, EMBEDDING_DIM).ne(0).any(dim=-1).all()
+
+
+def test_muvera_index_search(multi_vector_embeddings: List[torch.Tensor], tmp_path: Path):
+    query_embeddings = multi_vector_embeddings[:5]
+    index = MuveraIndex.build(multi_vector_embeddings, n_candidates=len(multi_vector_embeddings), block_size=16)
+
+    # Reranking all the passages is exhaustive
+    exact_scores = torch.tensor(
+        [[(q @ p.T).max(dim=1)[0].sum() for p in multi_vector_embeddings] for q in query_embeddings]
+    )
+    expected_scores, expected_indices = exact_scores.topk(5, dim=1)
+    top_k_indices, top_k_scores = index.search(query_embeddings, k=5)
+    assert torch.equal(top_k_indices, expected_indices)
+    assert torch.allclose(top_k_scores, expected_scores, atol=1e-5)
+
+    index.save(str(tmp_path / "index.muvera.pt"))
+    loaded_index = load_search_index(str(tmp_path / "index.muvera.pt"), passage_embeddings=multi_vector_embeddings)
+    assert isinstance(loaded_index, MuveraIndex)
+    assert torch.equal(loaded_index.search(query_embeddings, k=5)[0], top_k_indices)
+
+    # Without the passage embeddings, the FDE top-k is returned
+    fde_indices, _ = MuveraIndex.load(str(tmp_path / "index.muvera.pt")).search(query_embeddings, k=5)
+    assert fde_indices.shape == (5, 5)
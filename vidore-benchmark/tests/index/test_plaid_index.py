@@ -0,0 +1,69 @@
+from pathlib import Path
+from typing import List
+
+import pytest
+import torch
+
+from vidore_benchmark.index.plaid_index import PLAIDIndex, pack_bits, unpack_bits
+
+EMBEDDING_DIM = 32
+
+
+def get_exact_scores(query_embeddings: List[torch.Tensor], passage_embeddings: List[torch.Tensor]) -> torch.Tensor:
+    return torch.tensor([[(q @ p.T).max(dim=1)[0].sum() for p in passage_embeddings] for q in query_embeddings])
+
+
+@pytest.mark.parametrize("n_bits", [1, 2, 4, 8])
+def test_pack_bits_round_trip(n_bits: int):
+    codes = torch.randint(0, 1 << n_bits, (5, EMBEDDING_DIM))
+    packed = pack_bits(codes, n_bits)
+    assert packed.shape == (5, EMBEDDING_DIM * n_bits // 8)
+    assert torch.equal(unpack_bits(packed, n_bits), codes)
+
+
+def test_plaid_index_build(multi_vector_embeddings: List[torch.Tensor]):
+    index = PLAIDIndex.build(multi_vector_embeddings, n_centroids=16, n_bits=8)
+    assert len(index) == len(multi_vector_embeddings)
+    assert index.centroids.shape == (16, EMBEDDING_DIM)
+
+    # Every passage appears in the inverted list of each of its centroids
+    for passage_id in range(len(index)):
+        start, end = index.passage_centroid_offsets[passage_id], index.passage_centroid_offsets[passage_id + 1]
+        for centroid_id in index.passage_centroid_ids[start:end].tolist():
+            ivf = index.ivf_passage_ids[index.ivf_offsets[centroid_id] : index.ivf_offsets[centroid_id + 1]]
+            assert passage_id in ivf.tolist()
+
+    # 8-bit residuals are almost lossless
+    tokens = torch.cat(multi_vector_embeddings)
+    assert (index.decompress(torch.arange(len(tokens))) * tokens).sum(dim=-1).mean() > 0.99
+
+
+def test_plaid_index_search_matches_exhaustive(multi_vector_embeddings: List[torch.Tensor]):
+    query_embeddings = multi_vector_embeddings[:5]
+
+    # Probing all the centroids without pruning and rescoring in full precision is exhaustive
+    index = PLAIDIndex.build(
+        multi_vector_embeddings,
+        n_centroids=8,
+        n_probe=8,
+        n_candidates=len(multi_vector_embeddings),
+        centroid_score_threshold=None,
+    )
+    top_k_indices, top_k_scores = index.search(query_embeddings, k=5, passage_embeddings=multi_vector_embeddings)
+
+    expected_scores, expected_indices = get_exact_scores(query_embeddings, multi_vector_embeddings).topk(5, dim=1)
+    assert torch.equal(top_k_indices, expected_indices)
+    assert torch.allclose(top_k_scores, expected_scores, atol=1e-5)
+
+
+def test_plaid_index_search_pads_missing_results(multi_vector_embeddings: List[torch.Tensor], tmp_path: Path):
+    index = PLAIDIndex.build(multi_vector_embeddings, n_centroids=16, n_probe=1, n_candidates=4)
+    index.save(str(tmp_path / "index.plaid.pt"))
+
+    loaded_index = PLAIDIndex.load(str(tmp_path / "index.plaid.pt"), n_candidates=2)
+    assert loaded_index.n_candidates == 2
+
+    top_k_indices, top_k_scores = loaded_index.search(multi_vector_embeddings[:3], k=4)
+    assert top_k_indices.shape == (3, 4)
+    assert (top_k_indices[:, 2:] == -1).all()
+    assert torch.isinf(top_k_scores[:, 2:]).all()
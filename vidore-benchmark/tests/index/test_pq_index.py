@@ -0,0 +1,51 @@
+from pathlib import Path
+
+import torch
+
+from vidore_benchmark.index.base_index import load_search_index
+from vidore_benchmark.index.pq_index import PQIndex
+from vidore_benchmark.index.utils import recall_at_k
+
+EMBEDDING_DIM = 64
+
+
+def test_pq_index_build(passage_embeddings: torch.Tensor):
+    index = PQIndex.build(passage_embeddings, n_subquantizers=16)
+
+    assert len(index) == len(passage_embeddings)
+    assert index.codes.shape == (len(passage_embeddings), 16)
+    assert index.codes.dtype == torch.uint8
+    assert index.passage_embeddings is None
+
+
+def test_pq_index_search_matches_adc_scores(passage_embeddings: torch.Tensor, query_embeddings: torch.Tensor):
+    index = PQIndex.build(passage_embeddings, n_subquantizers=16, block_size=64)
+    indices, scores = index.search(query_embeddings, k=10)
+
+    expected_scores, expected_indices = index.score(query_embeddings).topk(10, dim=1)
+    assert torch.equal(indices, expected_indices)
+    torch.testing.assert_close(scores, expected_scores)
+
+
+def test_pq_index_rerank_is_exact(passage_embeddings: torch.Tensor, query_embeddings: torch.Tensor):
+    index = PQIndex.build(passage_embeddings, n_subquantizers=8, rerank_top_k=len(passage_embeddings))
+    indices, scores = index.search(query_embeddings, k=10)
+
+    expected_scores, expected_indices = (query_embeddings @ passage_embeddings.T).topk(10, dim=1)
+    assert torch.equal(indices, expected_indices)
+    torch.testing.assert_close(scores, expected_scores)
+
+
+def test_pq_index_save_load(passage_embeddings: torch.Tensor, query_embeddings: torch.Tensor, tmp_path: Path):
+    index = PQIndex.build(passage_embeddings, n_subquantizers=16, rerank_top_k=50)
+    indices, _ = index.search(query_embeddings, k=10)
+
+    path = str(tmp_path / "index.pq.pt")
+    index.save(path)
+
+    loaded_index = load_search_index(path, passage_embeddings=list(passage_embeddings))
+    loaded_indices, _ = loaded_index.search(query_embeddings, k=10)
+    assert torch.equal(loaded_indices, indices)
+
+    exact_indices = (query_embeddings @ passage_embeddings.T).topk(10, dim=1).indices
+    assert recall_at_k(loaded_indices, exact_indices) > 0.9
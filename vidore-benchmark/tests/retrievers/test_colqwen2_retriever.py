@@ -1,6 +1,8 @@
 from typing import Generator
 
 import pytest
+import torch
+from PIL import Image
 
 from vidore_benchmark.retrievers.colqwen2_retriever import ColQwen2Retriever
 from vidore_benchmark.utils.torch_utils import tear_down_torch
@@ -32,3 +34,31 @@ def test_get_scores(
 ):
     scores = retriever.get_scores(query_multi_vector_embeddings_fixture, passage_multi_vector_embeddings_fixture)
     assert scores.shape == (len(query_multi_vector_embeddings_fixture), len(passage_multi_vector_embeddings_fixture))
+
+
+@pytest.mark.slow
+def test_forward_documents_with_preprocessing_workers(retriever: ColQwen2Retriever, image_passage_fixture):
+    expected_embedding_docs = retriever.forward_passages(image_passage_fixture, batch_size=1)
+
+    retriever.set_preprocessing_workers(2)
+    embedding_docs = retriever.forward_passages(image_passage_fixture, batch_size=1)
+    retriever.set_preprocessing_workers(0)
+
+    assert len(embedding_docs) == len(expected_embedding_docs)
+    for embedding_doc, expected_embedding_doc in zip(embedding_docs, expected_embedding_docs):
+        assert torch.allclose(embedding_doc, expected_embedding_doc)
+
+
+@pytest.mark.slow
+def test_forward_documents_with_visual_token_budget(retriever: ColQwen2Retriever):
+    images = [Image.new("RGB", size, color="black") for size in [(448, 448), (28, 56), (224, 896), (28, 56)]]
+    expected_embedding_docs = retriever.forward_passages(images, batch_size=1)
+
+    retriever.max_visual_tokens_per_batch = 512
+    embedding_docs = retriever.forward_passages(images, batch_size=1)
+    retriever.max_visual_tokens_per_batch = None
+
+    # The passages are batched by visual-token budget, and their embeddings are returned in the original order
+    assert len(embedding_docs) == len(expected_embedding_docs)
+    for embedding_doc, expected_embedding_doc in zip(embedding_docs, expected_embedding_docs):
+        assert embedding_doc.shape == expected_embedding_doc.shape
@@ -1,8 +1,12 @@
-from typing import Generator
+import os
+from typing import Generator, List, Tuple
 
 import pytest
+import torch
 
+from vidore_benchmark.evaluation.encoding import encode_passages
 from vidore_benchmark.retrievers.dummy_retriever import DummyRetriever
+from vidore_benchmark.utils.data_utils import ListDataset
 from vidore_benchmark.utils.torch_utils import tear_down_torch
 
 
@@ -29,3 +33,66 @@ def test_get_scores(
 ):
     scores = retriever.get_scores(query_single_vector_embeddings_fixture, passage_single_vector_embeddings_fixture)
     assert scores.shape == (len(query_single_vector_embeddings_fixture), len(passage_single_vector_embeddings_fixture))
+
+
+def test_get_top_k(
+    retriever: DummyRetriever,
+    query_single_vector_embeddings_fixture,
+    passage_single_vector_embeddings_fixture,
+):
+    k = 2
+    top_k_indices, top_k_scores = retriever.get_top_k(
+        query_single_vector_embeddings_fixture,
+        passage_single_vector_embeddings_fixture,
+        k=k,
+        block_size=1,
+    )
+    scores = retriever.get_scores(query_single_vector_embeddings_fixture, passage_single_vector_embeddings_fixture)
+    expected_scores, expected_indices = scores.topk(min(k, scores.shape[1]), dim=1)
+
+    assert torch.equal(top_k_indices, expected_indices)
+    assert torch.allclose(top_k_scores, expected_scores)
+
+
+def test_prepare_passage_embeddings(retriever: DummyRetriever, passage_single_vector_embeddings_fixture):
+    assert retriever.prepare_passage_embeddings(passage_single_vector_embeddings_fixture) is (
+        passage_single_vector_embeddings_fixture
+    )
+
+
+def get_worker_pids(items: List[int]) -> List[Tuple[int, int]]:
+    return [(os.getpid(), item) for item in items]
+
+
+class PidDataset(ListDataset[int]):
+    def __getitem__(self, idx: int) -> Tuple[int, int]:
+        return os.getpid(), self.elements[idx]
+
+
+def test_get_dataloader_fetches_in_workers(retriever: DummyRetriever):
+    retriever.set_preprocessing_workers(2)
+    dataset = PidDataset(list(range(5)))
+    first_batches = list(retriever.get_dataloader(dataset, 2, list))
+    second_batches = list(retriever.get_dataloader(dataset, 2, list, [[4, 0]]))
+    retriever.set_preprocessing_workers(0)
+
+    assert [[item for _, item in batch] for batch in first_batches] == [[0, 1], [2, 3], [4]]
+    assert [[item for _, item in batch] for batch in second_batches] == [[4, 0]]
+    # The items are fetched by the workers, which are reused by the next pass over the same dataset
+    assert os.getpid() not in {pid for batch in first_batches for pid, _ in batch}
+    assert {pid for batch in second_batches for pid, _ in batch} <= {pid for batch in first_batches for pid, _ in batch}
+
+    # The streamed batches have no length
+    with pytest.raises(TypeError):
+        len(retriever.get_batch_dataloader(iter([[0, 1]]), list))
+
+
+def test_encode_passages_preprocesses_in_workers(retriever: DummyRetriever, monkeypatch: pytest.MonkeyPatch):
+    stages = [("preprocess", get_worker_pids), ("forward", lambda batch: batch)]
+    monkeypatch.setattr(retriever, "get_passage_encoding_stages", lambda: stages)
+    retriever.set_preprocessing_workers(2)
+    outputs = encode_passages(retriever, [{"id": idx} for idx in range(7)], lambda page: page["id"], batch_passage=2)
+    retriever.set_preprocessing_workers(0)
+
+    assert [item for _, item in outputs] == list(range(7))
+    assert os.getpid() not in {pid for pid, _ in outputs}
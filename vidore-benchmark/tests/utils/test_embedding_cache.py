@@ -0,0 +1,108 @@
+from pathlib import Path
+from typing import List
+
+import torch
+from PIL import Image
+
+from vidore_benchmark.retrievers.vision_retriever import VisionRetriever
+from vidore_benchmark.utils.embedding_cache import EmbeddingCache, hash_passage
+from vidore_benchmark.utils.ragged_utils import RaggedEmbeddings
+
+
+class CountingRetriever(VisionRetriever):
+    """Multi-vector retriever embedding each image as its pixel values, counting the encoded passages."""
+
+    def __init__(self):
+        self.n_encoded = 0
+
+    @property
+    def use_visual_embedding(self) -> bool:
+        return True
+
+    def forward_queries(self, queries: List[str], batch_size: int, **kwargs) -> List[torch.Tensor]:
+        self.n_encoded += len(queries)
+        return [torch.tensor([float(ord(char)) for char in query]) for query in queries]
+
+    def forward_passages(self, passages: List[Image.Image], batch_size: int, **kwargs) -> RaggedEmbeddings:
+        self.n_encoded += len(passages)
+        return RaggedEmbeddings.from_list(
+            [torch.tensor(image.getdata(), dtype=torch.float32)[: image.width] for image in passages]
+        )
+
+    def get_scores(self, query_embeddings, passage_embeddings, batch_size=None):
+        raise NotImplementedError
+
+
+def get_image(color: int, width: int = 4) -> Image.Image:
+    return Image.new("RGB", (width, 2), color=(color, color, color))
+
+
+def test_hash_passage():
+    assert hash_passage(get_image(1)) == hash_passage(get_image(1))
+    assert hash_passage(get_image(1)) != hash_passage(get_image(2))
+    assert hash_passage(get_image(1).convert("L")) != hash_passage(get_image(1))
+    assert hash_passage((get_image(1), "text")) != hash_passage((get_image(1), "other text"))
+    assert hash_passage(object()) is None
+
+
+def test_forward_passages_with_cache(tmp_path: Path):
+    retriever = CountingRetriever()
+    images = [get_image(idx, width=2 + idx) for idx in range(4)]
+    expected = retriever.forward_passages(images, batch_size=2)
+
+    cache = EmbeddingCache(str(tmp_path / "cache"))
+    retriever.set_passage_embedding_cache(cache)
+    retriever.n_encoded = 0
+
+    embeddings = retriever.forward_passages(images[:2], batch_size=2)
+    assert retriever.n_encoded == 2 and cache.n_hits == 0
+
+    # Only the misses are encoded, and the output keeps the order of the passages
+    embeddings = retriever.forward_passages(images, batch_size=2)
+    assert retriever.n_encoded == 4
+    assert isinstance(embeddings, RaggedEmbeddings)
+    for embedding, expected_embedding in zip(embeddings, expected):
+        assert torch.equal(embedding, expected_embedding)
+
+    # The cache persists across retrievers with the same namespace
+    other_retriever = CountingRetriever()
+    other_retriever.set_passage_embedding_cache(EmbeddingCache(str(tmp_path / "cache")))
+    other_retriever.forward_passages(images[::-1], batch_size=2)
+    assert other_retriever.n_encoded == 0
+    assert other_retriever.passage_embedding_cache.hit_rate == 1.0
+
+
+def test_embedding_cache_lru_eviction(tmp_path: Path):
+    retriever = CountingRetriever()
+    cache = EmbeddingCache(str(tmp_path / "cache"))
+    retriever.set_passage_embedding_cache(cache)
+
+    retriever.forward_passages([get_image(0)], batch_size=1)
+    entry_size = cache.size_bytes
+    cache.max_size_bytes = int(2.5 * entry_size)
+
+    retriever.forward_passages([get_image(1)], batch_size=1)
+    retriever.forward_passages([get_image(0)], batch_size=1)  # Most recently used
+    retriever.forward_passages([get_image(2)], batch_size=1)  # Evicts the least recently used entries
+    assert cache.size_bytes <= 0.9 * cache.max_size_bytes
+
+    retriever.n_encoded = 0
+    retriever.forward_passages([get_image(2)], batch_size=1)
+    assert retriever.n_encoded == 0
+
+
+def test_forward_queries_with_memory_cache():
+    retriever = CountingRetriever()
+    cache = EmbeddingCache(memory_max_entries=2, name="Query")
+    retriever.set_query_embedding_cache(cache)
+
+    retriever.forward_queries(["a", "bb"], batch_size=2)
+    embeddings = retriever.forward_queries(["bb", "a", "ccc"], batch_size=2)
+    assert retriever.n_encoded == 3 and cache.n_hits == 2
+    assert [embedding.tolist() for embedding in embeddings] == [[98.0, 98.0], [97.0], [99.0, 99.0, 99.0]]
+
+    # Only the 2 most recently used queries are kept in memory
+    assert list(cache.memory) == [cache.get_key(retriever.get_query_cache_namespace(), query) for query in ["a", "ccc"]]
+
+    # The query and passage embeddings do not share their namespace, even when the passages are texts
+    assert retriever.get_query_cache_namespace() != retriever.get_embedding_cache_namespace()
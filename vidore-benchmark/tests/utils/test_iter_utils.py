@@ -0,0 +1,22 @@
+from vidore_benchmark.utils.iter_utils import get_token_budget_batches
+
+
+def test_get_token_budget_batches():
+    n_tokens = [768, 64, 64, 100, 64, 300, 100]
+    batches = get_token_budget_batches(n_tokens, max_tokens_per_batch=256)
+
+    # The padded size of each batch fits in the budget, except for the items larger than it, alone in their batch
+    for batch in batches:
+        assert len(batch) * max(n_tokens[idx] for idx in batch) <= 256 or len(batch) == 1
+    assert batches == [[1, 2, 4], [3, 6], [5], [0]]
+
+    # All the items are batched once, the concatenated batches give the original order back
+    assert sorted(idx for batch in batches for idx in batch) == list(range(len(n_tokens)))
+
+    # Same number of tokens, the items are grouped by key
+    batches = get_token_budget_batches(
+        [4, 4, 4, 4], max_tokens_per_batch=8, group_keys=[(1, 4), (4, 1), (1, 4), (4, 1)]
+    )
+    assert batches == [[0, 2], [1, 3]]
+
+    assert get_token_budget_batches([1] * 5, max_tokens_per_batch=100, max_batch_size=2) == [[0, 1], [2, 3], [4]]
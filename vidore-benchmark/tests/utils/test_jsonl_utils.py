@@ -0,0 +1,66 @@
+import base64
+import io
+import json
+from pathlib import Path
+from typing import List
+
+import pytest
+from PIL import Image
+
+from vidore_benchmark.utils.jsonl_utils import iter_jsonl_pages
+
+
+def encode_image(color: int) -> str:
+    buffer = io.BytesIO()
+    Image.new("RGB", (16, 16), color=(color, color, color)).save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode("utf-8")
+
+
+@pytest.fixture
+def jsonl_path(tmp_path: Path) -> str:
+    path = tmp_path / "collection.jsonl"
+    with open(path, "w", encoding="utf-8") as f:
+        for idx in range(30):
+            page = {
+                "query": f"query {idx}",
+                "image": encode_image(idx),
+                "image_filename": f"page_{idx}.png",
+                "text_description": f"text {idx}",
+            }
+            f.write(json.dumps(page) + "\n")
+    return str(path)
+
+
+def get_colors(pages: List[dict]) -> List[int]:
+    return [page["image"].getpixel((0, 0))[0] for page in pages]
+
+
+@pytest.mark.parametrize("n_workers", [0, 2])
+def test_iter_jsonl_pages_in_order(jsonl_path: str, n_workers: int):
+    # Chunks smaller than a line: most chunks contain no line start
+    pages = list(iter_jsonl_pages(jsonl_path, n_workers=n_workers, chunk_bytes=100))
+
+    assert [page["image_filename"] for page in pages] == [f"page_{idx}.png" for idx in range(30)]
+    assert pages[3]["query"] == "query 3" and pages[3]["text_description"] == "text 3"
+    assert get_colors(pages) == list(range(30))
+
+
+def test_iter_jsonl_pages_fields(jsonl_path: str):
+    pages = list(iter_jsonl_pages(jsonl_path, fields=("query", "image_filename"), n_workers=0))
+    assert pages[0] == {"query": "query 0", "image_filename": "page_0.png"}
+
+
+def test_iter_jsonl_pages_skip(jsonl_path: str):
+    skipped = {"page_1.png", "page_2.png"}
+    pages = list(
+        iter_jsonl_pages(
+            jsonl_path,
+            skip_page=lambda filename: filename == "page_1.png",
+            # `page_2.png` is not skipped in the end: its image is decoded in the main process
+            maybe_skipped=skipped,
+            n_workers=2,
+            chunk_bytes=1000,
+        )
+    )
+    assert len(pages) == 29
+    assert get_colors(pages)[:3] == [0, 2, 3]
@@ -0,0 +1,129 @@
+from pathlib import Path
+
+import pytest
+import torch
+
+from vidore_benchmark.utils.memmap_utils import (
+    MemmapEmbeddings,
+    MemmapIndexWriter,
+    ShardedIndexWriter,
+    blockwise_top_k,
+    is_memmap_index,
+    load_doc_ids,
+    load_memmap_embeddings,
+    save_memmap_embeddings,
+    save_tombstones,
+)
+from vidore_benchmark.utils.ragged_utils import RaggedEmbeddings, load_embeddings
+
+EMBEDDING_DIM = 16
+
+
+@pytest.fixture
+def ragged_embeddings() -> RaggedEmbeddings:
+    torch.manual_seed(0)
+    return RaggedEmbeddings.from_list(
+        [torch.randn(n_tokens, EMBEDDING_DIM, dtype=torch.bfloat16) for n_tokens in [3, 7, 1, 5, 4, 2]]
+    )
+
+
+def test_memmap_embeddings_round_trip(ragged_embeddings: RaggedEmbeddings, tmp_path: Path):
+    path = str(tmp_path / "index")
+    doc_ids = [f"page_{idx}.png" for idx in range(len(ragged_embeddings))]
+
+    with MemmapIndexWriter(path) as writer:
+        writer.add(ragged_embeddings[:2], doc_ids[:2])
+        writer.add(ragged_embeddings[2:], doc_ids[2:])
+
+    assert is_memmap_index(path)
+    loaded = load_embeddings(path)
+    assert isinstance(loaded, MemmapEmbeddings)
+    assert loaded.dtype == torch.bfloat16
+    assert torch.equal(loaded.values, ragged_embeddings.values)
+    assert torch.equal(loaded.offsets, ragged_embeddings.offsets)
+    assert loaded.doc_ids == doc_ids
+    assert load_doc_ids(path) == doc_ids
+
+
+def test_memmap_embeddings_are_not_modified_in_place(ragged_embeddings: RaggedEmbeddings, tmp_path: Path):
+    path = str(tmp_path / "index")
+    save_memmap_embeddings(ragged_embeddings, path)
+
+    load_memmap_embeddings(path).values.zero_()
+    assert torch.equal(load_memmap_embeddings(path).values, ragged_embeddings.values)
+
+
+def test_memmap_single_vector_embeddings(tmp_path: Path):
+    path = str(tmp_path / "index")
+    embeddings = torch.randn(10, EMBEDDING_DIM)
+    save_memmap_embeddings(list(embeddings), path)
+
+    loaded = load_memmap_embeddings(path)
+    assert isinstance(loaded, torch.Tensor)
+    assert torch.equal(loaded, embeddings)
+
+
+def test_memmap_index_writer_checks_doc_ids(ragged_embeddings: RaggedEmbeddings, tmp_path: Path):
+    with pytest.raises(ValueError):
+        with MemmapIndexWriter(str(tmp_path / "index")) as writer:
+            writer.add(ragged_embeddings[:2], ["a", "b"])
+            writer.add(ragged_embeddings[2:])
+    assert not is_memmap_index(str(tmp_path / "index"))
+
+
+def test_blockwise_top_k(ragged_embeddings: RaggedEmbeddings):
+    queries = torch.randn(3, EMBEDDING_DIM)
+    passages = torch.stack([emb.float().mean(dim=0) for emb in ragged_embeddings])
+    expected_scores, expected_indices = (queries @ passages.T).topk(4, dim=1)
+
+    def search_fn(block: RaggedEmbeddings):
+        block_scores = queries @ torch.stack([emb.float().mean(dim=0) for emb in block]).T
+        block_scores, block_indices = block_scores.topk(min(4, block_scores.shape[1]), dim=1)
+        return block_indices, block_scores
+
+    indices, scores = blockwise_top_k(ragged_embeddings, search_fn, k=4, block_size=4)
+    assert torch.equal(indices, expected_indices)
+    torch.testing.assert_close(scores, expected_scores)
+
+
+def test_blockwise_top_k_skips_deleted_passages(ragged_embeddings: RaggedEmbeddings, tmp_path: Path):
+    path = str(tmp_path / "index")
+    save_memmap_embeddings(ragged_embeddings, path, doc_ids=[f"page_{idx}.png" for idx in range(6)])
+    save_tombstones(path, [1, 4])
+
+    def search_fn(block: RaggedEmbeddings):
+        block_scores = torch.stack([emb.float().sum() for emb in block]).expand(2, -1)
+        block_scores, block_indices = block_scores.topk(min(6, block_scores.shape[1]), dim=1)
+        return block_indices, block_scores
+
+    indices, _ = blockwise_top_k(load_memmap_embeddings(path), search_fn, k=6, block_size=2)
+    assert sorted(indices[0].tolist()) == [0, 2, 3, 5]
+
+
+def test_sharded_index_writer_resume(ragged_embeddings: RaggedEmbeddings, tmp_path: Path):
+    shards_path = str(tmp_path / "index.shards")
+    doc_ids = [f"page_{idx}.png" for idx in range(len(ragged_embeddings))]
+
+    writer = ShardedIndexWriter(shards_path, shard_size=2)
+    writer.add(ragged_embeddings[:3], doc_ids[:3])
+    writer.add(ragged_embeddings[3:4], doc_ids[3:4])
+    assert len(writer.shards) == 1
+    assert len(writer) == 4
+
+    # Simulate a crash: the buffered passage and a partially written shard are lost
+    (tmp_path / "index.shards" / "shard_00001").mkdir()
+    del writer
+
+    writer = ShardedIndexWriter(shards_path, shard_size=2)
+    assert writer.n_completed == 3
+    assert sorted(writer.completed_doc_ids) == doc_ids[:3]
+    assert not (tmp_path / "index.shards" / "shard_00001").exists()
+
+    writer.add(ragged_embeddings[3:], doc_ids[3:])
+    embeddings = writer.finalize(str(tmp_path / "index"))
+
+    assert isinstance(embeddings, MemmapEmbeddings)
+    assert embeddings.doc_ids == doc_ids
+    assert torch.equal(embeddings.values, ragged_embeddings.values)
+    assert torch.equal(embeddings.offsets, ragged_embeddings.offsets)
+    assert not (tmp_path / "index.shards").exists()
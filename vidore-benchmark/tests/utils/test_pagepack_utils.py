@@ -0,0 +1,95 @@
+import base64
+import io
+import json
+import os
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+from vidore_benchmark.utils.pagepack_utils import (
+    PagePack,
+    PagePackWriter,
+    convert_jsonl_to_page_pack,
+    encode_image,
+    iter_page_pack,
+)
+
+
+def get_image(color: int) -> Image.Image:
+    return Image.new("RGB", (16, 16), color=(color, color, color))
+
+
+@pytest.fixture
+def page_pack_path(tmp_path: Path) -> str:
+    path = str(tmp_path / "collection.pagepack")
+    with PagePackWriter(path, image_format="PNG") as writer:
+        for idx in range(20):
+            writer.add(get_image(idx), image_filename=f"page_{idx}.png", query=f"query {idx}", text_description="")
+    return path
+
+
+def test_page_pack_random_access(page_pack_path: str):
+    pack = PagePack(page_pack_path)
+
+    assert len(pack) == 20
+    assert pack.column("image_filename")[5] == "page_5.png"
+    page = pack[7]
+    assert page["query"] == "query 7"
+    assert page["image"].getpixel((0, 0)) == (7, 7, 7)
+    assert pack.get_image_bytes(3) == encode_image(get_image(3), format="PNG")
+
+
+def test_page_pack_append(page_pack_path: str):
+    with PagePackWriter(page_pack_path, append=True) as writer:
+        writer.add(encode_image(get_image(20), format="PNG"), image_filename="page_20.png", query=["a", "b"])
+
+    pack = PagePack(page_pack_path)
+    assert len(pack) == 21
+    assert pack[20]["query"] == "['a', 'b']"
+    assert pack[20]["image"].getpixel((0, 0)) == (20, 20, 20)
+    assert pack[19]["image"].getpixel((0, 0)) == (19, 19, 19)
+
+
+def test_page_pack_writer_error_keeps_previous_pages(page_pack_path: str):
+    with pytest.raises(RuntimeError):
+        with PagePackWriter(page_pack_path, append=True) as writer:
+            writer.add(get_image(20), image_filename="page_20.png")
+            raise RuntimeError("Interrupted")
+
+    assert len(PagePack(page_pack_path)) == 20
+    with PagePackWriter(page_pack_path, append=True) as writer:
+        writer.add(get_image(20), image_filename="page_20.png")
+    assert PagePack(page_pack_path)[20]["image"].getpixel((0, 0)) == (20, 20, 20)
+
+
+@pytest.mark.parametrize("n_workers", [0, 2])
+def test_iter_page_pack(page_pack_path: str, n_workers: int):
+    pages = list(
+        iter_page_pack(
+            page_pack_path, skip_page=lambda filename: filename == "page_1.png", n_workers=n_workers, chunk_size=3
+        )
+    )
+    assert [page["image_filename"] for page in pages] == [f"page_{idx}.png" for idx in range(20) if idx != 1]
+    assert [page["image"].getpixel((0, 0))[0] for page in pages] == [idx for idx in range(20) if idx != 1]
+
+    pages = list(iter_page_pack(page_pack_path, fields=["image_filename"]))
+    assert pages[0] == {"image_filename": "page_0.png"}
+
+
+def test_convert_jsonl_to_page_pack(tmp_path: Path):
+    jsonl_path = str(tmp_path / "collection.jsonl")
+    image_bytes = encode_image(get_image(1), format="PNG")
+    with open(jsonl_path, "w", encoding="utf-8") as f:
+        for idx in range(3):
+            page = {"image": base64.b64encode(image_bytes).decode(), "image_filename": f"page_{idx}.png", "page": idx}
+            f.write(json.dumps(page) + "\n")
+
+    path = str(tmp_path / "collection.pagepack")
+    convert_jsonl_to_page_pack(jsonl_path, path, n_workers=0)
+
+    pack = PagePack(path)
+    assert pack.column("page") == ["0", "1", "2"]
+    assert pack.get_image_bytes(2) == image_bytes
+    assert os.path.getsize(os.path.join(path, "images.bin")) < os.path.getsize(jsonl_path)
+    assert Image.open(io.BytesIO(pack.get_image_bytes(0))).size == (16, 16)
@@ -0,0 +1,51 @@
+import threading
+import time
+
+import pytest
+
+from vidore_benchmark.utils.pipeline_utils import Pipeline
+
+
+def test_pipeline_order_and_stats():
+    def slow_square(x: int) -> int:
+        time.sleep(0.01)
+        return x * x
+
+    pipeline = Pipeline([("square", slow_square), ("negate", lambda x: -x)], max_queue_size=2, unit_name="numbers")
+    outputs = list(pipeline.run(range(20), n_units=lambda x: 2))
+
+    assert outputs == [-(x * x) for x in range(20)]
+    assert [stats.name for stats in pipeline.stats] == ["fetch", "square", "negate"]
+    assert all(stats.n_items == 20 and stats.n_units == 40 for stats in pipeline.stats)
+    assert "square: " in pipeline.get_report() and "(bottleneck)" in pipeline.get_report().split("\n")[2]
+
+
+def test_pipeline_stages_run_concurrently():
+    # The first stage only processes its second item once the second stage started on the first one
+    second_stage_started = threading.Event()
+
+    def first_stage(x: int) -> int:
+        if x > 0:
+            assert second_stage_started.wait(timeout=5)
+        return x
+
+    def second_stage(x: int) -> int:
+        second_stage_started.set()
+        return x
+
+    pipeline = Pipeline([("first", first_stage), ("second", second_stage)], max_queue_size=1)
+    assert list(pipeline.run(range(5))) == list(range(5))
+
+
+def test_pipeline_raises_stage_errors():
+    def fail_on_3(x: int) -> int:
+        if x == 3:
+            raise ValueError("stage error")
+        return x
+
+    pipeline = Pipeline([("fail", fail_on_3)], max_queue_size=1)
+    outputs = []
+    with pytest.raises(ValueError, match="stage error"):
+        for output in pipeline.run(range(100)):
+            outputs.append(output)
+    assert outputs == [0, 1, 2]
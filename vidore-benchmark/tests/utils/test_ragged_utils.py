@@ -0,0 +1,89 @@
+from pathlib import Path
+
+import pytest
+import torch
+
+from vidore_benchmark.evaluation.scoring import score_multi_vector
+from vidore_benchmark.index.utils import flatten_embeddings
+from vidore_benchmark.utils.ragged_utils import (
+    RaggedEmbeddings,
+    concat_embeddings,
+    load_embeddings,
+    save_embeddings,
+)
+
+EMBEDDING_DIM = 16
+
+
+@pytest.fixture
+def embeddings_list() -> list:
+    torch.manual_seed(0)
+    return [torch.randn(n_tokens, EMBEDDING_DIM) for n_tokens in [3, 7, 1, 5, 4]]
+
+
+def test_ragged_embeddings_from_padded():
+    embeddings = torch.randn(2, 4, EMBEDDING_DIM)
+    attention_mask = torch.tensor([[1, 1, 0, 0], [0, 1, 1, 1]])
+    ragged = RaggedEmbeddings.from_padded(embeddings, attention_mask)
+
+    assert len(ragged) == 2
+    assert ragged.lengths.tolist() == [2, 3]
+    assert torch.equal(ragged[0], embeddings[0, :2])
+    assert torch.equal(ragged[1], embeddings[1, 1:])
+
+
+def test_ragged_embeddings_indexing(embeddings_list: list):
+    ragged = RaggedEmbeddings.from_list(embeddings_list)
+
+    assert torch.equal(ragged[-1], embeddings_list[-1])
+    for expected, actual in zip(embeddings_list[1:4], ragged[1:4]):
+        assert torch.equal(actual, expected)
+    for expected, actual in zip([embeddings_list[4], embeddings_list[0]], ragged[[4, 0]]):
+        assert torch.equal(actual, expected)
+
+    with pytest.raises(IndexError):
+        ragged[len(embeddings_list)]
+
+
+def test_ragged_embeddings_to_padded(embeddings_list: list):
+    ragged = RaggedEmbeddings.from_list(embeddings_list)
+    padded, attention_mask = ragged.to_padded()
+
+    assert padded.shape == (5, 7, EMBEDDING_DIM)
+    assert torch.equal(attention_mask.sum(dim=1), ragged.lengths)
+    assert torch.equal(RaggedEmbeddings.from_padded(padded, attention_mask).values, ragged.values)
+
+
+def test_concat_embeddings(embeddings_list: list):
+    batches = [RaggedEmbeddings.from_list(embeddings_list[:2]), RaggedEmbeddings.from_list(embeddings_list[2:])]
+    ragged = concat_embeddings(batches)
+
+    assert isinstance(ragged, RaggedEmbeddings)
+    assert torch.equal(ragged.values, torch.cat(embeddings_list))
+    assert isinstance(concat_embeddings([torch.randn(2, EMBEDDING_DIM), torch.randn(3, EMBEDDING_DIM)]), list)
+
+
+def test_save_load_embeddings(embeddings_list: list, tmp_path: Path):
+    ragged = RaggedEmbeddings.from_list(embeddings_list)
+    save_embeddings(ragged, str(tmp_path / "ragged.pt"))
+    save_embeddings(embeddings_list, str(tmp_path / "list.pt"))
+
+    loaded = load_embeddings(str(tmp_path / "ragged.pt"))
+    assert isinstance(loaded, RaggedEmbeddings)
+    assert torch.equal(loaded.values, ragged.values)
+    assert torch.equal(loaded.offsets, ragged.offsets)
+    assert isinstance(load_embeddings(str(tmp_path / "list.pt")), list)
+
+
+def test_ragged_embeddings_scoring(embeddings_list: list):
+    ragged = RaggedEmbeddings.from_list(embeddings_list)
+    query_embeddings = [torch.randn(4, EMBEDDING_DIM), torch.randn(2, EMBEDDING_DIM)]
+
+    torch.testing.assert_close(
+        score_multi_vector(query_embeddings, ragged, batch_size=2),
+        score_multi_vector(query_embeddings, embeddings_list, batch_size=2),
+    )
+
+    values, offsets = flatten_embeddings(ragged)
+    assert torch.equal(offsets, ragged.offsets)
+    assert torch.equal(values, ragged.values)